@@ -14,10 +14,42 @@ import traceback
 import time
 import uuid
 import re
-from utils import calculate_tdee, goal_config, classify_goal_from_text, process_single_day, calculate_macros
-from concurrent.futures import ThreadPoolExecutor
+from utils import calculate_tdee, goal_config, classify_goal_from_text, process_single_day, calculate_macros, NUTRITION_INDEX_MODE, FOOD_TABLE_MODE
+from day_segmenter import DaySegmenter, SUGGESTION
+from stage_graph import Stage, run_stages
+from pregen_store import create_pregen_admission, create_pregen_store, PregenDropped
+from single_flight import SingleFlight, canonical_key, normalize_list, normalize_prompt
+from parallel_days import stream_days_parallel, resolve_generation_mode, GENERATION_MODE_PARALLEL
+from loop_monitor import LoopLagMonitor
+from day_executor import DayExecutor
+from day_pipeline import PipelineMetrics, pipelined_days, stream_token_texts
+from day_repair import (
+    BackgroundRepairs, RepairStats, collect_patches, resolve_repair_mode, REPAIR_MODE_BACKGROUND,
+    REPAIR_STORE_MAX_BYTES, REPAIR_STORE_MAX_ENTRIES,
+)
+from nutrition_index import get_nutrition_index
+from food_table import get_food_table
+from plan_format import (
+    CompactPlanParser, ParseStats, format_sections, resolve_output_format, OUTPUT_FORMAT_COMPACT, OUTPUT_FORMAT_TEXT,
+)
+from stream_events import (
+    PlanEventEncoder, WorkoutEventEncoder, StreamEventStats, encode_stream, negotiate_stream_format,
+    STREAM_FORMAT_TEXT, STREAM_MEDIA_TYPES,
+)
+from upstream import UpstreamStats, until_plan_complete, CLOSE_COMPLETE, CLOSE_CANCELLED
+from llm_scheduler import (
+    LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_PREP, PRIORITY_REPAIR, PRIORITY_NAMES,
+)
+from rate_governor import create_rate_governor
+from hedging import Hedger, resolve_hedge
+from stage_cache import (
+    StageCache, create_stage_store, bucket, curator_key, dietary_rules_key,
+    STAGE_CACHE_CURATOR_TTL, STAGE_CACHE_RULES_TTL, STAGE_CACHE_PROTEIN_BUCKET, STAGE_CACHE_CALORIE_BUCKET,
+)
+from model_router import (
+    ModelRouter, ROUTE_PLAN, ROUTE_CURATOR, ROUTE_DIETARY_RULES, ROUTE_FIX_QUANTITIES, ROUTE_WORKOUT, ROUTE_CHAT,
+)
 import asyncio
-from concurrent.futures import ThreadPoolExecutor      
 from logger_setup import mealplan_logger, workoutplan_logger,user_logger, error_logger
 #from utils2 import chat_mimic
 import random
@@ -34,31 +66,81 @@ except ImportError:
 except Exception as e:
     print(f"[STARTUP] uvloop setup failed: {e} - using default asyncio event loop")
 
+# Load environment variables from .env file
+load_dotenv()
+
 # Initialize FastAPI app
 app = FastAPI()
 
-executor = ThreadPoolExecutor(max_workers=4)
+# process_single_day runs here: thread pool or warm process pool (DAY_EXECUTOR)
+executor = DayExecutor()
+
+# Stage timings of the /mealplan token reader -> day processing pipeline
+day_pipeline_metrics = PipelineMetrics()
+
+# Out-of-band fix_quantities repairs (repairMode=background); their patches
+# are kept apart from pre-generations so neither evicts the other
+repair_stats = RepairStats()
+repair_store = create_pregen_store("repairs", REPAIR_STORE_MAX_ENTRIES, REPAIR_STORE_MAX_BYTES)
+
+# Record/line counters of outputFormat=compact plans
+compact_parse_stats = ParseStats()
+
+# Typed NDJSON/SSE responses (negotiated with the Accept header)
+stream_event_stats = StreamEventStats()
+
+# LLM streams closed early (plan complete, client gone, pre-generation superseded)
+upstream_stats = UpstreamStats()
+
+# Priority classes and concurrency limits for every Groq call, admitted
+# against the provider's RPM/TPM budget (shared through Redis when configured)
+rate_governor = create_rate_governor(PRIORITY_NAMES)
+llm_scheduler = LLMScheduler(logger=mealplan_logger, governor=rate_governor)
+
+# Model chain and circuit breaker per call site (fails over to the next model)
+model_router = ModelRouter(llm_scheduler, logger=mealplan_logger)
+
+# Second main-plan request when the first token is later than the recent p90 (opt-in)
+plan_hedger = Hedger(logger=mealplan_logger)
+
+
+def plan_stream_response(chunks, stream_format, encoder_cls=PlanEventEncoder, headers=None):
+    """Legacy text stream as-is, or re-framed as typed events for NDJSON/SSE clients."""
+    if stream_format != STREAM_FORMAT_TEXT:
+        chunks = encode_stream(chunks, stream_format, encoder_cls(), stream_event_stats)
+        headers = {**(headers or {}), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(chunks, media_type=STREAM_MEDIA_TYPES[stream_format], headers=headers)
 
 # ============================================================
 # PRE-GENERATION CACHE - Start generation from /user endpoint
 # ============================================================
-# Stores pre-generated meal plan data keyed by session_id
-# Each entry contains: {'task': asyncio.Task, 'chunks': [], 'done': bool, 'error': str|None}
-mealplan_cache = {}
-CACHE_TTL_SECONDS = 300  # Clear old entries after 5 minutes
-
-def cleanup_old_cache():
-    """Remove cache entries older than TTL"""
-    current_time = time.time()
-    expired = [k for k, v in mealplan_cache.items() if current_time - v.get('created', 0) > CACHE_TTL_SECONDS]
-    for k in expired:
-        if k in mealplan_cache:
-            task = mealplan_cache[k].get('task')
-            if task and not task.done():
-                task.cancel()
-            del mealplan_cache[k]
-    if expired:
-        mealplan_logger.info(f"[CACHE_CLEANUP] Removed {len(expired)} expired entries")
+# Stores pre-generated meal plan chunks keyed by session_id. The backend is chosen
+# by PREGEN_STORE / REDIS_URL so /user and /mealplan can land on different workers.
+pregen_store = create_pregen_store()
+pregen_admission = create_pregen_admission(pregen_store)
+CACHE_TTL_SECONDS = pregen_store.ttl  # Entries (and the session cookie) expire after 5 minutes
+
+# Event loop lag, reported by /metrics (load tests watch it for blocking work)
+loop_monitor = LoopLagMonitor()
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+
+@app.on_event("startup")
+async def warm_day_executor():
+    # Spawning and warming worker processes blocks, so do it before serving rather than on a first request
+    await asyncio.get_event_loop().run_in_executor(None, executor.warm_up)
+    mealplan_logger.info(f"[DAY_EXECUTOR] {executor.kind} pool ready with {executor.workers} workers")
+
+
+@app.on_event("shutdown")
+async def stop_day_executor():
+    executor.shutdown(wait=False, cancel_futures=True)
+    if NUTRITION_INDEX_MODE == "on":
+        get_nutrition_index().flush()  # Observations still buffered in this process
 
 allowed_origins = [
     "https://theelefit.com",
@@ -80,15 +162,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Plan-Id"],
 )
-# Load environment variables from .env file
-load_dotenv()
-
 # Initialize Groq client
 groq_api_key = os.getenv("GROQ_API_KEY")  # Get from https://console.groq.com
 if not groq_api_key:
     raise RuntimeError("GROQ_API_KEY environment variable is not set.")
-client = AsyncGroq(api_key=groq_api_key)
+# LLM_BASE_URL points the client at another chat-completions server, e.g. the
+# local replay server in benchmarks/fake_llm_server.py for load tests
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+if LLM_BASE_URL:
+    print(f"[STARTUP] Using LLM endpoint {LLM_BASE_URL}")
+client = AsyncGroq(api_key=groq_api_key, base_url=LLM_BASE_URL)
 
 class ChatRequest(BaseModel):
     message: str
@@ -116,8 +201,8 @@ async def chat(req: ChatRequest):
             )
 
         # Async Groq call
-        response = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        response = await model_router.create(
+            ROUTE_CHAT, client, PRIORITY_INTERACTIVE,
             messages=[
                 {
                     "role": "system",
@@ -168,6 +253,15 @@ async def check_cache(req: CheckCacheRequest):
 
 REQUIRED_FIELDS = ["age", "weight", "height", "gender", "activityLevel"]
 
+# Identical in-flight /mealplan and /workoutplan requests share one upstream generation
+mealplan_flights = SingleFlight("mealplan", logger=mealplan_logger)
+workoutplan_flights = SingleFlight("workoutplan", logger=workoutplan_logger)
+
+
+def get_idempotency_key(request: Request, data: dict):
+    """Optional client idempotency key, from the Idempotency-Key header or body."""
+    return request.headers.get("Idempotency-Key") or data.get("idempotencyKey")
+
 @app.post("/user")
 async def user_endpoint(request: Request):
     try:
@@ -269,43 +363,80 @@ async def user_endpoint(request: Request):
             "capped": capped
         }
         
+        # A new session replaces the browser's previous one: its pre-generation can never be fetched
+        old_session_id = request.cookies.get("mealplan_session")
+        if old_session_id and old_session_id != session_id:
+            old_status = await pregen_store.status(old_session_id)
+            if old_status is not None:
+                await pregen_store.delete(old_session_id)
+                if not old_status["done"]:
+                    upstream_stats.pregen_superseded += 1
+                    user_logger.info(f"[PREGEN] Cancelled superseded pre-generation for session {old_session_id}")
+
         # Clean up old cache entries
-        cleanup_old_cache()
-        
-        # Initialize cache entry
-        mealplan_cache[session_id] = {
-            'chunks': [],
-            'done': False,
-            'error': None,
-            'created': time.time(),
-            'task': None
-        }
-        
-        # Start background generation task
-        async def run_pregeneration():
-            try:
-                user_logger.info(f"[PREGEN] Starting pre-generation for session {session_id}")
-                async for chunk in generate_mealplan_stream(generation_data):
-                    if session_id in mealplan_cache:
-                        mealplan_cache[session_id]['chunks'].append(chunk)
-                if session_id in mealplan_cache:
-                    mealplan_cache[session_id]['done'] = True
-                    user_logger.info(f"[PREGEN] Completed for session {session_id}, {len(mealplan_cache[session_id]['chunks'])} chunks")
-            except Exception as e:
-                if session_id in mealplan_cache:
-                    mealplan_cache[session_id]['error'] = str(e)
-                    mealplan_cache[session_id]['done'] = True
-                user_logger.error(f"[PREGEN] Error for session {session_id}: {e}")
+        expired = await pregen_store.cleanup()
+        if expired:
+            user_logger.info(f"[CACHE_CLEANUP] Removed {expired} expired entries")
         
-        # Schedule the background task
-        task = asyncio.create_task(run_pregeneration())
-        mealplan_cache[session_id]['task'] = task
-        user_logger.info(f"[PREGEN] Scheduled background generation for session {session_id}")
+        # Admission control: cap concurrent speculative generations and throttle
+        # when most pre-generated plans are never fetched by /mealplan
+        admitted, reason = await pregen_admission.admit()
+        if admitted:
+            # Initialize cache entry
+            await pregen_store.create(session_id)
+            await pregen_admission.on_start()
+            
+            # Start background generation task
+            async def run_pregeneration():
+                async def preempted():
+                    # A /mealplan on another worker may already be reading it: then it is no longer speculative
+                    if await pregen_store.promoted(session_id):
+                        llm_scheduler.promote(session_id, work)
+                    else:
+                        await pregen_store.delete(session_id)
+
+                # Its LLM calls queue behind user-facing ones and may be preempted (deleting this entry)
+                work = llm_scheduler.start_speculative(session_id, cancel=preempted)
+                chunks = generate_mealplan_stream(generation_data)
+                try:
+                    user_logger.info(f"[PREGEN] Starting pre-generation for session {session_id}")
+                    chunk_count = 0
+                    async for chunk in chunks:
+                        if not await pregen_store.append(session_id, chunk):
+                            # Deleted (superseded, evicted, preempted) - possibly by another worker
+                            user_logger.info(f"[PREGEN] Session {session_id} was dropped, stopping its generation")
+                            return
+                        if not work.promoted and await pregen_store.promoted(session_id):
+                            llm_scheduler.promote(session_id)  # Read by /mealplan on another worker
+                        chunk_count += 1
+                    await pregen_store.finish(session_id)
+                    user_logger.info(f"[PREGEN] Completed for session {session_id}, {chunk_count} chunks")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await pregen_store.finish(session_id, error=str(e))
+                    user_logger.error(f"[PREGEN] Error for session {session_id}: {e}")
+                finally:
+                    # Cancelled between chunks (superseded, evicted, preempted): close the completion now
+                    await chunks.aclose()
+                    llm_scheduler.end_speculative(session_id)
+                    pregen_admission.on_finish()
+            
+            # Schedule the background task
+            task = asyncio.create_task(run_pregeneration())
+            pregen_store.attach_task(session_id, task)
+            user_logger.info(f"[PREGEN] Scheduled background generation for session {session_id}")
+        else:
+            # /mealplan will miss this session and generate on demand
+            user_logger.info(
+                f"[PREGEN_SKIPPED] Session {session_id} not pre-generated ({reason}): "
+                f"{json.dumps(pregen_admission.stats())}"
+            )
 
         # Set cookies - user_profile + session_id for pre-generation
         resp = JSONResponse(content=profile)
         resp.set_cookie(key="user_profile", value=json.dumps(profile), httponly=True, samesite="lax")
-        resp.set_cookie(key="mealplan_session", value=session_id, httponly=True, samesite="lax", max_age=300)
+        resp.set_cookie(key="mealplan_session", value=session_id, httponly=True, samesite="lax", max_age=CACHE_TTL_SECONDS)
         return resp
 
     except HTTPException as he:
@@ -356,6 +487,30 @@ def prompt_guard(user_input: str, guard_type="prompt"):
 
 
 
+# Prompt phrases -> restriction names, in output order. Only the first matching
+# diet type applies ("vegan" wins over "vegetarian"). stage_cache's warm-up
+# enumerates the combinations these tables can produce.
+DIET_TYPE_TERMS = (
+    ('vegan', ('vegan', 'plant based', 'plant-based')),
+    ('vegetarian', ('vegetarian', 'veg ', 'veg,', 'veg.', ' veg', 'no meat', 'no non-veg', 'no non veg', 'no nonveg')),
+)
+DIETARY_TERMS = (
+    ('no dairy', ('no dairy', 'dairy free', 'dairy-free', 'lactose intolerant', 'no milk', 'no cheese', 'no paneer')),
+    ('gluten-free', ('gluten free', 'gluten-free', 'no gluten', 'celiac')),
+    ('no eggs', ('no egg', 'egg free', 'egg-free', 'no eggs')),
+    ('no seafood', ('no fish', 'no seafood', 'no shellfish')),
+    ('no red meat', ('no pork', 'no beef', 'no red meat')),
+    ('halal', ('halal',)),
+    ('kosher', ('kosher',)),
+    ('keto/low-carb', ('keto', 'ketogenic', 'low carb', 'low-carb')),
+)
+ALLERGY_TERMS = (
+    ('nuts', ('nut allergy', 'allergic to nuts', 'no nuts', 'nut-free')),
+    ('peanuts', ('peanut allergy', 'allergic to peanut')),
+    ('soy', ('soy allergy', 'allergic to soy', 'no soy')),
+)
+
+
 def extract_dietary_from_prompt(user_prompt: str) -> dict:
     """
     Extract dietary restrictions and allergies mentioned in the user's text prompt.
@@ -367,36 +522,20 @@ def extract_dietary_from_prompt(user_prompt: str) -> dict:
     extracted_allergies = []
     
     # Vegetarian/Vegan detection
-    if any(term in prompt_lower for term in ['vegan', 'plant based', 'plant-based']):
-        extracted_dietary.append('vegan')
-    elif any(term in prompt_lower for term in ['vegetarian', 'veg ', 'veg,', 'veg.', ' veg', 'no meat', 'no non-veg', 'no non veg', 'no nonveg']):
-        extracted_dietary.append('vegetarian')
+    for name, terms in DIET_TYPE_TERMS:
+        if any(term in prompt_lower for term in terms):
+            extracted_dietary.append(name)
+            break
     
     # Specific restrictions
-    if any(term in prompt_lower for term in ['no dairy', 'dairy free', 'dairy-free', 'lactose intolerant', 'no milk', 'no cheese', 'no paneer']):
-        extracted_dietary.append('no dairy')
-    if any(term in prompt_lower for term in ['gluten free', 'gluten-free', 'no gluten', 'celiac']):
-        extracted_dietary.append('gluten-free')
-    if any(term in prompt_lower for term in ['no egg', 'egg free', 'egg-free', 'no eggs']):
-        extracted_dietary.append('no eggs')
-    if any(term in prompt_lower for term in ['no fish', 'no seafood', 'no shellfish']):
-        extracted_dietary.append('no seafood')
-    if any(term in prompt_lower for term in ['no pork', 'no beef', 'no red meat']):
-        extracted_dietary.append('no red meat')
-    if any(term in prompt_lower for term in ['halal']):
-        extracted_dietary.append('halal')
-    if any(term in prompt_lower for term in ['kosher']):
-        extracted_dietary.append('kosher')
-    if any(term in prompt_lower for term in ['keto', 'ketogenic', 'low carb', 'low-carb']):
-        extracted_dietary.append('keto/low-carb')
+    for name, terms in DIETARY_TERMS:
+        if any(term in prompt_lower for term in terms):
+            extracted_dietary.append(name)
     
     # Allergy detection
-    if any(term in prompt_lower for term in ['nut allergy', 'allergic to nuts', 'no nuts', 'nut-free']):
-        extracted_allergies.append('nuts')
-    if any(term in prompt_lower for term in ['peanut allergy', 'allergic to peanut']):
-        extracted_allergies.append('peanuts')
-    if any(term in prompt_lower for term in ['soy allergy', 'allergic to soy', 'no soy']):
-        extracted_allergies.append('soy')
+    for name, terms in ALLERGY_TERMS:
+        if any(term in prompt_lower for term in terms):
+            extracted_allergies.append(name)
     
     return {'dietary': extracted_dietary, 'allergies': extracted_allergies}
 
@@ -485,8 +624,8 @@ CRITICAL RULES:
 Start with "CUISINE & NUTRITION GUIDE:" """
 
     try:
-        response = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        response = await model_router.create(
+            ROUTE_CURATOR, client, PRIORITY_PREP,
             messages=[
                 {"role": "user", "content": extraction_prompt}
             ],
@@ -573,8 +712,8 @@ IMPORTANT:
 Output ONLY the rules section - no explanations:"""
 
     try:
-        response = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        response = await model_router.create(
+            ROUTE_DIETARY_RULES, client, PRIORITY_PREP,
             messages=[
                 {"role": "user", "content": rules_prompt}
             ],
@@ -592,6 +731,72 @@ Output ONLY the rules section - no explanations:"""
         return ""
 
 
+# ============================================================
+# PREPARATORY STAGES - Curator + dietary rules before the main stream
+# ============================================================
+# Deadlines (seconds) after which the stage falls back to empty output
+CURATOR_STAGE_TIMEOUT = float(os.getenv("CURATOR_STAGE_TIMEOUT", "6"))
+DIETARY_RULES_STAGE_TIMEOUT = float(os.getenv("DIETARY_RULES_STAGE_TIMEOUT", "4"))
+
+
+# Cached by canonical inputs (see stage_cache.py); concurrent misses share one call
+stage_cache_store = create_stage_store(mealplan_logger)
+curator_cache = StageCache("curator", stage_cache_store, STAGE_CACHE_CURATOR_TTL, logger=mealplan_logger,
+                           cacheable=lambda value: bool(value.get("directions")))
+dietary_rules_cache = StageCache("dietary_rules", stage_cache_store, STAGE_CACHE_RULES_TTL, logger=mealplan_logger,
+                                 cacheable=bool)
+
+
+async def cached_user_preferences(user_prompt, dietary_restrictions, macros):
+    """extract_user_preferences_llm, asked with bucketed targets and memoized on them."""
+    if not curator_cache.enabled:
+        return await extract_user_preferences_llm(client, user_prompt, dietary_restrictions, macros)
+    dietary = normalize_list(dietary_restrictions)
+    macros = dict(macros or {})
+    macros['protein_g'] = bucket(macros.get('protein_g', 120), STAGE_CACHE_PROTEIN_BUCKET)
+    macros['calories'] = bucket(macros.get('calories', 1800), STAGE_CACHE_CALORIE_BUCKET)
+    key = curator_key(user_prompt, dietary, macros['protein_g'], macros['calories'])
+    return await curator_cache.get_or_compute(
+        key, lambda: extract_user_preferences_llm(client, user_prompt, dietary, macros)
+    )
+
+
+async def cached_dietary_rules(dietary_restrictions, allergies):
+    """generate_dietary_rules_llm memoized on the sorted restriction and allergy sets."""
+    if not dietary_rules_cache.enabled:
+        return await generate_dietary_rules_llm(client, dietary_restrictions, allergies)
+    dietary, allergies = normalize_list(dietary_restrictions), normalize_list(allergies)
+    return await dietary_rules_cache.get_or_compute(
+        dietary_rules_key(dietary, allergies), lambda: generate_dietary_rules_llm(client, dietary, allergies)
+    )
+
+
+async def run_prep_stages(user_prompt, dietary, allergies, macros_with_calories, label="PREP_STAGES", context=None):
+    """
+    Run the curator and dietary-rules LLM calls concurrently (or answer them from the stage cache).
+    Returns {"curator": {"directions": ..., "raw": ...}, "dietary_rules": str}.
+    """
+    return await run_stages(
+        [
+            Stage(
+                "curator",
+                lambda: cached_user_preferences(user_prompt, dietary, macros_with_calories),
+                timeout=CURATOR_STAGE_TIMEOUT,
+                fallback={"directions": "", "raw": {}},
+            ),
+            Stage(
+                "dietary_rules",
+                lambda: cached_dietary_rules(dietary, allergies),
+                timeout=DIETARY_RULES_STAGE_TIMEOUT,
+                fallback="",
+            ),
+        ],
+        logger=mealplan_logger,
+        label=label,
+        context=context,
+    )
+
+
 # ============================================================
 # VARIETY HELPER - Prevents duplicate meals on regeneration
 # ============================================================
@@ -637,7 +842,7 @@ DIETARY:
     return variety_instruction
 
 
-async def fix_quantities_with_llm(client, model, original_day_text, day_number, target_calories, target_macros):
+async def fix_quantities_with_llm(client, original_day_text, day_number, target_calories, target_macros):
     """
     Lightweight LLM call to fix quantities while keeping densities sensible.
     Called only when post-processing can't fix macros without making densities unrealistic.
@@ -688,8 +893,8 @@ STOP after Dinner. Do not continue."""
         mealplan_logger.info(f"[FIX_QUANTITIES] Target: {target_calories} kcal, {target_macros['protein_g']}g protein")
         mealplan_logger.info(f"[FIX_QUANTITIES] Cleaned text starts with: {cleaned_day_text[:100]}...")
         
-        response = await client.chat.completions.create(
-            model=model,
+        response = await model_router.create(
+            ROUTE_FIX_QUANTITIES, client, PRIORITY_REPAIR,
             messages=[
                 {"role": "system", "content": system_msg},
                 {"role": "user", "content": correction_prompt}
@@ -745,7 +950,7 @@ STOP after Dinner. Do not continue."""
                 # Process the corrected day
                 loop = asyncio.get_event_loop()
                 result = await loop.run_in_executor(
-                    None,
+                    executor,
                     process_single_day,
                     isolated_day_text,
                     target_calories,
@@ -764,7 +969,7 @@ STOP after Dinner. Do not continue."""
                 # Use full response if no day marker found
                 loop = asyncio.get_event_loop()
                 result = await loop.run_in_executor(
-                    None,
+                    executor,
                     process_single_day,
                     corrected_text,
                     target_calories,
@@ -826,13 +1031,11 @@ async def generate_mealplan_stream(data: dict):
         if allergies:
             diet_context += f"- Allergies (STRICTLY AVOID): {', '.join(allergies)}\n"
     
-    # Get curator instructions
+    # Curator instructions and dietary rules are independent - run them concurrently
     macros_with_calories = {**macros, 'calories': calories}
-    user_preferences = await extract_user_preferences_llm(client, user_prompt, dietary, macros_with_calories)
-    user_specific_directions = user_preferences.get("directions", "")
-    
-    # Get dietary rules
-    dietary_rules = await generate_dietary_rules_llm(client, dietary, allergies)
+    prep = await run_prep_stages(user_prompt, dietary, allergies, macros_with_calories, label="PREGEN_STAGES")
+    user_specific_directions = prep["curator"].get("directions", "")
+    dietary_rules = prep["dietary_rules"]
     
     profile_dict = {
         "targetCalories": calories,
@@ -861,12 +1064,10 @@ TARGETS: {calories} kcal/day, {macros['protein_g']}g protein, {macros['fat_g']}g
 {dietary_rules}
 END with: END-OF-PLAN-SUGGESTION: [tip]"""
 
-    MODEL = "llama-3.3-70b-versatile"
-    day_start_regex = re.compile(r'Day \d+:')
-    
+    stream = None
     try:
-        stream = await client.chat.completions.create(
-            model=MODEL,
+        stream = upstream_stats.track(await model_router.create(
+            ROUTE_PLAN, client, PRIORITY_INTERACTIVE,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
@@ -874,11 +1075,25 @@ END with: END-OF-PLAN-SUGGESTION: [tip]"""
             max_tokens=4096,
             temperature=0.9,
             stream=True,
-        )
+        ), "pregen", mealplan_logger)
         
-        buffer = ""
+        # Pre-generation keeps the suggestion inside the last day and flushes it as-is
+        segmenter = DaySegmenter(max_days=7, split_suggestion=False, drop_incomplete_last_day=False)
         day_count = 0
         
+        async def process_day(day_text, expected_day):
+            loop = asyncio.get_event_loop()
+            result = await loop.run_in_executor(
+                executor, process_single_day, day_text.strip(), calories, macros, 5, expected_day
+            )
+            
+            if isinstance(result, tuple):
+                processed, anomaly_info = result
+            else:
+                processed = result
+            
+            return processed + "\n"
+        
         async for chunk in stream:
             token_text = None
             try:
@@ -890,112 +1105,78 @@ END with: END-OF-PLAN-SUGGESTION: [tip]"""
             if not token_text:
                 continue
             
-            buffer += token_text
-            
             # Check for complete days
-            day_matches = list(day_start_regex.finditer(buffer))
-            
-            if len(day_matches) >= 2:
-                for i in range(len(day_matches) - 1):
-                    if day_count >= 7:
-                        break
-                    
-                    start = day_matches[i].start()
-                    end = day_matches[i + 1].start()
-                    day_text = buffer[start:end].strip()
-                    
-                    # Process the day
-                    loop = asyncio.get_event_loop()
-                    result = await loop.run_in_executor(
-                        executor, process_single_day, day_text, calories, macros, 5, day_count + 1
-                    )
-                    
-                    if isinstance(result, tuple):
-                        processed, anomaly_info = result
-                    else:
-                        processed = result
-                    
-                    processed += "\n"
-                    yield processed.encode("utf-8")
-                    
-                    buffer = buffer[end:]
-                    day_count += 1
-        
-        # Process remaining buffer
-        if buffer.strip() and day_count < 7:
-            remaining_days = list(day_start_regex.finditer(buffer))
-            for i, match in enumerate(remaining_days):
-                if day_count >= 7:
-                    break
-                start = match.start()
-                end = remaining_days[i + 1].start() if i + 1 < len(remaining_days) else len(buffer)
-                day_text = buffer[start:end].strip()
-                
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(
-                    executor, process_single_day, day_text, calories, macros, 5, day_count + 1
-                )
-                
-                if isinstance(result, tuple):
-                    processed, _ = result
-                else:
-                    processed = result
-                
-                processed += "\n"
+            for event in segmenter.feed(token_text):
+                processed = await process_day(event.text, event.day_number)
                 yield processed.encode("utf-8")
                 day_count += 1
         
+        # Process remaining buffer
+        for event in segmenter.close():
+            processed = await process_day(event.text, event.day_number)
+            yield processed.encode("utf-8")
+            day_count += 1
+        
         mealplan_logger.info(f"[PREGEN_STREAM] Completed {day_count} days")
         
     except Exception as e:
         error_msg = f"\n\nError: {str(e)}\n"
         yield error_msg.encode("utf-8")
         mealplan_logger.error(f"[PREGEN_STREAM] Error: {e}")
+    finally:
+        # Superseded or evicted pre-generation: release the completion right away
+        if stream is not None:
+            await stream.close(CLOSE_CANCELLED)
 
 
 @app.post("/mealplan")
+@mealplan_flights.leads
 async def meal_plan(request: Request):
     data = await request.json()
     full_t_start = time.perf_counter()
+    stream_format = negotiate_stream_format(request)
     
     # ============================================================
     # CHECK FOR PRE-GENERATED DATA FROM /user ENDPOINT
     # ============================================================
     # Try to get sessionId from request body first, then from cookie (set by /user)
     session_id = data.get("sessionId") or request.cookies.get("mealplan_session")
-    if session_id and session_id in mealplan_cache:
-        cache_entry = mealplan_cache[session_id]
+    if session_id and await pregen_store.exists(session_id):
         mealplan_logger.info(f"[PREGEN_HIT] Found cached data for session {session_id}")
+        await pregen_admission.on_hit()
+        # Someone is waiting on it now: no longer speculative (the producer may run on another worker)
+        await pregen_store.promote(session_id)
+        llm_scheduler.promote(session_id)
         
         async def stream_from_cache():
-            """Stream pre-generated chunks, waiting for more if not done"""
-            chunk_index = 0
-            while True:
-                # Get current state
-                chunks = cache_entry.get('chunks', [])
-                done = cache_entry.get('done', False)
-                error = cache_entry.get('error')
-                
-                # Yield any new chunks
-                while chunk_index < len(chunks):
-                    yield chunks[chunk_index]
-                    chunk_index += 1
-                
-                # Check if we're done
-                if done:
-                    if error:
-                        mealplan_logger.error(f"[PREGEN_ERROR] {error}")
-                    break
-                
-                # Wait a bit for more chunks
-                await asyncio.sleep(0.05)
+            """Stream pre-generated chunks, waiting for more if not done (possibly from another worker)"""
+            sent = 0
+            try:
+                async for chunk in pregen_store.tail(session_id):
+                    yield chunk
+                    if chunk.strip():
+                        sent += 1
+            except PregenDropped:
+                # Preempted, evicted or superseded before it finished (a race with the promotion above)
+                if not sent:
+                    mealplan_logger.warning(f"[PREGEN_DROPPED] Session {session_id} dropped before its first day, "
+                                            f"generating fresh")
+                    async for chunk in generate_mealplan_stream(data):
+                        yield chunk
+                    return
+                mealplan_logger.error(f"[PREGEN_DROPPED] Session {session_id} dropped after {sent} chunks")
+                yield "\n\nError: the pre-generated plan was dropped before it finished, please retry\n".encode("utf-8")
+                return
+            
+            status = await pregen_store.status(session_id)
+            if status and status.get('error'):
+                mealplan_logger.error(f"[PREGEN_ERROR] {status['error']}")
             
             # Cleanup cache entry after streaming
-            if session_id in mealplan_cache:
-                del mealplan_cache[session_id]
-                mealplan_logger.info(f"[PREGEN_CLEANUP] Removed session {session_id} from cache")
+            await pregen_store.delete(session_id)
+            mealplan_logger.info(f"[PREGEN_CLEANUP] Removed session {session_id} from cache")
         
-        return StreamingResponse(stream_from_cache(), media_type="application/octet-stream")
+        return plan_stream_response(stream_from_cache(), stream_format)
     
     # No cached data - proceed with normal generation
     if session_id:
@@ -1021,6 +1202,42 @@ async def meal_plan(request: Request):
     
     mealplan_logger.info(f"[DIETARY_EXTRACTION] Explicit: {dietary_explicit}, Extracted from prompt: {extracted['dietary']}, Merged: {dietary}")
 
+    # "single" (one 7-day stream, default) or "parallel" (one stream per day group)
+    generation_mode, day_group_size = resolve_generation_mode(data)
+    # "inline" (fix_quantities before a day is sent, default) or "background" (REPLACE-DAY patches)
+    repair_mode = resolve_repair_mode(data)
+    # "text" (the model writes the plan as shown, default) or "compact" (pipe records, rendered here)
+    output_format = resolve_output_format(data)
+    # Race a second main stream when the first token is late (MEALPLAN_HEDGE / "hedge")
+    hedge = resolve_hedge(data)
+
+    # ============================================================
+    # SINGLE-FLIGHT - Attach retries/double submits to an identical in-flight plan
+    # ============================================================
+    flight_key = canonical_key(
+        calories=calories,
+        macros=macros,  # From weight and calories; both prompts state the targets
+        dietary=normalize_list(dietary),
+        allergies=normalize_list(allergies),
+        prompt=normalize_prompt(user_prompt),
+        healthGoals=normalize_prompt(goals),
+        targetWeight=target_weight,
+        timelineWeeks=timeline_weeks,
+        capped=bool(capped),
+        generationMode=generation_mode,
+        dayGroupSize=day_group_size,
+        repairMode=repair_mode,
+        outputFormat=output_format,
+        idempotencyKey=get_idempotency_key(request, data),
+    )
+    flight_channel, flight_leader = mealplan_flights.join(flight_key)
+    # Same id for the leader and its followers; background repairs are stored under it
+    plan_id = f"{flight_key[:12]}-{int(flight_channel.created)}"
+    if not flight_leader:
+        return plan_stream_response(
+            mealplan_flights.stream(flight_key, flight_channel), stream_format, headers={"X-Plan-Id": plan_id},
+        )
+
     unique_id = str(uuid.uuid4())[:8]
     timestamp = int(time.time())
     
@@ -1054,20 +1271,15 @@ async def meal_plan(request: Request):
         if allergies:
             diet_context += f"- Allergies (STRICTLY AVOID): {', '.join(allergies) if isinstance(allergies, list) else allergies}\n"
     
-    # Extract user preferences using CURATOR AGENT with macro context
-    preferences_start = time.perf_counter()
-    # Pass macros with calories for protein-aware curation
+    # CURATOR AGENT (with macro context) and dietary enforcement rules run concurrently;
+    # each has a deadline, after which the plan is generated without it
     macros_with_calories = {**macros, 'calories': calories}
-    user_preferences = await extract_user_preferences_llm(client, user_prompt, dietary, macros_with_calories)
-    user_specific_directions = user_preferences.get("directions", "")
-    preferences_time = (time.perf_counter() - preferences_start) * 1000
-    mealplan_logger.info(f"[AI_EXTRACTION] Completed in {preferences_time:.0f}ms")
-    
-    # Generate dynamic dietary enforcement rules
-    dietary_rules_start = time.perf_counter()
-    dietary_rules = await generate_dietary_rules_llm(client, dietary, allergies)
-    dietary_rules_time = (time.perf_counter() - dietary_rules_start) * 1000
-    mealplan_logger.info(f"[DIETARY_RULES] Completed in {dietary_rules_time:.0f}ms")
+    prep = await run_prep_stages(
+        user_prompt, dietary, allergies, macros_with_calories,
+        label="PREP_STAGES", context={"request_id": f"{unique_id}-{timestamp}"}
+    )
+    user_specific_directions = prep["curator"].get("directions", "")
+    dietary_rules = prep["dietary_rules"]
 
     user_message = f"""
     USER_INPUT:
@@ -1092,20 +1304,12 @@ async def meal_plan(request: Request):
     Request-ID: {unique_id}-{timestamp}
     """
 
-    system_prompt = f"""
+    def build_system_prompt(plan_format):
+        format_section, output_section = format_sections(plan_format)
+        return f"""
 You are a meal plan generator. Output EXACTLY 7 days using ONLY foods from the curator's allowed list.
 
-FORMAT:
-Day X:
-- Breakfast (XXX kcal):
-  1. Food - quantity - kcal - Xp/Xf/Xc
-- Lunch (XXX kcal):
-  1. Food - quantity - kcal - Xp/Xf/Xc
-- Snack (XXX kcal):
-  1. Food - quantity - kcal - Xp/Xf/Xc
-- Dinner (XXX kcal):
-  1. Food - quantity - kcal - Xp/Xf/Xc
-Total: XXXX kcal
+{format_section}
 
 QUANTITY UNITS:
 - GRAMS for: cooked foods, proteins, grains, vegetables (e.g., 150g, 200g)
@@ -1158,23 +1362,7 @@ FREQUENCY LIMITS - RESPECT USER PREFERENCES:
 
 {dietary_rules}
 
-=== OUTPUT FORMAT ===
-
-ITEM FORMAT: "Food name - Xg - XXX kcal - Xp/Xf/Xc"
-(p=protein g, f=fat g, c=carbs g)
-
-CRITICAL FORMAT RULES:
-- Food name = JUST the food (e.g., "Greek yogurt", "Chicken breast", "Oatmeal")
-- NEVER put quantities in food name (WRONG: "1/2 cup oats", RIGHT: "Oatmeal")
-- Quantity = grams only (e.g., "150g", "200g")
-- For eggs/slices: use "Eggs - 2 eggs - XXX kcal" or "Bread - 2 slices - XXX kcal"
-
-EXAMPLES:
-✓ 1. Greek yogurt - 200g - 130 kcal - 20p/0f/8c
-✓ 2. Oatmeal - 80g - 100 kcal - 3p/2f/20c  
-✓ 3. Eggs - 2 eggs - 140 kcal - 12p/10f/0c
-✗ WRONG: 1/2 cup Greek yogurt - 200g - 130 kcal
-✗ WRONG: 2 hard-boiled eggs - 100g - 140 kcal
+{output_section}
 
 USE COMMON FOODS: Stick to everyday, widely available foods from curator's list.
 
@@ -1186,270 +1374,113 @@ END with:
 END-OF-PLAN-SUGGESTION: [brief tip for {target_weight}kg goal]
 """
 
-    MODEL = "llama-3.3-70b-versatile"  # Groq's fastest high-quality model
+    system_prompt = build_system_prompt(output_format)
+    # The FALLBACK call asks for "Day X:" prose and parses it as such, whatever the main stream's format
+    fallback_system_prompt = build_system_prompt(OUTPUT_FORMAT_TEXT)
+
+    async def repair_day(day_text, day_number):
+        return await fix_quantities_with_llm(client, day_text, day_number, calories, macros)
+
+    repairs = None
+    if repair_mode == REPAIR_MODE_BACKGROUND:
+        await repair_store.cleanup()  # Patches of earlier plans past their TTL
+        repairs = BackgroundRepairs(plan_id, repair_day, calories, repair_store, repair_stats, mealplan_logger)
+
+    # Shared by the single-stream and parallel generation modes
+    async def process_day(day_text, expected_day):
+        """Post-process one day off the event loop, fixing quantities on a calorie anomaly."""
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(
+            executor,
+            process_single_day,
+            day_text,
+            calories,
+            macros,
+            5,  # min_qty
+            expected_day  # expected_day_number
+        )
+
+        # Handle tuple return (output, anomaly_info)
+        if isinstance(result, tuple):
+            processed, anomaly_info = result
+        else:
+            processed, anomaly_info = result, None
+
+        # If anomaly detected (calories too low), fix quantities
+        if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
+            if repairs is not None:
+                # Send the locally corrected day now; a REPLACE-DAY patch follows if the repair validates
+                mealplan_logger.warning(f"[ANOMALY] Day {anomaly_info['day_number']} has calorie deficit. Repairing in background...")
+                repairs.schedule(day_text, anomaly_info['day_number'], processed)
+                return processed
+            mealplan_logger.warning(f"[ANOMALY] Day {anomaly_info['day_number']} has calorie deficit. Fixing quantities...")
+            corrected = await fix_quantities_with_llm(
+                client, day_text,
+                anomaly_info['day_number'], calories, macros
+            )
+            if corrected:
+                processed = corrected
+        return processed
 
-    # Regex patterns
-    day_start_regex = re.compile(r'Day \d+:')
-    suggestion_phrase = re.compile(r'END[-_\s]?OF[-_\s]?PLAN[-_\s]?SUGGESTION[:\s]*', re.IGNORECASE)
     # USE_MIMIC = False
     async def event_stream():
         """Async generator for streaming the GPT output as raw bytes."""
         # print("Mealplan generation started")
+        stream = fallback_stream = None
         try:
             # Groq streaming uses stream=True parameter
-            stream = await client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=4096,
-                temperature=0.9,
-                stream=True,
-            )
+            stream = upstream_stats.track(await plan_hedger.create(
+                lambda timed_client: model_router.create(
+                    ROUTE_PLAN, timed_client, PRIORITY_INTERACTIVE,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ],
+                    max_tokens=4096,
+                    temperature=0.9,
+                    stream=True,
+                ),
+                hedge=hedge,
+                client=client,
+            ), "mealplan", mealplan_logger)
 
-            buffer = ""
             day_count = 0
-            suggestion_mode = False
             processed_days_summary = []  # Track meals from processed days for variety
-            
-            async for chunk in stream:
-                # Extract token text from Groq streaming response
-                token_text = None
-                try:
-                    if chunk.choices and chunk.choices[0].delta:
-                        token_text = chunk.choices[0].delta.content
-                except Exception:
-                    token_text = None
-
-                if not token_text:
-                    continue
 
-                # If we're already in suggestion mode, stream everything directly
-                if suggestion_mode:
-                    yield token_text.encode("utf-8")
+            # The reader keeps draining the stream while earlier days are processed;
+            # days come back in order. The segmenter only scans new text, and on close
+            # an incomplete Day 7 is dropped and regenerated via fallback. Compact
+            # records are parsed line by line and each day is rendered as text.
+            # Once Day 7 and the suggestion are in, the completion is closed
+            # instead of read to the provider's end.
+            if output_format == OUTPUT_FORMAT_COMPACT:
+                segmenter = CompactPlanParser(max_days=7)
+            else:
+                segmenter = DaySegmenter(max_days=7)
+            token_texts = until_plan_complete(
+                stream_token_texts(stream), segmenter, lambda: stream.close(CLOSE_COMPLETE)
+            )
+            async for event, processed in pipelined_days(
+                token_texts, segmenter, process_day, day_pipeline_metrics
+            ):
+                if event.kind == SUGGESTION:
+                    yield processed.encode("utf-8")
                     continue
 
-                buffer += token_text
+                # Track this day's key items for variety in next days
+                processed_days_summary.append(f"Day {event.day_number}: {processed[:200]}...")
 
-                # Check if suggestion marker found
-                suggestion_match = suggestion_phrase.search(buffer)
-                if suggestion_match and not suggestion_mode:
-                    suggestion_mode = True
-                    idx = suggestion_match.start()
-                    
-                    # Process any remaining complete days before the suggestion
-                    pre_suggestion = buffer[:idx]
-                    day_starts = [m.start() for m in day_start_regex.finditer(pre_suggestion)]
-                    
-                    if day_starts:
-                        for i, start in enumerate(day_starts):
-                            if day_count >= 7:
-                                break
-                            end = day_starts[i + 1] if i + 1 < len(day_starts) else len(pre_suggestion)
-                            day_text = pre_suggestion[start:end]
-                            
-                            # Skip if too short
-                            if len(day_text.strip()) < 50:
-                                continue
-                            
-                            # Non-blocking processing with timing
-                            expected_day = day_count + 1  # day_count is 0-indexed
-                            proc_start = time.perf_counter()
-                            loop = asyncio.get_event_loop()
-                            result = await loop.run_in_executor(
-                                executor,
-                                process_single_day,
-                                day_text,
-                                calories,
-                                macros,
-                                5,  # min_qty
-                                expected_day  # expected_day_number
-                            )
-                            proc_time = (time.perf_counter() - proc_start) * 1000
-                            
-                            # Handle tuple return (output, anomaly_info)
-                            if isinstance(result, tuple):
-                                processed, anomaly_info = result
-                            else:
-                                processed, anomaly_info = result, None
-                            
-                            # If anomaly detected, fix quantities (lightweight call)
-                            if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
-                                corrected = await fix_quantities_with_llm(
-                                    client, MODEL, day_text, 
-                                    anomaly_info['day_number'], calories, macros
-                                )
-                                if corrected:
-                                    processed = corrected
-                            
-                            # Track this day's key items for variety in next days
-                            processed_days_summary.append(f"Day {day_count+1}: {processed[:200]}...")
-                            
-                            # Stream immediately to frontend
-                            processed += "\n"
-                            yield processed.encode("utf-8")
-                            await asyncio.sleep(0)
-                            day_count += 1
-                    
-                    # Stream the suggestion
-                    to_stream = buffer[idx:]
-                    yield to_stream.encode("utf-8")
-                    
-                    buffer = ""
-                    continue
-
-                # Process complete days ONE AT A TIME as soon as we have 2 markers
-                while day_count < 7:
-                    day_starts = [m.start() for m in day_start_regex.finditer(buffer)]
-                    if len(day_starts) < 2:
-                        break
-                    start = day_starts[0]
-                    end = day_starts[1]
-                    day_text = buffer[start:end]
-                    
-                    # Non-blocking processing with timing
-                    expected_day = day_count + 1  # day_count is 0-indexed
-                    proc_start = time.perf_counter()
-                    loop = asyncio.get_event_loop()
-                    result = await loop.run_in_executor(
-                        executor,
-                        process_single_day,
-                        day_text,
-                        calories,
-                        macros,
-                        5,  # min_qty
-                        expected_day  # expected_day_number
-                    )
-                    proc_time = (time.perf_counter() - proc_start) * 1000
-                    
-                    # Handle tuple return (output, anomaly_info)
-                    if isinstance(result, tuple):
-                        processed, anomaly_info = result
-                    else:
-                        processed, anomaly_info = result, None
-                    
-                    # If anomaly detected (calories too low), fix quantities
-                    if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
-                        mealplan_logger.warning(f"[ANOMALY] Day {anomaly_info['day_number']} has calorie deficit. Fixing quantities...")
-                        corrected = await fix_quantities_with_llm(
-                            client, MODEL, day_text,
-                            anomaly_info['day_number'], calories, macros
-                        )
-                        if corrected:
-                            processed = corrected
-                    
-                    # Track this day's key items for variety in next days
-                    processed_days_summary.append(f"Day {day_count+1}: {processed[:200]}...")
-                    
-                    # Stream this processed day immediately to frontend
-                    processed += "\n"
-                    yield processed.encode("utf-8")
-                    
-                    # Remove processed day from buffer and look for next day
-                    buffer = buffer[end:]
-                    day_count += 1
+                # Stream this processed day immediately to frontend
+                processed += "\n"
+                yield processed.encode("utf-8")
+                day_count += 1
 
-            # Process ALL remaining buffer content after stream ends
-            if buffer.strip() and day_count < 7:
-                # print(f"\n[DEBUG] Processing final buffer, day_count={day_count}, buffer_length={len(buffer)}")
-                
-                # Check for suggestion marker in remaining buffer
-                suggestion_match = suggestion_phrase.search(buffer)
-                
-                if suggestion_match:
-                    # Split buffer into days and suggestion
-                    suggestion_start = suggestion_match.start()
-                    pre_suggestion = buffer[:suggestion_start]
-                    suggestion_text = buffer[suggestion_start:]
-                else:
-                    pre_suggestion = buffer
-                    suggestion_text = ""
-                
-                # Process any remaining days - INCLUDING last day with only one marker
-                if pre_suggestion.strip():
-                    day_starts = list(day_start_regex.finditer(pre_suggestion))
-                    # print(f"[DEBUG] Found {len(day_starts)} day markers in final buffer")
-                    
-                    # Check if the last day marker is incomplete (less than 300 chars OR missing "Total Daily")
-                    if day_starts and day_count == 6:
-                        last_day_start = day_starts[-1].start()
-                        last_day_text = pre_suggestion[last_day_start:]
-                        remaining_after_last_marker = len(last_day_text)
-                        
-                        # Day 7 is incomplete if:
-                        # 1. Less than 300 chars after marker, OR
-                        # 2. Doesn't contain "Total Daily" (which indicates completion)
-                        is_incomplete = (remaining_after_last_marker < 300 or 
-                                       "Total Daily" not in last_day_text)
-                        
-                        if is_incomplete:
-                            # print(f"[DEBUG] Last day appears incomplete ({remaining_after_last_marker} chars, has 'Total Daily': {'Total Daily' in last_day_text}). Will skip and regenerate via fallback.")
-                            # Remove the incomplete last day from processing - DON'T send it to frontend
-                            day_starts = day_starts[:-1]
-                            # Also clear the buffer so fallback knows to regenerate
-                            buffer = pre_suggestion[:last_day_start] if last_day_start > 0 else ""
-                    
-                    for i in range(len(day_starts)):
-                        if day_count >= 7:
-                            break
-                        start = day_starts[i].start()
-                        # For last day, take everything to end of pre_suggestion
-                        end = day_starts[i+1].start() if i+1 < len(day_starts) else len(pre_suggestion)
-                        day_text = pre_suggestion[start:end]
-                        
-                        # CRITICAL: Don't skip short days at the end - Day 7 might be incomplete
-                        # Only skip if it's truly empty (< 20 chars) or doesn't have "Day" in it
-                        if len(day_text.strip()) < 20 or "Day" not in day_text:
-                            print(f"[DEBUG] Skipping invalid day segment (length={len(day_text)})")
-                            continue
-                        
-                        # print(f"[DEBUG] Processing final day {day_count + 1}, text_length={len(day_text)}")
-                        
-                        # Non-blocking processing
-                        expected_day = day_count + 1  # day_count is 0-indexed
-                        proc_start = time.perf_counter()
-                        loop = asyncio.get_event_loop()
-                        result = await loop.run_in_executor(
-                            executor,
-                            process_single_day,
-                            day_text,
-                            calories,
-                            macros,
-                            5,  # min_qty
-                            expected_day  # expected_day_number
-                        )
-                        
-                        # Handle tuple return (output, anomaly_info)
-                        if isinstance(result, tuple):
-                            processed, anomaly_info = result
-                        else:
-                            processed, anomaly_info = result, None
-                        
-                        # If anomaly detected, fix quantities
-                        if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
-                            mealplan_logger.warning(f"[ANOMALY] Day {anomaly_info['day_number']} has calorie deficit. Fixing quantities...")
-                            corrected = await fix_quantities_with_llm(
-                                client, MODEL, day_text,
-                                anomaly_info['day_number'], calories, macros
-                            )
-                            if corrected:
-                                processed = corrected
-                        
-                        processed += "\n"
-                        yield processed.encode("utf-8")
-                        day_count += 1
-                        # print(f"[DEBUG] Completed day {day_count}, total processed so far")
-                
-                # Stream suggestion if present
-                if suggestion_text:
-                    end_marker_match = suggestion_phrase.search(suggestion_text)
-                    if end_marker_match:
-                        start_idx = end_marker_match.start()
-                        suggestion_output = suggestion_text[start_idx:]
-                    else:
-                        suggestion_output = suggestion_text
-                    yield suggestion_output.encode("utf-8")
+                # Background repairs that finished meanwhile
+                if repairs is not None:
+                    for patch in repairs.take_ready():
+                        yield patch.encode("utf-8")
+            if output_format == OUTPUT_FORMAT_COMPACT:
+                compact_parse_stats.add(segmenter)
             
             # FALLBACK: If we still don't have all 7 days, make a second targeted API call
             # Check both day_count and if there was an incomplete day detected
@@ -1500,180 +1531,46 @@ Then add: END-OF-PLAN-SUGGESTION: [2-line suggestion for user's {target_weight}k
                         yield "\n".encode("utf-8")
                         await asyncio.sleep(0.1)
                     
-                    # Use streaming for fallback and process days in real-time
-                    fallback_buffer = ""
-                    fallback_day_count = 0
-                    
                     # Groq streaming uses stream=True parameter
-                    fallback_stream = await client.chat.completions.create(
-                        model=MODEL,
+                    fallback_stream = upstream_stats.track(await model_router.create(
+                        ROUTE_PLAN, client, PRIORITY_INTERACTIVE,
                         messages=[
-                            {"role": "system", "content": system_prompt},
+                            {"role": "system", "content": fallback_system_prompt},
                             {"role": "user", "content": fallback_prompt}
                         ],
                         max_tokens=4096,
                         temperature=0.9,
                         stream=True,
-                    )
+                    ), "mealplan_fallback", mealplan_logger)
                     
                     # Send immediate keep-alive before first token arrives
                     for _ in range(10):
                         yield "\n".encode("utf-8")
                         await asyncio.sleep(0.2)  # Spread over 2 seconds
                     
-                    # Stream tokens and process days as they complete
-                    async for chunk in fallback_stream:
-                        token_text = None
-                        try:
-                            if chunk.choices and chunk.choices[0].delta:
-                                token_text = chunk.choices[0].delta.content
-                        except Exception:
-                            token_text = None
-                        
-                        if not token_text:
+                    # Same reader -> process pipeline as the main stream. The segmenter
+                    # numbers the missing days from 1, so offset them to the plan's days;
+                    # a last day cut off here is kept, there is no further fallback.
+                    first_missing = day_count
+                    fallback_segmenter = DaySegmenter(max_days=len(missing_days), drop_incomplete_last_day=False)
+                    fallback_texts = until_plan_complete(
+                        stream_token_texts(fallback_stream), fallback_segmenter,
+                        lambda: fallback_stream.close(CLOSE_COMPLETE)
+                    )
+                    async for event, processed in pipelined_days(
+                        fallback_texts, fallback_segmenter,
+                        lambda day_text, n: process_day(day_text, first_missing + n),
+                        day_pipeline_metrics
+                    ):
+                        if event.kind == SUGGESTION:
+                            yield processed.encode("utf-8")
                             continue
-                        
-                        # Send newline periodically to keep frontend spinner active
-                        yield "\n".encode("utf-8")
-                        
-                        fallback_buffer += token_text
-                        
-                        # Check if we have complete days to process (look for 2 day markers or END marker)
-                        while day_count < 7 and fallback_day_count < len(missing_days):
-                            day_starts = [m.start() for m in day_start_regex.finditer(fallback_buffer)]
-                            
-                            # Need at least 2 markers to process a complete day
-                            if len(day_starts) < 2:
-                                # Check if we hit the end marker for last day
-                                if "Total Daily" in fallback_buffer and len(day_starts) == 1:
-                                    # Process the last day
-                                    start = day_starts[0]
-                                    day_text = fallback_buffer[start:]
-                                    
-                                    if len(day_text.strip()) > 100:
-                                        expected_day = day_count + 1  # day_count is 0-indexed
-                                        loop = asyncio.get_event_loop()
-                                        result = await loop.run_in_executor(
-                                            executor,
-                                            process_single_day,
-                                            day_text,
-                                            calories,
-                                            macros,
-                                            5,  # min_qty
-                                            expected_day  # expected_day_number
-                                        )
-                                        
-                                        # Handle tuple return
-                                        if isinstance(result, tuple):
-                                            processed, anomaly_info = result
-                                        else:
-                                            processed, anomaly_info = result, None
-                                        
-                                        # Fix quantities if anomaly
-                                        if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
-                                            corrected = await fix_quantities_with_llm(
-                                                client, MODEL, day_text,
-                                                anomaly_info['day_number'], calories, macros
-                                            )
-                                            if corrected:
-                                                processed = corrected
-                                        
-                                        processed += "\n"
-                                        yield processed.encode("utf-8")
-                                        day_count += 1
-                                        fallback_day_count += 1
-                                        fallback_buffer = ""  # Clear buffer after processing
-                                break
-                            
-                            # Process the first complete day
-                            start = day_starts[0]
-                            end = day_starts[1]
-                            day_text = fallback_buffer[start:end]
-                            
-                            if len(day_text.strip()) > 100:
-                                expected_day = day_count + 1  # day_count is 0-indexed
-                                loop = asyncio.get_event_loop()
-                                result = await loop.run_in_executor(
-                                    executor,
-                                    process_single_day,
-                                    day_text,
-                                    calories,
-                                    macros,
-                                    5,  # min_qty
-                                    expected_day  # expected_day_number
-                                )
-                                
-                                # Handle tuple return
-                                if isinstance(result, tuple):
-                                    processed, anomaly_info = result
-                                else:
-                                    processed, anomaly_info = result, None
-                                
-                                # Fix quantities if anomaly
-                                if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
-                                    corrected = await fix_quantities_with_llm(
-                                        client, MODEL, day_text,
-                                        anomaly_info['day_number'], calories, macros
-                                    )
-                                    if corrected:
-                                        processed = corrected
-                                
-                                processed += "\n"
-                                yield processed.encode("utf-8")
-                                day_count += 1
-                                fallback_day_count += 1
-                            
-                            # Remove processed day from buffer
-                            fallback_buffer = fallback_buffer[end:]
-                    
-                    # Process any remaining content in buffer (e.g., last day or suggestion)
-                    if fallback_buffer.strip() and day_count < 7:
-                        day_starts = list(day_start_regex.finditer(fallback_buffer))
-                        if day_starts:
-                            for i in range(len(day_starts)):
-                                if day_count >= 7:
-                                    break
-                                start = day_starts[i].start()
-                                end = day_starts[i+1].start() if i+1 < len(day_starts) else len(fallback_buffer)
-                                day_text = fallback_buffer[start:end]
-                                
-                                if len(day_text.strip()) > 100:
-                                    expected_day = day_count + 1  # day_count is 0-indexed
-                                    loop = asyncio.get_event_loop()
-                                    result = await loop.run_in_executor(
-                                        executor,
-                                        process_single_day,
-                                        day_text,
-                                        calories,
-                                        macros,
-                                        5,  # min_qty
-                                        expected_day  # expected_day_number
-                                    )
-                                    
-                                    # Handle tuple return
-                                    if isinstance(result, tuple):
-                                        processed, anomaly_info = result
-                                    else:
-                                        processed, anomaly_info = result, None
-                                    
-                                    # Fix quantities if anomaly
-                                    if anomaly_info and anomaly_info.get('type') == 'calorie_deficit':
-                                        corrected = await fix_quantities_with_llm(
-                                            client, MODEL, day_text,
-                                            anomaly_info['day_number'], calories, macros
-                                        )
-                                        if corrected:
-                                            processed = corrected
-                                    
-                                    processed += "\n"
-                                    yield processed.encode("utf-8")
-                                    day_count += 1
-                    
-                    # Check for suggestion in remaining buffer
-                    suggestion_match = suggestion_phrase.search(fallback_buffer)
-                    if suggestion_match:
-                        suggestion_text = fallback_buffer[suggestion_match.start():]
-                        yield suggestion_text.encode("utf-8")
+                        processed += "\n"
+                        yield processed.encode("utf-8")
+                        day_count += 1
+                        if repairs is not None:
+                            for patch in repairs.take_ready():
+                                yield patch.encode("utf-8")
                     
                     # print(f"[FALLBACK] Completed. Total days: {day_count}/7")
                     
@@ -1682,20 +1579,93 @@ Then add: END-OF-PLAN-SUGGESTION: [2-line suggestion for user's {target_weight}k
                     print(error_msg)
                     yield error_msg.encode("utf-8")
 
+            # Keep the stream open a little for repairs still running
+            if repairs is not None:
+                repairs.close()
+                async for patch in repairs.drain():
+                    yield patch.encode("utf-8")
+
+        except asyncio.CancelledError:
+            # Every client left (single-flight cancels the orphaned producer): nobody gets the patches
+            if repairs is not None:
+                upstream_stats.repairs_cancelled += repairs.cancel()
+            raise
         except Exception as e:
             error_msg = f"\n\nError generating meal plan: {str(e)}\n"
             yield error_msg.encode("utf-8")
         finally:
+            # No-ops for completions that ended or were closed on completion
+            for upstream in (stream, fallback_stream):
+                if upstream is not None:
+                    await upstream.close(CLOSE_CANCELLED)
+            if repairs is not None:
+                repairs.close()
             total_ms = (time.perf_counter() - full_t_start) * 1000
             mealplan_logger.info(f"[ENDPOINT_TOTAL_TIME]{total_ms:.2f} ms")
 
-    return StreamingResponse(event_stream(), media_type="application/octet-stream")
+    async def parallel_event_stream():
+        """Parallel mode: one stream per day group, re-ordered so the client still gets Day 1..7."""
+        try:
+            async for kind, text in stream_days_parallel(
+                model_router.bind(ROUTE_PLAN, client, PRIORITY_INTERACTIVE), model_router.primary(ROUTE_PLAN),
+                system_prompt, user_message, process_day,
+                group_size=day_group_size,
+                output_format=output_format,
+                variety_hint_fn=lambda day, attempt: get_variety_instructions(dietary=dietary, attempt_number=attempt),
+                logger=mealplan_logger,
+                upstream_stats=upstream_stats,
+                metrics=day_pipeline_metrics,
+            ):
+                if kind == SUGGESTION:
+                    yield text.encode("utf-8")
+                else:
+                    yield (text + "\n").encode("utf-8")
+                if repairs is not None:
+                    for patch in repairs.take_ready():
+                        yield patch.encode("utf-8")
+            if repairs is not None:
+                repairs.close()
+                async for patch in repairs.drain():
+                    yield patch.encode("utf-8")
+        except asyncio.CancelledError:
+            if repairs is not None:
+                upstream_stats.repairs_cancelled += repairs.cancel()
+            raise
+        except Exception as e:
+            error_msg = f"\n\nError generating meal plan: {str(e)}\n"
+            yield error_msg.encode("utf-8")
+        finally:
+            if repairs is not None:
+                repairs.close()
+            total_ms = (time.perf_counter() - full_t_start) * 1000
+            mealplan_logger.info(f"[ENDPOINT_TOTAL_TIME]{total_ms:.2f} ms (mode={generation_mode}, group={day_group_size})")
+
+    stream_factory = parallel_event_stream if generation_mode == GENERATION_MODE_PARALLEL else event_stream
+    return plan_stream_response(
+        mealplan_flights.stream(flight_key, flight_channel, stream_factory), stream_format,
+        headers={"X-Plan-Id": plan_id},
+    )
+
+
+@app.get("/mealplan/patches/{plan_id}")
+async def meal_plan_patches(plan_id: str, wait: float = 0.0):
+    """
+    REPLACE-DAY patches from background repairs (repairMode=background) of a plan,
+    for clients whose stream closed before every repair finished. `wait` seconds
+    (max 30) to let running repairs complete.
+    """
+    patches, done = await collect_patches(repair_store, plan_id, min(max(wait, 0.0), 30.0))
+    if patches is None:
+        raise HTTPException(status_code=404, detail="No repairs for this plan (unknown or expired)")
+    return {"plan_id": plan_id, "done": done, "patches": patches}
 
 
 
 @app.post("/workoutplan")
+@workoutplan_flights.leads
 async def workout_plan(request: Request):
     data = await request.json()
+    stream_format = negotiate_stream_format(request)
     workoutplan_logger.info("=== /workoutplan endpoint called ===")
     workoutplan_logger.info("Received data: %s", json.dumps(data, indent=2))
 
@@ -1715,6 +1685,22 @@ async def workout_plan(request: Request):
     workoutplan_logger.info("User Prompt: %s", user_prompt)
     workoutplan_logger.info("===================\n")
 
+    # Attach retries/double submits to an identical in-flight workout plan
+    flight_key = canonical_key(
+        goal=normalize_prompt(goal),
+        workout_focus=normalize_prompt(workout_focus),
+        prompt=normalize_prompt(user_prompt),
+        workout_days=workout_days,
+        targetWeight=target_weight,
+        timelineWeeks=timeline_weeks,
+        idempotencyKey=get_idempotency_key(request, data),
+    )
+    flight_channel, flight_leader = workoutplan_flights.join(flight_key)
+    if not flight_leader:
+        return plan_stream_response(
+            workoutplan_flights.stream(flight_key, flight_channel), stream_format, WorkoutEventEncoder
+        )
+
     system_prompt = f"""
 You are a fitness and nutrition assistant. Generate personalized workout plans.
 
@@ -1768,11 +1754,12 @@ At the end of the response, include a closing recommendation tailored to the use
     async def event_stream():
         workoutplan_logger.info("=== GROQ WORKOUT OUTPUT START ===")
         total_chars = 0
+        stream = None
         
         try:
             # Groq streaming uses stream=True parameter
-            stream = await client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
+            stream = upstream_stats.track(await model_router.create(
+                ROUTE_WORKOUT, client, PRIORITY_INTERACTIVE, logger=workoutplan_logger,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_message},
@@ -1780,7 +1767,7 @@ At the end of the response, include a closing recommendation tailored to the use
                 max_tokens=4096,
                 temperature=0.9,
                 stream=True,
-            )
+            ), "workoutplan", workoutplan_logger)
             
             # Iterate over the stream chunks
             async for chunk in stream:
@@ -1801,14 +1788,46 @@ At the end of the response, include a closing recommendation tailored to the use
             error_msg = f"\nException during streaming: {str(e)}\n{traceback.format_exc()}"
             workoutplan_logger.error("%s", error_msg)
             yield error_msg.encode("utf-8")
+        finally:
+            if stream is not None:
+                await stream.close(CLOSE_CANCELLED)
 
-    return StreamingResponse(event_stream(), media_type="application/octet-stream")
+    return plan_stream_response(
+        workoutplan_flights.stream(flight_key, flight_channel, event_stream), stream_format, WorkoutEventEncoder
+    )
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Process-local counters for caching/coalescing (one gunicorn worker's view)."""
+    return {
+        "pregen": {**pregen_store.stats(), **pregen_admission.stats()},
+        "single_flight": {
+            "mealplan": mealplan_flights.stats(),
+            "workoutplan": workoutplan_flights.stats(),
+        },
+        "event_loop_lag_ms": loop_monitor.stats(),
+        "day_executor": executor.stats(),
+        "day_pipeline": day_pipeline_metrics.stats(),
+        "day_repair": {**repair_stats.as_dict(), "store": repair_store.stats()},
+        # Lookups/corrections counted where days run (this process in thread mode)
+        "nutrition_index": get_nutrition_index().stats() if NUTRITION_INDEX_MODE == "on" else None,
+        "food_table": get_food_table().stats() if FOOD_TABLE_MODE != "off" else None,
+        "compact_output": compact_parse_stats.as_dict(),
+        "stream_events": stream_event_stats.stats(),
+        "upstream": upstream_stats.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "rate_governor": await rate_governor.stats_dict(),
+        "hedging": plan_hedger.stats_dict(),
+        "model_router": model_router.stats(),
+        "stage_cache": {"curator": curator_cache.stats(), "dietary_rules": dietary_rules_cache.stats()},
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -1820,6 +1839,7 @@ if __name__ == "__main__":
     print("- POST /user             : User profile creation")
     print("- POST /mealplan         : Generate meal plans")
     print("- POST /workoutplan      : Generate workout plans")
+    print("- GET  /metrics          : Cache/coalescing counters")
     print("- POST /suggestions      : Generate personalized suggestions")
 
     uvicorn.run("app:app", host="0.0.0.0", port=5002, reload=True)
\ No newline at end of file
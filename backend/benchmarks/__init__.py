@@ -0,0 +1,6 @@
+"""
+Micro-benchmarks for the meal plan backend.
+
+Run from the backend directory, e.g.:
+    python -m benchmarks.bench_day_segmenter
+"""
@@ -0,0 +1,153 @@
+"""
+Text vs compact (outputFormat=compact, plan_format.py) meal-plan output.
+
+Every recorded 7-day plan is replayed in both formats: as logged, and
+re-encoded as the compact records the compact prompt asks for
+("1|B|Oatmeal|150|g|150|5|2|30"). Token counts use the approximate replay
+tokenizer (benchmarks.recorded_plans.tokenize), not the model's own.
+
+  tokens/plan   output tokens of the plan body (suggestion included)
+  chars/plan    output characters
+  last day s    time to the 7th processed day through FakeChatClient at
+                --ttft/--tps, pipelined_days and the real process_single_day
+  days ok       days emitted with every source item recovered (same item
+                count and kcal) - the parse success rate
+  rejected      compact lines dropped as malformed
+
+--noise P perturbs each compact record with probability P the way models
+drift (units glued to numbers, full meal names, stray headers and code
+fences, and 1 in 4 of those a record with a missing field) to see what the
+parser tolerates.
+
+    python -m benchmarks.bench_compact_output [--plans N] [--tps N] [--ttft S] [--noise P]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import re
+import statistics
+import time
+
+from day_pipeline import PipelineMetrics, pipelined_days, stream_token_texts
+from day_segmenter import DaySegmenter, SUGGESTION
+from plan_format import CompactPlanParser
+from utils import calculate_macros, process_single_day
+from benchmarks.fake_llm import FakeChatClient
+from benchmarks.recorded_plans import DEFAULT_SUGGESTION, load_recorded_plans, render_plan, tokenize
+
+ITEM = re.compile(
+    r"^\s*\d+\.\s*(.+?)\s+-\s+(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s+-\s+(\d+(?:\.\d+)?)\s*kcal\s+-\s+"
+    r"(\d+(?:\.\d+)?)p/(\d+(?:\.\d+)?)f/(\d+(?:\.\d+)?)c"
+)
+MEAL = re.compile(r"^-\s*(Breakfast|Lunch|Snack|Dinner)", re.IGNORECASE)
+
+
+def day_items(day_text):
+    """[(meal, name, qty, unit, kcal, p, f, c)] of a text-format day."""
+    items, meal = [], None
+    for line in day_text.splitlines():
+        header = MEAL.match(line)
+        if header:
+            meal = header.group(1).capitalize()
+            continue
+        item = ITEM.match(line)
+        if item and meal:
+            name, qty, unit, kcal, protein, fat, carbs = item.groups()
+            items.append((meal, name, qty, unit.lower() or "g", kcal, protein, fat, carbs))
+    return items
+
+
+def to_compact(plan, noise=0.0, rng=None):
+    lines = []
+    for number, day in enumerate(plan["days"][:7], 1):
+        for meal, name, qty, unit, kcal, protein, fat, carbs in day_items(day):
+            fields = [str(number), meal[0], name, qty, unit, kcal, protein, fat, carbs]
+            if noise and rng.random() < noise:
+                fields, extra = perturb(fields, rng)
+                lines.extend(extra)
+            lines.append("|".join(fields))
+    return "\n".join(lines) + "\n" + DEFAULT_SUGGESTION + "\n"
+
+
+def perturb(fields, rng):
+    kind = rng.randrange(4)
+    if kind == 0:
+        fields[3] += fields[4]           # "150g"
+        fields[5] += " kcal"
+    elif kind == 1:
+        fields[1] = {"B": "Breakfast", "L": "Lunch", "S": "Snack", "D": "Dinner"}[fields[1]]
+        fields = [f" {field} " for field in fields]
+    elif kind == 2:
+        return fields, [rng.choice(["```", f"Day {fields[0]}:", ""])]
+    else:
+        del fields[rng.randrange(3, 9)]  # A record the parser has to reject
+    return fields, []
+
+
+def day_ok(source_day, emitted_day):
+    source, emitted = day_items(source_day), day_items(emitted_day)
+    return (len(source) == len(emitted)
+            and abs(sum(float(i[4]) for i in source) - sum(float(i[4]) for i in emitted)) <= len(source))
+
+
+async def run_once(plan, body, segmenter, args):
+    calories = plan["target_calories"] or 2000
+    macros = plan["macros"] or calculate_macros(70, calories)
+    client = FakeChatClient(lambda messages: body, ttft=args.ttft, tokens_per_sec=args.tps)
+    emitted = []
+
+    async def process_day(day_text, day_number):
+        emitted.append(day_text)
+        processed, _ = process_single_day(day_text, calories, macros, 5, day_number)
+        return processed
+
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(messages=[{"role": "user", "content": ""}], stream=True)
+    last_day = None
+    async for event, _ in pipelined_days(stream_token_texts(stream), segmenter, process_day, PipelineMetrics()):
+        if event.kind != SUGGESTION:
+            last_day = time.perf_counter() - started
+    ok = sum(day_ok(source, day) for source, day in zip(plan["days"][:7], emitted))
+    return {"last_day": last_day, "days": len(emitted), "ok": ok}
+
+
+async def main_async(args):
+    plans = load_recorded_plans(min_days=7)[:args.plans]
+    # Drop plans with lines the item regex can't read, so both formats carry the same items
+    plans = [p for p in plans if all(0 < len(day_items(d)) == d.count(" kcal - ") for d in p["days"][:7])]
+    rng = random.Random(7)
+    formats = (
+        ("text", lambda plan: render_plan(plan), lambda: DaySegmenter(max_days=7)),
+        ("compact", lambda plan: to_compact(plan, args.noise, rng), lambda: CompactPlanParser(max_days=7)),
+    )
+    print(f"{len(plans)} plans, ttft {args.ttft}s, {args.tps} tok/s, noise {args.noise}")
+    print(f"{'format':<8} {'tokens/plan':>11} {'chars/plan':>11} {'last day s':>11} {'days ok':>8} {'rejected':>9}")
+    for name, encode, make_segmenter in formats:
+        tokens, chars, runs, rejected = [], [], [], 0
+        for plan in plans:
+            body = encode(plan)
+            tokens.append(len(tokenize(body)))
+            chars.append(len(body))
+            segmenter = make_segmenter()
+            runs.append(await run_once(plan, body, segmenter, args))
+            rejected += getattr(segmenter, "rejected", 0)
+        ok = sum(r["ok"] for r in runs) / (7 * len(plans))
+        print(f"{name:<8} {statistics.mean(tokens):>11.0f} {statistics.mean(chars):>11.0f} "
+              f"{statistics.mean(r['last_day'] for r in runs):>11.2f} {ok:>8.1%} {rejected:>9d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, default=25)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--tps", type=float, default=250.0)
+    parser.add_argument("--noise", type=float, default=0.0, help="probability of perturbing a compact record")
+    args = parser.parse_args()
+
+    logging.getLogger("MEALPLAN").setLevel(logging.CRITICAL)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
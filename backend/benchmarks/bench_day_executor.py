@@ -0,0 +1,99 @@
+"""
+Thread pool vs warm process pool for process_single_day under concurrent plans.
+
+Each simulated plan streams 7 days: it waits --day-gen seconds (the LLM
+writing the day, jittered), then post-processes the day on the executor,
+like event_stream does. With N plans in flight the executor sees bursts of
+CPU work while the event loop keeps serving the other streams; loop lag
+shows how much that work stalls them.
+
+Per executor and concurrency level:
+  wall s        time until every plan has all 7 days
+  days/s        throughput
+  day p50/p99   submit-to-result latency per day (ms)
+  lag p99/max   event loop lag while the plans run (ms)
+
+    python -m benchmarks.bench_day_executor [--plans 10 50 100] [--workers 4] [--day-gen 0.05]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from day_executor import DayExecutor
+from loop_monitor import LoopLagMonitor, percentile
+from utils import process_single_day
+from benchmarks.bench_process_day import CORPUS_PATH, load_json
+
+DAYS_PER_PLAN = 7
+
+
+def process_case(text, target_calories, macros, expected_day):
+    """Runs in the executor (thread or worker process) with day logging off, as in bench_process_day."""
+    logging.getLogger("MEALPLAN").setLevel(logging.CRITICAL)
+    return process_single_day(text, target_calories, macros, 5, expected_day)
+
+
+async def run_plan(executor, cases, day_gen, latencies):
+    loop = asyncio.get_event_loop()
+    for case in cases:
+        await asyncio.sleep(day_gen * random.uniform(0.5, 1.5))
+        started = time.perf_counter()
+        await loop.run_in_executor(
+            executor, process_case, case["text"], case["target_calories"], case["macros"], case["expected_day"]
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run_level(executor, corpus, plans, day_gen):
+    monitor = LoopLagMonitor(interval=0.005, window=100000)
+    monitor.start()
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        run_plan(executor, random.sample(corpus, DAYS_PER_PLAN), day_gen, latencies) for _ in range(plans)
+    ])
+    wall = time.perf_counter() - started
+    monitor.stop()
+    lag = monitor.stats()
+    return {
+        "wall": wall,
+        "days_per_sec": len(latencies) / wall,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "lag_p99": lag["p99"],
+        "lag_max": lag["max"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--day-gen", type=float, default=0.05, help="seconds the LLM takes per day")
+    parser.add_argument("--kinds", nargs="+", default=["thread", "process"])
+    args = parser.parse_args()
+
+    logging.getLogger("MEALPLAN").setLevel(logging.CRITICAL)
+    random.seed(7)
+    corpus = [case for case in load_json(CORPUS_PATH) if case["source"] == "recorded"]
+
+    print(f"{args.workers} workers, {DAYS_PER_PLAN} days/plan, ~{args.day_gen * 1000:.0f} ms LLM time per day")
+    print(f"{'executor':<9} {'plans':>5} {'wall s':>7} {'days/s':>7} {'day p50':>8} {'day p99':>8} "
+          f"{'lag p99':>8} {'lag max':>8}")
+    for kind in args.kinds:
+        executor = DayExecutor(kind, args.workers)
+        warm_start = time.perf_counter()
+        executor.warm_up()
+        if kind == "process":
+            print(f"(process pool warm-up {time.perf_counter() - warm_start:.2f}s)")
+        for plans in args.plans:
+            r = asyncio.run(run_level(executor, corpus, plans, args.day_gen))
+            print(f"{kind:<9} {plans:>5} {r['wall']:>7.2f} {r['days_per_sec']:>7.0f} {r['p50']:>8.2f} "
+                  f"{r['p99']:>8.2f} {r['lag_p99']:>8.2f} {r['lag_max']:>8.2f}")
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
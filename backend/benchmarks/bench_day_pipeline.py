@@ -0,0 +1,138 @@
+"""
+Upstream stalls of the /mealplan day loop: sequential vs pipelined.
+
+Replays recorded plans through FakeChatClient and post-processes each day
+with the real process_single_day on the day executor. A day whose totals are
+off (the anomaly path) also waits --fix-latency seconds, standing in for the
+fix_quantities LLM call. Two consumers are compared:
+
+  sequential  the old event_stream loop: feed a token, await each finished
+              day, then read the next token
+  pipelined   day_pipeline.pipelined_days: the reader keeps draining the
+              stream while days are processed, days still emitted in order
+
+Per mode:
+  stall max s   worst delay between a token being available upstream and
+                being read (TCP backpressure in production)
+  drained s     time until the last upstream token was read
+  last day s    time until the last day was emitted
+  fixes         days that took the anomaly path
+
+    python -m benchmarks.bench_day_pipeline [--plans N] [--fix-latency S] [--tps N]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from day_executor import DayExecutor
+from day_pipeline import PipelineMetrics, pipelined_days, stream_token_texts
+from day_segmenter import DaySegmenter, SUGGESTION
+from utils import calculate_macros, process_single_day
+from benchmarks.fake_llm import FakeChatClient, _chunk, plan_responder
+from benchmarks.recorded_plans import load_recorded_plans
+
+
+class StallRecordingClient(FakeChatClient):
+    """FakeChatClient that records how late each token is read versus its schedule."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_stall = 0.0
+        self.drained_at = None
+
+    async def _stream(self, tokens):
+        loop = asyncio.get_event_loop()
+        start = loop.time() + self.ttft
+        for i, token in enumerate(tokens):
+            scheduled = start + i / self.tokens_per_sec
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.max_stall = max(self.max_stall, -delay)
+            self.tokens += 1
+            yield _chunk(token)
+        self.drained_at = time.perf_counter()
+
+
+def make_process_day(executor, plan, fix_latency, fixes):
+    calories = plan["target_calories"] or 2000
+    macros = plan["macros"] or calculate_macros(70, calories)
+
+    async def process_day(day_text, day_number):
+        loop = asyncio.get_event_loop()
+        processed, anomaly = await loop.run_in_executor(
+            executor, process_single_day, day_text, calories, macros, 5, day_number
+        )
+        if anomaly:
+            fixes.append(day_number)
+            await asyncio.sleep(fix_latency)
+        return processed
+
+    return process_day
+
+
+async def sequential(stream, process_day):
+    """The pre-pipeline event_stream loop."""
+    segmenter = DaySegmenter(max_days=7)
+    async for token_text in stream_token_texts(stream):
+        for event in segmenter.feed(token_text):
+            if event.kind == SUGGESTION:
+                yield event.text
+                continue
+            yield await process_day(event.text, event.day_number)
+    for event in segmenter.close():
+        yield await process_day(event.text, event.day_number)
+
+
+async def pipelined(stream, process_day):
+    metrics = PipelineMetrics()
+    async for event, text in pipelined_days(stream_token_texts(stream), DaySegmenter(max_days=7), process_day, metrics):
+        yield text
+
+
+async def run_once(mode, plan, executor, args):
+    client = StallRecordingClient(plan_responder(plan), ttft=args.ttft, tokens_per_sec=args.tps)
+    fixes = []
+    process_day = make_process_day(executor, plan, args.fix_latency, fixes)
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(messages=[{"role": "user", "content": ""}], stream=True)
+    async for _ in mode(stream, process_day):
+        pass
+    done = time.perf_counter()
+    return {
+        "stall": client.max_stall,
+        "drained": (client.drained_at or done) - started,
+        "last_day": done - started,
+        "fixes": len(fixes),
+    }
+
+
+async def main_async(args):
+    plans = load_recorded_plans(min_days=7)[:args.plans]
+    executor = DayExecutor("thread", 4)
+    print(f"{len(plans)} plans, {args.tps} tok/s, fix_quantities stand-in {args.fix_latency}s")
+    print(f"{'mode':<11} {'stall max s':>11} {'drained s':>10} {'last day s':>11} {'fixes':>6}")
+    for name, mode in (("sequential", sequential), ("pipelined", pipelined)):
+        runs = [await run_once(mode, plan, executor, args) for plan in plans]
+        print(f"{name:<11} {max(r['stall'] for r in runs):>11.2f} {statistics.mean(r['drained'] for r in runs):>10.2f} "
+              f"{statistics.mean(r['last_day'] for r in runs):>11.2f} {sum(r['fixes'] for r in runs):>6}")
+    executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--tps", type=float, default=250.0)
+    parser.add_argument("--fix-latency", type=float, default=1.5, help="seconds per fix_quantities call")
+    args = parser.parse_args()
+
+    logging.getLogger("MEALPLAN").setLevel(logging.CRITICAL)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Tokens/sec of the incremental DaySegmenter vs the old rescan-the-buffer loop.
+
+Replays recorded plans from logs/mealplan.log token by token (no LLM, no
+process_single_day) and checks both scanners cut exactly the same segments.
+
+    python -m benchmarks.bench_day_segmenter [--log PATH] [--repeat N] [--pad N]
+
+--pad N prefixes each day with N chars of filler so the per-day buffer gets
+longer, which is where the quadratic rescans of the old loop show up.
+"""
+import argparse
+import re
+import time
+
+from day_segmenter import DaySegmenter, DAY, SUGGESTION
+from benchmarks.recorded_plans import DEFAULT_LOG_PATH, load_recorded_plans, render_plan, tokenize
+
+day_start_regex = re.compile(r'Day \d+:')
+suggestion_phrase = re.compile(r'END[-_\s]?OF[-_\s]?PLAN[-_\s]?SUGGESTION[:\s]*', re.IGNORECASE)
+
+
+def legacy_segments(tokens):
+    """The pre-DaySegmenter event_stream loop, minus day processing."""
+    out = []
+    buffer = ""
+    day_count = 0
+    suggestion_mode = False
+
+    for token_text in tokens:
+        if suggestion_mode:
+            out.append((SUGGESTION, token_text))
+            continue
+
+        buffer += token_text
+
+        suggestion_match = suggestion_phrase.search(buffer)
+        if suggestion_match and not suggestion_mode:
+            suggestion_mode = True
+            idx = suggestion_match.start()
+            pre_suggestion = buffer[:idx]
+            day_starts = [m.start() for m in day_start_regex.finditer(pre_suggestion)]
+            for i, start in enumerate(day_starts):
+                if day_count >= 7:
+                    break
+                end = day_starts[i + 1] if i + 1 < len(day_starts) else len(pre_suggestion)
+                day_text = pre_suggestion[start:end]
+                if len(day_text.strip()) < 50:
+                    continue
+                out.append((DAY, day_text))
+                day_count += 1
+            out.append((SUGGESTION, buffer[idx:]))
+            buffer = ""
+            continue
+
+        while day_count < 7:
+            day_starts = [m.start() for m in day_start_regex.finditer(buffer)]
+            if len(day_starts) < 2:
+                break
+            start = day_starts[0]
+            end = day_starts[1]
+            out.append((DAY, buffer[start:end]))
+            buffer = buffer[end:]
+            day_count += 1
+
+    if buffer.strip() and day_count < 7:
+        day_starts = list(day_start_regex.finditer(buffer))
+        if day_starts and day_count == 6:
+            last_day_text = buffer[day_starts[-1].start():]
+            if len(last_day_text) < 300 or "Total Daily" not in last_day_text:
+                day_starts = day_starts[:-1]
+        for i in range(len(day_starts)):
+            if day_count >= 7:
+                break
+            start = day_starts[i].start()
+            end = day_starts[i + 1].start() if i + 1 < len(day_starts) else len(buffer)
+            day_text = buffer[start:end]
+            if len(day_text.strip()) < 20 or "Day" not in day_text:
+                continue
+            out.append((DAY, day_text))
+            day_count += 1
+    return out
+
+
+def incremental_segments(tokens):
+    out = []
+    segmenter = DaySegmenter(max_days=7)
+    for token_text in tokens:
+        for event in segmenter.feed(token_text):
+            out.append((event.kind, event.text))
+    for event in segmenter.close():
+        out.append((event.kind, event.text))
+    return out
+
+
+def pad_days(text, pad):
+    if not pad:
+        return text
+    filler = ("Notes: keep portions consistent and hydrate well. " * (pad // 50 + 1))[:pad]
+    return day_start_regex.sub(lambda m: filler + "\n" + m.group(0), text)
+
+
+def run(fn, streams, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for tokens in streams:
+            fn(tokens)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pad", type=int, default=0)
+    args = parser.parse_args()
+
+    plans = load_recorded_plans(args.log, min_days=7)
+    texts = [pad_days(render_plan(p), args.pad) for p in plans]
+    streams = [tokenize(t) for t in texts]
+    # Single-char tokens split every marker across token boundaries
+    char_streams = [list(t) for t in texts]
+
+    for name, group in (("tokens", streams), ("chars", char_streams)):
+        for tokens in group:
+            legacy, incremental = legacy_segments(tokens), incremental_segments(tokens)
+            assert legacy == incremental, f"segment mismatch ({name} replay)"
+
+    total_tokens = sum(len(s) for s in streams)
+    print(f"Plans: {len(plans)} | tokens: {total_tokens} | avg chars/plan: {sum(map(len, texts)) // len(texts)}")
+    print(f"{'scanner':<12} {'seconds':>10} {'tokens/sec':>14}")
+    results = {}
+    for name, fn in (("legacy", legacy_segments), ("incremental", incremental_segments)):
+        elapsed = run(fn, streams, args.repeat)
+        results[name] = total_tokens / elapsed
+        print(f"{name:<12} {elapsed:>10.4f} {results[name]:>14,.0f}")
+    print(f"Speedup: {results['incremental'] / results['legacy']:.2f}x (segments identical on token and char replays)")
+
+
+if __name__ == "__main__":
+    main()
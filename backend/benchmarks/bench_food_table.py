@@ -0,0 +1,136 @@
+"""
+Load time, lookup speed and plan-validation effect of the bundled food table
+(food_table.py, data/foods.csv).
+
+  load ms       FoodTable.load() (what the first get_food_table() call pays)
+  exact ns      find() of a name already in the table, memoized
+  fuzzy ns      first find() of a name that needs fuzzy matching
+  cached ns     repeated find() of the same fuzzy name
+  per_unit ns   per_unit() for a serving unit, memoized name
+
+Then, over the bench_process_day corpus, how many item names resolve to a
+food, how often the LLM's stated kcal disagree with the table, and what
+FOOD_TABLE=correct does to process_single_day (alone and with the learned
+index, built as in bench_nutrition_index). "validate" only reports, so its
+plans are identical to "off".
+
+  checked      items with a known food and unit
+  mismatch     of which stated kcal/unit is outside FOOD_TABLE_TOLERANCE
+  kcal hit     final day within ±100 kcal of target
+  macro hit    protein, fat and carbs each within ±5% of the plan's targets
+  anomalies    days that would be sent back to the LLM (fix_quantities)
+  fixes        densities replaced (table + index)
+
+Hit rates are measured against the same stated numbers the table corrects,
+so "correct" trades them for realistic calories rather than improving them.
+
+    python -m benchmarks.bench_food_table [--repeat N] [--source recorded]
+"""
+import argparse
+import os
+import tempfile
+import time
+import timeit
+
+import utils
+from food_table import FOOD_TABLE_PATH, FoodTable
+from utils import process_single_day
+from benchmarks.bench_macro_solver import macro_hit
+from benchmarks.bench_nutrition_index import build_index
+from benchmarks.bench_process_day import CORPUS_PATH, load_json, quiet_logging
+from nutrition_index import NUTRITION_INDEX_MIN_COUNT
+
+
+def ns_per_call(stmt, number=200000):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+
+def measure_lookups():
+    started = time.perf_counter()
+    table = FoodTable.load(FOOD_TABLE_PATH)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    table.find("Greek yogurt")
+    exact = ns_per_call(lambda: table.find("Greek yogurt"))
+
+    fuzzy_names = [f"Grilled lentil and chickpea curry {i}" for i in range(20000)]
+    started = time.perf_counter()
+    for name in fuzzy_names:
+        table.find(name)
+    fuzzy = (time.perf_counter() - started) / len(fuzzy_names) * 1e9
+
+    table.find("Sautéed spinach with garlic")
+    cached = ns_per_call(lambda: table.find("Sautéed spinach with garlic"))
+    per_unit = ns_per_call(lambda: table.per_unit("Hard boiled eggs", "egg"))
+    return table, load_ms, exact, fuzzy, cached, per_unit
+
+
+def evaluate(cases, **references):
+    kcal_hits = macro_hits = anomalies = 0
+    for case in cases:
+        report = {}
+        _, anomaly = process_single_day(
+            case["text"], case["target_calories"], case["macros"], 5, case["expected_day"],
+            report=report, **references,
+        )
+        kcal_hits += abs(report["calories"] - case["target_calories"]) <= 100
+        macro_hits += macro_hit(report, case)
+        anomalies += anomaly is not None
+    return {"kcal": kcal_hits, "macros": macro_hits, "anomalies": anomalies}
+
+
+def measure(cases, repeat, **references):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            process_single_day(case["text"], case["target_calories"], case["macros"], 5, case["expected_day"],
+                               **references)
+    return (time.perf_counter() - start) / (len(cases) * repeat) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--source", help="only cases from this corpus source (recorded, repaired, ...)")
+    args = parser.parse_args()
+
+    table, load_ms, exact, fuzzy, cached, per_unit = measure_lookups()
+    print(f"{len(table)} foods, {len(table.by_name)} names")
+    print(f"load {load_ms:.2f} ms | exact {exact:.0f} ns | fuzzy {fuzzy:.0f} ns | cached {cached:.0f} ns | "
+          f"per_unit {per_unit:.0f} ns")
+
+    quiet_logging(False)
+    cases = load_json(CORPUS_PATH)
+    if args.source:
+        cases = [case for case in cases if case["source"] == args.source]
+    n = len(cases)
+
+    table = FoodTable.load(FOOD_TABLE_PATH)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = build_index(os.path.join(tmp, "nutrition_index.sqlite"), False, NUTRITION_INDEX_MIN_COUNT)
+        modes = (
+            ("off", "off", {"nutrition_index": False, "food_table": False}),
+            ("validate", "validate", {"nutrition_index": False, "food_table": table}),
+            ("correct", "correct", {"nutrition_index": False, "food_table": table}),
+            ("correct+index", "correct", {"nutrition_index": index, "food_table": table}),
+        )
+        print(f"{n} cases")
+        print(f"{'mode':<14} {'checked':>8} {'mismatch':>9} {'kcal hit':>9} {'macro hit':>10} {'anomalies':>10} "
+              f"{'fixes':>6} {'ms/day':>8}")
+        for name, mode, references in modes:
+            utils.FOOD_TABLE_MODE = mode
+            checked, mismatches = table.checked, table.mismatches
+            before = table.corrections + index.corrections
+            result = evaluate(cases, **references)
+            checked, mismatches = table.checked - checked, table.mismatches - mismatches
+            fixes = table.corrections + index.corrections - before
+            ms = measure(cases, args.repeat, **references)
+            mismatch = f"{mismatches / checked:.0%}" if checked else "-"
+            print(f"{name:<14} {checked:>8d} {mismatch:>9} {result['kcal'] / n:>9.0%} {result['macros'] / n:>10.0%} "
+                  f"{result['anomalies']:>10d} {fixes:>6d} {ms:>8.3f}")
+        stats = table.stats()
+        print(f"item names: {stats['memoized']} distinct, {stats['memoized'] - stats['memo_misses']} matched to a food")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Main-plan time to first token and token spend with and without hedging.
+
+Plan streams from a fake provider whose first token usually takes --ttft
+(+/- --jitter) but, for --slow-rate of the calls, --slow-ttft (a queued or
+cold replica). --requests streams are read to the end, --concurrency at a
+time, through hedging.Hedger:
+
+  off         hedge=False (the tracker still learns the p90)
+  budget B    hedge=True with HEDGE_BUDGET = B second calls per request,
+              triggered at the --quantile first-token time
+
+  ttft p50/p99   time to the first content token as delivered
+  done p99       time to the last token
+  hedged / won   second calls fired / that delivered the first token
+  tokens         billed tokens: --prompt-tokens per call plus every streamed
+                 token. A losing call is closed at the winner's first token, so
+                 what a hedge costs is mostly its prompt
+
+    python -m benchmarks.bench_hedging [--requests N] [--slow-rate F] [--budgets 0.05,0.1,0.2] [--quantile 0.9]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.fake_llm import FakeChatClient, _chunk
+from benchmarks.recorded_plans import load_recorded_plans, render_plan
+from hedging import Hedger
+from loop_monitor import percentile
+
+
+class SlowTailClient(FakeChatClient):
+    """FakeChatClient whose calls occasionally wait much longer for their first token."""
+
+    def __init__(self, responder, ttft, tokens_per_sec, jitter, slow_rate, slow_ttft):
+        super().__init__(responder, ttft=ttft, tokens_per_sec=tokens_per_sec)
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_ttft = slow_ttft
+
+    async def _stream(self, tokens):
+        loop = asyncio.get_event_loop()
+        if random.random() < self.slow_rate:
+            ttft = self.slow_ttft
+        else:
+            ttft = self.ttft * (1 + random.uniform(-self.jitter, self.jitter))
+        start = loop.time() + ttft
+        await asyncio.sleep(ttft)
+        yield _chunk("")  # Groq's first chunk carries the role only
+        for i, token in enumerate(tokens):
+            delay = start + i / self.tokens_per_sec - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.tokens += 1
+            yield _chunk(token)
+
+
+async def run(args, text, budget):
+    random.seed(args.seed)
+    client = SlowTailClient(lambda messages: text, args.ttft, args.tps, args.jitter, args.slow_rate, args.slow_ttft)
+    hedger = Hedger(budget=budget or 0.0, quantile=args.quantile)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    ttfts, totals = [], []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            stream = await hedger.create(
+                lambda: client.chat.completions.create(messages=[], stream=True), hedge=budget is not None,
+            )
+            first = None
+            try:
+                async for chunk in stream:
+                    if first is None and chunk.choices[0].delta.content:
+                        first = time.perf_counter() - started
+            finally:
+                await stream.close()
+            ttfts.append(first)
+            totals.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    return {
+        "ttft": (percentile(ttfts, 50), percentile(ttfts, 99)),
+        "done_p99": percentile(totals, 99),
+        "hedged": hedger.stats.hedged,
+        "won": hedger.stats.hedge_won,
+        "tokens": client.tokens + client.calls * args.prompt_tokens,
+        "calls": client.calls,
+    }
+
+
+async def main_async(args):
+    text = render_plan(load_recorded_plans(min_days=7)[0])
+    print(f"{args.requests} plan streams, {args.concurrency} at a time; TTFT {args.ttft}s, "
+          f"{args.slow_rate:.0%} at {args.slow_ttft}s; {args.tps:.0f} tok/s; hedge at p{args.quantile * 100:g}")
+    print(f"{'mode':<12} {'ttft p50':>9} {'ttft p99':>9} {'done p99':>9} {'hedged':>7} {'won':>5} "
+          f"{'calls':>6} {'tokens':>8} {'extra':>7}")
+    baseline = None
+    for budget in [None] + [float(b) for b in args.budgets.split(",")]:
+        r = await run(args, text, budget)
+        baseline = baseline or r["tokens"]
+        label = "off" if budget is None else f"budget {budget:g}"
+        print(f"{label:<12} {r['ttft'][0]:>9.2f} {r['ttft'][1]:>9.2f} {r['done_p99']:>9.2f} {r['hedged']:>7} "
+              f"{r['won']:>5} {r['calls']:>6} {r['tokens']:>8} {(r['tokens'] - baseline) / baseline:>+7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--jitter", type=float, default=0.25, help="+/- fraction of --ttft")
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ttft", type=float, default=4.0)
+    parser.add_argument("--tps", type=float, default=2000.0, help="tokens/sec per stream")
+    parser.add_argument("--prompt-tokens", type=int, default=1500, help="billed prompt tokens per call")
+    parser.add_argument("--budgets", default="0.05,0.1,0.2")
+    parser.add_argument("--quantile", type=float, default=0.9, help="first-token quantile that triggers a hedge")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Interactive latency with speculative pre-generation competing for the same
+provider, with and without llm_scheduler.
+
+The fake provider has a fixed aggregate decode rate (--capacity tokens/s
+shared by every open stream, like a quota or a saturated deployment) plus
+--ttft per call. At t=0, --pregens speculative generations start (two prep
+calls and a plan stream each, under a SpeculativeWork ticket whose cancel
+callback cancels the task); then --interactive plan streams arrive every
+--gap seconds.
+
+  off   calls go straight to the provider
+  on    LLMScheduler with --spec-limit speculative slots, preempting
+        speculative work once --preempt-at interactive calls are in flight
+
+  ttft p50/p95     interactive time to first token
+  done p50/p95     interactive time to the last token
+  spec done        speculative generations that completed (the rest were preempted)
+
+    python -m benchmarks.bench_llm_scheduler [--pregens N] [--interactive N] [--gap S] [--capacity N]
+"""
+import argparse
+import asyncio
+import statistics
+
+from upstream import close_upstream
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_PREP, PRIORITY_SPECULATIVE
+from loop_monitor import percentile
+from benchmarks.fake_llm import FakeChatClient, _chunk
+from benchmarks.recorded_plans import load_recorded_plans, render_plan
+
+
+class SharedThroughputClient(FakeChatClient):
+    """FakeChatClient whose streams share one aggregate tokens/sec budget."""
+
+    def __init__(self, responder, ttft, capacity):
+        super().__init__(responder, ttft=ttft, tokens_per_sec=capacity)
+        self.next_token_at = 0.0
+
+    async def _stream(self, tokens):
+        loop = asyncio.get_event_loop()
+        await asyncio.sleep(self.ttft)
+        for token in tokens:
+            self.next_token_at = max(self.next_token_at, loop.time()) + 1 / self.tokens_per_sec
+            await asyncio.sleep(self.next_token_at - loop.time())
+            self.tokens += 1
+            yield _chunk(token)
+
+
+async def plan_stream(scheduler, client, priority):
+    stream = await scheduler.create(client, priority, messages=[{"role": "user", "content": ""}], stream=True)
+    first = None
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    try:
+        async for _ in stream:
+            if first is None:
+                first = loop.time() - started
+    finally:
+        await close_upstream(stream)
+    return first, loop.time() - started
+
+
+async def run(args, enabled):
+    plan = load_recorded_plans(min_days=7)[0]
+    text = render_plan(plan)
+    client = SharedThroughputClient(lambda messages: text, args.ttft, args.capacity)
+    scheduler = LLMScheduler(
+        limits=(32, 16, 4, args.spec_limit), max_concurrent=48, preempt_at=args.preempt_at, enabled=enabled,
+    )
+    spec_done = 0
+
+    async def pregen(key):
+        nonlocal spec_done
+        task = asyncio.current_task()
+
+        async def cancel():
+            task.cancel()
+
+        scheduler.start_speculative(key, cancel)
+        try:
+            for _ in range(2):
+                await scheduler.create(client, PRIORITY_PREP, messages=[{"role": "user", "content": ""}], max_tokens=1)
+            await plan_stream(scheduler, client, PRIORITY_SPECULATIVE)
+            spec_done += 1
+        except asyncio.CancelledError:
+            pass
+        finally:
+            scheduler.end_speculative(key)
+
+    pregens = [asyncio.ensure_future(pregen(f"pregen-{i}")) for i in range(args.pregens)]
+    interactive = []
+    for _ in range(args.interactive):
+        await asyncio.sleep(args.gap)
+        interactive.append(asyncio.ensure_future(plan_stream(scheduler, client, PRIORITY_INTERACTIVE)))
+    results = await asyncio.gather(*interactive)
+    await asyncio.gather(*pregens)
+    ttfts = [r[0] for r in results]
+    totals = [r[1] for r in results]
+    return {
+        "ttft": (statistics.median(ttfts), percentile(ttfts, 95)),
+        "done": (statistics.median(totals), percentile(totals, 95)),
+        "spec_done": spec_done,
+        "tokens": client.tokens,
+    }
+
+
+async def main_async(args):
+    print(f"{args.pregens} pregens + {args.interactive} interactive every {args.gap}s, "
+          f"provider {args.capacity:.0f} tok/s shared, TTFT {args.ttft}s")
+    print(f"{'mode':<5} {'ttft p50':>9} {'ttft p95':>9} {'done p50':>9} {'done p95':>9} {'spec done':>10} {'tokens':>8}")
+    for enabled in (False, True):
+        r = await run(args, enabled)
+        print(f"{'on' if enabled else 'off':<5} {r['ttft'][0]:>9.2f} {r['ttft'][1]:>9.2f} {r['done'][0]:>9.2f} "
+              f"{r['done'][1]:>9.2f} {r['spec_done']:>6}/{args.pregens:<3} {r['tokens']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pregens", type=int, default=8)
+    parser.add_argument("--interactive", type=int, default=6)
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds between interactive arrivals")
+    parser.add_argument("--capacity", type=float, default=3000.0, help="aggregate provider tokens/sec")
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--spec-limit", type=int, default=2, help="speculative concurrency limit")
+    parser.add_argument("--preempt-at", type=int, default=3, help="interactive calls in flight that preempt")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Accuracy and speed of the STEP 2 macro correction in utils.process_single_day:
+the legacy iterative loop vs the NumPy bounded least-squares solver
+(macro_solver.py), over the bench_process_day corpus.
+
+Per solver:
+  kcal hit     final day within ±100 kcal of target
+  macro hit    protein, fat and carbs each within ±5% of target
+  all hit      both of the above
+  anomalies    days that would be sent back to the LLM (fix_quantities)
+  ms/day       time per day (whole process_single_day, logging off)
+  correct ms   of which the STEP 2 correction phase
+
+    python -m benchmarks.bench_macro_solver [--repeat N] [--source recorded]
+"""
+import argparse
+import time
+
+from utils import process_single_day
+from benchmarks.bench_process_day import CORPUS_PATH, load_json, quiet_logging
+
+SOLVERS = ("legacy", "numpy")
+
+
+def macro_hit(report, case):
+    targets = {"protein": case["macros"].get("protein_g", 0),
+               "fat": case["macros"].get("fat_g", 0),
+               "carbs": case["macros"].get("carbs_g", 0)}
+    return all(abs(report[key] - target) <= target * 0.05 for key, target in targets.items() if target > 0)
+
+
+def evaluate(cases, solver):
+    kcal_hits = macro_hits = all_hits = anomalies = 0
+    for case in cases:
+        report = {}
+        _, anomaly = process_single_day(
+            case["text"], case["target_calories"], case["macros"], 5, case["expected_day"],
+            solver=solver, report=report,
+        )
+        kcal_ok = abs(report["calories"] - case["target_calories"]) <= 100
+        macros_ok = macro_hit(report, case)
+        kcal_hits += kcal_ok
+        macro_hits += macros_ok
+        all_hits += kcal_ok and macros_ok
+        anomalies += anomaly is not None
+    return {"kcal": kcal_hits, "macros": macro_hits, "all": all_hits, "anomalies": anomalies}
+
+
+def measure(cases, solver, repeat):
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            process_single_day(case["text"], case["target_calories"], case["macros"], 5, case["expected_day"],
+                               timings=timings, solver=solver)
+    days = len(cases) * repeat
+    return (time.perf_counter() - start) / days * 1000, timings.get("correct", 0.0) / days
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--source", help="only cases from this corpus source (recorded, repaired, ...)")
+    args = parser.parse_args()
+
+    quiet_logging(False)
+    cases = load_json(CORPUS_PATH)
+    if args.source:
+        cases = [case for case in cases if case["source"] == args.source]
+    n = len(cases)
+
+    print(f"{n} cases")
+    print(f"{'solver':<8} {'kcal hit':>9} {'macro hit':>10} {'all hit':>8} {'anomalies':>10} {'ms/day':>8} {'correct ms':>11}")
+    for solver in SOLVERS:
+        result = evaluate(cases, solver)
+        ms, correct_ms = measure(cases, solver, args.repeat)
+        print(f"{solver:<8} {result['kcal'] / n:>9.0%} {result['macros'] / n:>10.0%} {result['all'] / n:>8.0%} "
+              f"{result['anomalies']:>10d} {ms:>8.3f} {correct_ms:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Plan-stream latency while the primary model degrades, with and without
+model_router.
+
+Plan streams arrive every --gap seconds for --duration seconds. The fake
+provider serves two models; from --degrade-at to --recover-at seconds into
+the run the primary either stalls (first token after --stall seconds) or,
+with --mode error, fails every call. The fallback model stays healthy.
+
+  off   LLM_ROUTING=off: every call goes to the primary and waits it out
+  on    ModelRouter: --deadline to the first token, then the fallback; the
+        circuit opens and later probes let the primary back in
+
+  ttft / done p50, p99   time to the first / last token of each plan
+  failed                 plans that got no stream at all
+  fallback               plans served by the fallback model
+  primary calls          calls that reached the primary (stalled ones included)
+
+    python -m benchmarks.bench_model_router [--mode stall|error] [--duration S] [--deadline S]
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_llm import FakeChatClient
+from benchmarks.recorded_plans import load_recorded_plans, render_plan
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE
+from loop_monitor import percentile
+import model_router
+from model_router import ModelRouter, Route, ROUTE_PLAN
+from upstream import close_upstream
+
+PRIMARY = "primary-70b"
+FALLBACK = "fallback-8b"
+
+
+class DegradingClient(FakeChatClient):
+    """Two fake models; the primary is degraded while `degraded` is set."""
+
+    def __init__(self, responder, args):
+        super().__init__(responder, ttft=args.ttft, tokens_per_sec=args.tps)
+        self.args = args
+        self.degraded = False
+        self.primary_calls = 0
+
+    async def _create(self, model=None, messages=None, stream=False, max_tokens=None, **kwargs):
+        if model == PRIMARY:
+            self.primary_calls += 1
+            if self.degraded and self.args.mode == "error":
+                await asyncio.sleep(self.args.ttft)
+                raise RuntimeError("503 Service Unavailable")
+        response = await super()._create(model=model, messages=messages, stream=stream, max_tokens=max_tokens)
+        if stream and model == PRIMARY and self.degraded:
+            return self._stalled(response)
+        return response
+
+    async def _stalled(self, chunks):
+        await asyncio.sleep(self.args.stall)
+        async for chunk in chunks:
+            yield chunk
+
+
+async def run(args, text, routing):
+    client = DegradingClient(lambda messages: text, args)
+    router = ModelRouter(LLMScheduler(), routes={ROUTE_PLAN: Route(ROUTE_PLAN, (PRIMARY, FALLBACK), args.deadline)},
+                         enabled=routing)
+    results = []
+
+    async def plan():
+        started = time.perf_counter()
+        first = None
+        try:
+            stream = await router.create(ROUTE_PLAN, client, PRIORITY_INTERACTIVE, messages=[], stream=True)
+        except Exception:
+            results.append(None)
+            return
+        try:
+            async for chunk in stream:
+                if first is None and chunk.choices[0].delta.content:
+                    first = time.perf_counter() - started
+        finally:
+            await close_upstream(stream)
+        results.append((first, time.perf_counter() - started))
+
+    async def degrade():
+        await asyncio.sleep(args.degrade_at)
+        client.degraded = True
+        await asyncio.sleep(args.recover_at - args.degrade_at)
+        client.degraded = False
+
+    controller = asyncio.ensure_future(degrade())
+    tasks = []
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        tasks.append(asyncio.ensure_future(plan()))
+        await asyncio.sleep(args.gap)
+    await asyncio.gather(*tasks)
+    await controller
+    served = [r for r in results if r is not None]
+    return {
+        "ttft": [r[0] for r in served],
+        "done": [r[1] for r in served],
+        "failed": len(results) - len(served),
+        "fallback": router.routes[ROUTE_PLAN].served_by.get(FALLBACK, 0),
+        "primary_calls": client.primary_calls,
+        "requests": len(results),
+        "opened": router.health(PRIMARY).opened,
+    }
+
+
+async def main_async(args):
+    model_router.ROUTER_COOLDOWN = args.cooldown
+    text = render_plan(load_recorded_plans(min_days=7)[0])
+    print(f"plan every {args.gap}s for {args.duration}s; primary {args.mode} from {args.degrade_at}s to "
+          f"{args.recover_at}s{f' ({args.stall}s stall)' if args.mode == 'stall' else ''}; deadline {args.deadline}s")
+    print(f"{'mode':<5} {'plans':>6} {'ttft p50':>9} {'ttft p99':>9} {'done p50':>9} {'done p99':>9} "
+          f"{'failed':>7} {'fallback':>9} {'primary calls':>14} {'opened':>7}")
+    for routing in (False, True):
+        r = await run(args, text, routing)
+        print(f"{'on' if routing else 'off':<5} {r['requests']:>6} {percentile(r['ttft'], 50):>9.2f} "
+              f"{percentile(r['ttft'], 99):>9.2f} {percentile(r['done'], 50):>9.2f} {percentile(r['done'], 99):>9.2f} "
+              f"{r['failed']:>7} {r['fallback']:>9} {r['primary_calls']:>14} {r['opened']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("stall", "error"), default="stall")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--gap", type=float, default=0.25, help="seconds between plan arrivals")
+    parser.add_argument("--degrade-at", type=float, default=8.0)
+    parser.add_argument("--recover-at", type=float, default=20.0)
+    parser.add_argument("--stall", type=float, default=12.0, help="primary first-token delay while degraded")
+    parser.add_argument("--deadline", type=float, default=2.0, help="router first-token deadline")
+    parser.add_argument("--cooldown", type=float, default=5.0, help="seconds an open circuit waits for a probe")
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--tps", type=float, default=1000.0, help="tokens/sec per stream")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
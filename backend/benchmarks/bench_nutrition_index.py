@@ -0,0 +1,94 @@
+"""
+Effect of the learned nutrition index (nutrition_index.py) on
+utils.process_single_day over the bench_process_day corpus.
+
+The index is built into a temporary file from the recorded plans that are
+NOT in the corpus (plans after the first RECORDED_PLANS of the log), so the
+days being evaluated never taught it their own densities; --in-sample learns
+from every plan instead.
+
+Per mode:
+  kcal hit     final day within ±100 kcal of target
+  macro hit    protein, fat and carbs each within ±5% of target
+  anomalies    days that would be sent back to the LLM (fix_quantities)
+  fixes        densities replaced by the index median
+  ms/day       time per day (whole process_single_day, logging off)
+
+    python -m benchmarks.bench_nutrition_index [--repeat N] [--source recorded] [--min-count N] [--in-sample]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from nutrition_index import NUTRITION_INDEX_MIN_COUNT, NutritionIndex, learn_from_plans
+from utils import process_single_day
+from benchmarks.bench_macro_solver import macro_hit
+from benchmarks.bench_process_day import CORPUS_PATH, RECORDED_PLANS, load_json, quiet_logging
+from benchmarks.recorded_plans import load_recorded_plans
+
+
+def build_index(path, in_sample, min_count):
+    plans = load_recorded_plans()
+    index = NutritionIndex(path, min_count=min_count)
+    learn_from_plans(index, plans if in_sample else plans[RECORDED_PLANS:])
+    quiet_logging(False)
+    index.rebuild()
+    index.learn = False
+    return index
+
+
+def evaluate(cases, index):
+    kcal_hits = macro_hits = anomalies = 0
+    for case in cases:
+        report = {}
+        _, anomaly = process_single_day(
+            case["text"], case["target_calories"], case["macros"], 5, case["expected_day"],
+            report=report, nutrition_index=index,
+        )
+        kcal_hits += abs(report["calories"] - case["target_calories"]) <= 100
+        macro_hits += macro_hit(report, case)
+        anomalies += anomaly is not None
+    return {"kcal": kcal_hits, "macros": macro_hits, "anomalies": anomalies}
+
+
+def measure(cases, index, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            process_single_day(case["text"], case["target_calories"], case["macros"], 5, case["expected_day"],
+                               nutrition_index=index)
+    return (time.perf_counter() - start) / (len(cases) * repeat) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--source", help="only cases from this corpus source (recorded, repaired, ...)")
+    parser.add_argument("--min-count", type=int, default=NUTRITION_INDEX_MIN_COUNT,
+                        help="observations needed before a food is used")
+    parser.add_argument("--in-sample", action="store_true", help="learn from every plan, corpus included")
+    args = parser.parse_args()
+
+    quiet_logging(False)
+    cases = load_json(CORPUS_PATH)
+    if args.source:
+        cases = [case for case in cases if case["source"] == args.source]
+    n = len(cases)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = build_index(os.path.join(tmp, "nutrition_index.sqlite"), args.in_sample, args.min_count)
+        stats = index.stats()
+        print(f"{n} cases, index: {stats['foods']} foods ({stats['usable']} with >= {index.min_count} observations)")
+        print(f"{'mode':<9} {'kcal hit':>9} {'macro hit':>10} {'anomalies':>10} {'fixes':>6} {'ms/day':>8}")
+        for name, mode_index in (("off", False), ("index", index)):
+            corrections = index.corrections
+            result = evaluate(cases, mode_index)
+            fixes = index.corrections - corrections
+            ms = measure(cases, mode_index, args.repeat)
+            print(f"{name:<9} {result['kcal'] / n:>9.0%} {result['macros'] / n:>10.0%} {result['anomalies']:>10d} "
+                  f"{fixes:>6d} {ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
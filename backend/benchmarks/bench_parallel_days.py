@@ -0,0 +1,101 @@
+"""
+Wall time and time-to-each-day of /mealplan: single stream vs parallel day groups.
+
+Drives the real meal_plan endpoint (prompts, DaySegmenter, process_single_day,
+re-ordering) with app.client swapped for FakeChatClient, which replays
+recorded plans from logs/mealplan.log at a fixed TTFT and tokens/sec.
+Nothing leaves the process and no tokens are spent.
+
+    python -m benchmarks.bench_parallel_days [--plans N] [--ttft S] [--tps N] [--groups 1,2,7]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import statistics
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark-fake-key")
+
+from starlette.requests import Request  # noqa: E402
+
+import app as backend  # noqa: E402
+from benchmarks.fake_llm import FakeChatClient, plan_responder  # noqa: E402
+from benchmarks.recorded_plans import load_recorded_plans  # noqa: E402
+
+DAY_MARKER = re.compile(r"Day (\d+):")
+
+
+def make_request(body):
+    payload = json.dumps(body).encode("utf-8")
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "path": "/mealplan", "headers": []}
+    return Request(scope, receive)
+
+
+async def run_once(plan, mode, group_size, ttft, tps):
+    backend.client = FakeChatClient(plan_responder(plan), ttft=ttft, tokens_per_sec=tps)
+    body = {
+        "targetCalories": plan["target_calories"] or 2000,
+        "targetWeight": 70,
+        "timelineWeeks": 12,
+        "prompt": "",  # No curator / rules calls: both modes share that cost anyway
+        "generationMode": mode,
+        "dayGroupSize": group_size,
+    }
+    start = time.perf_counter()
+    response = await backend.meal_plan(make_request(body))
+    day_times = {}
+    text = ""
+    async for chunk in response.body_iterator:
+        text += chunk.decode("utf-8")
+        now = time.perf_counter() - start
+        for match in DAY_MARKER.finditer(text):
+            day_times.setdefault(int(match.group(1)), now)
+    return time.perf_counter() - start, day_times, backend.client.calls
+
+
+def summarize(name, runs):
+    walls = [r[0] for r in runs]
+    first = [r[1].get(1, r[0]) for r in runs]
+    last = [r[1].get(7, r[0]) for r in runs]
+    calls = statistics.mean(r[2] for r in runs)
+    missing = sum(1 for r in runs if len(r[1]) < 7)
+    print(f"{name:<14} {statistics.mean(walls):>9.2f} {statistics.mean(first):>10.2f} "
+          f"{statistics.mean(last):>10.2f} {calls:>7.1f} {missing:>8}")
+
+
+async def main_async(args):
+    plans = load_recorded_plans(min_days=7)[:args.plans]
+    modes = [("single", "single", 1)] + [
+        (f"parallel/{g}", "parallel", g) for g in args.groups
+    ]
+    print(f"{len(plans)} plans, TTFT {args.ttft}s, {args.tps} tok/s per stream")
+    print(f"{'mode':<14} {'wall s':>9} {'day1 s':>10} {'day7 s':>10} {'calls':>7} {'<7 days':>8}")
+    for name, mode, group_size in modes:
+        runs = [await run_once(plan, mode, group_size, args.ttft, args.tps) for plan in plans]
+        summarize(name, runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.4, help="seconds to first token per call")
+    parser.add_argument("--tps", type=float, default=250.0, help="tokens/sec per stream")
+    parser.add_argument("--groups", type=lambda s: [int(g) for g in s.split(",")], default=[1, 2],
+                        help="parallel group sizes to compare, e.g. 1,2,4")
+    args = parser.parse_args()
+
+    # process_single_day logs every item; keep the table readable
+    for name in ("MEALPLAN", "USER"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Wakeups and added latency of pre-generation readers: 50 ms polling vs BroadcastChannel.
+
+A fake producer publishes one chunk per day (7 days + suggestion) with a fixed
+gap between them, like run_pregeneration does. Each reader records how often
+it woke up and how long after publication each chunk reached it.
+
+    python -m benchmarks.bench_pregen_fanout [--readers N] [--gap SECONDS]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from broadcast import BroadcastChannel
+
+CHUNKS_PER_PLAN = 8  # 7 days + suggestion
+
+
+async def produce(publish, close, published_at, gap):
+    for i in range(CHUNKS_PER_PLAN):
+        await asyncio.sleep(gap)
+        published_at.append(time.perf_counter())
+        await publish(f"Day {i + 1}".encode("utf-8"))
+    await close()
+
+
+async def legacy_reader(entry, published_at, latencies, counters):
+    """The old stream_from_cache loop over a {'chunks', 'done'} dict."""
+    chunk_index = 0
+    while True:
+        counters["wakeups"] += 1
+        chunks = entry['chunks']
+        done = entry['done']
+        while chunk_index < len(chunks):
+            latencies.append(time.perf_counter() - published_at[chunk_index])
+            chunk_index += 1
+        if done:
+            break
+        await asyncio.sleep(0.05)
+
+
+async def run_legacy(readers, gap):
+    entry = {'chunks': [], 'done': False}
+    published_at, latencies = [], []
+    counters = {"wakeups": 0}
+
+    async def publish(chunk):
+        entry['chunks'].append(chunk)
+
+    async def close():
+        entry['done'] = True
+
+    await asyncio.gather(
+        produce(publish, close, published_at, gap),
+        *(legacy_reader(entry, published_at, latencies, counters) for _ in range(readers)),
+    )
+    return counters["wakeups"], latencies
+
+
+async def run_channel(readers, gap):
+    channel = BroadcastChannel()
+    published_at, latencies = [], []
+
+    async def reader():
+        index = 0
+        async for _chunk in channel.subscribe():
+            latencies.append(time.perf_counter() - published_at[index])
+            index += 1
+
+    await asyncio.gather(
+        produce(channel.publish, channel.close, published_at, gap),
+        *(reader() for _ in range(readers)),
+    )
+    # +1 per reader for the first pass through the loop, matching the legacy count
+    return channel.wakeups + readers, latencies
+
+
+def report(name, wakeups, latencies, readers):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"{name:<10} {wakeups / readers:>16.1f} {statistics.mean(ms):>12.2f} {p95:>10.2f} {ms[-1]:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=2, help="concurrent readers per session (e.g. browser retry)")
+    parser.add_argument("--gap", type=float, default=0.4, help="seconds between days")
+    args = parser.parse_args()
+
+    print(f"{CHUNKS_PER_PLAN} chunks/plan, {args.gap}s apart, {args.readers} reader(s)")
+    print(f"{'mode':<10} {'wakeups/reader':>16} {'mean ms':>12} {'p95 ms':>10} {'max ms':>10}")
+    wakeups, latencies = asyncio.run(run_legacy(args.readers, args.gap))
+    report("polling", wakeups, latencies, args.readers)
+    wakeups, latencies = asyncio.run(run_channel(args.readers, args.gap))
+    report("channel", wakeups, latencies, args.readers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Throughput, per-phase time and memory of utils.process_single_day over a
+fixed corpus of day texts, checked against golden outputs.
+
+Corpus (benchmarks/fixtures/process_day_corpus.json), built from logs/mealplan.log:
+  recorded   days as the LLM produced them (BATCH TRANSFORMATIONS inputs)
+  repaired   days re-written by fix_quantities_with_llm
+  preview    [RAW_INPUT_PREVIEW] inputs - real malformed days (inline items,
+             missing quantities, cut at 500 chars)
+  synthetic  recorded days rewritten as: no_macros, three_meals,
+             serving_units, em_dashes, crlf_nbsp
+
+Golden outputs (benchmarks/fixtures/process_day_golden.json) hold the exact
+(output, anomaly) of every case, so an optimisation that changes a plan fails
+the run.
+
+    python -m benchmarks.bench_process_day [--repeat N] [--with-logging]
+    python -m benchmarks.bench_process_day --build-corpus [--log PATH]
+    python -m benchmarks.bench_process_day --update-golden
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from utils import calculate_macros, process_single_day
+from benchmarks.recorded_plans import DEFAULT_LOG_PATH, load_recorded_plans
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+CORPUS_PATH = os.path.join(FIXTURES_DIR, "process_day_corpus.json")
+GOLDEN_PATH = os.path.join(FIXTURES_DIR, "process_day_golden.json")
+
+PHASES = ("normalize", "parse", "correct", "round", "format", "log")
+
+RECORDED_PLANS = 10      # All 7 days of the first N plans
+REPAIRED_DAYS = 20
+SYNTHETIC_SOURCES = 8    # Recorded days each synthetic variant is applied to
+
+MACRO_SUFFIX = re.compile(r"\s*-\s*\d+(?:\.\d+)?p/\d+(?:\.\d+)?f/\d+(?:\.\d+)?c")
+SNACK_BLOCK = re.compile(r"- Snack \(.*?(?=- Dinner)", re.DOTALL)
+GRAM_QUANTITY = re.compile(r" - \d+g - ")
+
+
+# ============================================================
+# Corpus
+# ============================================================
+def _variants(text):
+    return {
+        "no_macros": MACRO_SUFFIX.sub("", text),
+        "three_meals": SNACK_BLOCK.sub("", text),
+        "serving_units": GRAM_QUANTITY.sub(" - 1 cup - ", GRAM_QUANTITY.sub(" - 2 slices - ", text, count=2), count=2),
+        "em_dashes": text.replace(" - ", " — "),
+        "crlf_nbsp": text.replace("\n", "\r\n").replace(" kcal", "\u00a0kcal"),
+    }
+
+
+def build_corpus(log_path):
+    plans = load_recorded_plans(log_path)
+    cases = []
+    seen = set()
+
+    def add(case_id, source, plan, text, day):
+        if text in seen:
+            return
+        seen.add(text)
+        target = plan["target_calories"] or 2000
+        cases.append({
+            "id": case_id,
+            "source": source,
+            "target_calories": target,
+            "macros": plan["macros"] or calculate_macros(70, target),
+            "expected_day": day,
+            "text": text,
+        })
+
+    for p_index, plan in enumerate(plans[:RECORDED_PLANS]):
+        for d_index, text in enumerate(plan["days"][:7]):
+            add(f"recorded-{p_index}-{d_index + 1}", "recorded", plan, text, d_index + 1)
+
+    repaired = [(plan, text) for plan in plans for text in plan["repaired_days"]][:REPAIRED_DAYS]
+    for index, (plan, text) in enumerate(repaired):
+        day = re.match(r"Day (\d+)", text)
+        add(f"repaired-{index}", "repaired", plan, text, int(day.group(1)) if day else 1)
+
+    previews = [(plan, text) for plan in plans for text in plan["previews"]]
+    for index, (plan, text) in enumerate(previews):
+        day = re.search(r"Day (\d+)", text)
+        add(f"preview-{index}", "preview", plan, text, int(day.group(1)) if day else 1)
+
+    sources = [(plan, plan["days"][0]) for plan in plans if plan["days"]][:SYNTHETIC_SOURCES]
+    for index, (plan, text) in enumerate(sources):
+        for name, variant in _variants(text).items():
+            add(f"{name}-{index}", name, plan, variant, 1)
+
+    return cases
+
+
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, ensure_ascii=False)
+
+
+# ============================================================
+# Runs
+# ============================================================
+def run_case(case, timings=None):
+    output, anomaly = process_single_day(
+        case["text"], case["target_calories"], case["macros"], 5, case["expected_day"], timings=timings
+    )
+    return {"output": output, "anomaly": anomaly}
+
+
+def check_golden(cases, golden):
+    mismatches = []
+    for case in cases:
+        expected = golden.get(case["id"])
+        actual = json.loads(json.dumps(run_case(case)))  # Same shape as loaded from disk
+        if expected != actual:
+            mismatches.append((case["id"], expected, actual))
+    return mismatches
+
+
+def measure_time(cases, repeat):
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            run_case(case, timings)
+    elapsed = time.perf_counter() - start
+    return elapsed, timings
+
+
+def measure_memory(cases):
+    """Peak traced allocation per day (KB) and blocks allocated over the run."""
+    peaks = []
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    for case in cases:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        run_case(case)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append((peak - base) / 1024)
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+    return peaks, blocks_after - blocks_before
+
+
+def quiet_logging(with_logging):
+    logger = logging.getLogger("MEALPLAN")
+    if with_logging:
+        # Keep message formatting, drop the file/console I/O
+        logger.handlers = [logging.NullHandler()]
+    else:
+        logger.setLevel(logging.CRITICAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--with-logging", action="store_true", help="include log formatting in the timings")
+    parser.add_argument("--build-corpus", action="store_true")
+    parser.add_argument("--update-golden", action="store_true")
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH)
+    args = parser.parse_args()
+
+    quiet_logging(args.with_logging)
+
+    if args.build_corpus:
+        cases = build_corpus(args.log)
+        save_json(CORPUS_PATH, cases)
+        print(f"{len(cases)} cases -> {CORPUS_PATH}")
+        return
+
+    cases = load_json(CORPUS_PATH)
+    if args.update_golden:
+        save_json(GOLDEN_PATH, {case["id"]: run_case(case) for case in cases})
+        print(f"golden outputs for {len(cases)} cases -> {GOLDEN_PATH}")
+        return
+
+    mismatches = check_golden(cases, load_json(GOLDEN_PATH))
+
+    elapsed, timings = measure_time(cases, args.repeat)
+    days = len(cases) * args.repeat
+    peaks, blocks = measure_memory(cases)
+
+    by_source = {}
+    for case in cases:
+        by_source[case["source"]] = by_source.get(case["source"], 0) + 1
+    print(f"{len(cases)} cases: " + ", ".join(f"{k}={v}" for k, v in by_source.items()))
+    print(f"{days / elapsed:.0f} days/sec ({elapsed / days * 1000:.3f} ms/day, logging {'on' if args.with_logging else 'off'})")
+    total_ms = sum(timings.values())
+    for phase in PHASES:
+        ms = timings.get(phase, 0.0)
+        print(f"  {phase:<10} {ms / days:>8.3f} ms/day  {ms / total_ms * 100 if total_ms else 0:>5.1f}%")
+    print(f"memory: peak {sum(peaks) / len(peaks):.1f} KB/day (max {max(peaks):.1f} KB), "
+          f"{blocks:+d} live blocks after the run")
+
+    if mismatches:
+        case_id, expected, actual = mismatches[0]
+        print(f"\nGOLDEN MISMATCH in {len(mismatches)} case(s), first: {case_id}")
+        print("--- expected\n" + (expected or {}).get("output", "<missing>"))
+        print("--- actual\n" + actual["output"])
+        sys.exit(1)
+    print("golden: all outputs match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Provider 429s per priority class with and without the rate governor.
+
+Starts benchmarks.fake_llm_server with Groq-style account limits (--rpm /
+--tpm, x-ratelimit-* headers, 429 + retry-after over the limit) and drives
+a mixed workload through a real AsyncGroq client (default retries, like the
+app) and LLMScheduler for --duration seconds per governor mode:
+
+  interactive   a plan stream every --interactive-gap s, after its two prep calls
+  speculative   a pre-generation plan stream every --speculative-gap s
+  repair        a quantity-fix call every --repair-gap s
+
+  off        the governor is not consulted
+  simulate   decisions are counted but never applied
+  on         calls wait for / are shed from the budget
+
+Per class: calls that completed, failed (a 429 or other error after the
+SDK's retries), were shed by the governor, and their mean latency. "429s"
+is what the fake provider rejected, retries included.
+
+    python -m benchmarks.bench_rate_governor [--duration S] [--tpm N] [--rpm N] [--modes off,on]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from groq import AsyncGroq
+
+from llm_scheduler import (
+    LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_NAMES, PRIORITY_PREP, PRIORITY_REPAIR, PRIORITY_SPECULATIVE,
+)
+from rate_governor import LocalBudget, RateGovernor, RateLimitShed
+from upstream import close_upstream
+
+PLAN_MESSAGES = [
+    {"role": "system", "content": "You are a meal plan generator. Output 7 days." + " Follow the format." * 60},
+    {"role": "user", "content": "Generate complete 7-day meal plan. Request-ID: bench"},
+]
+RULES_MESSAGES = [{"role": "user", "content": "Write dietary enforcement rules for: vegetarian"}]
+CURATOR_MESSAGES = [{"role": "user", "content": "You are a NUTRITION CURATOR. " + "User prompt. " * 40}]
+FIX_MESSAGES = [
+    {"role": "system", "content": "You adjust meal quantities to hit calorie targets."},
+    {"role": "user", "content": "Day 3:\n- Breakfast (400 kcal): ..."},
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_llm_server", "--port", str(port), "--tps", str(args.tps),
+         "--ttft", str(args.ttft), "--rpm", str(args.rpm), "--tpm", str(args.tpm)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/_fake/stats", timeout=0.5)
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("fake_llm_server did not start")
+
+
+class Outcomes:
+    def __init__(self):
+        self.results = {name: {"ok": 0, "failed": 0, "shed": 0, "latency": []} for name in PRIORITY_NAMES}
+
+    async def call(self, priority, coro):
+        started = time.perf_counter()
+        entry = self.results[PRIORITY_NAMES[priority]]
+        try:
+            await coro
+        except RateLimitShed:
+            entry["shed"] += 1
+            return False
+        except Exception:
+            entry["failed"] += 1
+            return False
+        entry["ok"] += 1
+        entry["latency"].append(time.perf_counter() - started)
+        return True
+
+
+async def run_mode(mode, args):
+    process, url = start_server(args)
+    try:
+        client = AsyncGroq(api_key="benchmark-fake-key", base_url=url)
+        # TPM is resynced from the headers; RPM is in no header, like RATE_LIMIT_RPM
+        governor = RateGovernor(LocalBudget(limit_requests=args.rpm, limit_tokens=0), PRIORITY_NAMES, mode=mode)
+        scheduler = LLMScheduler(governor=governor if mode != "off" else None)
+        outcomes = Outcomes()
+
+        async def stream(priority):
+            response = await scheduler.create(client, priority, model="fake", messages=PLAN_MESSAGES,
+                                              max_tokens=4096, stream=True)
+            try:
+                async for _ in response:
+                    pass
+            finally:
+                await close_upstream(response)
+
+        async def plan():
+            for messages in (CURATOR_MESSAGES, RULES_MESSAGES):
+                await outcomes.call(PRIORITY_PREP, scheduler.create(client, PRIORITY_PREP, model="fake",
+                                                                    messages=messages, max_tokens=500))
+            await outcomes.call(PRIORITY_INTERACTIVE, stream(PRIORITY_INTERACTIVE))
+
+        async def arrivals(gap, make):
+            tasks = []
+            deadline = time.monotonic() + args.duration
+            while time.monotonic() < deadline:
+                tasks.append(asyncio.ensure_future(make()))
+                await asyncio.sleep(gap)
+            await asyncio.gather(*tasks)
+
+        await asyncio.gather(
+            arrivals(args.interactive_gap, plan),
+            arrivals(args.speculative_gap,
+                     lambda: outcomes.call(PRIORITY_SPECULATIVE, stream(PRIORITY_SPECULATIVE))),
+            arrivals(args.repair_gap, lambda: outcomes.call(
+                PRIORITY_REPAIR,
+                scheduler.create(client, PRIORITY_REPAIR, model="fake", messages=FIX_MESSAGES, max_tokens=400))),
+        )
+        server = json.loads(urllib.request.urlopen(f"{url}/_fake/stats").read())
+        return outcomes.results, server, await governor.stats_dict()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main_async(args):
+    print(f"limits {args.rpm} RPM / {args.tpm} TPM, {args.duration}s per mode; interactive every "
+          f"{args.interactive_gap}s, speculative every {args.speculative_gap}s, repair every {args.repair_gap}s")
+    print(f"{'mode':<9} {'class':<12} {'ok':>5} {'failed':>7} {'shed':>5} {'mean s':>7}")
+    for mode in args.modes.split(","):
+        results, server, governor = await run_mode(mode, args)
+        for name, entry in results.items():
+            mean = statistics.mean(entry["latency"]) if entry["latency"] else 0.0
+            print(f"{mode:<9} {name:<12} {entry['ok']:>5} {entry['failed']:>7} {entry['shed']:>5} {mean:>7.2f}")
+        simulated = {n: c["shed"] for n, c in governor["classes"].items() if c["shed"]}
+        print(f"{mode:<9} 429s {server['rate_limited']}, headers seen {governor['headers_seen']}"
+              f"{f', would shed {simulated}' if mode == 'simulate' else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=240000)
+    parser.add_argument("--tps", type=float, default=2000.0, help="fake provider tokens/sec per stream")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--interactive-gap", type=float, default=2.0)
+    parser.add_argument("--speculative-gap", type=float, default=0.5)
+    parser.add_argument("--repair-gap", type=float, default=1.0)
+    parser.add_argument("--modes", default="off,simulate,on")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Curator + dietary-rules prep stages with and without the stage cache.
+
+--requests plans (--concurrency at a time) run app.run_prep_stages against
+a fake provider answering after --latency seconds. Each request draws a
+prompt from a small pool, re-typed the way users do (case, punctuation,
+spacing), restrictions from extract_dietary_from_prompt plus an optional
+explicit one, and a protein/calorie target from a random profile.
+
+  prep p50/p95    seconds until both stages are done
+  LLM calls       curator + dietary-rules calls that reached the provider
+  hit ratio       (hits + coalesced misses) / lookups, per stage
+
+    python -m benchmarks.bench_stage_cache [--requests N] [--concurrency N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark-fake-key")
+
+import app
+from benchmarks.fake_llm import FakeChatClient, ReplayResponder
+from benchmarks.replay_fixtures import load_fixtures
+from stage_cache import MemoryCacheStore
+from utils import calculate_macros
+
+PROMPTS = [
+    "I want a high protein western diet, I eat everything",
+    "Vegetarian Indian food please, I like paneer and dal",
+    "Mediterranean meals, no pork, quick lunches",
+    "Vegan meals, I have a nut allergy",
+    "Gluten free please, I love Mexican food",
+    "Keto diet, no fish",
+    "Halal meals with lots of chicken and rice",
+    "Simple vegetarian food, no eggs, no dairy",
+]
+EXPLICIT = [[], [], [], ["vegetarian"], ["gluten-free"], ["halal"]]
+
+
+def retype(prompt):
+    """The same request as another user would type it."""
+    variants = [prompt, prompt.lower(), prompt.upper(), prompt.replace(",", ""), prompt + ".", prompt + "!!",
+                "  " + prompt.replace(" ", "  ")]
+    return random.choice(variants)
+
+
+def make_request():
+    prompt = retype(random.choice(PROMPTS))
+    extracted = app.extract_dietary_from_prompt(prompt)
+    dietary = list(set(random.choice(EXPLICIT) + extracted["dietary"]))
+    weight = random.choice([58, 65, 72, 82, 95])
+    calories = random.choice([1600, 1800, 1900, 2000, 2200, 2400])
+    macros = calculate_macros(weight, calories)
+    return prompt, dietary, extracted["allergies"], {**macros, "calories": calories}
+
+
+async def run(requests, concurrency, enabled):
+    for cache in (app.curator_cache, app.dietary_rules_cache):
+        cache.__init__(cache.name, MemoryCacheStore(), cache.ttl, enabled=enabled, cacheable=cache.cacheable)
+    client = app.client
+    calls_before = client.calls
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(request):
+        async with semaphore:
+            started = time.perf_counter()
+            await app.run_prep_stages(*request, label="BENCH")
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(request) for request in requests))
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+        "calls": client.calls - calls_before,
+        "curator": app.curator_cache.stats()["hit_ratio"],
+        "rules": app.dietary_rules_cache.stats()["hit_ratio"],
+    }
+
+
+async def main_async(args):
+    import logging
+    logging.getLogger("MEALPLAN").setLevel(logging.CRITICAL)
+    app.client = FakeChatClient(ReplayResponder(load_fixtures()), ttft=args.latency)
+    random.seed(args.seed)
+    requests = [make_request() for _ in range(args.requests)]
+    print(f"{args.requests} requests, {args.concurrency} at a time; provider latency {args.latency}s")
+    print(f"{'cache':<6} {'prep p50':>9} {'prep p95':>9} {'LLM calls':>10} {'curator hit':>12} {'rules hit':>10}")
+    for enabled in (False, True):
+        r = await run(requests, args.concurrency, enabled)
+        print(f"{'on' if enabled else 'off':<6} {r['p50']:>9.2f} {r['p95']:>9.2f} {r['calls']:>10} "
+              f"{r['curator']:>12.1%} {r['rules']:>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per fake curator/rules call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Bytes on the wire and client-side parsing of /mealplan: legacy text vs typed
+NDJSON / SSE events (stream_events.py, chosen by the Accept header).
+
+Drives the real meal_plan endpoint with app.client swapped for FakeChatClient
+(see bench_parallel_days). With --truncate the first completion is cut off
+inside Day 6, so the FALLBACK call runs and the text stream carries its
+keep-alive newlines.
+
+  bytes        response body size
+  chunks       body chunks received
+  parse ms     client CPU to turn the body into days: for text, re-scanning
+               the accumulated text for complete days after every chunk (what
+               a streaming text client has to do); for NDJSON/SSE, one
+               json.loads per event
+  day7 s       time until Day 7 could be shown
+  days         days the client recovered
+
+    python -m benchmarks.bench_stream_events [--plans N] [--ttft S] [--tps N] [--truncate]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark-fake-key")
+
+from starlette.requests import Request  # noqa: E402
+
+import app as backend  # noqa: E402
+from stream_events import DAY_HEADER_PATTERN, parse_day  # noqa: E402
+from benchmarks.fake_llm import FakeChatClient, plan_responder  # noqa: E402
+from benchmarks.recorded_plans import load_recorded_plans  # noqa: E402
+
+ACCEPT = {"text": "*/*", "ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def make_request(body, accept):
+    payload = json.dumps(body).encode("utf-8")
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "path": "/mealplan", "headers": [(b"accept", accept.encode())]}
+    return Request(scope, receive)
+
+
+def truncating_responder(plan):
+    """First completion stops in the middle of Day 6; later ones (the fallback) are whole."""
+    respond = plan_responder(plan)
+    calls = []
+
+    def responder(messages):
+        text = respond(messages)
+        calls.append(1)
+        if len(calls) == 1:
+            cut = text.find("Day 6:")
+            return text[:cut + (len(text) - cut) // 6] if cut >= 0 else text
+        return text
+
+    return responder
+
+
+class TextClient:
+    """Re-scans the accumulated text for complete days after every chunk."""
+
+    def __init__(self):
+        self.text = ""
+        self.days = {}
+        self.parse_s = 0.0
+
+    def feed(self, chunk, now):
+        started = time.perf_counter()
+        self.text += chunk.decode("utf-8")
+        starts = [m.start() for m in DAY_HEADER_PATTERN.finditer(self.text)]
+        for start, end in zip(starts, starts[1:] + [len(self.text)]):
+            day = parse_day(self.text[start:end])
+            if day["total_kcal"] is not None and day["day"] not in self.days:
+                self.days[day["day"]] = now
+        self.parse_s += time.perf_counter() - started
+
+
+class EventClient:
+    def __init__(self, sse):
+        self.sse = sse
+        self.pending = ""
+        self.days = {}
+        self.parse_s = 0.0
+
+    def feed(self, chunk, now):
+        started = time.perf_counter()
+        self.pending += chunk.decode("utf-8")
+        separator = "\n\n" if self.sse else "\n"
+        *events, self.pending = self.pending.split(separator)
+        for event in events:
+            if self.sse:
+                lines = event.split("\n")
+                event_type, payload = lines[0][len("event: "):], json.loads(lines[1][len("data: "):])
+            else:
+                payload = json.loads(event)
+                event_type = payload["type"]
+            if event_type == "day" and not payload.get("replace"):
+                self.days.setdefault(payload["day"], now)
+        self.parse_s += time.perf_counter() - started
+
+
+async def run_once(plan, stream_format, args):
+    responder = truncating_responder(plan) if args.truncate else plan_responder(plan)
+    backend.client = FakeChatClient(responder, ttft=args.ttft, tokens_per_sec=args.tps)
+    body = {
+        "targetCalories": plan["target_calories"] or 2000,
+        "targetWeight": 70,
+        "timelineWeeks": 12,
+        "prompt": "",
+    }
+    client = TextClient() if stream_format == "text" else EventClient(stream_format == "sse")
+    start = time.perf_counter()
+    response = await backend.meal_plan(make_request(body, ACCEPT[stream_format]))
+    size = chunks = 0
+    async for chunk in response.body_iterator:
+        size += len(chunk)
+        chunks += 1
+        client.feed(chunk, time.perf_counter() - start)
+    wall = time.perf_counter() - start
+    return {"bytes": size, "chunks": chunks, "parse_ms": client.parse_s * 1000,
+            "day7": client.days.get(7, wall), "days": len(client.days)}
+
+
+async def main_async(args):
+    plans = load_recorded_plans(min_days=7)[:args.plans]
+    print(f"{len(plans)} plans, TTFT {args.ttft}s, {args.tps} tok/s{', truncated at Day 6' if args.truncate else ''}")
+    print(f"{'format':<8} {'bytes':>8} {'chunks':>7} {'parse ms':>9} {'day7 s':>7} {'days':>5}")
+    for stream_format in ("text", "ndjson", "sse"):
+        runs = [await run_once(plan, stream_format, args) for plan in plans]
+        print(f"{stream_format:<8} {statistics.mean(r['bytes'] for r in runs):>8.0f} "
+              f"{statistics.mean(r['chunks'] for r in runs):>7.0f} {statistics.mean(r['parse_ms'] for r in runs):>9.2f} "
+              f"{statistics.mean(r['day7'] for r in runs):>7.2f} {statistics.mean(r['days'] for r in runs):>5.1f}")
+    print(f"server: {backend.stream_event_stats.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.4, help="seconds to first token per call")
+    parser.add_argument("--tps", type=float, default=1000.0, help="tokens/sec per stream")
+    parser.add_argument("--truncate", action="store_true", help="cut the first completion inside Day 6")
+    args = parser.parse_args()
+
+    for name in ("MEALPLAN", "USER"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Upstream tokens read by /mealplan when the completion is closed early
+(upstream.py): after Day 7 and the suggestion, and when the client leaves.
+
+Drives the real meal_plan endpoint with app.client swapped for FakeChatClient
+(see bench_parallel_days). Scenarios:
+
+  complete     the recorded plan as is; the stream ends with the suggestion
+  tail         the model keeps writing after the 2-line suggestion (--tail
+               tokens of notes); the completion is closed once the suggestion
+               paragraph ends
+  disconnect   the client reads Day 1..--days and closes the response; the
+               single-flight producer is cancelled after --linger seconds and
+               its completion closed
+
+  produced     tokens the fake model would have streamed to the end
+  read         tokens actually pulled from it
+  wall s       until the response ended (disconnect: until the completion closed)
+
+    python -m benchmarks.bench_upstream_cancel [--plans N] [--ttft S] [--tps N] [--tail N] [--days N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import statistics
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark-fake-key")
+
+from starlette.requests import Request  # noqa: E402
+
+import app as backend  # noqa: E402
+from benchmarks.fake_llm import FakeChatClient, plan_responder  # noqa: E402
+from benchmarks.recorded_plans import load_recorded_plans, tokenize  # noqa: E402
+
+DAY_MARKER = re.compile(r"Day (\d+):")
+TAIL_NOTE = ("Remember to drink 2-3 liters of water daily, prioritise sleep and "
+             "track your weight weekly so portions can be adjusted. ")
+
+
+def make_request(body):
+    payload = json.dumps(body).encode("utf-8")
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "path": "/mealplan", "headers": []}
+    return Request(scope, receive)
+
+
+def tail_responder(plan, tail_tokens):
+    """Plan, suggestion, then a blank line and notes the prompt did not ask for."""
+    respond = plan_responder(plan)
+    notes = ""
+    while len(tokenize(notes)) < tail_tokens:
+        notes += TAIL_NOTE
+
+    def responder(messages):
+        return respond(messages) + "\n" + notes
+
+    return responder
+
+
+async def run_once(plan, scenario, args):
+    responder = tail_responder(plan, args.tail) if scenario == "tail" else plan_responder(plan)
+    produced = len(tokenize(responder([{"role": "user", "content": ""}])))
+    backend.client = FakeChatClient(responder, ttft=args.ttft, tokens_per_sec=args.tps)
+    body = {
+        "targetCalories": plan["target_calories"] or 2000,
+        "targetWeight": 70,
+        "timelineWeeks": 12,
+        "prompt": "",
+    }
+    start = time.perf_counter()
+    response = await backend.meal_plan(make_request(body))
+    text = ""
+    iterator = response.body_iterator
+    async for chunk in iterator:
+        text += chunk.decode("utf-8")
+        if scenario == "disconnect" and len(DAY_MARKER.findall(text)) >= args.days:
+            break
+    if scenario == "disconnect":
+        await iterator.aclose()
+        # Producer is cancelled after the linger; wait for its completion to be released
+        site = backend.upstream_stats.site("mealplan")
+        closed = site.closed["cancelled"]
+        while site.closed["cancelled"] == closed:
+            await asyncio.sleep(0.01)
+    wall = time.perf_counter() - start
+    return {"produced": produced, "read": backend.client.tokens, "wall": wall,
+            "days": len(set(DAY_MARKER.findall(text)))}
+
+
+async def main_async(args):
+    plans = load_recorded_plans(min_days=7)[:args.plans]
+    backend.mealplan_flights.linger = args.linger
+    print(f"{len(plans)} plans, TTFT {args.ttft}s, {args.tps} tok/s, tail {args.tail} tokens, "
+          f"disconnect after Day {args.days}, linger {args.linger}s")
+    print(f"{'scenario':<11} {'produced':>9} {'read':>7} {'saved':>7} {'wall s':>7} {'days':>5}")
+    for scenario in ("complete", "tail", "disconnect"):
+        runs = [await run_once(plan, scenario, args) for plan in plans]
+        produced = statistics.mean(r["produced"] for r in runs)
+        read = statistics.mean(r["read"] for r in runs)
+        print(f"{scenario:<11} {produced:>9.0f} {read:>7.0f} {1 - read / produced:>7.1%} "
+              f"{statistics.mean(r['wall'] for r in runs):>7.2f} {statistics.mean(r['days'] for r in runs):>5.1f}")
+    print(f"server: {json.dumps(backend.upstream_stats.stats())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.4, help="seconds to first token per call")
+    parser.add_argument("--tps", type=float, default=1000.0, help="tokens/sec per stream")
+    parser.add_argument("--tail", type=int, default=400, help="tokens written after the suggestion")
+    parser.add_argument("--days", type=int, default=2, help="days read before disconnecting")
+    parser.add_argument("--linger", type=float, default=0.5, help="single-flight linger before cancelling")
+    args = parser.parse_args()
+
+    for name in ("MEALPLAN", "USER"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+In-process stand-in for AsyncGroq that replays recorded meal plans.
+
+Mimics the parts of the client the backend uses:
+    await client.chat.completions.create(model=..., messages=..., stream=True)
+        -> async iterator of chunks with chunk.choices[0].delta.content
+    await client.chat.completions.create(..., stream=False)
+        -> object with .choices[0].message.content
+
+Timing is modelled per call: `ttft` seconds before the first token, then
+`tokens_per_sec` per stream (concurrent calls decode independently, like a
+hosted model). A request for specific days ("Generate ONLY: Day 3, Day 4")
+gets just those days, so both generation modes see the same plan text.
+
+ReplayResponder answers every call site of the backend (curator, dietary
+rules, meal plan, quantity fix, workout plan, chat) from the replay fixtures;
+the fake LLM server uses it too.
+"""
+import asyncio
+import itertools
+import re
+import zlib
+from types import SimpleNamespace
+
+from benchmarks.recorded_plans import DEFAULT_SUGGESTION, load_recorded_plans, tokenize
+
+# Main prompt in parallel mode, and the FALLBACK prompt for a truncated plan
+REQUESTED_DAYS = re.compile(r"Generate ONLY(?: the following missing days)?: ((?:Day \d+(?:, )?)+)")
+DAY_HEADER = re.compile(r"^Day \d+:")
+REQUEST_ID = re.compile(r"Request-ID: (\S+)")
+FIX_DAY = re.compile(r"^Day (\d+):", re.MULTILINE)
+
+WORKOUT_DAYS = [
+    "Chest & Triceps:\n1. Bench press — 4 × 8\n2. Incline dumbbell press — 3 × 10\n3. Cable fly — 3 × 12\n4. Triceps pushdown — 3 × 12\n",
+    "Back & Biceps:\n1. Deadlift — 4 × 6\n2. Pull-ups — 3 × 8\n3. Seated row — 3 × 10\n4. Barbell curl — 3 × 12\n",
+    "Rest Day\n",
+    "Legs:\n1. Back squat — 4 × 8\n2. Romanian deadlift — 3 × 10\n3. Walking lunges — 3 × 12\n4. Calf raises — 4 × 15\n",
+    "Shoulders & Core:\n1. Overhead press — 4 × 8\n2. Lateral raises — 3 × 12\n3. Plank — 3 × 60 s\n4. Hanging leg raises — 3 × 12\n",
+    "Cardio:\n1. Running — 30 minutes\n2. Cycling — 20 minutes\n",
+    "Rest Day\n",
+]
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def plan_responder(plan):
+    """Build a responder(messages) -> text over one recorded plan (7 days + suggestion)."""
+    days = plan["days"][:7]
+
+    def respond(messages):
+        user = messages[-1]["content"]
+        requested = REQUESTED_DAYS.search(user)
+        if requested:
+            numbers = [int(n) for n in re.findall(r"\d+", requested.group(1))]
+        else:
+            numbers = list(range(1, len(days) + 1))
+        text = "".join(DAY_HEADER.sub(f"Day {n}:", days[(n - 1) % len(days)]) for n in numbers)
+        if numbers[-1] == 7:
+            text += DEFAULT_SUGGESTION + "\n"
+        return text
+
+    return respond
+
+
+class ReplayResponder:
+    """
+    responder(messages) -> text for any backend prompt, built from replay fixtures
+    (see benchmarks.replay_fixtures). The meal plan for a request is chosen by
+    hashing its Request-ID, so the parallel calls of one request agree.
+    """
+
+    def __init__(self, fixtures):
+        self.plans = fixtures["mealplans"]
+        self.repaired_days = fixtures["repaired_days"] or [p["days"][0] for p in self.plans]
+        self.suggestions = fixtures["suggestions"]
+        self.curator_chars = fixtures["curator"]["median_chars"]
+        self._round_robin = itertools.count()
+
+    def _pick(self, items, text):
+        match = REQUEST_ID.search(text)
+        index = zlib.crc32(match.group(1).encode("utf-8")) if match else next(self._round_robin)
+        return items[index % len(items)]
+
+    def __call__(self, messages):
+        system = messages[0]["content"] if len(messages) > 1 else ""
+        user = messages[-1]["content"]
+        if "NUTRITION CURATOR" in user:
+            return self.curator()
+        if "dietary enforcement rules" in user:
+            return "DIETARY RULES:\n- Follow the listed restrictions strictly.\n- Never include listed allergens.\n"
+        if "adjust meal quantities" in system:
+            day = FIX_DAY.search(user)
+            text = self._pick(self.repaired_days, user)
+            return DAY_HEADER.sub(f"Day {day.group(1) if day else 1}:", text)
+        if "meal plan generator" in system:
+            return self.mealplan(user)
+        if "WORKOUT_PLAN" in system:
+            return self.workout()
+        return "Stay consistent: train 3-5 times a week, eat enough protein and sleep 7-9 hours.\n"
+
+    def curator(self):
+        body = "CUISINE & NUTRITION GUIDE:\n1. CUISINE: Western (default)\n2. DIETARY TYPE: Non-veg\n"
+        filler = "3. ALLOWED HIGH-PROTEIN FOODS: chicken breast (31g), eggs (13g), Greek yogurt (10g), lentils (9g)\n"
+        while len(body) < self.curator_chars:
+            body += filler
+        return body[:self.curator_chars]
+
+    def mealplan(self, user):
+        plan = self._pick(self.plans, user)
+        days = plan["days"]
+        requested = REQUESTED_DAYS.search(user)
+        numbers = [int(n) for n in re.findall(r"\d+", requested.group(1))] if requested else list(range(1, 8))
+        text = "".join(DAY_HEADER.sub(f"Day {n}:", days[(n - 1) % len(days)]) for n in numbers)
+        if numbers[-1] == 7:
+            text += self._pick(self.suggestions, user) + "\n"
+        return text
+
+    def workout(self):
+        text = "".join(f"Day {i} – {day}" for i, day in enumerate(WORKOUT_DAYS, 1))
+        return text + "\nEND-OF-PLAN-SUGGESTION: Follow this plan consistently for 3 months to reach your goal.\n"
+
+
+class FakeChatClient:
+    def __init__(self, responder, ttft=0.4, tokens_per_sec=250.0):
+        self.responder = responder
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.calls = 0
+        self.tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model=None, messages=None, stream=False, max_tokens=None, **_kwargs):
+        self.calls += 1
+        text = self.responder(messages)
+        if not stream:
+            await asyncio.sleep(self.ttft)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+        tokens = tokenize(text)
+        if max_tokens is not None:
+            tokens = tokens[:max_tokens]
+        return self._stream(tokens)
+
+    async def _stream(self, tokens):
+        loop = asyncio.get_event_loop()
+        start = loop.time() + self.ttft
+        for i, token in enumerate(tokens):
+            # Schedule against the call's own clock so sleep overhead doesn't accumulate
+            delay = start + i / self.tokens_per_sec - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.tokens += 1
+            yield _chunk(token)
+
+
+def cycle_plans(log_path=None, min_days=7):
+    """Endless iterator over recorded 7-day plans."""
+    plans = load_recorded_plans(log_path, min_days=min_days) if log_path else load_recorded_plans(min_days=min_days)
+    if not plans:
+        raise SystemExit("No recorded 7-day plans found in the log")
+    return itertools.cycle(plans)
@@ -0,0 +1,274 @@
+"""
+Local stand-in for the Groq / OpenAI chat-completions API, for load testing
+without spending tokens.
+
+Speaks the streaming protocol used by client.chat.completions.create(stream=True)
+(SSE "data: {chat.completion.chunk}" lines ending in "data: [DONE]") and the
+non-streaming JSON response, and answers every backend prompt from the replay
+fixtures (benchmarks/fixtures/llm_replay.json, see benchmarks.replay_fixtures).
+
+    python -m benchmarks.fake_llm_server [--port 8099] [--tps 250] [--ttft 0.4]
+        [--jitter 0.1] [--error-rate 0.0] [--truncate-rate 0.0] [--truncate-at 0.8]
+        [--rpm 0] [--rpd 0] [--tpm 0] [--slow-rate 0.0] [--slow-ttft 8.0]
+
+With --rpm/--tpm the server enforces Groq-style account limits: a request
+over the limit gets a 429 with retry-after, and every response carries the
+x-ratelimit-{limit,remaining,reset}-{requests,tokens} headers. As on Groq,
+the -tokens headers are per minute and the -requests headers per DAY
+(--rpd, default --rpm x 1440); the per-minute request limit is in no header.
+
+With --slow-rate a fraction of calls waits --slow-ttft seconds before its
+first token instead (a queued/cold replica: the long TTFT tail that
+hedged requests target).
+
+Point the backend at it (both SDKs append their own API path):
+    LLM_BASE_URL=http://localhost:8099 uvicorn app:app          # AsyncGroq -> /openai/v1/...
+    OPENAI_BASE_URL=http://localhost:8099/v1 python restoreapp.py  # OpenAI SDK -> /v1/...
+
+Behaviour can be changed while running (e.g. between load-test phases):
+    curl -X POST localhost:8099/_fake/config -d '{"error_rate": 0.05}'
+    curl localhost:8099/_fake/stats
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.fake_llm import ReplayResponder
+from benchmarks.recorded_plans import tokenize
+from benchmarks.replay_fixtures import DEFAULT_FIXTURE_PATH, load_fixtures
+
+
+class FakeLLMConfig:
+    """Knobs for the simulated provider; all can be changed via POST /_fake/config."""
+
+    fields = ("tokens_per_sec", "ttft", "jitter", "error_rate", "error_status", "truncate_rate", "truncate_at",
+              "rpm_limit", "tpm_limit", "slow_rate", "slow_ttft", "rpd_limit")
+
+    def __init__(self, tokens_per_sec=250.0, ttft=0.4, jitter=0.1, error_rate=0.0, error_status=429,
+                 truncate_rate=0.0, truncate_at=0.8, rpm_limit=0, tpm_limit=0, slow_rate=0.0, slow_ttft=8.0,
+                 rpd_limit=0):
+        self.tokens_per_sec = tokens_per_sec  # Decode speed per stream
+        self.ttft = ttft                      # Seconds before the first token
+        self.jitter = jitter                  # +/- fraction applied to ttft
+        self.error_rate = error_rate          # Fraction of calls rejected before streaming
+        self.error_status = error_status      # 429 (rate limit) or 5xx
+        self.truncate_rate = truncate_rate    # Fraction of streams cut short
+        self.truncate_at = truncate_at        # ... after this fraction of their tokens
+        self.rpm_limit = rpm_limit            # Account requests/minute (0 = unlimited)
+        self.tpm_limit = tpm_limit            # Account tokens/minute, prompt + completion (0 = unlimited)
+        self.slow_rate = slow_rate            # Fraction of calls with a slow first token
+        self.slow_ttft = slow_ttft            # ... their ttft
+        self.rpd_limit = rpd_limit            # Requests/day in the headers (0 = rpm_limit x 1440)
+
+    def update(self, values):
+        for key, value in values.items():
+            if key in self.fields:
+                setattr(self, key, type(getattr(self, key))(value))
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.fields}
+
+
+class RateLimits:
+    """
+    Groq-style per-account limits: token buckets refilled at limit/60 per
+    second. Every response carries x-ratelimit-* headers (requests per day,
+    tokens per minute); a request that doesn't fit gets a 429 with retry-after.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.requests = None
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.day_started = self.updated
+        self.day_requests = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        rpm, tpm = self.config.rpm_limit, self.config.tpm_limit
+        self.requests = rpm if self.requests is None else min(rpm, self.requests + elapsed * rpm / 60)
+        self.tokens = tpm if self.tokens is None else min(tpm, self.tokens + elapsed * tpm / 60)
+
+    def take(self, cost):
+        """(allowed, headers) for a request of `cost` tokens."""
+        rpm, tpm = self.config.rpm_limit, self.config.tpm_limit
+        if not rpm and not tpm:
+            return True, {}
+        self._refill()
+        waits = []
+        if rpm and self.requests < 1:
+            waits.append((1 - self.requests) / (rpm / 60))
+        if tpm and self.tokens < cost:
+            waits.append((cost - self.tokens) / (tpm / 60))
+        if not waits:
+            self.requests -= 1 if rpm else 0
+            self.tokens -= cost if tpm else 0
+            self.day_requests += 1
+        if self.updated - self.day_started >= 86400:
+            self.day_started, self.day_requests = self.updated, 0
+        headers = {}
+        if rpm:
+            rpd = self.config.rpd_limit or rpm * 1440
+            headers.update({
+                "x-ratelimit-limit-requests": str(int(rpd)),
+                "x-ratelimit-remaining-requests": str(max(0, int(rpd - self.day_requests))),
+                "x-ratelimit-reset-requests": f"{self.day_requests / (rpd / 86400):.2f}s",
+            })
+        if tpm:
+            headers.update({
+                "x-ratelimit-limit-tokens": str(int(tpm)),
+                "x-ratelimit-remaining-tokens": str(max(0, int(self.tokens))),
+                "x-ratelimit-reset-tokens": f"{(tpm - self.tokens) / (tpm / 60):.2f}s",
+            })
+        if waits:
+            headers["retry-after"] = str(max(1, int(max(waits) + 0.999)))
+        return not waits, headers
+
+
+def create_app(config=None, fixtures_path=DEFAULT_FIXTURE_PATH):
+    config = config or FakeLLMConfig()
+    responder = ReplayResponder(load_fixtures(fixtures_path))
+    limits = RateLimits(config)
+    stats = {"requests": 0, "streams": 0, "errors": 0, "truncated": 0, "tokens": 0, "active_streams": 0,
+             "rate_limited": 0, "slow": 0}
+    app = FastAPI()
+
+    def error_response():
+        stats["errors"] += 1
+        headers = {"retry-after": "1"} if config.error_status == 429 else {}
+        body = {"error": {"message": "Simulated provider error", "type": "fake_error", "code": config.error_status}}
+        return JSONResponse(body, status_code=config.error_status, headers=headers)
+
+    def rate_limited_response(headers):
+        stats["rate_limited"] += 1
+        body = {"error": {"message": "Rate limit reached (simulated)", "type": "tokens", "code": "rate_limit_exceeded"}}
+        return JSONResponse(body, status_code=429, headers=headers)
+
+    def apply_stop(text, stop):
+        for seq in ([stop] if isinstance(stop, str) else stop or []):
+            idx = text.find(seq)
+            if idx >= 0:
+                text = text[:idx]
+        return text
+
+    async def completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if random.random() < config.error_rate:
+            return error_response()
+
+        model = body.get("model", "fake-model")
+        text = apply_stop(responder(body.get("messages", [])), body.get("stop"))
+        tokens = tokenize(text)
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if max_tokens and len(tokens) > max_tokens:
+            tokens, finish_reason = tokens[:max_tokens], "length"
+        if random.random() < config.truncate_rate:
+            stats["truncated"] += 1
+            tokens, finish_reason = tokens[:int(len(tokens) * config.truncate_at)], "length"
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        ttft = max(0.0, config.ttft * (1 + random.uniform(-config.jitter, config.jitter)))
+        if random.random() < config.slow_rate:
+            stats["slow"] += 1
+            ttft = config.slow_ttft
+        usage = {"prompt_tokens": sum(len(m.get("content") or "") // 4 for m in body.get("messages", [])),
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        allowed, limit_headers = limits.take(usage["total_tokens"])
+        if not allowed:
+            return rate_limited_response(limit_headers)
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + len(tokens) / config.tokens_per_sec)
+            stats["tokens"] += len(tokens)
+            return JSONResponse(headers=limit_headers, content={
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        def sse(delta, finish=None, extra=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            if extra:
+                chunk.update(extra)
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        async def event_stream():
+            stats["streams"] += 1
+            stats["active_streams"] += 1
+            try:
+                loop = asyncio.get_event_loop()
+                start = loop.time() + ttft
+                await asyncio.sleep(ttft)
+                yield sse({"role": "assistant", "content": ""})
+                for i, token in enumerate(tokens):
+                    delay = start + i / config.tokens_per_sec - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    stats["tokens"] += 1
+                    yield sse({"content": token})
+                # Groq reports usage on the last chunk under x_groq
+                yield sse({}, finish_reason, {"x_groq": {"id": completion_id, "usage": usage}})
+                yield b"data: [DONE]\n\n"
+            finally:
+                stats["active_streams"] -= 1
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers=limit_headers)
+
+    # Groq SDK path and OpenAI SDK path
+    app.add_api_route("/openai/v1/chat/completions", completions, methods=["POST"])
+    app.add_api_route("/v1/chat/completions", completions, methods=["POST"])
+
+    @app.get("/_fake/stats")
+    async def fake_stats():
+        return {**stats, "config": config.as_dict()}
+
+    @app.post("/_fake/config")
+    async def fake_config(request: Request):
+        config.update(await request.json())
+        return config.as_dict()
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE_PATH)
+    parser.add_argument("--tps", type=float, default=250.0, help="tokens/sec per stream")
+    parser.add_argument("--ttft", type=float, default=0.4, help="seconds to first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- fraction of ttft")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-at", type=float, default=0.8)
+    parser.add_argument("--rpm", type=int, default=0, help="requests/minute limit (0 = unlimited)")
+    parser.add_argument("--rpd", type=int, default=0, help="requests/day in the headers (0 = rpm x 1440)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens/minute limit (0 = unlimited)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of calls with --slow-ttft")
+    parser.add_argument("--slow-ttft", type=float, default=8.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeLLMConfig(args.tps, args.ttft, args.jitter, args.error_rate, args.error_status,
+                           args.truncate_rate, args.truncate_at, args.rpm, args.tpm, args.slow_rate, args.slow_ttft,
+                           args.rpd)
+    uvicorn.run(create_app(config, args.fixtures), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Asyncio load generator for the FastAPI backend.
+
+Virtual users loop over a weighted mix of scenarios at fixed concurrency:
+  user_mealplan  POST /user, then POST /mealplan carrying the mealplan_session cookie
+  mealplan       POST /mealplan without a session (on-demand generation)
+  workoutplan    POST /workoutplan
+  chat           POST /chat
+
+and records per request: status, time to first byte, time until each
+"Day N:" shows up in the stream, total stream time and errors (HTTP >= 400 or
+an error message inside a 200 stream). Event-loop lag is sampled on both the
+generator (to prove it isn't the bottleneck) and the server (/metrics).
+
+Run against a server that uses the fake LLM (see benchmarks.fake_llm_server),
+or let the script start both:
+    python -m benchmarks.load_test --spawn --concurrency 20 --duration 60
+    python -m benchmarks.load_test --base-url http://localhost:8000 --mix user_mealplan=3,chat=1
+
+Results are written as JSON (default benchmarks/results/load-<commit>.json);
+compare two runs with:
+    python -m benchmarks.load_test --compare OLD.json NEW.json
+
+Hedged main-plan requests (hedging.py) against a provider with a slow
+first-token tail - run once without and once with --hedge, then --compare;
+"provider tokens" is what the fake LLM streamed, i.e. the extra spend:
+    python -m benchmarks.load_test --spawn --slow-rate 0.05 --slow-ttft 6 --mix mealplan=1 --out off.json
+    python -m benchmarks.load_test --spawn --slow-rate 0.05 --slow-ttft 6 --mix mealplan=1 --hedge --out on.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from loop_monitor import LoopLagMonitor, percentile
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+DAY_MARKER = re.compile(rb"Day (\d+)")
+STREAM_ERRORS = (b"Error generating meal plan", b"[ERROR]", b"[FALLBACK ERROR]", b"Exception during streaming")
+
+PROFILES = [
+    {"age": 30, "weight": 82, "height": 178, "gender": "male", "activityLevel": "moderate",
+     "healthGoals": "lose weight", "targetWeight": 75, "timelineWeeks": 12},
+    {"age": 26, "weight": 58, "height": 163, "gender": "female", "activityLevel": "light",
+     "healthGoals": "build muscle", "targetWeight": 62, "timelineWeeks": 16},
+    {"age": 45, "weight": 95, "height": 182, "gender": "male", "activityLevel": "sedentary",
+     "healthGoals": "lose weight", "targetWeight": 85, "timelineWeeks": 20},
+]
+PROMPTS = [
+    "I want a high protein western diet, I eat everything",
+    "Vegetarian Indian food please, I like paneer and dal",
+    "Mediterranean meals, no pork, quick lunches",
+]
+CHAT_MESSAGES = ["How much protein should I eat per day?", "Is creatine safe?", "Best time to do cardio?"]
+
+DEFAULT_MIX = "user_mealplan=5,mealplan=2,workoutplan=2,chat=1"
+
+
+def mealplan_body(profile, prompt, target_calories=None):
+    return {
+        "targetCalories": target_calories or 2000,
+        "targetWeight": profile["targetWeight"],
+        "timelineWeeks": profile["timelineWeeks"],
+        "weight": profile["weight"],
+        "healthGoals": profile["healthGoals"],
+        "prompt": prompt,
+    }
+
+
+class LoadTest:
+    def __init__(self, base_url, mix, concurrency, duration, timeout=180.0):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.timeout = timeout
+        self.records = []
+
+    async def timed_post(self, client, scenario, path, body):
+        """POST and read the stream, timing the first byte and every "Day N"."""
+        record = {"scenario": scenario, "endpoint": path, "status": None, "error": None,
+                  "ttfb_ms": None, "total_ms": None, "day_ms": {}}
+        start = time.perf_counter()
+        seen = b""
+        try:
+            async with client.stream("POST", path, json=body) as response:
+                record["status"] = response.status_code
+                async for chunk in response.aiter_bytes():
+                    now_ms = (time.perf_counter() - start) * 1000
+                    if record["ttfb_ms"] is None:
+                        record["ttfb_ms"] = now_ms
+                    seen += chunk
+                    for match in DAY_MARKER.finditer(seen[-len(chunk) - 8:]):
+                        record["day_ms"].setdefault(match.group(1).decode(), now_ms)
+                if response.status_code >= 400:
+                    record["error"] = f"HTTP {response.status_code}"
+                elif any(marker in seen for marker in STREAM_ERRORS):
+                    record["error"] = "error in stream"
+        except Exception as e:
+            record["error"] = type(e).__name__
+        record["total_ms"] = (time.perf_counter() - start) * 1000
+        self.records.append(record)
+        return record, seen
+
+    async def scenario_user_mealplan(self, client):
+        profile = random.choice(PROFILES)
+        prompt = random.choice(PROMPTS)
+        record, body = await self.timed_post(client, "user_mealplan", "/user",
+                                             {"prompt": prompt, "userDetails": profile})
+        if record["error"]:
+            return
+        # The session cookie from /user is kept by the client's cookie jar
+        target_calories = json.loads(body).get("targetCalories")
+        await self.timed_post(client, "user_mealplan", "/mealplan", mealplan_body(profile, prompt, target_calories))
+
+    async def scenario_mealplan(self, client):
+        await self.timed_post(client, "mealplan", "/mealplan",
+                              mealplan_body(random.choice(PROFILES), random.choice(PROMPTS)))
+
+    async def scenario_workoutplan(self, client):
+        profile = random.choice(PROFILES)
+        await self.timed_post(client, "workoutplan", "/workoutplan", {
+            "goal": "weight_loss", "workout_focus": "Mixed Cardio and Strength", "workout_days": random.randint(3, 6),
+            "targetWeight": profile["targetWeight"], "timelineWeeks": profile["timelineWeeks"],
+            "prompt": random.choice(PROMPTS),
+        })
+
+    async def scenario_chat(self, client):
+        await self.timed_post(client, "chat", "/chat", {"message": random.choice(CHAT_MESSAGES)})
+
+    async def virtual_user(self, deadline):
+        names, weights = zip(*self.mix.items())
+        while time.perf_counter() < deadline:
+            # A fresh client per iteration: new cookie jar, like a new browser session
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+                scenario = random.choices(names, weights)[0]
+                await getattr(self, f"scenario_{scenario}")(client)
+
+    async def server_metrics(self):
+        try:
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=5) as client:
+                return (await client.get("/metrics")).json()
+        except Exception as e:
+            print(f"[load_test] /metrics unavailable: {e!r}")
+            return None
+
+    async def run(self):
+        monitor = LoopLagMonitor(interval=0.05)
+        monitor.start()
+        before = await self.server_metrics()
+        deadline = time.perf_counter() + self.duration
+        started = time.perf_counter()
+        await asyncio.gather(*(self.virtual_user(deadline) for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+        after = await self.server_metrics()
+        monitor.stop()
+        return summarize(self.records, elapsed, monitor.stats(), before, after)
+
+
+def _dist(values):
+    values = [v for v in values if v is not None]
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+    }
+
+
+def summarize(records, elapsed, client_lag, before, after):
+    endpoints = {}
+    for key in sorted({(r["scenario"], r["endpoint"]) for r in records}):
+        rows = [r for r in records if (r["scenario"], r["endpoint"]) == key]
+        ok = [r for r in rows if not r["error"]]
+        days = sorted({d for r in ok for d in r["day_ms"]}, key=int)
+        errors = {}
+        for r in rows:
+            if r["error"]:
+                errors[r["error"]] = errors.get(r["error"], 0) + 1
+        endpoints[f"{key[0]}:{key[1]}"] = {
+            "requests": len(rows),
+            "error_rate": round(1 - len(ok) / len(rows), 4),
+            "errors": errors,
+            "ttfb_ms": _dist([r["ttfb_ms"] for r in ok]),
+            "total_ms": _dist([r["total_ms"] for r in ok]),
+            "day_ms": {d: _dist([r["day_ms"].get(d) for r in ok]) for d in days},
+        }
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(records) / elapsed, 3) if elapsed else 0,
+        "endpoints": endpoints,
+        "event_loop_lag_ms": {
+            "client": client_lag,
+            "server": (after or {}).get("event_loop_lag_ms"),
+        },
+        "server_metrics": {"before": before, "after": after},
+    }
+
+
+def print_summary(summary):
+    print(f"\n{summary['elapsed_s']}s, {summary['throughput_rps']} req/s")
+    print(f"{'endpoint':<28} {'reqs':>6} {'err%':>6} {'ttfb p50/p95/p99 ms':>24} {'total p50/p95/p99 ms':>26} {'day7 p50':>9}")
+    for name, row in summary["endpoints"].items():
+        t, tot = row["ttfb_ms"], row["total_ms"]
+        day7 = row["day_ms"].get("7", {}).get("p50", "-")
+        print(f"{name:<28} {row['requests']:>6} {row['error_rate'] * 100:>5.1f}% "
+              f"{t['p50']:>8}/{t['p95']}/{t['p99']:<8} {tot['p50']:>9}/{tot['p95']}/{tot['p99']:<9} {day7:>9}")
+        if row["errors"]:
+            print(f"{'':<28} errors: {row['errors']}")
+    lag = summary["event_loop_lag_ms"]
+    print(f"event loop lag ms - client: {lag['client']}  server: {lag['server']}")
+    provider = summary.get("provider")
+    if provider:
+        print(f"provider: {provider['requests']} calls, {provider['tokens']} tokens streamed, {provider['slow']} slow")
+    hedging = ((summary["server_metrics"]["after"] or {}).get("hedging"))
+    if hedging and hedging["requests"]:
+        print(f"hedging: {hedging}")
+
+
+def compare(old_path, new_path):
+    """Print p50/p95/p99 deltas of every endpoint between two result files."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('meta', {}).get('commit')} -> {new.get('meta', {}).get('commit')}")
+    tokens = [(run.get("summary", {}).get("provider") or {}).get("tokens") for run in (old, new)]
+    if all(tokens):
+        print(f"provider tokens {tokens[0]}->{tokens[1]} ({(tokens[1] - tokens[0]) / tokens[0] * 100:+.1f}%)")
+    for name, row in new["summary"]["endpoints"].items():
+        prev = old["summary"]["endpoints"].get(name)
+        if not prev:
+            print(f"{name:<28} (new)")
+            continue
+        parts = []
+        for metric in ("ttfb_ms", "total_ms"):
+            for pct in ("p50", "p95", "p99"):
+                a, b = prev[metric][pct], row[metric][pct]
+                change = f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+                parts.append(f"{metric[:-3]} {pct} {a:.0f}->{b:.0f} ({change})")
+        parts.append(f"err {prev['error_rate']:.3f}->{row['error_rate']:.3f}")
+        print(f"{name:<28} " + ", ".join(parts))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def wait_until_up(url, timeout=30):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.perf_counter() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.25)
+    raise SystemExit(f"{url} did not come up within {timeout}s")
+
+
+async def fake_llm_stats(port):
+    async with httpx.AsyncClient(timeout=5) as client:
+        return (await client.get(f"http://127.0.0.1:{port}/_fake/stats")).json()
+
+
+def port_in_use(port):
+    with socket.socket() as sock:
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def spawn_servers(args):
+    """Start the fake LLM server and the backend (uvicorn) pointed at it."""
+    for port in (args.fake_port, args.app_port):
+        if port_in_use(port):
+            raise SystemExit(f"Port {port} is already in use - stop that server or pick another port")
+    env = dict(os.environ, GROQ_API_KEY=os.environ.get("GROQ_API_KEY", "load-test-fake-key"),
+               LLM_BASE_URL=f"http://127.0.0.1:{args.fake_port}")
+    if args.hedge:
+        env["MEALPLAN_HEDGE"] = "on"
+    fake = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_llm_server", "--port", str(args.fake_port),
+                             "--tps", str(args.tps), "--ttft", str(args.ttft),
+                             "--slow-rate", str(args.slow_rate), "--slow-ttft", str(args.slow_ttft)],
+                            cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    backend = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.app_port),
+                                "--log-level", "warning"],
+                               cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return [fake, backend]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(LoadTest, f"scenario_{name.strip()}"):
+            raise SystemExit(f"Unknown scenario '{name}'")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=None, help="backend URL (default: the spawned one)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=10, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to keep starting scenarios")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="result JSON path")
+    parser.add_argument("--spawn", action="store_true", help="start fake LLM + backend locally")
+    parser.add_argument("--app-port", type=int, default=8001)
+    parser.add_argument("--fake-port", type=int, default=8099)
+    parser.add_argument("--tps", type=float, default=250.0, help="fake LLM tokens/sec (with --spawn)")
+    parser.add_argument("--ttft", type=float, default=0.4, help="fake LLM TTFT seconds (with --spawn)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fake LLM slow-TTFT fraction (with --spawn)")
+    parser.add_argument("--slow-ttft", type=float, default=8.0, help="fake LLM slow TTFT seconds (with --spawn)")
+    parser.add_argument("--hedge", action="store_true", help="spawned backend hedges the main plan stream")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    random.seed(args.seed)
+    base_url = args.base_url or f"http://127.0.0.1:{args.app_port}"
+    processes = spawn_servers(args) if args.spawn else []
+    try:
+        if processes:
+            asyncio.run(wait_until_up(f"http://127.0.0.1:{args.fake_port}/_fake/stats"))
+            asyncio.run(wait_until_up(f"{base_url}/health"))
+        test = LoadTest(base_url, parse_mix(args.mix), args.concurrency, args.duration)
+        summary = asyncio.run(test.run())
+        if processes:
+            summary["provider"] = asyncio.run(fake_llm_stats(args.fake_port))
+    finally:
+        for process in processes:
+            process.terminate()
+
+    print_summary(summary)
+    commit = git_commit()
+    result = {
+        "meta": {
+            "commit": commit,
+            "timestamp": int(time.time()),
+            "base_url": base_url,
+            "mix": parse_mix(args.mix),
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "fake_llm": {"tps": args.tps, "ttft": args.ttft, "slow_rate": args.slow_rate,
+                         "slow_ttft": args.slow_ttft, "hedge": args.hedge} if args.spawn else None,
+        },
+        "summary": summary,
+        "requests": test.records,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"load-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=1)
+    print(f"results -> {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Recorded meal plans harvested from logs/mealplan.log.
+
+process_single_day logs every parsed input line in its BATCH TRANSFORMATIONS
+block ("[DAY] Day 1:  -->  ...", "[MEAL] - Breakfast (408 kcal):  -->  ...",
+"[ITEM] 1. Oatmeal - 150g - 150 kcal - 5p/2f/30c  -->  ..."), so the left-hand
+side of those entries is enough to rebuild the day text the LLM produced.
+Low-item days also log a "[RAW_INPUT_PREVIEW]" with the first 500 raw chars.
+"""
+import os
+import re
+
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "logs", "mealplan.log")
+
+LOG_LINE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} \[MEALPLAN\] \w+: (.*)$")
+TRANSFORM = re.compile(r"^\[(DAY|MEAL|ITEM)\] (.*?)  -->  ")
+TARGET_CALORIES = re.compile(r"^Target Calories: (\d+)")
+MACROS = re.compile(r"^Macros: Protein=(\d+)g, Fat=(\d+)g, Carbs=(\d+)g")
+PREGEN_START = re.compile(r"^\[PREGEN_STREAM\] Starting generation: (\d+) kcal")
+PREVIEW = re.compile(r"^\[RAW_INPUT_PREVIEW\] Low item count! First 500 chars: (.*)$")
+
+DEFAULT_SUGGESTION = (
+    "END-OF-PLAN-SUGGESTION: Follow this plan consistently and adjust portions "
+    "as your weight changes."
+)
+
+# Rough stand-in for the model tokenizer: short words, number runs, single symbols
+TOKEN_PATTERN = re.compile(r" ?[A-Za-z]{1,6}| ?\d{1,3}|\s+|[^\sA-Za-z\d]")
+
+
+def _decode(raw):
+    # The log mixes UTF-8 input lines with cp1252 em-dashes in formatted output
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("cp1252", errors="replace")
+
+
+def _new_plan(request_id, target_calories=None):
+    return {
+        "request_id": request_id,
+        "target_calories": target_calories,
+        "macros": None,
+        "days": [],
+        "repaired_days": [],
+        "previews": [],
+    }
+
+
+def load_recorded_plans(log_path=DEFAULT_LOG_PATH, min_days=1):
+    """
+    Parse the mealplan log into a list of plans:
+    {request_id, target_calories, macros, days: [day_text], repaired_days: [day_text], previews: [raw_text]}
+    Days re-processed by fix_quantities_with_llm go to repaired_days.
+    """
+    plans = []
+    plan = None
+    block = None
+    in_repair = False
+
+    with open(log_path, "rb") as f:
+        for raw in f:
+            match = LOG_LINE.match(_decode(raw).rstrip("\r\n"))
+            if not match:
+                continue
+            msg = match.group(1)
+
+            if msg.startswith("[USER_PROMPT] Request ID: "):
+                plan = _new_plan(msg.split(": ", 1)[1].strip())
+                plans.append(plan)
+                continue
+            pregen = PREGEN_START.match(msg)
+            if pregen:
+                plan = _new_plan("pregen-%d" % len(plans), int(pregen.group(1)))
+                plans.append(plan)
+                continue
+            if plan is None:
+                continue
+
+            cal_match = TARGET_CALORIES.match(msg)
+            if cal_match:
+                plan["target_calories"] = int(cal_match.group(1))
+                continue
+            macro_match = MACROS.match(msg)
+            if macro_match:
+                protein, fat, carbs = (int(g) for g in macro_match.groups())
+                plan["macros"] = {"protein_g": protein, "fat_g": fat, "carbs_g": carbs}
+                continue
+            preview = PREVIEW.match(msg)
+            if preview:
+                plan["previews"].append(preview.group(1).replace("\\n", "\n"))
+                continue
+
+            if msg.startswith("[FIX_QUANTITIES] Fixed Day"):
+                in_repair = True
+            elif msg.startswith("[PARSE_FAILURE]"):
+                # Parse failures return before the batch is logged
+                in_repair = False
+            elif msg == "":
+                # The START banner is logged as "\n=====...", i.e. an empty INFO line
+                block = []
+            elif msg == "===== BATCH TRANSFORMATIONS END =====":
+                if block:
+                    (plan["repaired_days"] if in_repair else plan["days"]).append(render_day(block))
+                block = None
+                in_repair = False
+            elif block is not None:
+                transform = TRANSFORM.match(msg)
+                if transform:
+                    block.append(transform.groups())
+
+    return [p for p in plans if len(p["days"]) >= min_days]
+
+
+def render_day(entries):
+    """Rebuild the raw LLM day text from logged (label, input) pairs."""
+    lines = []
+    meal_total = 0
+    for label, text in entries:
+        if label == "DAY":
+            lines.append(text)
+        elif label == "MEAL":
+            lines.append(text)
+            kcal = re.search(r"\((\d+)", text)
+            meal_total += int(kcal.group(1)) if kcal else 0
+        else:
+            lines.append("  " + text)
+    lines.append(f"Total: {meal_total} kcal")
+    return "\n".join(lines) + "\n\n"
+
+
+def render_plan(plan, suggestion=DEFAULT_SUGGESTION):
+    """Full plan body as the main stream would emit it: 7 days then the suggestion."""
+    return "".join(plan["days"][:7]) + suggestion + "\n"
+
+
+def tokenize(text):
+    """Split text into LLM-sized tokens (~3-4 chars) so stream replays look realistic."""
+    tokens = TOKEN_PATTERN.findall(text)
+    assert "".join(tokens) == text, "tokenizer must be lossless"
+    return tokens
@@ -0,0 +1,84 @@
+"""
+Replay fixtures for the fake LLM server, harvested from logs/mealplan.log.
+
+The log has the full day text of every generated plan (via the BATCH
+TRANSFORMATIONS blocks), the days re-written by fix_quantities_with_llm, and
+the size/latency of the curator calls, but not the curator or dietary-rules
+text itself. Those are synthesised at the logged median length.
+
+    python -m benchmarks.replay_fixtures [--log PATH] [--out PATH]
+
+writes benchmarks/fixtures/llm_replay.json, which the server loads by default.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+
+from benchmarks.recorded_plans import DEFAULT_LOG_PATH, DEFAULT_SUGGESTION, load_recorded_plans, _decode
+
+DEFAULT_FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "llm_replay.json")
+
+CURATOR_CHARS = re.compile(r"\[AI_EXTRACTION\] Generated instructions: (\d+) chars")
+CURATOR_MS = re.compile(r"\[AI_EXTRACTION\] Completed in (\d+)ms")
+SUGGESTION_LINE = re.compile(r"END-OF-PLAN-SUGGESTION:[^\n\\]*")
+
+
+def _median(values, default):
+    return int(statistics.median(values)) if values else default
+
+
+def harvest(log_path=DEFAULT_LOG_PATH):
+    plans = load_recorded_plans(log_path, min_days=7)
+    curator_chars, curator_ms, suggestions = [], [], []
+    with open(log_path, "rb") as f:
+        for raw in f:
+            line = _decode(raw)
+            for pattern, values in ((CURATOR_CHARS, curator_chars), (CURATOR_MS, curator_ms)):
+                match = pattern.search(line)
+                if match:
+                    values.append(int(match.group(1)))
+            match = SUGGESTION_LINE.search(line)
+            # Previews are cut at 500 chars - keep only complete sentences
+            if match and match.group(0).rstrip().endswith("."):
+                suggestions.append(match.group(0).strip())
+
+    return {
+        "source": os.path.basename(log_path),
+        "mealplans": [
+            {
+                "request_id": p["request_id"],
+                "target_calories": p["target_calories"],
+                "macros": p["macros"],
+                "days": p["days"][:7],
+            }
+            for p in plans
+        ],
+        "repaired_days": [d for p in plans for d in p["repaired_days"]],
+        "suggestions": suggestions or [DEFAULT_SUGGESTION],
+        "curator": {"median_chars": _median(curator_chars, 2400), "median_ms": _median(curator_ms, 2000)},
+    }
+
+
+def load_fixtures(path=DEFAULT_FIXTURE_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH)
+    parser.add_argument("--out", default=DEFAULT_FIXTURE_PATH)
+    args = parser.parse_args()
+
+    fixtures = harvest(args.log)
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(fixtures, f, indent=1, ensure_ascii=False)
+    print(f"{len(fixtures['mealplans'])} plans, {len(fixtures['repaired_days'])} repaired days, "
+          f"{len(fixtures['suggestions'])} suggestions -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
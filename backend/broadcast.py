@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+# ============================================================
+# BROADCAST CHANNEL - One producer, any number of replaying subscribers
+# ============================================================
+# Replaces the "append to a list, readers poll every 50 ms" pattern. Readers
+# sleep on an asyncio.Condition and are woken exactly when the producer
+# publishes a chunk or closes the channel. Every subscriber starts from the
+# first chunk, so a late reader (e.g. a browser retry) gets the already
+# emitted days immediately and then follows the live stream.
+
+
+class BroadcastChannel:
+    """
+    Append-only chunk log with wake-on-publish subscribers.
+
+    Attributes kept for callers that used the old cache entry dict:
+    chunks, done, error, created, task
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.created = time.time()
+        self.task = None
+        self.subscribers = 0
+        self.wakeups = 0  # Times a waiting subscriber was woken (for benchmarks)
+        self._cond = asyncio.Condition()
+
+    async def publish(self, chunk):
+        async with self._cond:
+            if self.done:
+                return
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def close(self, error=None):
+        async with self._cond:
+            if self.done:
+                return
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    async def subscribe(self):
+        """Yield every chunk from the beginning, waiting for new ones until closed."""
+        index = 0
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._cond:
+                    if index >= len(self.chunks) and not self.done:
+                        await self._cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                        self.wakeups += 1
+                    pending = self.chunks[index:]
+                    done = self.done
+
+                # Yield outside the lock so a slow reader never blocks the producer
+                for chunk in pending:
+                    yield chunk
+                index += len(pending)
+
+                if done and index >= len(self.chunks):
+                    return
+        finally:
+            self.subscribers -= 1
@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from food_table import drain_food_table, get_food_table
+from nutrition_index import get_nutrition_index
+
+# ============================================================
+# DAY EXECUTOR - Where process_single_day runs off the event loop
+# ============================================================
+# process_single_day is pure-Python CPU work (~1 ms per day). On the default
+# thread pool every day of every concurrent plan competes for the GIL with
+# the event loop itself; with DAY_EXECUTOR=process it runs in a pool of
+# pre-warmed worker processes instead. Day text, targets and the day number
+# go in, and the formatted day plus anomaly dict come back - small strings
+# and dicts, so pickling costs a few microseconds per call.
+#
+# Workers are started with "spawn" (forking a process that already runs an
+# event loop, the Groq client and Redis connections is not safe). Each one
+# imports utils - compiling its regexes - and pushes a sample day through
+# process_single_day once, before the first real request reaches it.
+# Workers append to the same log files as the parent, like gunicorn workers.
+# What a worker's nutrition index learned from a day (NUTRITION_INDEX_LEARN),
+# and its food-table check counters, come back with the day's result and are
+# merged into the parent's, so /metrics counts every day in either mode.
+# Results arrive on the pool's manager thread, which must not block on
+# SQLite, so the parent's batched writes go to one dedicated writer thread.
+#
+#   DAY_EXECUTOR=thread|process    (default thread)
+#   DAY_EXECUTOR_WORKERS=4
+
+DAY_EXECUTOR = os.getenv("DAY_EXECUTOR", "thread")
+DAY_EXECUTOR_WORKERS = int(os.getenv("DAY_EXECUTOR_WORKERS", "4"))
+
+WARMUP_DAY = (
+    "Day 1:\n"
+    "- Breakfast (400 kcal):\n"
+    "  1. Rolled oats - 60g - 230 kcal - 8p/4f/40c\n"
+    "  2. Greek yogurt - 170g - 170 kcal - 17p/8f/7c\n"
+    "Total Daily Calories: 400 kcal\n"
+)
+
+
+def _warm_worker():
+    """Process-pool initializer: import utils and run one day without logging it."""
+    from logger_setup import mealplan_logger
+    from utils import process_single_day
+
+    mealplan_logger.disabled = True
+    try:
+        process_single_day(WARMUP_DAY, 400, {"protein_g": 25, "fat_g": 12, "carbs_g": 47}, 5, 1)
+    finally:
+        mealplan_logger.disabled = False
+        get_nutrition_index().drain()  # Not a real plan: learn or count nothing from it
+        drain_food_table()
+
+
+def _run_in_worker(fn, args, kwargs):
+    """Call fn in a pool worker; return its result with what its nutrition index and food table counted."""
+    return fn(*args, **kwargs), get_nutrition_index().drain(), drain_food_table()
+
+
+def _unwrap(worker_future, future, writer):
+    """Settle the caller's future from a _run_in_worker result, merging the observations into this process."""
+    if worker_future.cancelled():
+        future.cancel()
+        return
+    error = worker_future.exception()
+    if error is None:
+        result, learned, checked = worker_future.result()
+        get_nutrition_index().absorb(*learned, writer=writer)
+        if checked and any(checked.values()):
+            get_food_table().absorb(checked)
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass  # The caller cancelled it meanwhile
+
+
+def _worker_pid(delay):
+    # Holds the worker briefly so warm-up pings land on different processes
+    time.sleep(delay)
+    return os.getpid()
+
+
+class DayExecutor(Executor):
+    """
+    concurrent.futures.Executor over a thread or process pool, usable as
+    loop.run_in_executor(executor, process_single_day, ...) either way.
+    Tracks submitted/completed calls, in-flight work and service time for
+    /metrics.
+    """
+
+    def __init__(self, kind=None, workers=None):
+        self.kind = kind or DAY_EXECUTOR
+        self.workers = workers or DAY_EXECUTOR_WORKERS
+        if self.kind == "process":
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nutrition-writer")
+        elif self.kind == "thread":
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            self.writer = None
+        else:
+            raise ValueError(f"Unknown DAY_EXECUTOR '{self.kind}' (expected 'thread' or 'process')")
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_ms = 0.0
+        self.max_ms = 0.0
+        self.warm = self.kind == "thread"
+
+    def warm_up(self):
+        """Start every worker process now (blocking) so requests never wait for a spawn."""
+        if self.warm:
+            return
+        futures = [self.pool.submit(_worker_pid, 0.05) for _ in range(self.workers)]
+        wait(futures)
+        self.warm = True
+
+    def submit(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        if self.kind == "process":
+            worker_future = self.pool.submit(_run_in_worker, fn, args, kwargs)
+            future = Future()
+            future.add_done_callback(lambda done: done.cancelled() and worker_future.cancel())
+            worker_future.add_done_callback(lambda done: _unwrap(done, future, self.writer))
+        else:
+            future = self.pool.submit(fn, *args, **kwargs)
+        with self.lock:
+            self.submitted += 1
+
+        def record(done):
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.completed += 1
+                if done.cancelled() or done.exception() is not None:
+                    self.failed += 1
+                self.busy_ms += elapsed_ms
+                self.max_ms = max(self.max_ms, elapsed_ms)
+
+        future.add_done_callback(record)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)  # Let queued observation batches land
+
+    def stats(self):
+        with self.lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "warm": self.warm,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "in_flight": self.submitted - self.completed,
+                # Queue wait + run time, as seen by the caller
+                "avg_ms": round(self.busy_ms / self.completed, 2) if self.completed else 0.0,
+                "max_ms": round(self.max_ms, 2),
+            }
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+
+from day_segmenter import SUGGESTION
+
+# ============================================================
+# DAY PIPELINE - Token reader and day processing as separate stages
+# ============================================================
+# event_stream used to await process_single_day (and, on an anomaly, a
+# fix_quantities LLM call) before pulling the next token, so the upstream
+# HTTP stream sat undrained while a day was being corrected. Here:
+#
+#   reader   drains the LLM stream at full speed, segments it into days and
+#            starts processing each day as soon as it is complete
+#   process  up to DAY_PIPELINE_WORKERS days post-processed concurrently
+#   emit     the caller's loop, taking finished days strictly in order
+#
+# reader and emit are connected by a bounded queue of (event, future) in
+# stream order; when the client reads slower than the plan is generated
+# the reader waits on the queue instead of buffering without limit.
+
+DAY_PIPELINE_QUEUE_SIZE = int(os.getenv("DAY_PIPELINE_QUEUE_SIZE", "8"))
+DAY_PIPELINE_WORKERS = int(os.getenv("DAY_PIPELINE_WORKERS", "2"))
+
+
+class StageStats:
+    """Service time and queue depth of one pipeline stage, summed over all runs in this process."""
+
+    def __init__(self):
+        self.items = 0
+        self.busy_ms = 0.0
+        self.max_ms = 0.0
+        self.depth = 0       # Items currently waiting for this stage
+        self.max_depth = 0
+
+    def set_depth(self, depth):
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def record(self, ms):
+        self.items += 1
+        self.busy_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def as_dict(self):
+        return {
+            "items": self.items,
+            "avg_ms": round(self.busy_ms / self.items, 3) if self.items else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+        }
+
+
+class PipelineMetrics:
+    def __init__(self):
+        self.runs = 0
+        self.queues = set()          # Reader -> emit queues of the runs in progress
+        self.reader = StageStats()   # per chunk: segmenting; queue = days handed to emit, not yet taken
+        self.process = StageStats()  # per day: process_day; queue = days waiting for a worker slot
+        self.emit = StageStats()     # per day: head-of-line wait for the next day in order
+
+    def handed_off(self):
+        self.reader.set_depth(sum(q.qsize() for q in self.queues))
+
+    def stats(self):
+        self.reader.depth = sum(q.qsize() for q in self.queues)
+        return {
+            "runs": self.runs,
+            "active": len(self.queues),
+            "reader": self.reader.as_dict(),
+            "process": self.process.as_dict(),
+            "emit": self.emit.as_dict(),
+        }
+
+
+async def stream_token_texts(stream):
+    """Content deltas of a chat.completions stream, skipping empty/role-only chunks."""
+    async for chunk in stream:
+        token_text = None
+        try:
+            if chunk.choices and chunk.choices[0].delta:
+                token_text = chunk.choices[0].delta.content
+        except Exception:
+            token_text = None
+        if token_text:
+            yield token_text
+
+
+_END = object()
+
+
+async def pipelined_days(token_texts, segmenter, process_day, metrics, queue_size=None, workers=None):
+    """
+    Async generator of (event, text) in stream order.
+
+    token_texts   async iterator of text deltas (see stream_token_texts)
+    segmenter     a DaySegmenter; feed() on every delta, close() at the end
+    process_day   async (day_text, day_number) -> processed text
+    metrics       PipelineMetrics shared by every run
+
+    Day events come back with process_day's output, suggestion events with
+    their text unchanged. A stream error or a process_day error is raised
+    from the generator at the point where it would have been emitted.
+    """
+    queue = asyncio.Queue(maxsize=queue_size or DAY_PIPELINE_QUEUE_SIZE)
+    slots = asyncio.Semaphore(workers or DAY_PIPELINE_WORKERS)
+    tasks = []
+
+    async def run_day(event):
+        waiting = True
+        metrics.process.set_depth(metrics.process.depth + 1)
+        try:
+            async with slots:
+                waiting = False
+                metrics.process.depth -= 1
+                started = time.perf_counter()
+                try:
+                    return await process_day(event.text, event.day_number)
+                finally:
+                    metrics.process.record((time.perf_counter() - started) * 1000)
+        finally:
+            if waiting:  # Cancelled before a slot freed up
+                metrics.process.depth -= 1
+
+    pending_suggestion = None  # Suggestion entry queued but not yet emitted
+
+    async def hand_off(event):
+        nonlocal pending_suggestion
+        if event.kind == SUGGESTION:
+            # After the marker every token is a suggestion event; merge them while
+            # the emitter is busy so they don't fill the queue and block the reader
+            if pending_suggestion is not None:
+                pending_suggestion.append(event.text)
+                return
+            pending_suggestion = [event.text]
+            entry = (event, pending_suggestion)
+        else:
+            pending_suggestion = None
+            future = asyncio.ensure_future(run_day(event))
+            tasks.append(future)
+            entry = (event, future)
+        await queue.put(entry)
+        metrics.handed_off()
+
+    async def read():
+        try:
+            async for token_text in token_texts:
+                started = time.perf_counter()
+                events = segmenter.feed(token_text)
+                metrics.reader.record((time.perf_counter() - started) * 1000)
+                for event in events:
+                    await hand_off(event)
+            for event in segmenter.close():
+                await hand_off(event)
+            await queue.put((_END, None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put((_END, e))
+
+    metrics.runs += 1
+    metrics.queues.add(queue)
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            event, future = await queue.get()
+            if event is _END:
+                if future is not None:
+                    raise future
+                break
+            if event.kind == SUGGESTION:
+                if future is pending_suggestion:
+                    pending_suggestion = None
+                yield event, "".join(future)
+                continue
+            started = time.perf_counter()
+            text = await future
+            metrics.emit.record((time.perf_counter() - started) * 1000)
+            yield event, text
+    finally:
+        metrics.queues.discard(queue)
+        # Client went away or an error surfaced: stop reading upstream and drop unfinished days
+        reader.cancel()
+        for task in tasks:
+            task.cancel()
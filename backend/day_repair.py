@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+from pregen_store import PregenDropped
+
+# ============================================================
+# BACKGROUND DAY REPAIR - fix_quantities off the streaming path
+# ============================================================
+# In "inline" mode (default) a day with a calorie anomaly is held back until
+# fix_quantities_with_llm returns, and every later day waits behind it. In
+# "background" mode the locally corrected day is streamed right away, the
+# repair runs as a task (several days concurrently, REPAIR_MAX_CONCURRENT
+# per process) and, if the repaired day passes validation, a patch is sent:
+#
+#   REPLACE-DAY-3:
+#   Day 3:
+#   - Breakfast (...)
+#   ...
+#   END-REPLACE-DAY-3
+#
+# Patches are written into the stream between days and, once the plan is
+# done, for up to REPAIR_STREAM_WAIT_SECONDS more. Every accepted patch is
+# also kept in the repair store under the plan id (X-Plan-Id response
+# header), so GET /mealplan/patches/{plan_id} returns late ones after the
+# stream has closed. That is a pregen-style store of its own ("repairs"
+# key prefix, REPAIR_STORE_MAX_* caps), so patches and pre-generations never
+# evict each other.
+
+REPAIR_MODE_INLINE = "inline"
+REPAIR_MODE_BACKGROUND = "background"
+MEALPLAN_REPAIR_MODE = os.getenv("MEALPLAN_REPAIR_MODE", REPAIR_MODE_INLINE)
+REPAIR_MAX_CONCURRENT = int(os.getenv("REPAIR_MAX_CONCURRENT", "4"))
+REPAIR_STREAM_WAIT_SECONDS = float(os.getenv("REPAIR_STREAM_WAIT_SECONDS", "15"))
+REPAIR_STORE_MAX_ENTRIES = int(os.getenv("REPAIR_STORE_MAX_ENTRIES", "500"))
+REPAIR_STORE_MAX_BYTES = int(os.getenv("REPAIR_STORE_MAX_BYTES", str(4 * 1024 * 1024)))
+REPAIR_CALORIE_TOLERANCE = 100  # Same ±100 kcal band as process_single_day's anomaly check
+
+TOTAL_CALORIES_PATTERN = re.compile(r"Total Daily Calories:\s*(\d+)\s*kcal", re.IGNORECASE)
+MEAL_HEADER_PATTERN = re.compile(r"^- (Breakfast|Lunch|Snack|Dinner) \(", re.IGNORECASE | re.MULTILINE)
+
+_repair_slots = None
+_running = set()  # Strong references: repairs outlive the request that started them
+
+
+def resolve_repair_mode(data):
+    mode = str(data.get("repairMode") or MEALPLAN_REPAIR_MODE).lower()
+    return mode if mode in (REPAIR_MODE_INLINE, REPAIR_MODE_BACKGROUND) else REPAIR_MODE_INLINE
+
+
+def day_total_calories(day_text):
+    match = TOTAL_CALORIES_PATTERN.search(day_text or "")
+    return int(match.group(1)) if match else None
+
+
+def patch_event(day_number, day_text):
+    return f"REPLACE-DAY-{day_number}:\n{day_text.strip()}\nEND-REPLACE-DAY-{day_number}\n"
+
+
+class RepairStats:
+    def __init__(self):
+        self.scheduled = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.cancelled = 0  # Still running when the plan's producer was cancelled
+        self.streamed = 0   # Patches delivered on the plan's own stream
+        self.busy_ms = 0.0
+
+    def as_dict(self):
+        done = self.accepted + self.rejected + self.failed + self.cancelled
+        return {
+            "scheduled": self.scheduled,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "in_flight": self.scheduled - done,
+            "streamed": self.streamed,
+            "avg_ms": round(self.busy_ms / done, 1) if done else 0.0,
+        }
+
+
+class BackgroundRepairs:
+    """
+    Repairs for one plan.
+
+    repair(day_text, day_number) is the async call that returns the repaired,
+    post-processed day text or None (fix_quantities_with_llm bound to the
+    plan's targets). A result is accepted when it has all the meals of the day
+    that was already sent and its "Total Daily Calories" is within
+    REPAIR_CALORIE_TOLERANCE of target and closer than the sent day's.
+    """
+
+    def __init__(self, plan_id, repair, target_calories, store, stats, logger):
+        global _repair_slots
+        if _repair_slots is None:
+            _repair_slots = asyncio.Semaphore(REPAIR_MAX_CONCURRENT)
+        self.plan_id = plan_id
+        self.repair = repair
+        self.target_calories = target_calories
+        self.store = store
+        self.stats = stats
+        self.logger = logger
+        self.tasks = []
+        self.ready = []           # Accepted patches not yet written to the stream
+        self.changed = asyncio.Event()
+        self.store_ready = None   # Store entry is created with the first repair
+        self.closed = False       # No more days will be scheduled
+
+    def schedule(self, day_text, day_number, sent_text):
+        day_number = int(day_number) if str(day_number).isdigit() else day_number
+        if self.store_ready is None:
+            self.store_ready = asyncio.ensure_future(self.store.create(self.plan_id))
+        self.stats.scheduled += 1
+        task = asyncio.ensure_future(self._run(day_text, day_number, sent_text))
+        self.tasks.append(task)
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+        task.add_done_callback(lambda _: self._maybe_finish_store())
+        self.logger.info(f"[REPAIR] Day {day_number} scheduled in background for plan {self.plan_id}")
+
+    def _accepts(self, repaired, sent_text):
+        repaired_total = day_total_calories(repaired)
+        if repaired_total is None:
+            return False
+        # The repair must keep every meal (the LLM sometimes collapses a day into one)
+        if len(MEAL_HEADER_PATTERN.findall(repaired)) < len(MEAL_HEADER_PATTERN.findall(sent_text)):
+            return False
+        repaired_diff = abs(repaired_total - self.target_calories)
+        sent_total = day_total_calories(sent_text)
+        sent_diff = abs(sent_total - self.target_calories) if sent_total is not None else float("inf")
+        return repaired_diff <= REPAIR_CALORIE_TOLERANCE and repaired_diff < sent_diff
+
+    async def _run(self, day_text, day_number, sent_text):
+        started = time.perf_counter()
+        try:
+            async with _repair_slots:
+                repaired = await self.repair(day_text, day_number)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.failed += 1
+            self.logger.error(f"[REPAIR] Day {day_number} failed for plan {self.plan_id}: {e}")
+            return
+        finally:
+            self.stats.busy_ms += (time.perf_counter() - started) * 1000
+
+        if not repaired or not self._accepts(repaired, sent_text):
+            self.stats.rejected += 1
+            self.logger.warning(
+                f"[REPAIR] Day {day_number} rejected for plan {self.plan_id} "
+                f"(total {day_total_calories(repaired)} vs target {self.target_calories})"
+            )
+            return
+
+        self.stats.accepted += 1
+        self.ready.append((day_number, repaired))
+        self.changed.set()
+        await self.store_ready
+        record = json.dumps({"day": day_number, "text": repaired})
+        await self.store.append(self.plan_id, record.encode("utf-8"))
+        self.logger.info(f"[REPAIR] Day {day_number} accepted for plan {self.plan_id}")
+
+    def close(self):
+        """The plan is fully generated (or its stream went away); no more repairs will be scheduled."""
+        if not self.closed:
+            self.closed = True
+            self._maybe_finish_store()
+
+    def cancel(self):
+        """Nobody is left to receive the patches: stop the repairs still running. Returns how many."""
+        self.close()
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        self.stats.cancelled += len(pending)
+        if pending:
+            self.logger.info(f"[REPAIR] {len(pending)} repair(s) cancelled for plan {self.plan_id}")
+        return len(pending)
+
+    def _maybe_finish_store(self):
+        if self.closed and self.store_ready is not None and all(task.done() for task in self.tasks):
+            asyncio.ensure_future(self._finish_store())
+
+    async def _finish_store(self):
+        await self.store_ready
+        await self.store.finish(self.plan_id)
+
+    def take_ready(self):
+        """Patch events for repairs that finished since the last call (never blocks)."""
+        ready, self.ready = self.ready, []
+        self.changed.clear()
+        self.stats.streamed += len(ready)
+        return [patch_event(day_number, text) for day_number, text in ready]
+
+    async def drain(self, timeout=None):
+        """Yield patch events as the remaining repairs finish, for at most `timeout` seconds."""
+        deadline = time.monotonic() + (REPAIR_STREAM_WAIT_SECONDS if timeout is None else timeout)
+        while True:
+            for patch in self.take_ready():
+                yield patch
+            if all(task.done() for task in self.tasks):
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                pending = sum(1 for task in self.tasks if not task.done())
+                self.logger.info(f"[REPAIR] {pending} repair(s) still running for plan {self.plan_id}, "
+                                 f"available via /mealplan/patches")
+                return
+            try:
+                await asyncio.wait_for(self.changed.wait(), min(remaining, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def collect_patches(store, plan_id, wait):
+    """Accepted patches stored for a plan: (patches, done). Waits up to `wait` seconds for running repairs."""
+    status = await store.status(plan_id)
+    if status is None:
+        return None, False
+    patches = []
+
+    async def read_all():
+        try:
+            async for chunk in store.tail(plan_id):
+                patches.append(json.loads(chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk))
+        except PregenDropped:
+            pass  # Expired while being read: what was read is all there is
+
+    if status.get("done"):
+        await read_all()
+        return patches, True
+    try:
+        # A short minimum so already-stored patches are read even with wait=0
+        await asyncio.wait_for(read_all(), max(wait, 0.1))
+        done = True
+    except asyncio.TimeoutError:
+        done = False
+    return patches, done
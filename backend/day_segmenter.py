@@ -0,0 +1,163 @@
+import re
+from collections import namedtuple
+
+# ============================================================
+# INCREMENTAL DAY SEGMENTER - Splits the LLM token stream into days
+# ============================================================
+# The old loops did `buffer += token` and then re-ran the day/suggestion
+# regexes over the whole buffer for every token. The segmenter remembers how
+# far it has already scanned and only looks at the new text plus a short
+# overlap, so a marker split across tokens ("Da" + "y 3:") is still found.
+
+DAY_START_PATTERN = re.compile(r'Day \d+:')
+SUGGESTION_PATTERN = re.compile(r'END[-_\s]?OF[-_\s]?PLAN[-_\s]?SUGGESTION[:\s]*', re.IGNORECASE)
+
+# Longest marker we must be able to see across a token boundary.
+# "END-OF-PLAN-SUGGESTION" is 22 chars, "Day 123:" is 8.
+MARKER_OVERLAP = 32
+
+DAY = "day"
+SUGGESTION = "suggestion"
+
+SegmentEvent = namedtuple("SegmentEvent", ["kind", "text", "day_number"])
+
+
+class DaySegmenter:
+    """
+    Stateful scanner fed one token at a time.
+
+    feed() / close() return lists of SegmentEvent:
+      - ("day", day_text, n)       a complete "Day X:" block (n is 1-based emit order)
+      - ("suggestion", text, None) the END-OF-PLAN-SUGGESTION section, then every
+                                   later token as-is
+
+    Emission rules match the original /mealplan event_stream loop:
+      - a day is complete once the next "Day X:" marker arrives
+      - at most max_days days are emitted
+      - days found right before the suggestion marker are skipped if < 50 chars
+      - on close(), an unfinished last day 7 is dropped so the FALLBACK call regenerates it
+    """
+
+    def __init__(self, max_days=7, split_suggestion=True, drop_incomplete_last_day=True):
+        self.max_days = max_days
+        self.split_suggestion = split_suggestion
+        self.drop_incomplete_last_day = drop_incomplete_last_day
+
+        self.buffer = ""
+        self.day_count = 0
+        self.suggestion_mode = False
+
+        self._day_starts = []        # marker offsets in self.buffer not yet consumed
+        self._day_scan_pos = 0       # offset from which day markers still need scanning
+        self._suggestion_scan_pos = 0
+
+    # ------------------------------------------------------------
+    # Scanning helpers
+    # ------------------------------------------------------------
+    def _scan_day_markers(self):
+        """Find day markers in the unscanned tail, re-checking a short overlap."""
+        for match in DAY_START_PATTERN.finditer(self.buffer, self._day_scan_pos):
+            self._day_starts.append(match.start())
+        last_end = self._day_starts[-1] + 1 if self._day_starts else 0
+        self._day_scan_pos = max(last_end, len(self.buffer) - MARKER_OVERLAP, 0)
+
+    def _scan_suggestion(self):
+        match = SUGGESTION_PATTERN.search(self.buffer, self._suggestion_scan_pos)
+        if match:
+            return match
+        self._suggestion_scan_pos = max(len(self.buffer) - MARKER_OVERLAP, 0)
+        return None
+
+    def _all_day_starts(self, limit):
+        """Day markers before `limit`, including any the overlap window has not reached yet."""
+        self._scan_day_markers()
+        return [s for s in self._day_starts if s < limit]
+
+    def _consume(self, end):
+        """Drop buffer[:end] and shift the bookkeeping offsets."""
+        self.buffer = self.buffer[end:]
+        self._day_starts = [s - end for s in self._day_starts if s >= end]
+        self._day_scan_pos = max(self._day_scan_pos - end, 0)
+        self._suggestion_scan_pos = max(self._suggestion_scan_pos - end, 0)
+
+    def _emit_day(self, events, day_text):
+        self.day_count += 1
+        events.append(SegmentEvent(DAY, day_text, self.day_count))
+
+    # ------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------
+    def feed(self, token_text):
+        """Add one token and return the events it completes."""
+        events = []
+        if not token_text:
+            return events
+
+        # Everything after the suggestion marker is streamed through directly
+        if self.suggestion_mode:
+            events.append(SegmentEvent(SUGGESTION, token_text, None))
+            return events
+
+        self.buffer += token_text
+
+        if self.split_suggestion:
+            suggestion_match = self._scan_suggestion()
+            if suggestion_match:
+                self.suggestion_mode = True
+                idx = suggestion_match.start()
+
+                # Remaining complete days before the suggestion
+                day_starts = self._all_day_starts(idx)
+                for i, start in enumerate(day_starts):
+                    if self.day_count >= self.max_days:
+                        break
+                    end = day_starts[i + 1] if i + 1 < len(day_starts) else idx
+                    day_text = self.buffer[start:end]
+                    if len(day_text.strip()) < 50:
+                        continue
+                    self._emit_day(events, day_text)
+
+                events.append(SegmentEvent(SUGGESTION, self.buffer[idx:], None))
+                self.buffer = ""
+                self._day_starts = []
+                return events
+
+        # Emit complete days ONE AT A TIME as soon as we have 2 markers
+        self._scan_day_markers()
+        while self.day_count < self.max_days and len(self._day_starts) >= 2:
+            start, end = self._day_starts[0], self._day_starts[1]
+            self._emit_day(events, self.buffer[start:end])
+            self._consume(end)
+
+        return events
+
+    def close(self):
+        """Flush whatever is left in the buffer once the upstream stream ends."""
+        events = []
+        if self.suggestion_mode or not self.buffer.strip() or self.day_count >= self.max_days:
+            return events
+
+        self._scan_day_markers()
+        day_starts = list(self._day_starts)
+        pre_suggestion = self.buffer
+
+        # The last day is incomplete if it is short or lacks its "Total Daily" line
+        if (self.drop_incomplete_last_day and day_starts
+                and self.day_count == self.max_days - 1):
+            last_day_text = pre_suggestion[day_starts[-1]:]
+            if len(last_day_text) < 300 or "Total Daily" not in last_day_text:
+                day_starts = day_starts[:-1]
+
+        for i, start in enumerate(day_starts):
+            if self.day_count >= self.max_days:
+                break
+            end = day_starts[i + 1] if i + 1 < len(day_starts) else len(pre_suggestion)
+            day_text = pre_suggestion[start:end]
+            # Only skip segments that are truly empty or not a day at all
+            if len(day_text.strip()) < 20 or "Day" not in day_text:
+                continue
+            self._emit_day(events, day_text)
+
+        self.buffer = ""
+        self._day_starts = []
+        return events
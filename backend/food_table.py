@@ -0,0 +1,213 @@
+import csv
+import os
+import unicodedata
+from array import array
+
+# ============================================================
+# FOOD TABLE - Bundled nutrition reference with fast name lookup
+# ============================================================
+# data/foods.csv holds per-100 g (per-100 ml for basis "ml") calories and
+# macros for the foods our plans use, rounded from USDA FoodData Central and
+# IFCT reference values, plus standard weights for serving units
+# ("egg:50;large:50", "piece:40", "cup:195"). One row per food; aliases
+# (roti|chapati|phulka) point at the same row.
+#
+# Loaded lazily on the first get_food_table() call, so importing this module
+# costs nothing at worker startup. Values live in flat arrays indexed by row;
+# names map to rows through one dict, and fuzzy matches (cooking words
+# dropped, then the longest known food contained in the name) are memoized,
+# so a repeated lookup is a single dict hit.
+#
+# Plain stdlib on purpose: groccery-backend.py imports it as
+# backend.food_table without the rest of the backend.
+
+FOOD_TABLE_PATH = os.getenv(
+    "FOOD_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+)
+MAX_MEMO_SIZE = 20000  # Distinct raw names remembered (hits and misses)
+
+# Preparation words that don't change which food it is
+DESCRIPTORS = frozenset((
+    "grilled", "baked", "steamed", "roasted", "sauteed", "boiled", "poached", "fried", "stir", "fry", "hard",
+    "soft", "fresh", "raw", "cooked", "sliced", "chopped", "diced", "plain", "lean", "low", "fat",
+    "nonfat", "unsweetened", "organic", "homemade", "light", "spiced", "seasoned", "mashed", "whole",
+))
+STOP_WORDS = frozenset(("and", "with", "of", "in", "made", "a", "the", "on", "style"))
+WEIGHT_UNITS = {"g": 1.0, "gram": 1.0, "grams": 1.0, "ml": 1.0, "milliliter": 1.0, "milliliters": 1.0, "oz": 28.35}
+UNIT_ALIASES = {"pieces": "piece", "pc": "piece", "pcs": "piece", "unit": "piece", "units": "piece",
+                "eggs": "egg", "slices": "slice", "cups": "cup", "servings": "serving", "scoops": "scoop"}
+
+
+def singular(word):
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def food_words(name):
+    """'Sautéed Cherry Tomatoes (halved)' -> ['sauteed', 'cherry', 'tomato']."""
+    text = unicodedata.normalize("NFKD", str(name).lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    depth = 0
+    kept = []
+    for ch in text:  # Drop parentheticals and anything that isn't a letter
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(0, depth - 1)
+        elif not depth:
+            kept.append(ch if "a" <= ch <= "z" else " ")
+    return [singular(word) for word in "".join(kept).split()]
+
+
+def normalize_food_name(name):
+    return " ".join(food_words(name))
+
+
+class FoodTable:
+    def __init__(self, rows):
+        self.names = []
+        self.basis = []
+        self.kcal = array("d")      # Per 100 g / 100 ml
+        self.protein = array("d")
+        self.fat = array("d")
+        self.carbs = array("d")
+        self.servings = []          # Per row: {unit: grams}
+        self.by_name = {}           # Normalized name or alias -> row
+        self.by_words = []          # (word set, row) of every name and alias, for fuzzy matching
+        self.memo = {}              # Raw name -> row or -1
+        self.checked = 0            # process_single_day items compared with the table
+        self.mismatches = 0         # ... whose stated kcal were outside tolerance
+        self.corrections = 0        # ... and were replaced (FOOD_TABLE=correct)
+        for row in rows:
+            index = len(self.names)
+            self.names.append(row["name"])
+            self.basis.append(row["basis"])
+            self.kcal.append(float(row["kcal"]))
+            self.protein.append(float(row["protein"]))
+            self.fat.append(float(row["fat"]))
+            self.carbs.append(float(row["carbs"]))
+            self.servings.append({
+                unit: float(grams)
+                for unit, grams in (entry.split(":") for entry in row["servings"].split(";") if entry)
+            })
+            for alias in [row["name"]] + [a for a in row["aliases"].split("|") if a]:
+                key = normalize_food_name(alias)
+                self.by_name.setdefault(key, index)
+                self.by_words.append((frozenset(key.split()), index))
+        # Longest names first so "chickpea curry" wins over "chickpea"
+        self.by_words.sort(key=lambda entry: -len(entry[0]))
+
+    @classmethod
+    def load(cls, path=FOOD_TABLE_PATH):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls(list(csv.DictReader(f)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self, name):
+        """Row of the food `name` refers to, or -1."""
+        row = self.memo.get(name)
+        if row is None:
+            row = self._match(name)
+            if len(self.memo) >= MAX_MEMO_SIZE:
+                self.memo.clear()
+            self.memo[name] = row
+        return row
+
+    def _match(self, name):
+        words = food_words(name)
+        row = self.by_name.get(" ".join(words))
+        if row is not None:
+            return row
+        core = [w for w in words if w not in DESCRIPTORS and w not in STOP_WORDS]
+        row = self.by_name.get(" ".join(core))
+        if row is not None:
+            return row
+        if not core:
+            return -1
+        # The longest known food whose words all appear in the name; on a tie
+        # prefer the one containing the last word ("lentil and chickpea curry")
+        present = set(core)
+        best, best_size = -1, 0
+        for food, index in self.by_words:
+            if len(food) < best_size:
+                break
+            if food <= present:
+                if core[-1] in food:
+                    return index
+                if best < 0:
+                    best, best_size = index, len(food)
+        return best
+
+    def unit_grams(self, row, unit):
+        """Grams (ml) in one `unit` of the food, or None if that unit has no standard weight."""
+        unit = str(unit).lower().strip()
+        if unit in WEIGHT_UNITS:
+            return WEIGHT_UNITS[unit]
+        unit = UNIT_ALIASES.get(unit, unit)
+        servings = self.servings[row]
+        return servings.get(unit) or (servings.get("serving") if unit == "piece" else None)
+
+    def serving_weight(self, name, unit):
+        """(amount, "g" or "ml") in one `unit` of food `name` ("slice" of bread -> (32.0, "g")), or None."""
+        row = self.find(name)
+        amount = self.unit_grams(row, unit) if row >= 0 else None
+        return (amount, self.basis[row]) if amount is not None else None
+
+    def per_unit(self, name, unit):
+        """(kcal, protein, fat, carbs) in one `unit` of food `name`, or None if unknown."""
+        row = self.find(name)
+        if row < 0:
+            return None
+        grams = self.unit_grams(row, unit)
+        if grams is None:
+            return None
+        factor = grams / 100.0
+        return (self.kcal[row] * factor, self.protein[row] * factor,
+                self.fat[row] * factor, self.carbs[row] * factor)
+
+    def drain(self):
+        """checked/mismatches/corrections counted since the last drain, reset here - a pool worker's share for its parent."""
+        counters = {"checked": self.checked, "mismatches": self.mismatches, "corrections": self.corrections}
+        self.checked = self.mismatches = self.corrections = 0
+        return counters
+
+    def absorb(self, counters):
+        """Take over what drain() returned in a pool worker."""
+        for name, value in counters.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def stats(self):
+        return {
+            "foods": len(self.names),
+            "names": len(self.by_name),
+            "memoized": len(self.memo),
+            "memo_misses": sum(1 for row in self.memo.values() if row < 0),
+            "checked": self.checked,
+            "mismatches": self.mismatches,
+            "corrections": self.corrections,
+        }
+
+
+_table = None
+
+
+def get_food_table():
+    """Process-wide table at FOOD_TABLE_PATH, loaded on first use."""
+    global _table
+    if _table is None:
+        _table = FoodTable.load()
+    return _table
+
+
+def drain_food_table():
+    """drain() of the process-wide table, or None if this process never loaded it."""
+    return _table.drain() if _table is not None else None
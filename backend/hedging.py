@@ -0,0 +1,231 @@
+import asyncio
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from loop_monitor import percentile
+from upstream import StreamWrapper, chunk_content, close_upstream
+
+# ============================================================
+# HEDGED REQUESTS - Race a second plan stream when the first token is late
+# ============================================================
+# /mealplan's tail latency is mostly the odd completion whose first token
+# takes several times the usual TTFT. With hedging on (MEALPLAN_HEDGE=on or
+# "hedge": true in the body), the main stream is created, and if no content
+# token has arrived after the current p90 TTFT, an identical second call is
+# fired; whichever produces a token first is used and the other is closed.
+#
+# HEDGE_BUDGET caps the extra calls: every request earns that many credits
+# (at most HEDGE_BURST banked) and a hedge spends one, so at most ~20% of
+# requests are doubled however slow the provider gets. A p90 trigger fires on
+# ~10% of requests from ordinary jitter alone, so the budget has to sit above
+# that for the slow tail to get hedged at all. The p90 comes from the last
+# HEDGE_WINDOW first-token times of this process's primary calls; a primary
+# that lost to its hedge counts with the time it had waited by then, so slow
+# calls are not left out of the sample and the p90 does not drift down.
+#
+# Given the client, the hedger hands create() a SendTimer proxy of it, and
+# both the hedge delay and the first-token samples run from the moment the
+# request is actually sent. A call queued for a scheduler slot or the rate
+# governor is not late, and a second call would only queue behind it.
+
+HEDGE_MODE = os.getenv("MEALPLAN_HEDGE", "off").lower()
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.2"))
+HEDGE_BURST = 5
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.9"))
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))  # Until HEDGE_MIN_SAMPLES are in
+HEDGE_MIN_DELAY = 0.25
+HEDGE_MAX_DELAY = 10.0
+
+
+def resolve_hedge(data):
+    value = data.get("hedge")
+    if value is None:
+        return HEDGE_MODE == "on"
+    return str(value).lower() in ("1", "true", "on", "yes")
+
+
+class HedgeStats:
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0           # Second calls fired (the extra spend)
+        self.hedge_won = 0        # ... that delivered the first token
+        self.budget_denied = 0    # Late first tokens that were not hedged for lack of budget
+        self.ttft = deque(maxlen=HEDGE_WINDOW)  # As delivered, from the first create()
+
+    def as_dict(self, delay):
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_won": self.hedge_won,
+            "budget_denied": self.budget_denied,
+            "delay_s": round(delay, 2),
+            "ttft_p50_s": round(percentile(self.ttft, 50), 2),
+            "ttft_p99_s": round(percentile(self.ttft, 99), 2),
+        }
+
+
+class SendTimer:
+    """Client proxy noting when the scheduler actually sends the request (after slot and budget waits)."""
+
+    def __init__(self, client):
+        self.sent = asyncio.Event()
+        self.sent_at = None
+        completions = client.chat.completions
+        raw = getattr(completions, "with_raw_response", None)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=self._wrap(completions.create),
+            with_raw_response=SimpleNamespace(create=self._wrap(raw.create)) if raw is not None else None,
+        ))
+
+    def _wrap(self, create):
+        async def call(**kwargs):
+            self.sent_at = time.perf_counter()
+            self.sent.set()
+            return await create(**kwargs)
+        return call
+
+    def elapsed(self):
+        return time.perf_counter() - self.sent_at if self.sent_at is not None else None
+
+
+class FirstToken:
+    """A stream whose chunks up to (and including) the first content chunk were read ahead."""
+
+    def __init__(self, stream, iterator, buffered, started, ended):
+        self.stream = stream
+        self.iterator = iterator
+        self.buffered = buffered
+        self.ttft = time.perf_counter() - started
+        self.ended = ended
+
+
+async def read_first_token(create, timer=None):
+    """await create() and read up to its first content chunk; ttft counts from timer's send, else from this call."""
+    started = time.perf_counter()
+    stream = await create()
+    if timer is not None and timer.sent_at is not None:
+        started = timer.sent_at
+    iterator = stream.__aiter__()
+    buffered = []
+    try:
+        while True:
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return FirstToken(stream, iterator, buffered, started, ended=True)
+            buffered.append(chunk)
+            if chunk_content(chunk):
+                return FirstToken(stream, iterator, buffered, started, ended=False)
+    except BaseException:
+        await close_upstream(stream)  # Lost the race or failed: release it
+        raise
+
+
+class HedgedStream(StreamWrapper):
+    """The winning stream: read-ahead chunks first, then the rest; close() closes it."""
+
+    def __init__(self, first):
+        super().__init__(first.stream)
+        self.first = first
+
+    async def _iterate(self):
+        for chunk in self.first.buffered:
+            yield chunk
+        if self.first.ended:
+            return
+        async for chunk in self.first.iterator:
+            yield chunk
+
+
+class Hedger:
+    def __init__(self, budget=HEDGE_BUDGET, quantile=HEDGE_QUANTILE, logger=None):
+        self.budget = budget
+        self.quantile = quantile
+        self.credits = float(HEDGE_BURST)
+        self.samples = deque(maxlen=HEDGE_WINDOW)  # First-token times of primary calls (a lower bound if hedged)
+        self.stats = HedgeStats()
+        self.logger = logger
+
+    def delay(self):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, percentile(self.samples, self.quantile * 100)))
+
+    def _attempt(self, create, client):
+        if client is None:
+            return None, asyncio.ensure_future(read_first_token(create))
+        timer = SendTimer(client)
+        return timer, asyncio.ensure_future(read_first_token(lambda: create(timer), timer))
+
+    async def create(self, create, hedge=True, client=None):
+        """
+        await create() -> a completion stream, hedged when `hedge` and its
+        first token is late. Returns a HedgedStream; the caller closes it.
+
+        With `client`, create(client) is called with a SendTimer of it and
+        lateness counts from the send instead of from the create() call.
+        """
+        self.stats.requests += 1
+        self.credits = min(HEDGE_BURST, self.credits + self.budget)
+        started = time.perf_counter()
+        timer, primary = self._attempt(create, client)
+        tasks = [primary]
+        try:
+            if hedge and timer is not None:
+                sent = asyncio.ensure_future(timer.sent.wait())
+                try:
+                    await asyncio.wait({primary, sent}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sent.cancel()
+            delay = self.delay()
+            done, _ = await asyncio.wait(tasks, timeout=delay if hedge else None)
+            if not done:
+                if self.credits >= 1:
+                    self.credits -= 1
+                    self.stats.hedged += 1
+                    if self.logger is not None:
+                        self.logger.info(f"[HEDGE] No token after {delay:.2f}s (p{int(self.quantile * 100)}), "
+                                         f"sending a second request")
+                    tasks.append(self._attempt(create, client)[1])
+                else:
+                    self.stats.budget_denied += 1
+            winner = await self._first_success(tasks)
+            decided = time.perf_counter()
+            primary_failed = primary.done() and primary.exception() is not None
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            await asyncio.gather(*losers, return_exceptions=True)  # Their streams are closed on the way out
+        for task in tasks:
+            if task is not winner and task.done() and not task.cancelled() and task.exception() is None:
+                await close_upstream(task.result().stream)  # Finished in the same tick as the winner
+        first = winner.result()
+        if winner is primary:
+            self.samples.append(first.ttft)
+        else:
+            self.stats.hedge_won += 1
+            if not primary_failed:
+                # The primary had no token yet: its TTFT was at least this long
+                self.samples.append(decided - (timer.sent_at if timer is not None and timer.sent_at else started))
+        self.stats.ttft.append(time.perf_counter() - started)
+        return HedgedStream(first)
+
+    async def _first_success(self, tasks):
+        """The first task to finish without an error; the first error if all of them fail."""
+        pending = set(tasks)
+        first_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is None:
+                    return task
+                first_error = first_error or task
+        return first_error  # .result() re-raises its exception
+
+    def stats_dict(self):
+        return self.stats.as_dict(self.delay())
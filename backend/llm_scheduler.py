@@ -0,0 +1,379 @@
+import asyncio
+import contextvars
+import inspect
+import os
+import time
+from types import SimpleNamespace
+
+from rate_governor import RateLimitShed, estimate_cost, estimate_prompt_tokens
+from upstream import StreamWrapper, chunk_content
+
+# ============================================================
+# LLM SCHEDULER - One queue in front of every Groq call
+# ============================================================
+# Interactive plan streams, prep stages (curator / dietary rules), quantity
+# repairs and speculative pre-generation all share one provider quota. Every
+# call takes a slot of its priority class first:
+#
+#   interactive   /mealplan, /workoutplan and /chat streams
+#   prep          curator and dietary-rules calls
+#   repair        fix_quantities_with_llm
+#   speculative   everything a /user pre-generation does
+#
+# Each class has its own concurrency limit, and LLM_MAX_CONCURRENT caps the
+# total. Free slots go to waiting classes in priority order; a class blocked
+# by the total limit also blocks the classes below it, one blocked by its own
+# limit does not. A stream holds its slot until it ends or is closed.
+#
+# Pre-generation runs under a SpeculativeWork ticket (a context variable, so
+# the prep-stage tasks it starts inherit it): all its calls are queued as
+# speculative, and when interactive demand reaches LLM_PREEMPT_INTERACTIVE_AT
+# (or an interactive call has to wait) the newest ticket with a call in
+# flight is preempted - its cancel callback deletes the pre-generation. A
+# ticket is promoted once /mealplan starts reading it: it can no longer be
+# preempted and its remaining calls use their own class. A reader on another
+# worker promotes it through the pre-generation store; a cancel callback that
+# finds it promoted there declines the preemption with promote(key, work). Work shared with
+# other requests (a stage-cache fill) runs in detached_context(), outside
+# the ticket.
+#
+# With a RateGovernor, a call that got its slot is then admitted against the
+# provider's RPM/TPM budget (see rate_governor.py); speculative work whose
+# call is shed there is preempted the same way.
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREP = 1
+PRIORITY_REPAIR = 2
+PRIORITY_SPECULATIVE = 3
+PRIORITY_NAMES = ("interactive", "prep", "repair", "speculative")
+
+LLM_SCHEDULER_MODE = os.getenv("LLM_SCHEDULER", "on").lower()  # "off": calls pass straight through
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "48"))
+LLM_CLASS_LIMITS = (
+    int(os.getenv("LLM_LIMIT_INTERACTIVE", "32")),
+    int(os.getenv("LLM_LIMIT_PREP", "16")),
+    int(os.getenv("LLM_LIMIT_REPAIR", "4")),
+    int(os.getenv("LLM_LIMIT_SPECULATIVE", "4")),
+)
+LLM_PREEMPT_INTERACTIVE_AT = int(os.getenv("LLM_PREEMPT_INTERACTIVE_AT", str(LLM_CLASS_LIMITS[0] * 3 // 4)))
+
+_current_work = contextvars.ContextVar("llm_speculative_work", default=None)
+_preempting = set()  # Strong references to running cancel callbacks
+
+
+def detached_context():
+    """A copy of the current context outside any SpeculativeWork, for a call that several requests share."""
+    context = contextvars.copy_context()
+    context.run(_current_work.set, None)
+    return context
+
+
+class SpeculativeWork:
+    def __init__(self, key, cancel):
+        self.key = key
+        self.cancel = cancel      # async callable that stops the work
+        self.started = time.monotonic()
+        self.in_flight = 0        # Slots its calls hold right now
+        self.promoted = False
+        self.preempted = False
+
+
+class ClassStats:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self.queued = 0           # Calls that had to wait for a slot
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def as_dict(self, waiting):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak": self.peak,
+            "waiting": waiting,
+            "calls": self.calls,
+            "queued": self.queued,
+            "avg_wait_ms": round(self.wait_ms / self.calls, 1) if self.calls else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+def stream_usage(chunk):
+    """total_tokens of a stream chunk's usage (OpenAI: chunk.usage, Groq: chunk.x_groq.usage), else None."""
+    usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class ScheduledStream(StreamWrapper):
+    """
+    A completion stream holding a scheduler slot; the slot is released when it
+    ends or is closed. A governed stream is settled at the same point, with
+    the usage its last chunk reported or the content chunks it delivered.
+    """
+
+    def __init__(self, stream, release, settle=None):
+        super().__init__(stream)
+        self._release = release
+        self._settle = settle     # async callable(total_tokens or None, content_chunks)
+        self.total_tokens = None
+        self.content_chunks = 0
+
+    async def _iterate(self):
+        try:
+            async for chunk in self.stream:
+                if chunk_content(chunk):
+                    self.content_chunks += 1
+                self.total_tokens = stream_usage(chunk) or self.total_tokens
+                yield chunk
+        finally:
+            self.release()
+            await self.settle()
+
+    def release(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+    async def settle(self):
+        if self._settle is not None:
+            settle, self._settle = self._settle, None
+            await settle(self.total_tokens, self.content_chunks)
+
+    async def close(self):
+        self.release()
+        await super().close()
+        await self.settle()
+
+
+class LLMScheduler:
+    def __init__(self, limits=LLM_CLASS_LIMITS, max_concurrent=LLM_MAX_CONCURRENT,
+                 preempt_at=LLM_PREEMPT_INTERACTIVE_AT, enabled=LLM_SCHEDULER_MODE != "off", logger=None,
+                 governor=None):
+        self.enabled = enabled
+        self.governor = governor             # RateGovernor: admits each call against the RPM/TPM budget
+        self.max_concurrent = max_concurrent
+        self.preempt_at = preempt_at
+        self.logger = logger
+        self.classes = [ClassStats(limit) for limit in limits]
+        self.queues = [[] for _ in limits]   # FIFO of futures per class
+        self.in_flight = 0
+        self.work = {}                       # key -> SpeculativeWork
+        self.preempted = 0
+        self.promoted = 0
+
+    # ------------------------------------------------------------
+    # Calls
+    # ------------------------------------------------------------
+    def effective_priority(self, priority):
+        work = _current_work.get()
+        if work is not None and not work.promoted:
+            return max(priority, PRIORITY_SPECULATIVE)
+        return priority
+
+    async def create(self, client, priority, **kwargs):
+        """client.chat.completions.create(**kwargs) under a slot of `priority` (PRIORITY_*)."""
+        if not self.enabled:
+            if self.governor is not None and self.governor.enabled:
+                response, settle = await self._governed(client, self.effective_priority(priority), kwargs)
+                return ScheduledStream(response, None, settle) if settle is not None else response
+            return await client.chat.completions.create(**kwargs)
+        priority = self.effective_priority(priority)
+        work = _current_work.get()
+        await self._acquire(priority)
+        if work is not None:
+            work.in_flight += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                if work is not None:
+                    work.in_flight -= 1
+                self._release(priority)
+
+        settle = None
+        try:
+            if self.governor is not None and self.governor.enabled:
+                response, settle = await self._governed(client, priority, kwargs)
+            else:
+                response = await client.chat.completions.create(**kwargs)
+        except RateLimitShed:
+            release()
+            if work is not None and not work.promoted:
+                self._preempt(work, "shed by the rate governor")  # Don't keep a half-generated plan
+            raise
+        except BaseException:
+            release()
+            raise
+        if kwargs.get("stream"):
+            return ScheduledStream(response, release, settle)
+        release()
+        return response
+
+    async def _governed(self, client, priority, kwargs):
+        """
+        Admit the call against the rate-limit budget, send it and feed the
+        response headers back. Returns (response, settle): a response is
+        settled here from its usage, a stream gets `settle` to call when it ends.
+        """
+        cost = estimate_cost(kwargs)
+        await self.governor.admit(priority, cost)
+        raw_create = getattr(getattr(client.chat.completions, "with_raw_response", None), "create", None)
+        try:
+            if raw_create is None:  # Test doubles without raw responses
+                response = await client.chat.completions.create(**kwargs)
+            else:
+                raw = await raw_create(**kwargs)
+                await self.governor.observe(raw.headers)
+                response = raw.parse()
+                if inspect.isawaitable(response):
+                    response = await response
+        except Exception as e:
+            await self.governor.observe_error(e)
+            raise
+        if kwargs.get("stream"):
+            async def settle(total_tokens, content_chunks):
+                # No usage chunk (cut short): a content chunk is about one token
+                used = total_tokens if total_tokens is not None else estimate_prompt_tokens(kwargs) + content_chunks
+                await self.governor.settle(cost, used)
+
+            return response, settle
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            await self.governor.settle(cost, getattr(usage, "total_tokens", None))
+        return response, None
+
+    def bind(self, client, priority):
+        """Client-shaped view whose chat.completions.create() goes through this scheduler."""
+        return BoundClient(self, client, priority)
+
+    # ------------------------------------------------------------
+    # Slots
+    # ------------------------------------------------------------
+    def _can_start(self, priority):
+        return self.classes[priority].in_flight < self.classes[priority].limit and self.in_flight < self.max_concurrent
+
+    def _grant(self, priority):
+        stats = self.classes[priority]
+        stats.in_flight += 1
+        stats.peak = max(stats.peak, stats.in_flight)
+        self.in_flight += 1
+
+    def _record_wait(self, priority, started):
+        stats = self.classes[priority]
+        wait_ms = (time.perf_counter() - started) * 1000
+        stats.calls += 1
+        stats.wait_ms += wait_ms
+        stats.max_wait_ms = max(stats.max_wait_ms, wait_ms)
+
+    async def _acquire(self, priority):
+        started = time.perf_counter()
+        # Waiters of this or a higher class go first
+        ahead = any(self.queues[p] for p in range(priority + 1))
+        if priority == PRIORITY_INTERACTIVE:
+            demand = self.classes[priority].in_flight + len(self.queues[priority]) + 1
+            if ahead or not self._can_start(priority) or demand >= self.preempt_at:
+                self._preempt_one()
+        if not ahead and self._can_start(priority):
+            self._grant(priority)
+            self._record_wait(priority, started)
+            return
+        self.classes[priority].queued += 1
+        waiter = asyncio.get_event_loop().create_future()
+        self.queues[priority].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(priority)  # Granted just as the caller went away
+            elif waiter in self.queues[priority]:
+                self.queues[priority].remove(waiter)
+            raise
+        self._record_wait(priority, started)
+
+    def _release(self, priority):
+        self.classes[priority].in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for priority, queue in enumerate(self.queues):
+            while queue and self._can_start(priority):
+                waiter = queue.pop(0)
+                if waiter.done():
+                    continue
+                self._grant(priority)
+                waiter.set_result(None)
+            if queue and self.in_flight >= self.max_concurrent:
+                return  # Lower classes must not take the slot this class is waiting for
+
+    # ------------------------------------------------------------
+    # Speculative work
+    # ------------------------------------------------------------
+    def start_speculative(self, key, cancel):
+        """Run the calls of the current task (and tasks it starts) as preemptible speculative work."""
+        work = SpeculativeWork(key, cancel)
+        self.work[key] = work
+        _current_work.set(work)
+        return work
+
+    def end_speculative(self, key):
+        self.work.pop(key, None)
+
+    def promote(self, key, work=None):
+        """A client is waiting on this work: stop treating it as speculative (`work`: a ticket already preempted)."""
+        work = work or self.work.get(key)
+        if work is not None and not work.promoted:
+            if work.preempted:  # Its cancel callback declined: the work goes on
+                work.preempted = False
+                self.preempted -= 1
+                self.work[key] = work
+            work.promoted = True
+            self.promoted += 1
+
+    def _preempt_one(self):
+        candidates = [w for w in self.work.values() if w.in_flight and not w.promoted and not w.preempted]
+        if candidates:
+            work = max(candidates, key=lambda w: w.started)  # Newest: least progress lost
+            self._preempt(work, f"{self.classes[PRIORITY_INTERACTIVE].in_flight} interactive in flight")
+
+    def _preempt(self, work, reason):
+        if work.preempted:
+            return
+        work.preempted = True
+        self.preempted += 1
+        self.work.pop(work.key, None)
+        if self.logger is not None:
+            self.logger.info(f"[LLM_SCHEDULER] Preempted speculative work {work.key} ({reason})")
+        task = asyncio.ensure_future(work.cancel())
+        _preempting.add(task)
+        task.add_done_callback(_preempting.discard)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "classes": {
+                name: stats.as_dict(len(queue))
+                for name, stats, queue in zip(PRIORITY_NAMES, self.classes, self.queues)
+            },
+            "speculative_running": len(self.work),
+            "preempted": self.preempted,
+            "promoted": self.promoted,
+        }
+
+
+class BoundClient:
+    def __init__(self, scheduler, client, priority):
+        self.scheduler = scheduler
+        self.client = client
+        self.priority = priority
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        return await self.scheduler.create(self.client, self.priority, **kwargs)
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from collections import deque
+
+# ============================================================
+# EVENT LOOP LAG MONITOR - How late the loop runs scheduled callbacks
+# ============================================================
+# A background task sleeps for `interval` and records how much later than
+# requested it woke up. Sustained lag means something is blocking the loop
+# (sync work in a handler, a slow regex on a big buffer, ...) and every
+# open stream stalls for that long.
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.1, window=600):
+        self.interval = interval
+        self.samples = deque(maxlen=window)  # Lag in ms, most recent `window` ticks
+        self.max_lag_ms = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - started - self.interval) * 1000)
+            self.samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def stats(self):
+        samples = list(self.samples)
+        return {
+            "samples": len(samples),
+            "p50": round(percentile(samples, 50), 2),
+            "p99": round(percentile(samples, 99), 2),
+            "max": round(self.max_lag_ms, 2),
+        }
@@ -0,0 +1,136 @@
+import numpy as np
+
+# ============================================================
+# MACRO SOLVER - One-shot bounded weighted least squares for item quantities
+# ============================================================
+# The legacy STEP 2 loop in process_single_day nudges quantities one macro at
+# a time with per-item caps for up to 10 iterations. Here the adjustable
+# gram/ml items are a quantity vector x, their densities a 4 x n matrix A
+# (kcal, protein, fat, carbs per g), and we solve
+#
+#     min  || W (A x + fixed - target) ||^2  +  reg * || (x - x0) / x0 ||^2
+#     s.t. lo <= x <= hi
+#
+# in one go. W scales each row by its tolerance (±100 kcal, ±5% macros) and by
+# priority (calories > protein > fat = carbs); the small regulariser keeps
+# portions close to what the LLM wrote when the targets leave freedom. The
+# result is snapped to the 5 g grid points inside each item's bounds, with a
+# greedy ±5 g search so rounding does not undo the fit.
+
+DENSITY_KEYS = ("cal_density", "protein_density", "fat_density", "carbs_density")
+
+PRIORITY = np.array([4.0, 2.0, 1.0, 1.0])  # calories > protein > fat = carbs
+REGULARIZATION = 0.05
+GRID = 5.0
+
+
+def tolerances(targets):
+    """Per-row tolerance used to normalise residuals (same bands as the legacy loop)."""
+    calories, protein, fat, carbs = targets
+    return np.array([
+        100.0,
+        max(5.0, protein * 0.05),
+        max(3.0, fat * 0.05),
+        max(5.0, carbs * 0.05),
+    ])
+
+
+def bvls(A, b, lo, hi, max_iter=None):
+    """
+    Bounded-variable least squares: min ||A x - b|| s.t. lo <= x <= hi.
+
+    Active-set method (Stark & Parker): start with every variable at the
+    bound closest to the unconstrained optimum's side, free the variable whose
+    gradient most wants to leave its bound, solve for the free set, and step
+    back to the feasible box when the solution leaves it.
+    """
+    n = A.shape[1]
+    max_iter = max_iter or 4 * n + 10
+    x = np.clip(np.zeros(n), lo, hi)
+    free = np.zeros(n, dtype=bool)
+
+    for _ in range(max_iter):
+        grad = A.T @ (b - A @ x)  # Negative gradient of 0.5 * ||Ax - b||^2
+        # A bound variable may leave only in the feasible direction
+        can_leave = (~free) & (((x <= lo) & (grad > 1e-9)) | ((x >= hi) & (grad < -1e-9)))
+        if not can_leave.any():
+            break
+        free[np.argmax(np.where(can_leave, np.abs(grad), -1))] = True
+
+        while True:
+            z = x.copy()
+            rhs = b - A[:, ~free] @ x[~free]
+            z[free] = np.linalg.lstsq(A[:, free], rhs, rcond=None)[0]
+            inside = (z[free] > lo[free]) & (z[free] < hi[free])
+            if inside.all():
+                x = z
+                break
+            # Step from x towards z until the first free variable hits a bound
+            direction = z - x
+            with np.errstate(divide="ignore", invalid="ignore"):
+                to_lo = np.where(direction < 0, (lo - x) / direction, np.inf)
+                to_hi = np.where(direction > 0, (hi - x) / direction, np.inf)
+            step = np.min(np.where(free, np.minimum(to_lo, to_hi), np.inf))
+            x = x + max(0.0, min(1.0, step)) * direction
+            at_bound = free & ((x <= lo + 1e-9) | (x >= hi - 1e-9))
+            x = np.clip(x, lo, hi)
+            free &= ~at_bound
+            if not free.any():
+                break
+    return np.clip(x, lo, hi)
+
+
+def solve_quantities(items, targets, fixed_totals, bounds, regularization=REGULARIZATION):
+    """
+    Return new quantities for `items` (adjustable gram/ml utils.MealItem objects).
+
+    targets       (calories, protein, fat, carbs) for the whole day; 0 = no target
+    fixed_totals  same four sums for the items that are not adjustable
+    bounds        [(lo, hi)] per item, e.g. from get_min_quantity/get_max_quantity
+    """
+    if not items:
+        return []
+    A = np.array([[getattr(item, key) for item in items] for key in DENSITY_KEYS])
+    t = np.asarray(targets, dtype=float)
+    fixed = np.asarray(fixed_totals, dtype=float)
+    x0 = np.array([max(item.gpt_quantity or item.quantity, 1.0) for item in items])
+    lo = np.array([b[0] for b in bounds], dtype=float)
+    hi = np.array([b[1] for b in bounds], dtype=float)
+
+    weights = np.where(t > 0, PRIORITY / tolerances(t), 0.0)
+    system = np.vstack([weights[:, None] * A, np.diag(np.sqrt(regularization) / x0)])
+    rhs = np.concatenate([weights * (t - fixed), np.sqrt(regularization) * np.ones(len(items))])
+    x = bvls(system, rhs, lo, hi)
+
+    return list(snap_to_grid(x, A, weights, t - fixed, lo, hi))
+
+
+def snap_to_grid(x, A, weights, goal, lo, hi, passes=3):
+    """
+    Round to the GRID g points inside [lo, hi], then greedily move single
+    items by ±GRID (staying on those points) while the weighted error drops.
+    An item whose range holds no grid point keeps its clipped value.
+    """
+    grid_lo = np.maximum(GRID, np.ceil(lo / GRID - 1e-9) * GRID)
+    grid_hi = np.floor(hi / GRID + 1e-9) * GRID
+    on_grid = grid_lo <= grid_hi
+    x = np.where(on_grid, np.clip(np.round(x / GRID) * GRID, grid_lo, grid_hi), np.clip(x, lo, hi))
+    WA = weights[:, None] * A
+    residual = WA @ x - weights * goal
+    best = float(residual @ residual)
+    for _ in range(passes):
+        improved = False
+        for i in range(len(x)):
+            for delta in (GRID, -GRID):
+                candidate = x[i] + delta
+                if not on_grid[i] or candidate < grid_lo[i] or candidate > grid_hi[i]:
+                    continue
+                moved = residual + delta * WA[:, i]
+                err = float(moved @ moved)
+                if err < best - 1e-9:
+                    x[i], residual, best = candidate, moved, err
+                    improved = True
+                    break
+        if not improved:
+            break
+    return x
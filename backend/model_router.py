@@ -0,0 +1,327 @@
+import asyncio
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from hedging import HedgedStream, SendTimer, read_first_token
+from loop_monitor import percentile
+from rate_governor import RateLimitShed
+from upstream import chunk_content
+
+# ============================================================
+# MODEL ROUTER - Per-call-site model chains behind a circuit breaker
+# ============================================================
+# Every Groq call names a call site instead of a model. A site has a chain
+# of models (MODEL_ROUTE_<SITE>="model-a,model-b") and a deadline
+# (MODEL_DEADLINE_<SITE>, seconds; 0 = none) counted from when the request
+# is actually sent (after the scheduler slot and the rate budget): to the
+# first content token for streams, to the whole response otherwise.
+#
+# The first model whose circuit is not open is tried; an error or a missed
+# deadline counts against that model and the next one in the chain is tried.
+# Each attempt is its own scheduler.create(): the failed call's slot is
+# released, and the next model queues for a new slot of the same priority
+# and a new rate-budget reservation (it is a separate provider call; its
+# deadline again starts once it is sent).
+#
+# Per model the router keeps the outcomes of its last ROUTER_WINDOW calls,
+# TTFTs and decode speed. A circuit opens after ROUTER_CONSECUTIVE_FAILURES
+# failures in a row, or when ROUTER_ERROR_RATE of a window of at least
+# ROUTER_MIN_CALLS failed. After ROUTER_COOLDOWN seconds one probe call is let
+# through (half-open): it closes the circuit or opens it again. When every
+# model of a chain is open, the first one is tried anyway.
+#
+# Client errors (bad request, auth) are raised as-is: another model would not
+# fix them and they say nothing about the model's health. Each routed call
+# logs its decision ([MODEL_ROUTE]) to the request's log.
+
+LLM_ROUTING = os.getenv("LLM_ROUTING", "on").lower()  # "off": the first model of each chain, no failover
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "20"))
+ROUTER_MIN_CALLS = int(os.getenv("ROUTER_MIN_CALLS", "5"))
+ROUTER_ERROR_RATE = float(os.getenv("ROUTER_ERROR_RATE", "0.5"))
+ROUTER_CONSECUTIVE_FAILURES = int(os.getenv("ROUTER_CONSECUTIVE_FAILURES", "3"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+
+MODEL_70B = "llama-3.3-70b-versatile"
+MODEL_8B = "llama-3.1-8b-instant"
+
+ROUTE_PLAN = "plan"                      # /mealplan body (main, fallback, parallel groups) and pre-generation
+ROUTE_CURATOR = "curator"
+ROUTE_DIETARY_RULES = "dietary_rules"
+ROUTE_FIX_QUANTITIES = "fix_quantities"
+ROUTE_WORKOUT = "workout"
+ROUTE_CHAT = "chat"
+
+# site -> (default chain, default deadline). The curator has no deadline of
+# its own: its prep stage times out first (CURATOR_STAGE_TIMEOUT).
+DEFAULT_ROUTES = {
+    ROUTE_PLAN: ((MODEL_70B, MODEL_8B), 10.0),
+    ROUTE_CURATOR: ((MODEL_70B, MODEL_8B), 0.0),
+    ROUTE_DIETARY_RULES: ((MODEL_8B, MODEL_70B), 2.0),
+    ROUTE_FIX_QUANTITIES: ((MODEL_8B, MODEL_70B), 5.0),
+    ROUTE_WORKOUT: ((MODEL_70B, MODEL_8B), 10.0),
+    ROUTE_CHAT: ((MODEL_70B, MODEL_8B), 20.0),
+}
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+NON_FAILOVER_STATUS = (400, 401, 403, 413, 422)
+
+
+class ModelStall(Exception):
+    pass
+
+
+def load_routes():
+    routes = {}
+    for site, (chain, deadline) in DEFAULT_ROUTES.items():
+        env_chain = os.getenv(f"MODEL_ROUTE_{site.upper()}")
+        if env_chain:
+            chain = tuple(m.strip() for m in env_chain.split(",") if m.strip())
+        deadline = float(os.getenv(f"MODEL_DEADLINE_{site.upper()}", str(deadline)))
+        routes[site] = Route(site, chain, deadline)
+    return routes
+
+
+class Route:
+    def __init__(self, site, chain, deadline):
+        self.site = site
+        self.chain = chain
+        self.deadline = deadline or None
+        self.calls = 0
+        self.failovers = 0        # Calls not served by the chain's first model
+        self.failed = 0           # Calls every model failed
+        self.served_by = {}
+
+    def as_dict(self):
+        return {
+            "chain": list(self.chain),
+            "deadline_s": self.deadline,
+            "calls": self.calls,
+            "failovers": self.failovers,
+            "failed": self.failed,
+            "served_by": dict(self.served_by),
+        }
+
+
+class ModelHealth:
+    def __init__(self, model):
+        self.model = model
+        self.outcomes = deque(maxlen=ROUTER_WINDOW)  # True = success
+        self.ttft = deque(maxlen=ROUTER_WINDOW)
+        self.tokens_per_sec = None                   # EWMA over finished streams
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.calls = 0
+        self.failures = 0
+        self.stalls = 0
+        self.opened = 0
+        self.last_error = None
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def try_acquire(self):
+        """May a call go to this model now? Claims the probe of a half-open circuit."""
+        if self.state == CIRCUIT_OPEN:
+            if time.monotonic() - self.opened_at < ROUTER_COOLDOWN:
+                return False
+            self.state = CIRCUIT_HALF_OPEN
+            self.probing = False
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def release(self):
+        """The call ended without a verdict (cancelled): let another probe through."""
+        self.probing = False
+
+    def record_success(self, ttft):
+        self.calls += 1
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if ttft is not None:
+            self.ttft.append(ttft)
+        if self.state == CIRCUIT_HALF_OPEN:
+            self.state = CIRCUIT_CLOSED
+            self.outcomes.clear()
+        self.probing = False
+
+    def record_failure(self, error):
+        self.calls += 1
+        self.failures += 1
+        if isinstance(error, ModelStall):
+            self.stalls += 1
+        self.last_error = f"{type(error).__name__}: {error}"[:200]
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        tripped = self.consecutive_failures >= ROUTER_CONSECUTIVE_FAILURES or (
+            len(self.outcomes) >= ROUTER_MIN_CALLS and self.error_rate() >= ROUTER_ERROR_RATE
+        )
+        if self.state == CIRCUIT_HALF_OPEN or (self.state == CIRCUIT_CLOSED and tripped):
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+            self.opened += 1
+        self.probing = False
+
+    def record_decode(self, tokens, seconds):
+        if tokens > 1 and seconds > 0:
+            rate = tokens / seconds
+            self.tokens_per_sec = rate if self.tokens_per_sec is None else 0.8 * self.tokens_per_sec + 0.2 * rate
+
+    def as_dict(self):
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "stalls": self.stalls,
+            "error_rate": round(self.error_rate(), 3),
+            "opened": self.opened,
+            "ttft_p50_s": round(percentile(self.ttft, 50), 2),
+            "ttft_p90_s": round(percentile(self.ttft, 90), 2),
+            "tokens_per_sec": round(self.tokens_per_sec or 0.0, 1),
+            "last_error": self.last_error,
+        }
+
+
+class RoutedStream(HedgedStream):
+    """A stream served by a routed model; its decode speed is recorded when it ends."""
+
+    def __init__(self, first, health):
+        super().__init__(first)
+        self.health = health
+
+    async def _iterate(self):
+        started = time.perf_counter()
+        tokens = 0
+        async for chunk in super()._iterate():
+            if chunk_content(chunk):
+                tokens += 1
+            yield chunk
+        self.health.record_decode(tokens, time.perf_counter() - started)
+
+
+class ModelRouter:
+    def __init__(self, scheduler, routes=None, enabled=LLM_ROUTING != "off", logger=None):
+        self.scheduler = scheduler
+        self.routes = routes or load_routes()
+        self.enabled = enabled
+        self.logger = logger
+        self.models = {}
+
+    def health(self, model):
+        if model not in self.models:
+            self.models[model] = ModelHealth(model)
+        return self.models[model]
+
+    def primary(self, site):
+        return self.routes[site].chain[0]
+
+    async def create(self, site, client, priority, logger=None, **kwargs):
+        """scheduler.create(client, priority, model=<routed>, **kwargs) for call site `site` (ROUTE_*)."""
+        route = self.routes[site]
+        route.calls += 1
+        if not self.enabled:
+            return await self.scheduler.create(client, priority, **{**kwargs, "model": route.chain[0]})
+        logger = logger or self.logger
+        notes = []
+        last_error = None
+        tried = False
+        for index, model in enumerate(route.chain):
+            health = self.health(model)
+            if not health.try_acquire():
+                notes.append(f"{model} {health.state}")
+                continue
+            tried = True
+            try:
+                return await self._serve(route, index, model, client, priority, kwargs, notes, logger)
+            except ModelStall as e:
+                last_error = e
+            except RateLimitShed:
+                health.release()
+                raise
+            except asyncio.CancelledError:
+                health.release()
+                raise
+            except Exception as e:
+                if getattr(e, "status_code", None) in NON_FAILOVER_STATUS:
+                    health.release()
+                    raise
+                last_error = e
+            health.record_failure(last_error)
+            notes.append(f"{model} failed ({type(last_error).__name__})")
+        if not tried:  # Every circuit is open: better a likely failure than none at all
+            model = route.chain[0]
+            notes.append("all circuits open")
+            try:
+                return await self._serve(route, 0, model, client, priority, kwargs, notes, logger)
+            except (asyncio.CancelledError, RateLimitShed):
+                raise
+            except Exception as e:
+                last_error = e
+                self.health(model).record_failure(e)
+        route.failed += 1
+        if logger is not None:
+            logger.warning(f"[MODEL_ROUTE] {site}: no model served the call ({'; '.join(notes)})")
+        raise last_error
+
+    async def _serve(self, route, index, model, client, priority, kwargs, notes, logger):
+        health = self.health(model)
+        timer = SendTimer(client)
+        call_kwargs = {**kwargs, "model": model}
+        stream = bool(kwargs.get("stream"))
+
+        async def call():
+            return await self.scheduler.create(timer, priority, **call_kwargs)
+
+        task = asyncio.ensure_future(read_first_token(call) if stream else call())
+        try:
+            if route.deadline:
+                sent = asyncio.ensure_future(timer.sent.wait())
+                try:
+                    await asyncio.wait({task, sent}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sent.cancel()
+                if not task.done():
+                    done, _ = await asyncio.wait({task}, timeout=route.deadline)
+                    if not done:
+                        raise ModelStall(f"{model}: nothing after {route.deadline:g}s")
+            result = await task
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)  # Closes a half-open stream
+        ttft = timer.elapsed()
+        health.record_success(ttft)
+        if index:
+            route.failovers += 1
+        route.served_by[model] = route.served_by.get(model, 0) + 1
+        if logger is not None:
+            skipped = f" ({'; '.join(notes)})" if notes else ""
+            logger.info(f"[MODEL_ROUTE] {route.site} -> {model} in {ttft or 0.0:.2f}s{skipped}")
+        if stream:
+            return RoutedStream(result, health)
+        if ttft:
+            usage = getattr(result, "usage", None)
+            health.record_decode(getattr(usage, "completion_tokens", 0) or 0, ttft)
+        return result
+
+    def bind(self, site, client, priority):
+        """Client-shaped view whose chat.completions.create() is routed for `site`."""
+        async def create(**kwargs):
+            return await self.create(site, client, priority, **kwargs)
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "models": {model: health.as_dict() for model, health in self.models.items()},
+            "sites": {site: route.as_dict() for site, route in self.routes.items()},
+        }
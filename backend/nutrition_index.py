@@ -0,0 +1,302 @@
+import argparse
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from collections import namedtuple
+
+from food_table import normalize_food_name
+
+# ============================================================
+# NUTRITION INDEX - Learned per-food densities from parsed plans
+# ============================================================
+# Every parsed gram/ml item carries kcal/protein/fat/carbs per gram derived
+# from the numbers the LLM wrote, and the same food often gets very different
+# numbers across days and plans. The index keeps, per normalized food name
+# and unit, the median densities over everything we have parsed, so
+# process_single_day can replace an implausible density with the usual one
+# and re-solve quantities locally instead of asking the LLM to fix the day.
+#
+# Storage is one SQLite file:
+#   observations(name, unit, cal_density, protein_density, ...)  raw samples
+#   food_density(name, unit, count, cal_density, ..., cal_mad)   medians
+# Workers read food_density through a read-only connection into an in-memory
+# dict, reloaded when the file changes (checked at most every
+# NUTRITION_INDEX_RELOAD_SECONDS), so every gunicorn worker shares the same
+# snapshot. With NUTRITION_INDEX_LEARN=1 they also append observations in
+# small batches; medians are recomputed offline. Days processed in
+# DAY_EXECUTOR=process workers hand their observations and counters back to
+# the parent with each result (drain / absorb), so only the serving process
+# writes and its /metrics count every day:
+#
+#   python nutrition_index.py build [--log ../logs/mealplan.log]   bootstrap from recorded plans
+#   python nutrition_index.py rebuild                             recompute medians
+#   python nutrition_index.py stats
+
+NUTRITION_INDEX_PATH = os.getenv(
+    "NUTRITION_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition_index.sqlite")
+)
+NUTRITION_INDEX_MIN_COUNT = int(os.getenv("NUTRITION_INDEX_MIN_COUNT", "5"))
+NUTRITION_INDEX_LEARN = os.getenv("NUTRITION_INDEX_LEARN", "0") == "1"
+NUTRITION_INDEX_RELOAD_SECONDS = 60
+OBSERVATION_BATCH = 200
+
+DensityEntry = namedtuple(
+    "DensityEntry", ["count", "cal_density", "protein_density", "fat_density", "carbs_density", "cal_mad"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    name TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    cal_density REAL NOT NULL,
+    protein_density REAL,
+    fat_density REAL,
+    carbs_density REAL,
+    observed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS food_density (
+    name TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    cal_density REAL NOT NULL,
+    protein_density REAL,
+    fat_density REAL,
+    carbs_density REAL,
+    cal_mad REAL NOT NULL,
+    PRIMARY KEY (name, unit)
+);
+"""
+
+GRAM_UNITS = ("g", "grams", "gram")
+ML_UNITS = ("ml", "milliliter", "milliliters")
+
+
+def normalize_unit(unit):
+    unit = str(unit).lower().strip()
+    if unit in GRAM_UNITS:
+        return "g"
+    if unit in ML_UNITS:
+        return "ml"
+    return unit
+
+
+def connect(path, read_only=False):
+    if read_only:
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")  # Readers in other workers are not blocked by writers
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class NutritionIndex:
+    def __init__(self, path=NUTRITION_INDEX_PATH, min_count=NUTRITION_INDEX_MIN_COUNT, learn=NUTRITION_INDEX_LEARN):
+        self.path = path
+        self.min_count = min_count
+        self.learn = learn
+        self.entries = {}
+        self.loaded_mtime = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.pending = []
+        self.lookups = 0
+        self.hits = 0
+        self.corrections = 0
+        self.observed = 0
+
+    # ------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self.loaded_mtime is not None and now - self.checked_at < NUTRITION_INDEX_RELOAD_SECONDS:
+            return
+        self.checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.loaded_mtime:
+            return
+        try:
+            conn = connect(self.path, read_only=True)
+            try:
+                rows = conn.execute(
+                    "SELECT name, unit, count, cal_density, protein_density, fat_density, carbs_density, cal_mad "
+                    "FROM food_density"
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return  # Missing table or a rebuild in progress; keep the previous snapshot
+        self.entries = {(row[0], row[1]): DensityEntry(*row[2:]) for row in rows}
+        self.loaded_mtime = mtime
+
+    def lookup(self, name, unit):
+        """Median densities for a food, or None if it has fewer than min_count observations."""
+        self._maybe_reload()
+        self.lookups += 1
+        entry = self.entries.get((normalize_food_name(name), normalize_unit(unit)))
+        if entry is None or entry.count < self.min_count:
+            return None
+        self.hits += 1
+        return entry
+
+    # ------------------------------------------------------------
+    # Learning
+    # ------------------------------------------------------------
+    def observe(self, item, macros_stated=True):
+        """Record an item's densities as parsed (before any correction)."""
+        if not self.learn or item.cal_density <= 0:
+            return
+        row = (
+            normalize_food_name(item.name), normalize_unit(item.unit), item.cal_density,
+            item.protein_density if macros_stated else None,
+            item.fat_density if macros_stated else None,
+            item.carbs_density if macros_stated else None,
+            time.time(),
+        )
+        with self.lock:
+            self.pending.append(row)
+            self.observed += 1
+            if len(self.pending) < OBSERVATION_BATCH:
+                return
+            batch, self.pending = self.pending, []
+        self._write(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self._write(batch)
+
+    def drain(self):
+        """(observations, counters) gathered since the last drain, reset here - a pool worker's share for its parent."""
+        with self.lock:
+            rows, self.pending = self.pending, []
+            counters = {"lookups": self.lookups, "hits": self.hits, "corrections": self.corrections,
+                        "observed": self.observed}
+            self.lookups = self.hits = self.corrections = self.observed = 0
+        return rows, counters
+
+    def absorb(self, rows, counters, writer=None):
+        """Take over what drain() returned in a pool worker; a full batch is written on `writer` (an Executor) if given."""
+        with self.lock:
+            self.pending.extend(rows)
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+            if len(self.pending) < OBSERVATION_BATCH:
+                return
+            batch, self.pending = self.pending, []
+        if writer is not None:
+            writer.submit(self._write, batch)
+        else:
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            conn = connect(self.path)
+            try:
+                with conn:
+                    conn.executemany("INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass  # Learning is best-effort; a locked or read-only file must not fail a plan
+
+    def rebuild(self):
+        """Recompute food_density from all observations. Returns the number of foods."""
+        conn = connect(self.path)
+        try:
+            groups = {}
+            for name, unit, cal, protein, fat, carbs in conn.execute(
+                "SELECT name, unit, cal_density, protein_density, fat_density, carbs_density FROM observations"
+            ):
+                groups.setdefault((name, unit), []).append((cal, protein, fat, carbs))
+
+            rows = []
+            for (name, unit), samples in groups.items():
+                cals = [s[0] for s in samples]
+                cal_median = statistics.median(cals)
+
+                def median_of(index):
+                    values = [s[index] for s in samples if s[index] is not None]
+                    return statistics.median(values) if values else None
+
+                rows.append((
+                    name, unit, len(samples), cal_median, median_of(1), median_of(2), median_of(3),
+                    statistics.median(abs(c - cal_median) for c in cals),
+                ))
+            with conn:
+                conn.execute("DELETE FROM food_density")
+                conn.executemany("INSERT INTO food_density VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+        self.loaded_mtime = None  # Pick the new medians up on the next lookup
+        return len(rows)
+
+    def stats(self):
+        self._maybe_reload()
+        return {
+            "foods": len(self.entries),
+            "usable": sum(1 for e in self.entries.values() if e.count >= self.min_count),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "corrections": self.corrections,
+            "observed": self.observed,
+        }
+
+
+_default_index = None
+
+
+def get_nutrition_index():
+    """Process-wide index at NUTRITION_INDEX_PATH (created lazily)."""
+    global _default_index
+    if _default_index is None:
+        _default_index = NutritionIndex()
+    return _default_index
+
+
+def learn_from_plans(index, plans):
+    """Feed every day of recorded plans (benchmarks.recorded_plans) through process_single_day in learn mode."""
+    import logging
+    from utils import process_single_day, calculate_macros
+
+    logging.getLogger("MEALPLAN").setLevel(logging.CRITICAL)
+    index.learn = True
+    days = 0
+    for plan in plans:
+        target = plan["target_calories"] or 2000
+        macros = plan["macros"] or calculate_macros(70, target)
+        for number, text in enumerate(plan["days"] + plan["repaired_days"], 1):
+            process_single_day(text, target, macros, 5, number, nutrition_index=index)
+            days += 1
+    index.flush()
+    return days
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect the learned nutrition index.")
+    parser.add_argument("command", choices=["build", "rebuild", "stats"])
+    parser.add_argument("--path", default=NUTRITION_INDEX_PATH)
+    parser.add_argument("--log", help="mealplan log to learn from (build)")
+    args = parser.parse_args()
+
+    index = NutritionIndex(args.path)
+    if args.command == "build":
+        from benchmarks.recorded_plans import DEFAULT_LOG_PATH, load_recorded_plans
+        plans = load_recorded_plans(args.log or DEFAULT_LOG_PATH)
+        print(f"learned from {learn_from_plans(index, plans)} days of {len(plans)} plans")
+        print(f"{index.rebuild()} foods -> {args.path}")
+    elif args.command == "rebuild":
+        print(f"{index.rebuild()} foods -> {args.path}")
+    else:
+        print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import re
+
+from day_pipeline import PipelineMetrics, pipelined_days, stream_token_texts
+from day_segmenter import DaySegmenter, DAY, SUGGESTION
+from plan_format import CompactPlanParser, OUTPUT_FORMAT_COMPACT, OUTPUT_FORMAT_TEXT
+from stream_events import TOTAL_PATTERN
+from upstream import UpstreamStats, CLOSE_CANCELLED
+
+# ============================================================
+# PARALLEL DAY GENERATION - Fan the week out as concurrent LLM streams
+# ============================================================
+# The single-stream mode produces Day 1..7 in one sequential completion, so
+# Day 7 arrives after ~6x the time of Day 1 and a truncated tail needs the
+# slow FALLBACK call. In parallel mode each group of days (e.g. [1], [2], ...
+# or [1, 2], [3, 4], ...) is its own stream sharing the same system prompt and
+# curator directions. Every call gets a variety hint so groups don't pick the
+# same meals, and results are re-ordered so the client still receives
+# Day 1..7 in order, each as soon as it (and every day before it) is ready.
+
+GENERATION_MODE_SINGLE = "single"
+GENERATION_MODE_PARALLEL = "parallel"
+GENERATION_MODES = (GENERATION_MODE_SINGLE, GENERATION_MODE_PARALLEL)
+
+DEFAULT_GENERATION_MODE = os.getenv("MEALPLAN_GENERATION_MODE", GENERATION_MODE_SINGLE).lower()
+DEFAULT_DAY_GROUP_SIZE = int(os.getenv("MEALPLAN_DAY_GROUP_SIZE", "1"))
+MAX_TOKENS_PER_DAY = int(os.getenv("MEALPLAN_MAX_TOKENS_PER_DAY", "900"))
+GROUP_ATTEMPTS = 2  # A group that comes back short is retried once for its missing days
+
+LEADING_DAY_MARKER = re.compile(r'^\s*Day \d+:')
+
+
+def resolve_generation_mode(data):
+    """Per-request mode/group size from the body, falling back to the env defaults."""
+    mode = str(data.get("generationMode") or DEFAULT_GENERATION_MODE).lower()
+    if mode not in GENERATION_MODES:
+        mode = GENERATION_MODE_SINGLE
+    try:
+        group_size = int(data.get("dayGroupSize") or DEFAULT_DAY_GROUP_SIZE)
+    except (TypeError, ValueError):
+        group_size = DEFAULT_DAY_GROUP_SIZE
+    return mode, max(1, min(group_size, 7))
+
+
+def day_groups(total_days=7, group_size=1):
+    """[[1], [2], ...] for group_size 1, [[1, 2], [3, 4], [5, 6], [7]] for 2, ..."""
+    days = list(range(1, total_days + 1))
+    return [days[i:i + group_size] for i in range(0, total_days, group_size)]
+
+
+def group_instructions(days, total_days=7, variety_hint=""):
+    """Appended to the shared user message so each call produces only its days."""
+    days_str = ", ".join(f"Day {d}" for d in days)
+    last = days[-1] == total_days
+    # Offsetting into the curator's lists by day number keeps concurrent calls
+    # from converging on the same first-listed protein/breakfast
+    rotation = ", ".join(
+        f"Day {d}: start from item #{d} of each allowed list (wrap around)" for d in days
+    )
+    return f"""
+    PARALLEL GENERATION:
+    The other days of this week are being generated separately.
+    Generate ONLY: {days_str} - number them exactly like that, same format as above.
+    VARIETY ROTATION (so days don't repeat each other):
+    {rotation}
+    {variety_hint}
+    {"END with the END-OF-PLAN-SUGGESTION line." if last else "Do NOT add the END-OF-PLAN-SUGGESTION line."}
+    """
+
+
+def has_day_total(day_text):
+    """Does the day reach its "Total: X kcal" line (i.e. was it not cut off)?"""
+    return any(TOTAL_PATTERN.match(line) for line in day_text.splitlines())
+
+
+def renumber_day(day_text, day_number):
+    """Force the "Day X:" header to the slot this text fills."""
+    return LEADING_DAY_MARKER.sub(f"Day {day_number}:", day_text, count=1)
+
+
+async def stream_days_parallel(client, model, system_prompt, user_message, process_day,
+                               group_size=1, total_days=7, variety_hint_fn=None,
+                               temperature=0.9, logger=None, output_format=OUTPUT_FORMAT_TEXT,
+                               upstream_stats=None, metrics=None):
+    """
+    Async generator yielding (kind, text) in client order:
+      (DAY, processed_day_text) for Day 1..total_days, then (SUGGESTION, text) if any.
+
+    process_day(day_text, day_number) is awaited for every raw day as soon as
+    its group stream completes it, through the same reader -> process
+    pipeline as the single stream (stages recorded in `metrics`), so a group
+    keeps draining its stream while its days and earlier groups are processed. Missing days after GROUP_ATTEMPTS are
+    reported as an error string in their slot instead of hanging the stream.
+    With output_format="compact" the streams are parsed as compact records and
+    a day missing a meal counts as cut off. Group streams still open when the
+    consumer goes away are closed (counted under "parallel" in upstream_stats).
+    """
+    upstream_stats = upstream_stats or UpstreamStats()
+    metrics = metrics or PipelineMetrics()
+    loop = asyncio.get_event_loop()
+    slots = {d: loop.create_future() for d in range(1, total_days + 1)}
+    suggestion_parts = []
+
+    def fill(day_number, value):
+        if not slots[day_number].done():
+            slots[day_number].set_result(value)
+
+    async def run_group(days):
+        pending = list(days)
+        for attempt in range(1, GROUP_ATTEMPTS + 1):
+            hint = variety_hint_fn(days[0], attempt) if variety_hint_fn else ""
+            stream = upstream_stats.track(await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message + group_instructions(pending, total_days, hint)},
+                ],
+                max_tokens=MAX_TOKENS_PER_DAY * len(pending) + 200,
+                temperature=temperature,
+                stream=True,
+            ), "parallel", logger)
+            if output_format == OUTPUT_FORMAT_COMPACT:
+                segmenter = CompactPlanParser(max_days=len(pending))
+            else:
+                segmenter = DaySegmenter(max_days=len(pending), drop_incomplete_last_day=False)
+            produced = []
+            # Keep the suggestion from the first attempt that writes one
+            wants_suggestion = pending[-1] == total_days and not suggestion_parts
+
+            async def process_group_day(day_text, index):
+                if not has_day_total(day_text):
+                    return None  # Cut off before its total line - retried below
+                day_number = pending[index - 1]
+                return await process_day(renumber_day(day_text, day_number), day_number)
+
+            try:
+                async for event, processed in pipelined_days(
+                    stream_token_texts(stream), segmenter, process_group_day, metrics
+                ):
+                    if event.kind == SUGGESTION:
+                        if wants_suggestion:
+                            suggestion_parts.append(processed)
+                        continue
+                    if processed is not None:
+                        day_number = pending[event.day_number - 1]
+                        fill(day_number, processed)
+                        produced.append(day_number)
+            finally:
+                await stream.close(CLOSE_CANCELLED)  # No-op once the stream has ended
+
+            pending = [d for d in pending if d not in produced]
+            if not pending:
+                return
+            if logger is not None:
+                logger.warning(f"[PARALLEL_DAYS] Attempt {attempt} missed days {pending} - retrying")
+        for d in pending:
+            fill(d, f"\n[ERROR] Day {d} could not be generated.\n")
+
+    async def guarded(days):
+        try:
+            await run_group(days)
+        except Exception as e:
+            if logger is not None:
+                logger.error(f"[PARALLEL_DAYS] Group {days} failed: {e}")
+            for d in days:
+                fill(d, f"\n[ERROR] Day {d} could not be generated: {e}\n")
+
+    groups = day_groups(total_days, group_size)
+    tasks = [asyncio.ensure_future(guarded(days)) for days in groups]
+    try:
+        for day_number in range(1, total_days + 1):
+            yield DAY, await slots[day_number]
+        await asyncio.gather(*tasks)
+        if suggestion_parts:
+            yield SUGGESTION, "".join(suggestion_parts)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,291 @@
+import os
+import re
+
+from day_segmenter import DAY, SUGGESTION, SUGGESTION_PATTERN, SegmentEvent
+
+# ============================================================
+# PLAN OUTPUT FORMAT - Prose lines (default) or compact records
+# ============================================================
+# "text": the model writes the plan the way the frontend shows it
+#   Day 1:
+#   - Breakfast (370 kcal):
+#     1. Greek yogurt - 200g - 130 kcal - 20p/0f/8c
+#   and process_single_day re-parses it with its cascade of item regexes.
+#
+# "compact": the model writes one record per item and nothing else
+#   1|B|Greek yogurt|200|g|130|20|0|8
+# (day|meal|food|qty|unit|kcal|p|f|c). That is roughly half the output tokens,
+# and CompactPlanParser builds the items as the lines arrive and renders each
+# finished day in the canonical text format above, server-side. Everything
+# downstream (process_single_day, repairs, the frontend) sees the same text as
+# in "text" mode. The END-OF-PLAN-SUGGESTION line is the same in both formats.
+#
+# Chosen per request with "outputFormat" or MEALPLAN_OUTPUT_FORMAT.
+
+OUTPUT_FORMAT_TEXT = "text"
+OUTPUT_FORMAT_COMPACT = "compact"
+MEALPLAN_OUTPUT_FORMAT = os.getenv("MEALPLAN_OUTPUT_FORMAT", OUTPUT_FORMAT_TEXT)
+
+TEXT_FORMAT_SECTION = """FORMAT:
+Day X:
+- Breakfast (XXX kcal):
+  1. Food - quantity - kcal - Xp/Xf/Xc
+- Lunch (XXX kcal):
+  1. Food - quantity - kcal - Xp/Xf/Xc
+- Snack (XXX kcal):
+  1. Food - quantity - kcal - Xp/Xf/Xc
+- Dinner (XXX kcal):
+  1. Food - quantity - kcal - Xp/Xf/Xc
+Total: XXXX kcal"""
+
+TEXT_OUTPUT_SECTION = """=== OUTPUT FORMAT ===
+
+ITEM FORMAT: "Food name - Xg - XXX kcal - Xp/Xf/Xc"
+(p=protein g, f=fat g, c=carbs g)
+
+CRITICAL FORMAT RULES:
+- Food name = JUST the food (e.g., "Greek yogurt", "Chicken breast", "Oatmeal")
+- NEVER put quantities in food name (WRONG: "1/2 cup oats", RIGHT: "Oatmeal")
+- Quantity = grams only (e.g., "150g", "200g")
+- For eggs/slices: use "Eggs - 2 eggs - XXX kcal" or "Bread - 2 slices - XXX kcal"
+
+EXAMPLES:
+✓ 1. Greek yogurt - 200g - 130 kcal - 20p/0f/8c
+✓ 2. Oatmeal - 80g - 100 kcal - 3p/2f/20c  
+✓ 3. Eggs - 2 eggs - 140 kcal - 12p/10f/0c
+✗ WRONG: 1/2 cup Greek yogurt - 200g - 130 kcal
+✗ WRONG: 2 hard-boiled eggs - 100g - 140 kcal"""
+
+COMPACT_FORMAT_SECTION = """FORMAT:
+One line per food item, fields separated by "|", in this order:
+day|meal|food|qty|unit|kcal|p|f|c
+- day: 1 to 7; meal: B=Breakfast, L=Lunch, S=Snack, D=Dinner
+- p/f/c = protein/fat/carbs in grams; every number without units
+- Items of a meal together, meals in order B, L, S, D, days in order
+- NO day headers, meal headers, totals, numbering or blank lines - they are computed from the items"""
+
+COMPACT_OUTPUT_SECTION = """=== OUTPUT FORMAT ===
+
+ITEM FORMAT: "day|meal|food|qty|unit|kcal|p|f|c"
+
+CRITICAL FORMAT RULES:
+- food = JUST the food (e.g., "Greek yogurt", "Chicken breast", "Oatmeal"), never containing "|"
+- NEVER put quantities in food name (WRONG: "1/2 cup oats", RIGHT: "Oatmeal")
+- Grams: qty|g (e.g., "150|g"); eggs/slices/fruits/flatbreads: whole count and unit ("2|egg", "2|slice", "1|apple", "2|roti")
+
+EXAMPLES:
+✓ 1|B|Greek yogurt|200|g|130|20|0|8
+✓ 1|B|Oatmeal|80|g|100|3|2|20
+✓ 1|B|Eggs|2|egg|140|12|10|0
+✗ WRONG: 1. Greek yogurt - 200g - 130 kcal - 20p/0f/8c
+✗ WRONG: 1|B|Greek yogurt|200g|130 kcal|20p|0f|8c"""
+
+MEALS = ("Breakfast", "Lunch", "Snack", "Dinner")
+MEAL_CODES = {"b": "Breakfast", "l": "Lunch", "s": "Snack", "d": "Dinner"}
+
+# Units process_single_day recognizes; anything else ("roti", "apple", "scoop") is rendered as pieces
+UNIT_NAMES = {
+    "g": "g", "gram": "g", "grams": "g", "ml": "ml", "oz": "oz",
+    "egg": "egg", "eggs": "egg", "slice": "slice", "slices": "slice",
+    "piece": "piece", "pieces": "piece", "pc": "piece", "pcs": "piece",
+    "cup": "cup", "cups": "cup", "serving": "serving", "servings": "serving",
+    "tbsp": "tbsp", "tsp": "tsp", "medium": "medium", "small": "small", "large": "large",
+}
+WEIGHT_UNITS = ("g", "ml", "oz")
+PLURAL_UNITS = ("egg", "slice", "piece", "cup", "serving")
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+PARSE_COUNTERS = ("plans", "records", "rejected", "ignored", "days", "dropped_days")
+
+
+def resolve_output_format(data):
+    value = str(data.get("outputFormat") or MEALPLAN_OUTPUT_FORMAT).lower()
+    return value if value in (OUTPUT_FORMAT_TEXT, OUTPUT_FORMAT_COMPACT) else OUTPUT_FORMAT_TEXT
+
+
+def format_sections(output_format):
+    """(FORMAT section, OUTPUT FORMAT section) of the /mealplan system prompt."""
+    if output_format == OUTPUT_FORMAT_COMPACT:
+        return COMPACT_FORMAT_SECTION, COMPACT_OUTPUT_SECTION
+    return TEXT_FORMAT_SECTION, TEXT_OUTPUT_SECTION
+
+
+def _number(field):
+    """'150', '150g', ' 130 kcal' -> float; None if there is no number."""
+    match = NUMBER.search(field)
+    return float(match.group(0)) if match else None
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else f"{value:g}"
+
+
+def parse_record(line):
+    """
+    One compact line -> (day, meal, name, qty, unit, kcal, p, f, c), or None.
+
+    Tolerates what models add around the fields: spaces, unit suffixes on the
+    numbers ("150g", "130 kcal"), full meal names, a leading "|".
+    """
+    fields = [field.strip() for field in line.strip().strip("|").split("|")]
+    if len(fields) != 9:
+        return None
+    day = _number(fields[0])
+    meal = MEAL_CODES.get(fields[1][:1].lower())
+    name = fields[2]
+    numbers = [_number(fields[3])] + [_number(field) for field in fields[5:]]
+    if day is None or meal is None or not name or any(n is None or n < 0 for n in numbers):
+        return None
+    qty, kcal, protein, fat, carbs = numbers
+    if qty <= 0:
+        return None
+    unit = fields[4].lower().rstrip(".") or "g"
+    return int(day), meal, name, qty, unit, kcal, protein, fat, carbs
+
+
+def render_item(number, name, qty, unit, kcal, protein, fat, carbs):
+    """Canonical item line, as ITEM_PATTERN_MACROS in process_single_day expects it."""
+    unit = UNIT_NAMES.get(unit, "piece")
+    if unit in WEIGHT_UNITS:
+        quantity = f"{_format_number(round(qty))}{unit}"
+    else:
+        # Natural units are parsed as whole counts; keep the item's numbers consistent with the rounding
+        count = max(1, round(qty))
+        if count != qty:
+            scale = count / qty
+            kcal, protein, fat, carbs = kcal * scale, protein * scale, fat * scale, carbs * scale
+        quantity = f"{count} {unit}{'s' if count != 1 and unit in PLURAL_UNITS else ''}"
+    return (f"  {number}. {name} - {quantity} - {round(kcal)} kcal - "
+            f"{round(protein)}p/{round(fat)}f/{round(carbs)}c")
+
+
+def render_day(day_number, meals):
+    """meals: {meal name: [record, ...]} -> the day in the text plan format."""
+    lines = [f"Day {day_number}:"]
+    day_total = 0
+    for meal in MEALS:
+        items = meals.get(meal)
+        if not items:
+            continue
+        meal_total = round(sum(item[5] for item in items))
+        day_total += meal_total
+        lines.append(f"- {meal} ({meal_total} kcal):")
+        for number, (_, _, name, qty, unit, kcal, protein, fat, carbs) in enumerate(items, 1):
+            lines.append(render_item(number, name, qty, unit, kcal, protein, fat, carbs))
+    lines.append(f"Total: {day_total} kcal")
+    return "\n".join(lines) + "\n\n"
+
+
+class ParseStats:
+    """Compact-format parse counters, summed over every plan in this process."""
+
+    def __init__(self):
+        for counter in PARSE_COUNTERS:
+            setattr(self, counter, 0)
+
+    def add(self, parser):
+        self.plans += 1
+        for counter in PARSE_COUNTERS[1:]:
+            setattr(self, counter, getattr(self, counter) + getattr(parser, counter))
+
+    def as_dict(self):
+        lines = self.records + self.rejected
+        return {
+            **{counter: getattr(self, counter) for counter in PARSE_COUNTERS},
+            "record_success": round(self.records / lines, 4) if lines else None,
+        }
+
+
+class CompactPlanParser:
+    """
+    Incremental parser for compact plans, a drop-in for DaySegmenter.
+
+    feed() / close() return SegmentEvents:
+      - ("day", rendered_day_text, n)  a day, once a record of a later day (or
+                                       the suggestion) shows it is complete
+      - ("suggestion", text, None)     the END-OF-PLAN-SUGGESTION line, then
+                                       every later token as-is
+
+    Only whole lines are parsed. Lines that are not records (a stray header,
+    a code fence) are ignored; lines that look like records but don't parse
+    are counted as rejected. On close(), a last day missing any meal is
+    dropped so the FALLBACK call regenerates it, like DaySegmenter.
+    """
+
+    def __init__(self, max_days=7, drop_incomplete_last_day=True):
+        self.max_days = max_days
+        self.drop_incomplete_last_day = drop_incomplete_last_day
+        self.line = ""
+        self.suggestion_mode = False
+        self.current_day = None     # Day number as written by the model
+        self.meals = {}
+        self.day_count = 0
+        self.records = 0
+        self.rejected = 0
+        self.ignored = 0
+        self.days = 0
+        self.dropped_days = 0
+
+    def _flush_day(self, events):
+        if self.meals and self.day_count < self.max_days:
+            self.day_count += 1
+            self.days += 1
+            events.append(SegmentEvent(DAY, render_day(self.day_count, self.meals), self.day_count))
+        self.meals = {}
+
+    def _take_line(self, line, events):
+        if "|" not in line:
+            if line.strip():
+                self.ignored += 1
+            return
+        record = parse_record(line)
+        if record is None:
+            self.rejected += 1
+            return
+        self.records += 1
+        if self.current_day is not None and record[0] != self.current_day:
+            self._flush_day(events)
+        self.current_day = record[0]
+        self.meals.setdefault(record[1], []).append(record)
+
+    def _start_suggestion(self, events, text):
+        self.suggestion_mode = True
+        self._flush_day(events)
+        events.append(SegmentEvent(SUGGESTION, text, None))
+
+    def feed(self, token_text):
+        """Add one token and return the events it completes."""
+        events = []
+        if not token_text:
+            return events
+        if self.suggestion_mode:
+            events.append(SegmentEvent(SUGGESTION, token_text, None))
+            return events
+
+        self.line += token_text
+        *complete, self.line = self.line.split("\n")
+        for i, line in enumerate(complete):
+            if SUGGESTION_PATTERN.match(line.strip()):
+                rest = "\n".join(complete[i:] + [self.line])
+                self.line = ""
+                self._start_suggestion(events, rest.lstrip())
+                return events
+            self._take_line(line, events)
+        if SUGGESTION_PATTERN.match(self.line.lstrip()):
+            text, self.line = self.line.lstrip(), ""
+            self._start_suggestion(events, text)
+        return events
+
+    def close(self):
+        """Flush the last line and day once the upstream stream ends."""
+        events = []
+        if self.suggestion_mode:
+            return events
+        if self.line.strip():
+            self._take_line(self.line, events)
+            self.line = ""
+        if self.meals and self.drop_incomplete_last_day and len(self.meals) < len(MEALS):
+            self.dropped_days += 1
+            self.meals = {}
+        self._flush_day(events)
+        return events
@@ -0,0 +1,558 @@
+import heapq
+import os
+import random
+import time
+from collections import OrderedDict
+
+from broadcast import BroadcastChannel
+from logger_setup import user_logger
+from redis_client import REDIS_URL, shared_redis, use_redis
+
+# ============================================================
+# PRE-GENERATION STORE - Chunks produced by /user, consumed by /mealplan
+# ============================================================
+# /user starts a background generation keyed by the mealplan_session cookie and
+# /mealplan tails it. With several gunicorn workers the two requests can land on
+# different processes, so the store is pluggable:
+#   - InMemoryPregenStore: process-local dict (single worker / local dev)
+#   - RedisPregenStore:    one Redis stream per session, shared by all workers
+#
+# Both expose the same async API:
+#   create(session_id)             register a new generation
+#   attach_task(session_id, task)  remember the local asyncio.Task producing it
+#   append(session_id, chunk)      add an encoded chunk (bytes); False if the entry
+#                                  is gone (deleted on any worker, or expired) -
+#                                  the producer should stop
+#   finish(session_id, error=None) mark the generation done (optionally failed)
+#   exists(session_id)             is there a live entry for this session?
+#   tail(session_id)               async iterator over all chunks, waiting for new
+#                                  ones until the producer finishes
+#   status(session_id)             {"done": bool, "error": str|None} or None
+#   promote(session_id)            a reader has started: mark the entry as wanted
+#   promoted(session_id)           has a reader (on any worker) promoted it?
+#   delete(session_id)             drop the entry (and cancel a local task); tail()
+#                                  readers still waiting raise PregenDropped
+#   cleanup()                      expire old entries
+
+PREGEN_TTL_SECONDS = 300  # Matches the mealplan_session cookie max_age
+
+# Memory caps for either store (a full plan is ~5 KB of chunks)
+PREGEN_MAX_ENTRIES = int(os.getenv("PREGEN_MAX_ENTRIES", "500"))
+PREGEN_MAX_BYTES = int(os.getenv("PREGEN_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Admission control for speculative generations started by /user
+PREGEN_MAX_CONCURRENT = int(os.getenv("PREGEN_MAX_CONCURRENT", "8"))
+PREGEN_MIN_HIT_RATE = float(os.getenv("PREGEN_MIN_HIT_RATE", "0.3"))
+PREGEN_HIT_WINDOW = int(os.getenv("PREGEN_HIT_WINDOW", "100"))
+PREGEN_MIN_ADMIT = float(os.getenv("PREGEN_MIN_ADMIT", "0.05"))  # Probes that let a zero hit rate recover
+
+
+DROPPED_ERROR = "dropped before it finished"
+
+
+class PregenDropped(Exception):
+    """tail(): the entry was deleted or expired before its producer finished."""
+
+
+class InMemoryPregenStore:
+    """
+    Process-local store. Each entry is a BroadcastChannel (chunks, done, error, created, task).
+
+    - expiry: (expires_at, session_id) min-heap, so cleanup() only pops what is due
+      instead of scanning every entry
+    - caps: max_entries / max_bytes, enforced by evicting the least recently used
+      entry (its generation task is cancelled)
+    """
+
+    def __init__(self, ttl=PREGEN_TTL_SECONDS, max_entries=PREGEN_MAX_ENTRIES, max_bytes=PREGEN_MAX_BYTES, name="PREGEN"):
+        self.ttl = ttl
+        self.name = name  # Log tag
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # LRU order: oldest access first
+        self.sizes = {}
+        self.total_bytes = 0
+        self.expiry_heap = []
+        self.promoted_sessions = set()
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    async def create(self, session_id):
+        if session_id in self.entries:
+            await self.delete(session_id)
+        channel = BroadcastChannel()
+        self.entries[session_id] = channel
+        self.sizes[session_id] = 0
+        heapq.heappush(self.expiry_heap, (channel.created + self.ttl, session_id))
+        await self._enforce_caps(keep=session_id)
+
+    def attach_task(self, session_id, task):
+        if session_id in self.entries:
+            self.entries[session_id].task = task
+
+    async def append(self, session_id, chunk):
+        channel = self.entries.get(session_id)
+        if channel is None:
+            return False
+        await channel.publish(chunk)
+        self.sizes[session_id] += len(chunk)
+        self.total_bytes += len(chunk)
+        await self._enforce_caps(keep=session_id)
+        return True
+
+    async def finish(self, session_id, error=None):
+        channel = self.entries.get(session_id)
+        if channel is not None:
+            await channel.close(error)
+
+    async def exists(self, session_id):
+        if session_id not in self.entries:
+            return False
+        self.entries.move_to_end(session_id)
+        return True
+
+    async def status(self, session_id):
+        channel = self.entries.get(session_id)
+        if channel is None:
+            return None
+        return {'done': channel.done, 'error': channel.error, 'chunks': len(channel.chunks)}
+
+    async def tail(self, session_id):
+        # Readers wake only when run_pregeneration publishes or finishes;
+        # concurrent readers (e.g. a browser retry) each get the full stream
+        channel = self.entries.get(session_id)
+        if channel is None:
+            return
+        self.entries.move_to_end(session_id)
+        async for chunk in channel.subscribe():
+            yield chunk
+        if channel.error == DROPPED_ERROR:
+            raise PregenDropped(session_id)
+
+    async def promote(self, session_id):
+        if session_id in self.entries:
+            self.promoted_sessions.add(session_id)
+
+    async def promoted(self, session_id):
+        return session_id in self.promoted_sessions
+
+    async def delete(self, session_id):
+        channel = self.entries.pop(session_id, None)
+        self.promoted_sessions.discard(session_id)
+        if channel:
+            self.total_bytes -= self.sizes.pop(session_id, 0)
+            task = channel.task
+            if task and not task.done():
+                task.cancel()
+            # Release anyone still tailing a cancelled generation
+            await channel.close(DROPPED_ERROR)
+
+    async def cleanup(self):
+        """Remove entries whose TTL has passed, cancelling their generation task."""
+        current_time = time.time()
+        expired = 0
+        while self.expiry_heap and self.expiry_heap[0][0] <= current_time:
+            expires_at, session_id = heapq.heappop(self.expiry_heap)
+            channel = self.entries.get(session_id)
+            # Skip stale heap items for entries already deleted or re-created
+            if channel is not None and channel.created + self.ttl == expires_at:
+                await self.delete(session_id)
+                expired += 1
+        self.expired_count += expired
+        return expired
+
+    async def _enforce_caps(self, keep=None):
+        """Evict least recently used entries until both caps hold (never `keep`)."""
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            victim = next((k for k in self.entries if k != keep), None)
+            if victim is None:
+                break
+            user_logger.info(
+                f"[{self.name}_EVICT] Evicting {victim} "
+                f"({len(self.entries)} entries, {self.total_bytes} bytes)"
+            )
+            await self.delete(victim)
+            self.evicted_count += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count,
+        }
+
+
+# KEYS[1] admission hash; ARGV: window. Returns {started, hits} after counting a start.
+ADMISSION_START_SCRIPT = """
+local started = tonumber(redis.call('HINCRBYFLOAT', KEYS[1], 'started', 1))
+local hits = tonumber(redis.call('HGET', KEYS[1], 'hits') or '0')
+if started > tonumber(ARGV[1]) then
+  started = started / 2
+  hits = hits / 2
+  redis.call('HSET', KEYS[1], 'started', started, 'hits', hits)
+end
+return {tostring(started), tostring(hits)}
+"""
+
+# KEYS[1] admission hash. Returns {started, hits} after counting a hit.
+ADMISSION_HIT_SCRIPT = """
+local started = tonumber(redis.call('HGET', KEYS[1], 'started') or '0')
+local hits = math.min(tonumber(redis.call('HGET', KEYS[1], 'hits') or '0') + 1, started)
+redis.call('HSET', KEYS[1], 'hits', hits)
+return {tostring(started), tostring(hits)}
+"""
+
+
+class PregenAdmission:
+    """
+    Decides whether /user may start another speculative generation.
+
+    - at most max_concurrent pre-generations run at once (per process)
+    - hit rate = /mealplan hits / pre-generations started, over roughly the last
+      `window` starts (both counters are halved when the window fills). Once enough
+      samples exist and the hit rate is below min_hit_rate, only that fraction of
+      requests is admitted, so unconsumed pre-gens stop costing LLM tokens.
+      At least min_admit of them still are: hits can only follow starts, so a
+      hit rate of 0 would otherwise never be measured again.
+
+    With a shared (Redis) store, /user and /mealplan of one session usually
+    land on different workers, so the started/hits counters are kept in one
+    Redis hash (pass `redis_client`) instead of per process.
+    """
+
+    def __init__(self, max_concurrent=PREGEN_MAX_CONCURRENT, min_hit_rate=PREGEN_MIN_HIT_RATE, window=PREGEN_HIT_WINDOW,
+                 min_admit=PREGEN_MIN_ADMIT, redis_client=None, key="pregen:admission"):
+        self.max_concurrent = max_concurrent
+        self.min_hit_rate = min_hit_rate
+        self.min_admit = min_admit
+        self.window = window
+        self.redis = redis_client
+        self.key = key
+        self.running = 0
+        self.started = 0
+        self.hits = 0
+        self.rejected = 0
+        if redis_client is not None:
+            self._start = redis_client.register_script(ADMISSION_START_SCRIPT)
+            self._hit = redis_client.register_script(ADMISSION_HIT_SCRIPT)
+
+    def hit_rate(self):
+        return self.hits / self.started if self.started else 1.0
+
+    async def _refresh(self):
+        """Shared counters: load what every worker has counted."""
+        if self.redis is not None:
+            started, hits = await self.redis.hmget(self.key, "started", "hits")
+            self.started, self.hits = float(started or 0), float(hits or 0)
+
+    async def admit(self):
+        """Return (admitted, reason)."""
+        if self.running >= self.max_concurrent:
+            self.rejected += 1
+            return False, "concurrency"
+        await self._refresh()
+        if self.started >= self.window // 4 and self.hit_rate() < self.min_hit_rate:
+            # Throttle proportionally to how far below the floor we are
+            if random.random() > max(self.min_admit, self.hit_rate() / self.min_hit_rate):
+                self.rejected += 1
+                return False, "hit_rate"
+        return True, "ok"
+
+    async def on_start(self):
+        self.running += 1
+        if self.redis is not None:
+            started, hits = await self._start(keys=[self.key], args=[self.window])
+            self.started, self.hits = float(started), float(hits)
+            return
+        self.started += 1
+        if self.started > self.window:
+            self.started /= 2
+            self.hits /= 2
+
+    def on_finish(self):
+        self.running = max(0, self.running - 1)
+
+    async def on_hit(self):
+        if self.redis is not None:
+            started, hits = await self._hit(keys=[self.key])
+            self.started, self.hits = float(started), float(hits)
+            return
+        self.hits = min(self.hits + 1, self.started)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "hit_rate": round(self.hit_rate(), 3),
+            "rejected": self.rejected,
+            "shared_hit_rate": self.redis is not None,
+        }
+
+
+# Caps in Redis: every session of a prefix is in one sorted set scored by its
+# creation time, its size in a hash, and the total in a counter. The scripts
+# below share KEYS = [index, sizes, bytes] and ARGV = [prefix, session_id, ...]
+# so drop() can remove any session's keys. Eviction deletes the oldest entries
+# (never ARGV[2]), so their producers stop at their next append.
+CAPS_LUA = """
+local function drop(sid)
+  redis.call('DEL', ARGV[1] .. ':' .. sid .. ':meta', ARGV[1] .. ':' .. sid .. ':chunks')
+  local size = tonumber(redis.call('HGET', KEYS[2], sid) or '0')
+  redis.call('HDEL', KEYS[2], sid)
+  redis.call('ZREM', KEYS[1], sid)
+  redis.call('DECRBY', KEYS[3], size)
+end
+
+local function evict(max_entries, max_bytes)
+  local evicted = {}
+  while redis.call('ZCARD', KEYS[1]) > max_entries
+      or tonumber(redis.call('GET', KEYS[3]) or '0') > max_bytes do
+    local victim = nil
+    for _, sid in ipairs(redis.call('ZRANGE', KEYS[1], 0, 1)) do
+      if sid ~= ARGV[2] then
+        victim = sid
+        break
+      end
+    end
+    if victim == nil then
+      break
+    end
+    drop(victim)
+    table.insert(evicted, victim)
+  end
+  return evicted
+end
+"""
+
+# ARGV: prefix, session_id, ttl, max_entries, max_bytes, now. Returns the evicted sessions.
+CREATE_SCRIPT = CAPS_LUA + """
+drop(ARGV[2])
+local meta = ARGV[1] .. ':' .. ARGV[2] .. ':meta'
+redis.call('HSET', meta, 'created', ARGV[6], 'done', 0, 'error', '')
+redis.call('EXPIRE', meta, ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[6], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[2], 0)
+return evict(tonumber(ARGV[4]), tonumber(ARGV[5]))
+"""
+
+# ARGV: prefix, session_id, ttl, max_entries, max_bytes, chunk. Only while the
+# meta hash exists, so a deleted session's chunks stream is never re-created.
+# Returns false if the entry is gone, else the evicted sessions.
+APPEND_SCRIPT = CAPS_LUA + """
+local meta = ARGV[1] .. ':' .. ARGV[2] .. ':meta'
+local chunks = ARGV[1] .. ':' .. ARGV[2] .. ':chunks'
+if redis.call('EXISTS', meta) == 0 then
+  return false
+end
+redis.call('XADD', chunks, '*', 'chunk', ARGV[6])
+redis.call('EXPIRE', chunks, ARGV[3])
+redis.call('HINCRBY', KEYS[2], ARGV[2], #ARGV[6])
+redis.call('INCRBY', KEYS[3], #ARGV[6])
+return evict(tonumber(ARGV[4]), tonumber(ARGV[5]))
+"""
+
+# ARGV: prefix, session_id
+DELETE_SCRIPT = CAPS_LUA + """
+drop(ARGV[2])
+"""
+
+# ARGV: prefix, "", created cutoff. Returns how many sessions were dropped.
+CLEANUP_SCRIPT = CAPS_LUA + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+for _, sid in ipairs(expired) do
+  drop(sid)
+end
+return #expired
+"""
+
+# KEYS[1] meta hash
+PROMOTE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('HSET', KEYS[1], 'promoted', 1)
+end
+"""
+
+# KEYS[1] meta hash, KEYS[2] chunks stream; ARGV: ttl, error ("" for none)
+FINISH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'done', 1, 'error', ARGV[2])
+redis.call('XADD', KEYS[2], '*', 'end', 1)
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class RedisPregenStore:
+    """
+    Cross-worker store on top of redis.asyncio.
+
+    Keys per session (both expire after ttl):
+      pregen:{sid}:meta    hash  {created, done, error, promoted}
+      pregen:{sid}:chunks  stream of {chunk: bytes} entries, closed by an {end: 1} entry
+
+    Shared by all sessions of the prefix (never expire):
+      pregen:index  sorted set of session ids by creation time
+      pregen:sizes  hash {sid: chunk bytes}
+      pregen:bytes  total chunk bytes
+
+    Any worker can tail() a generation another worker is producing: readers
+    block on XREAD until the producer adds a chunk or the end entry. Any
+    worker can delete() it too: the producer's next append() returns False.
+    max_entries / max_bytes hold across all workers: create() and append()
+    evict the oldest entries (by creation, not last use as in memory).
+    Pass a redis.asyncio client (or fakeredis.FakeAsyncRedis) to the constructor.
+    """
+
+    key_prefix = "pregen"
+    block_ms = 1000
+
+    def __init__(self, redis_client, ttl=PREGEN_TTL_SECONDS, key_prefix=None, max_entries=PREGEN_MAX_ENTRIES,
+                 max_bytes=PREGEN_MAX_BYTES):
+        self.redis = redis_client
+        self.ttl = ttl
+        if key_prefix is not None:
+            self.key_prefix = key_prefix
+        self.name = self.key_prefix.upper()  # Log tag
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Tasks can't live in Redis - keep the ones this worker owns
+        self.tasks = {}
+        self.expired_count = 0
+        self.evicted_count = 0
+        self._create = redis_client.register_script(CREATE_SCRIPT)
+        self._append = redis_client.register_script(APPEND_SCRIPT)
+        self._delete = redis_client.register_script(DELETE_SCRIPT)
+        self._cleanup = redis_client.register_script(CLEANUP_SCRIPT)
+        self._finish = redis_client.register_script(FINISH_SCRIPT)
+        self._promote = redis_client.register_script(PROMOTE_SCRIPT)
+
+    def _caps_keys(self):
+        return [f"{self.key_prefix}:index", f"{self.key_prefix}:sizes", f"{self.key_prefix}:bytes"]
+
+    def _cancel_local(self, session_id):
+        task = self.tasks.pop(session_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    def _evicted(self, sessions):
+        """Cancel the producers this worker owns among evicted sessions; the others stop at their next append()."""
+        for session_id in sessions:
+            session_id = session_id.decode("utf-8")
+            user_logger.info(f"[{self.name}_EVICT] Evicting {session_id}")
+            self._cancel_local(session_id)
+            self.evicted_count += 1
+
+    def _meta_key(self, session_id):
+        return f"{self.key_prefix}:{session_id}:meta"
+
+    def _chunks_key(self, session_id):
+        return f"{self.key_prefix}:{session_id}:chunks"
+
+    async def create(self, session_id):
+        args = [self.key_prefix, session_id, self.ttl, self.max_entries, self.max_bytes, time.time()]
+        self._evicted(await self._create(keys=self._caps_keys(), args=args))
+
+    def attach_task(self, session_id, task):
+        self.tasks[session_id] = task
+        task.add_done_callback(lambda _t: self.tasks.pop(session_id, None))
+
+    async def append(self, session_id, chunk):
+        args = [self.key_prefix, session_id, self.ttl, self.max_entries, self.max_bytes, chunk]
+        evicted = await self._append(keys=self._caps_keys(), args=args)
+        if evicted is None:
+            return False
+        self._evicted(evicted)
+        return True
+
+    async def finish(self, session_id, error=None):
+        keys = [self._meta_key(session_id), self._chunks_key(session_id)]
+        await self._finish(keys=keys, args=[self.ttl, error or ""])
+
+    async def exists(self, session_id):
+        return bool(await self.redis.exists(self._meta_key(session_id)))
+
+    async def status(self, session_id):
+        meta = await self.redis.hgetall(self._meta_key(session_id))
+        if not meta:
+            return None
+        error = meta.get(b"error", b"").decode("utf-8")
+        done = meta.get(b"done") == b"1"
+        entries = await self.redis.xlen(self._chunks_key(session_id))
+        return {
+            'done': done,
+            'error': error or None,
+            'chunks': entries - 1 if done else entries,  # minus the end entry
+        }
+
+    async def tail(self, session_id):
+        if not await self.exists(session_id):
+            return
+        chunks_key = self._chunks_key(session_id)
+        last_id = "0-0"
+        while True:
+            response = await self.redis.xread({chunks_key: last_id}, block=self.block_ms, count=100)
+            if not response:
+                # Nothing new - fail if the session expired or was deleted before its end entry
+                if not await self.exists(session_id):
+                    raise PregenDropped(session_id)
+                continue
+            for _key, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    if b"end" in fields:
+                        return
+                    yield fields[b"chunk"]
+
+    async def promote(self, session_id):
+        await self._promote(keys=[self._meta_key(session_id)])
+
+    async def promoted(self, session_id):
+        return await self.redis.hget(self._meta_key(session_id), "promoted") == b"1"
+
+    async def delete(self, session_id):
+        await self._delete(keys=self._caps_keys(), args=[self.key_prefix, session_id])
+        self._cancel_local(session_id)
+
+    async def cleanup(self):
+        """Drop index entries past their TTL (Redis already expired their keys)."""
+        expired = await self._cleanup(keys=self._caps_keys(), args=[self.key_prefix, "", time.time() - self.ttl])
+        self.expired_count += expired
+        return expired
+
+    def stats(self):
+        # Entry and byte totals live in Redis; report what this worker did
+        return {
+            "local_tasks": len(self.tasks),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count,
+        }
+
+
+def create_pregen_admission(store):
+    """PregenAdmission for `store`, counting hits across workers when the store is shared through Redis."""
+    if isinstance(store, RedisPregenStore):
+        return PregenAdmission(redis_client=store.redis, key=f"{store.key_prefix}:admission")
+    return PregenAdmission()
+
+
+def create_pregen_store(key_prefix="pregen", max_entries=PREGEN_MAX_ENTRIES, max_bytes=PREGEN_MAX_BYTES):
+    """
+    Pick the backend from the environment:
+      PREGEN_STORE=redis (or REDIS_URL set) -> RedisPregenStore on REDIS_URL
+      otherwise                            -> InMemoryPregenStore
+
+    Other chunk logs with the same lifetime (background repair patches) get
+    their own store: their own key prefix and their own caps.
+    """
+    if use_redis("PREGEN_STORE"):
+        try:
+            store = RedisPregenStore(shared_redis(), key_prefix=key_prefix, max_entries=max_entries, max_bytes=max_bytes)
+            user_logger.info(f"[PREGEN_STORE] Using Redis store at {REDIS_URL} for {key_prefix}")
+            return store
+        except ImportError:
+            user_logger.warning("[PREGEN_STORE] redis package not installed - falling back to in-memory store")
+    return InMemoryPregenStore(max_entries=max_entries, max_bytes=max_bytes, name=key_prefix.upper())
@@ -0,0 +1,344 @@
+import asyncio
+import os
+import re
+import time
+
+from logger_setup import mealplan_logger
+from redis_client import REDIS_URL, shared_redis, use_redis
+
+# ============================================================
+# RATE GOVERNOR - Stay under the provider's RPM/TPM caps on purpose
+# ============================================================
+# Groq enforces requests- and tokens-per-minute limits per account, shared
+# by every gunicorn worker. Without coordination the cap is found by a 429,
+# which surfaces as an error in the middle of someone's plan. The governor
+# keeps an estimate of the remaining quota and gates every call
+# (LLMScheduler asks it after a slot is granted):
+#
+#   cost       prompt characters / 4 + max_tokens (RATE_DEFAULT_MAX_TOKENS if unset),
+#              settled against the real usage once known: the response's usage,
+#              or for a stream its usage chunk / the content chunks it delivered
+#   budget     buckets refilled at limit / 60 per second. Tokens: TPM, resynced
+#              by every response's x-ratelimit-{limit,remaining}-tokens.
+#              Requests: RATE_LIMIT_RPM only - Groq's x-ratelimit-*-requests
+#              headers count requests per DAY, so they are kept for /metrics
+#              (requests_per_day, remaining_requests_day) and not refilled per
+#              minute. A 429's retry-after empties both until then.
+#   reserve    a class may only spend down to RATE_RESERVE[class] x limit, so
+#              the last part of the minute is kept for the classes above it
+#
+# A call that doesn't fit waits for the refill. Interactive calls wait at
+# most RATE_MAX_WAIT seconds and then go ahead anyway (the provider decides).
+# Lower classes are shed with RateLimitShed instead: prep stages fall back
+# to their defaults, repairs keep the locally corrected day, and speculative
+# pre-generations are dropped.
+#
+# The budget lives in Redis (RATE_GOVERNOR_STORE=redis, or REDIS_URL set) so
+# all workers spend from the same estimate; otherwise it is per process.
+# RATE_GOVERNOR=simulate makes every decision and counts it but never waits
+# or sheds - to size the reserves against real (or fake_llm_server) traffic.
+
+RATE_GOVERNOR_MODE = os.getenv("RATE_GOVERNOR", "on").lower()  # on | simulate | off
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "0"))         # No header reports it; 0 = not enforced
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "0"))         # Seeds until headers arrive; 0 = unknown
+RATE_DEFAULT_MAX_TOKENS = int(os.getenv("RATE_DEFAULT_MAX_TOKENS", "1024"))
+# interactive, prep, repair, speculative (LLMScheduler classes)
+RATE_RESERVE = (0.0, 0.05, 0.15, 0.30)
+RATE_MAX_WAIT = (
+    float(os.getenv("RATE_MAX_WAIT_INTERACTIVE", "20")),
+    float(os.getenv("RATE_MAX_WAIT_PREP", "2")),
+    float(os.getenv("RATE_MAX_WAIT_REPAIR", "10")),
+    float(os.getenv("RATE_MAX_WAIT_SPECULATIVE", "0")),
+)
+RATE_KEY = "ratelimit:groq"
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+class RateLimitShed(Exception):
+    """A lower-priority call was not sent because the rate-limit budget is kept for higher classes."""
+
+
+def parse_duration(value):
+    """Groq reset headers ('2m59.56s', '7.66s', '120ms') or a retry-after number -> seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    return sum(float(n) * DURATION_SECONDS[unit] for n, unit in parts) if parts else None
+
+
+def estimate_prompt_tokens(kwargs):
+    return sum(len(m.get("content") or "") for m in kwargs.get("messages") or []) // 4
+
+
+def estimate_cost(kwargs):
+    return estimate_prompt_tokens(kwargs) + (kwargs.get("max_tokens") or RATE_DEFAULT_MAX_TOKENS)
+
+
+def read_headers(headers):
+    """Rate-limit fields of a response's headers (any mapping with .get), None if it has none."""
+    if headers is None:
+        return None
+    fields = {}
+    for field, name in (("requests_per_day", "x-ratelimit-limit-requests"), ("limit_tokens", "x-ratelimit-limit-tokens"),
+                        ("remaining_requests_day", "x-ratelimit-remaining-requests"),
+                        ("remaining_tokens", "x-ratelimit-remaining-tokens")):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                fields[field] = float(value)
+            except ValueError:
+                pass
+    retry_after = parse_duration(headers.get("retry-after"))
+    if retry_after is not None:
+        fields["retry_after"] = retry_after
+    return fields or None
+
+
+class LocalBudget:
+    """Token buckets for one process."""
+
+    def __init__(self, limit_requests=RATE_LIMIT_RPM, limit_tokens=RATE_LIMIT_TPM):
+        self.limit_requests = float(limit_requests)
+        self.limit_tokens = float(limit_tokens)
+        self.remaining_requests = self.limit_requests
+        self.remaining_tokens = self.limit_tokens
+        self.updated = time.time()
+        self.blocked_until = 0.0
+        self.day = {}  # requests_per_day / remaining_requests_day, as last reported
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self.updated)
+        self.remaining_requests = min(self.limit_requests, self.remaining_requests + elapsed * self.limit_requests / 60)
+        self.remaining_tokens = min(self.limit_tokens, self.remaining_tokens + elapsed * self.limit_tokens / 60)
+        self.updated = now
+
+    async def reserve(self, cost, reserve_fraction, dry_run=False):
+        """Take one request and `cost` tokens if they fit above the reserve: (ok, seconds to wait)."""
+        now = time.time()
+        self._refill(now)
+        if now < self.blocked_until:
+            return False, self.blocked_until - now
+        waits = []
+        for remaining, limit, need in ((self.remaining_requests, self.limit_requests, 1),
+                                       (self.remaining_tokens, self.limit_tokens, cost)):
+            if limit <= 0:
+                continue  # Unknown limit: don't gate on it
+            deficit = reserve_fraction * limit + need - remaining
+            if deficit > 0:
+                waits.append(deficit / (limit / 60))
+        if waits and not dry_run:
+            return False, max(waits)
+        if self.limit_requests > 0:
+            self.remaining_requests -= 1
+        if self.limit_tokens > 0:
+            self.remaining_tokens -= cost
+        return not waits, max(waits) if waits else 0.0
+
+    async def refund(self, tokens):
+        if self.limit_tokens > 0:
+            self.remaining_tokens = min(self.limit_tokens, self.remaining_tokens + tokens)
+
+    async def observe(self, fields):
+        now = time.time()
+        self._refill(now)
+        self.limit_tokens = fields.get("limit_tokens", self.limit_tokens)
+        self.remaining_tokens = fields.get("remaining_tokens", self.remaining_tokens)
+        self.day.update({k: v for k, v in fields.items() if k.endswith("_day")})
+        if "retry_after" in fields:
+            self.blocked_until = max(self.blocked_until, now + fields["retry_after"])
+            self.remaining_requests = min(self.remaining_requests, 0.0)
+            self.remaining_tokens = min(self.remaining_tokens, 0.0)
+
+    async def snapshot(self):
+        self._refill(time.time())
+        return {
+            "limit_requests": self.limit_requests,
+            "limit_tokens": self.limit_tokens,
+            "remaining_requests": round(self.remaining_requests),
+            "remaining_tokens": round(self.remaining_tokens),
+            **self.day,
+        }
+
+
+# Same bucket arithmetic as LocalBudget, atomic across workers.
+# KEYS[1] budget hash; ARGV: now, cost, reserve_fraction, dry_run, seed_limit_requests, seed_limit_tokens
+RESERVE_SCRIPT = """
+local b = redis.call('HGETALL', KEYS[1])
+local f = {}
+for i = 1, #b, 2 do f[b[i]] = tonumber(b[i + 1]) end
+local now, cost, frac, dry = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4] == '1'
+local lr = f.limit_requests or tonumber(ARGV[5])
+local lt = f.limit_tokens or tonumber(ARGV[6])
+local elapsed = math.max(0, now - (f.updated or now))
+local rr = math.min(lr, (f.remaining_requests or lr) + elapsed * lr / 60)
+local rt = math.min(lt, (f.remaining_tokens or lt) + elapsed * lt / 60)
+local blocked = f.blocked_until or 0
+if now < blocked then
+  redis.call('HSET', KEYS[1], 'limit_requests', lr, 'limit_tokens', lt, 'remaining_requests', rr,
+             'remaining_tokens', rt, 'updated', now)
+  return {0, tostring(blocked - now)}
+end
+local wait = 0
+if lr > 0 then wait = math.max(wait, (frac * lr + 1 - rr) / (lr / 60)) end
+if lt > 0 then wait = math.max(wait, (frac * lt + cost - rt) / (lt / 60)) end
+local ok = wait <= 0
+if ok or dry then
+  if lr > 0 then rr = rr - 1 end
+  if lt > 0 then rt = rt - cost end
+end
+redis.call('HSET', KEYS[1], 'limit_requests', lr, 'limit_tokens', lt, 'remaining_requests', rr,
+           'remaining_tokens', rt, 'updated', now)
+redis.call('EXPIRE', KEYS[1], 3600)
+return {ok and 1 or 0, tostring(math.max(wait, 0))}
+"""
+
+
+class RedisBudget:
+    """LocalBudget shared by every worker through one Redis hash."""
+
+    def __init__(self, redis_client, key=RATE_KEY, limit_requests=RATE_LIMIT_RPM, limit_tokens=RATE_LIMIT_TPM):
+        self.redis = redis_client
+        self.key = key
+        self.seed = (float(limit_requests), float(limit_tokens))
+        self._reserve = redis_client.register_script(RESERVE_SCRIPT)
+
+    async def reserve(self, cost, reserve_fraction, dry_run=False):
+        ok, wait = await self._reserve(
+            keys=[self.key], args=[time.time(), cost, reserve_fraction, int(dry_run), *self.seed]
+        )
+        return bool(ok), float(wait)
+
+    async def refund(self, tokens):
+        await self.redis.hincrbyfloat(self.key, "remaining_tokens", tokens)
+
+    async def observe(self, fields):
+        now = time.time()
+        mapping = {k: v for k, v in fields.items() if k != "retry_after"}
+        if "retry_after" in fields:
+            mapping.update(remaining_requests=0, remaining_tokens=0, blocked_until=now + fields["retry_after"])
+        if mapping:
+            mapping["updated"] = now
+            await self.redis.hset(self.key, mapping=mapping)
+
+    async def snapshot(self):
+        values = await self.redis.hgetall(self.key)
+        fields = {k.decode() if isinstance(k, bytes) else k: float(v) for k, v in values.items()}
+        return {name: round(fields[name]) if name.startswith("remaining") else fields[name]
+                for name in ("limit_requests", "limit_tokens", "remaining_requests", "remaining_tokens",
+                             "requests_per_day", "remaining_requests_day")
+                if name in fields}
+
+
+class GovernorStats:
+    def __init__(self, classes):
+        self.classes = {name: {"admitted": 0, "delayed": 0, "delay_ms": 0.0, "shed": 0, "forced": 0}
+                        for name in classes}
+        self.headers_seen = 0
+        self.rate_limited = 0   # 429s that reached the governor
+        self.refunded_tokens = 0
+
+    def as_dict(self):
+        return {
+            "classes": {name: {**c, "delay_ms": round(c["delay_ms"])} for name, c in self.classes.items()},
+            "headers_seen": self.headers_seen,
+            "rate_limited": self.rate_limited,
+            "refunded_tokens": self.refunded_tokens,
+        }
+
+
+class RateGovernor:
+    def __init__(self, budget, class_names, mode=RATE_GOVERNOR_MODE, reserves=RATE_RESERVE,
+                 max_waits=RATE_MAX_WAIT, logger=None):
+        self.budget = budget
+        self.class_names = class_names
+        self.mode = mode
+        self.reserves = reserves
+        self.max_waits = max_waits
+        self.logger = logger
+        self.stats = GovernorStats(class_names)
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    async def admit(self, priority, cost):
+        """Wait until `cost` tokens fit this class's share of the budget; RateLimitShed if it won't in time."""
+        counters = self.stats.classes[self.class_names[priority]]
+        if self.mode == "simulate":
+            ok, wait = await self.budget.reserve(cost, self.reserves[priority], dry_run=True)
+            if not ok:
+                shed = priority > 0 and wait > self.max_waits[priority]
+                counters["shed" if shed else "delayed"] += 1
+                counters["delay_ms"] += 0 if shed else wait * 1000
+            counters["admitted"] += 1
+            return
+        deadline = time.monotonic() + self.max_waits[priority]
+        started = time.monotonic()
+        while True:
+            ok, wait = await self.budget.reserve(cost, self.reserves[priority])
+            if ok:
+                break
+            if time.monotonic() + wait > deadline:
+                if priority > 0:
+                    counters["shed"] += 1
+                    if self.logger is not None:
+                        self.logger.warning(f"[RATE_GOVERNOR] Shed {self.class_names[priority]} call "
+                                            f"({cost} tokens, {wait:.1f}s to fit)")
+                    raise RateLimitShed(f"{self.class_names[priority]} call shed: rate-limit budget reserved")
+                # Interactive: out of patience, send it and let the provider decide
+                await self.budget.reserve(cost, 0.0, dry_run=True)
+                counters["forced"] += 1
+                break
+            await asyncio.sleep(min(wait, max(0.05, deadline - time.monotonic())))
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            counters["delayed"] += 1
+            counters["delay_ms"] += waited * 1000
+        counters["admitted"] += 1
+
+    async def observe(self, headers):
+        fields = read_headers(headers)
+        if fields:
+            self.stats.headers_seen += 1
+            await self.budget.observe(fields)
+
+    async def observe_error(self, error):
+        """A provider error; 429s (status_code on the SDK exception) block the budget until retry-after."""
+        if getattr(error, "status_code", None) != 429:
+            return
+        self.stats.rate_limited += 1
+        response = getattr(error, "response", None)
+        fields = read_headers(getattr(response, "headers", None)) or {}
+        fields.setdefault("retry_after", 1.0)
+        await self.budget.observe(fields)
+
+    async def settle(self, estimated, used):
+        """Return the part of a call's estimate it did not use."""
+        if used is not None and used < estimated:
+            self.stats.refunded_tokens += estimated - used
+            await self.budget.refund(estimated - used)
+
+    async def stats_dict(self):
+        return {"mode": self.mode, "budget": await self.budget.snapshot(), **self.stats.as_dict()}
+
+
+def create_rate_governor(class_names):
+    """
+    RATE_GOVERNOR_STORE=redis (or REDIS_URL set) -> budget shared through Redis on REDIS_URL
+    otherwise                                    -> per-process budget
+    """
+    budget = None
+    if use_redis("RATE_GOVERNOR_STORE"):
+        try:
+            budget = RedisBudget(shared_redis())
+            mealplan_logger.info(f"[RATE_GOVERNOR] Sharing the rate-limit budget through Redis at {REDIS_URL}")
+        except ImportError:
+            mealplan_logger.warning("[RATE_GOVERNOR] redis package not installed - using a per-process budget")
+    return RateGovernor(budget or LocalBudget(), class_names, logger=mealplan_logger)
@@ -0,0 +1,28 @@
+import os
+
+# ============================================================
+# REDIS CLIENT - One connection pool for every Redis-backed store
+# ============================================================
+# The pre-generation store (and the repair patches), the rate-governor budget
+# and the stage cache can each live in Redis so every worker shares them:
+# <NAME>_STORE=redis, or REDIS_URL set and <NAME>_STORE not "memory". All of
+# them use the one redis.asyncio client of the process, so a worker keeps a
+# single connection pool to REDIS_URL instead of one per store.
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_client = None
+
+
+def use_redis(store_env):
+    """Does the `store_env` setting (e.g. "PREGEN_STORE") select Redis? Defaults to whether REDIS_URL is set."""
+    return os.getenv(store_env, "redis" if os.getenv("REDIS_URL") else "memory").lower() == "redis"
+
+
+def shared_redis():
+    """The process's redis.asyncio client on REDIS_URL; raises ImportError without the redis package."""
+    global _client
+    if _client is None:
+        import redis.asyncio as aioredis
+        _client = aioredis.from_url(REDIS_URL)
+    return _client
@@ -0,0 +1,179 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import re
+
+from broadcast import BroadcastChannel
+
+# ============================================================
+# SINGLE-FLIGHT COALESCING - One upstream generation per identical request
+# ============================================================
+# Frontend timeouts/retries and double submits used to start a brand-new
+# 4096-token Groq stream each time. Identical in-flight requests now share one
+# generation: the first caller (leader) starts a background producer that
+# publishes into a BroadcastChannel, and every caller - leader included -
+# subscribes to it. Followers get the already-emitted days immediately.
+
+_joined = contextvars.ContextVar("single_flight_joined", default=None)  # [(flights, key, channel)] a call leads
+
+
+def normalize_prompt(text):
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def normalize_list(values):
+    if isinstance(values, str):
+        values = [values]
+    return sorted({str(v).strip().lower() for v in (values or []) if str(v).strip()})
+
+
+def canonical_key(**fields):
+    """Stable sha256 over the normalized request fields."""
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent generations that share a key.
+
+    Usage from an endpoint (decorated with @flights.leads):
+        channel, leader = flights.join(key)
+        if leader:
+            ...prepare prompts...
+        return StreamingResponse(flights.stream(key, channel, event_stream if leader else None))
+
+    join() registers the key before the leader's preparatory work, so a
+    double submit during the curator/rules stages already coalesces. An
+    endpoint decorated with @flights.leads that raises (or is cancelled)
+    after join() made it the leader, before its stream started, closes the
+    channel with the error right away. A leader whose stream never starts
+    for any other reason (its response was dropped) is released after
+    `start_timeout` seconds.
+    stream() starts the producer (leader only; `factory` is a zero-arg callable
+    returning the async generator to run) and subscribes the caller. If every
+    subscriber goes away, the producer is cancelled after `linger` seconds
+    unless a retry re-attaches first.
+    """
+
+    def __init__(self, name, logger=None, linger=10.0, start_timeout=30.0):
+        self.name = name
+        self.logger = logger
+        self.linger = linger
+        self.start_timeout = start_timeout
+        self.inflight = {}
+        self.cancel_handles = {}
+        self.leaders = 0
+        self.followers = 0  # == upstream generations saved
+        self.abandoned = 0  # Leaders that failed before streaming
+
+    def _log(self, msg):
+        if self.logger is not None:
+            self.logger.info(f"[SINGLE_FLIGHT] {self.name}: {msg}")
+
+    def join(self, key):
+        """Return (channel, leader): leader is True if the caller starts a new generation."""
+        channel = self.inflight.get(key)
+        if channel is None:
+            channel = self.inflight[key] = BroadcastChannel()
+            loop = asyncio.get_event_loop()
+            loop.call_later(self.start_timeout, self._release_if_not_started, key, channel)
+            self.leaders += 1
+            self._log(f"leader {key[:12]}")
+            joined = _joined.get()
+            if joined is not None:
+                joined.append((self, key, channel))
+            return channel, True
+
+        self.followers += 1
+        handle = self.cancel_handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        self._log(f"follower {key[:12]} attached after {len(channel.chunks)} chunks "
+                  f"({self.followers} upstream calls saved)")
+        return channel, False
+
+    def leads(self, endpoint):
+        """Endpoint decorator: abandon the generations it leads if it fails before streaming them."""
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            joined = []
+            token = _joined.set(joined)
+            try:
+                return await endpoint(*args, **kwargs)
+            except BaseException as e:
+                for flights, key, channel in joined:
+                    flights.abandon(key, channel, "cancelled" if isinstance(e, asyncio.CancelledError) else str(e))
+                raise
+            finally:
+                _joined.reset(token)
+
+        return wrapper
+
+    def abandon(self, key, channel, error):
+        """The leader will not stream: release the key and end the followers' streams with the error."""
+        if channel.task is None and self.inflight.get(key) is channel:
+            self._log(f"leader {key[:12]} failed before streaming ({error}) - releasing")
+            del self.inflight[key]
+            self.abandoned += 1
+            asyncio.ensure_future(self._fail(channel, error))
+
+    async def _fail(self, channel, error):
+        await channel.publish(f"\n\nError: {error}\n".encode("utf-8"))
+        await channel.close(error)
+
+    def _release_if_not_started(self, key, channel):
+        self.abandon(key, channel, "leader never started streaming")
+
+    def _start(self, key, channel, factory):
+        async def produce():
+            error = None
+            try:
+                async for chunk in factory():
+                    await channel.publish(chunk)
+            except asyncio.CancelledError:
+                error = "cancelled"
+                raise
+            except Exception as e:
+                error = str(e)
+            finally:
+                await channel.close(error)
+                if self.inflight.get(key) is channel:
+                    del self.inflight[key]
+                self.cancel_handles.pop(key, None)
+
+        channel.task = asyncio.create_task(produce())
+
+    async def stream(self, key, channel, factory=None):
+        # Followers hold their channel, so they still replay it if the leader
+        # finishes (and releases the key) before their response starts
+        if channel.task is None and factory is not None:
+            self._start(key, channel, factory)
+
+        subscription = channel.subscribe()
+        try:
+            async for chunk in subscription:
+                yield chunk
+        finally:
+            await subscription.aclose()
+            # Last subscriber left (e.g. client disconnect) - give retries a grace period
+            if channel.subscribers == 0 and not channel.done and key not in self.cancel_handles:
+                loop = asyncio.get_event_loop()
+                self.cancel_handles[key] = loop.call_later(self.linger, self._cancel_if_orphaned, key, channel)
+
+    def _cancel_if_orphaned(self, key, channel):
+        self.cancel_handles.pop(key, None)
+        if channel.subscribers == 0 and not channel.done and channel.task is not None:
+            self._log(f"cancelling orphaned generation {key[:12]}")
+            channel.task.cancel()
+
+    def stats(self):
+        return {
+            "in_flight": len(self.inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "abandoned": self.abandoned,
+            "upstream_calls_saved": self.followers,
+        }
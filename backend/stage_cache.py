@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+from llm_scheduler import detached_context
+from redis_client import REDIS_URL, shared_redis, use_redis
+from single_flight import canonical_key, normalize_list
+
+# ============================================================
+# STAGE CACHE - Memoized curator directions and dietary rules
+# ============================================================
+# The dietary-rules stage only depends on the sorted restriction/allergy sets
+# (a few dozen combinations in practice) and the curator on the prompt, the
+# restrictions and the macro targets, yet both used to cost an LLM call per
+# plan. Results are cached under canonical keys:
+#
+#   dietary_rules   sorted, lowercased restrictions and allergies
+#   curator         prompt lowercased with punctuation and whitespace folded,
+#                   sorted restrictions, protein target in STAGE_CACHE_PROTEIN_BUCKET
+#                   grams and calories in STAGE_CACHE_CALORIE_BUCKET kcal steps
+#
+# The curator is asked with the bucketed targets, so a cached answer is the
+# one every request with that key would have got. Concurrent misses for a key
+# share one call, which runs in its own task: a stage that times out leaves it
+# running to fill the cache for the next request. That task runs outside the
+# first caller's SpeculativeWork, so an interactive request coalescing onto a
+# pre-generation's miss does not wait on a preemptible, sheddable call. Only
+# values the stage's `cacheable` predicate accepts are stored - the stage
+# functions answer a failed call with empty output ("" / empty directions).
+#
+# Entries live in a per-process LRU with a TTL, or in Redis
+# (STAGE_CACHE_STORE=redis, or REDIS_URL set) so every worker shares them and
+# `python -m stage_cache warm` can precompute the dietary rules beforehand:
+# the combinations extract_dietary_from_prompt can return with at most
+# --max-size restrictions + allergies (90 for the default 2; 6143 for 0 =
+# all). Warming refuses to run without a shared store, where its results
+# would be discarded with the process.
+
+STAGE_CACHE_MODE = os.getenv("STAGE_CACHE", "on").lower()
+STAGE_CACHE_MAX_ENTRIES = int(os.getenv("STAGE_CACHE_MAX_ENTRIES", "1000"))
+STAGE_CACHE_RULES_TTL = int(os.getenv("STAGE_CACHE_RULES_TTL", str(24 * 3600)))
+STAGE_CACHE_CURATOR_TTL = int(os.getenv("STAGE_CACHE_CURATOR_TTL", "3600"))
+STAGE_CACHE_PROTEIN_BUCKET = int(os.getenv("STAGE_CACHE_PROTEIN_BUCKET", "10"))
+STAGE_CACHE_CALORIE_BUCKET = int(os.getenv("STAGE_CACHE_CALORIE_BUCKET", "100"))
+STAGE_CACHE_VERSION = "1"  # Bump when a stage prompt changes
+STAGE_CACHE_PREFIX = "stagecache"
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def normalize_stage_prompt(text):
+    """Lowercase, punctuation to spaces, whitespace collapsed."""
+    return re.sub(r"\s+", " ", _PUNCTUATION.sub(" ", str(text or "").lower())).strip()
+
+
+def bucket(value, step):
+    if value is None or not step:
+        return value
+    return int(round(float(value) / step) * step)
+
+
+def dietary_rules_key(dietary, allergies):
+    return canonical_key(stage="dietary_rules", v=STAGE_CACHE_VERSION, dietary=dietary, allergies=allergies)
+
+
+def curator_key(user_prompt, dietary, protein_g, calories):
+    return canonical_key(stage="curator", v=STAGE_CACHE_VERSION, prompt=normalize_stage_prompt(user_prompt),
+                         dietary=dietary, protein=protein_g, calories=calories)
+
+
+class MemoryCacheStore:
+    """Process-local LRU of JSON values with per-entry expiry."""
+
+    shared = False
+
+    def __init__(self, max_entries=STAGE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, json); oldest access first
+        self.evictions = 0
+        self.expired = 0
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key, value, ttl):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {"backend": "memory", "entries": len(self.entries), "max_entries": self.max_entries,
+                "evictions": self.evictions, "expired": self.expired}
+
+
+class RedisCacheStore:
+    """Shared across workers; expiry is the key TTL, eviction the server's maxmemory policy."""
+
+    shared = True
+
+    def __init__(self, redis_client, prefix=STAGE_CACHE_PREFIX):
+        self.redis = redis_client
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.redis.get(f"{self.prefix}:{key}")
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    async def set(self, key, value, ttl):
+        await self.redis.set(f"{self.prefix}:{key}", value, ex=ttl)
+
+    def stats(self):
+        return {"backend": "redis", "prefix": self.prefix}
+
+
+class StageCache:
+    def __init__(self, name, store, ttl, enabled=STAGE_CACHE_MODE != "off", logger=None, cacheable=bool):
+        self.name = name
+        self.store = store
+        self.ttl = ttl
+        self.cacheable = cacheable  # value -> whether it is a real answer worth storing
+        self.enabled = enabled
+        self.logger = logger
+        self.inflight = {}  # key -> task computing it
+        self.lookups = 0
+        self.hits = 0
+        self.coalesced = 0  # Misses that waited for another caller's call
+        self.misses = 0
+        self.stores = 0
+        self.uncacheable = 0  # Computed values rejected by `cacheable` (failed calls)
+        self.store_errors = 0
+
+    async def get_or_compute(self, key, compute):
+        """Cached value for `key`, else await compute() (one call per key at a time) and cache it."""
+        if not self.enabled:
+            return await compute()
+        self.lookups += 1
+        task = self.inflight.get(key)
+        if task is None:
+            value = await self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            task = self.inflight.get(key)  # Another caller missed while we were reading
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self.inflight[key] = detached_context().run(asyncio.ensure_future, self._fill(key, compute))
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        self.inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved even if every caller gave up waiting
+
+    async def _fill(self, key, compute):
+        value = await compute()
+        if not self.cacheable(value):
+            self.uncacheable += 1
+            return value
+        try:
+            await self.store.set(key, json.dumps(value), self.ttl)
+            self.stores += 1
+        except Exception as e:
+            self._store_error("write", e)
+        return value
+
+    async def get(self, key):
+        """Cached value or None (store errors read as a miss); not counted as a lookup."""
+        try:
+            value = await self.store.get(key)
+        except Exception as e:
+            self._store_error("read", e)
+            return None
+        return json.loads(value) if value is not None else None
+
+    def _store_error(self, action, error):
+        self.store_errors += 1
+        if self.logger is not None:
+            self.logger.warning(f"[STAGE_CACHE] {self.name}: {action} failed: {error}")
+
+    async def put(self, key, value):
+        await self.store.set(key, json.dumps(value), self.ttl)
+        self.stores += 1
+
+    def stats(self):
+        answered = self.hits + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "ttl_s": self.ttl,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_ratio": round(answered / self.lookups, 3) if self.lookups else 0.0,
+            "stores": self.stores,
+            "uncacheable": self.uncacheable,
+            "store_errors": self.store_errors,
+            "inflight": len(self.inflight),
+            **self.store.stats(),
+        }
+
+
+def create_stage_store(logger=None):
+    """
+    Pick the backend from the environment:
+      STAGE_CACHE_STORE=redis (or REDIS_URL set) -> RedisCacheStore on REDIS_URL
+      otherwise                                  -> MemoryCacheStore
+    """
+    if use_redis("STAGE_CACHE_STORE"):
+        try:
+            store = RedisCacheStore(shared_redis())
+            if logger is not None:
+                logger.info(f"[STAGE_CACHE] Using Redis at {REDIS_URL}")
+            return store
+        except ImportError:
+            if logger is not None:
+                logger.warning("[STAGE_CACHE] redis package not installed - falling back to a per-process cache")
+    return MemoryCacheStore()
+
+
+def restriction_combinations(diet_types, dietary, allergies, max_size=0):
+    """
+    Every (dietary, allergies) pair extract_dietary_from_prompt can return,
+    canonicalized: at most one diet type, any subset of the other restrictions
+    and allergies, at most max_size items in total (0 = no limit).
+    """
+    options = [None] + list(diet_types)
+    flags = list(dietary) + [("allergy", a) for a in allergies]
+    limit = max_size or len(flags) + 1
+    for diet_type in options:
+        room = limit - (diet_type is not None)
+        for size in range(0, min(room, len(flags)) + 1):
+            for chosen in itertools.combinations(flags, size):
+                restrictions = [diet_type] if diet_type else []
+                restrictions += [f for f in chosen if not isinstance(f, tuple)]
+                found_allergies = [f[1] for f in chosen if isinstance(f, tuple)]
+                if restrictions or found_allergies:
+                    yield normalize_list(restrictions), normalize_list(found_allergies)
+
+
+def app_combinations(app, max_size):
+    return list(restriction_combinations(
+        [name for name, _ in app.DIET_TYPE_TERMS], [name for name, _ in app.DIETARY_TERMS],
+        [name for name, _ in app.ALLERGY_TERMS], max_size,
+    ))
+
+
+async def warm_dietary_rules(max_size, concurrency):
+    import app
+
+    if not app.dietary_rules_cache.store.shared:
+        raise SystemExit("error: the stage cache is per-process here; set REDIS_URL or STAGE_CACHE_STORE=redis "
+                         "so the warmed rules reach the server")
+    combinations = app_combinations(app, max_size)
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"cached": 0, "generated": 0, "failed": 0}
+
+    async def warm(dietary, allergies):
+        async with semaphore:
+            key = dietary_rules_key(dietary, allergies)
+            if await app.dietary_rules_cache.get(key) is not None:
+                counts["cached"] += 1
+                return
+            rules = await app.generate_dietary_rules_llm(app.client, dietary, allergies)
+            if rules:
+                await app.dietary_rules_cache.put(key, rules)
+                counts["generated"] += 1
+            else:
+                counts["failed"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(warm(dietary, allergies) for dietary, allergies in combinations))
+    print(f"{len(combinations)} combinations in {time.perf_counter() - started:.1f}s: "
+          f"{counts['generated']} generated, {counts['cached']} already cached, {counts['failed']} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute cached dietary rules.")
+    parser.add_argument("command", choices=["warm", "combinations"])
+    parser.add_argument("--max-size", type=int, default=2,
+                        help="only combinations of at most this many restrictions + allergies (0 = all)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        asyncio.run(warm_dietary_rules(args.max_size, args.concurrency))
+    else:
+        import app
+        combinations = app_combinations(app, args.max_size)
+        for dietary, allergies in combinations:
+            print(json.dumps({"dietary": dietary, "allergies": allergies}))
+        print(f"{len(combinations)} combinations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+
+# ============================================================
+# STAGE GRAPH - Run independent preparatory LLM stages concurrently
+# ============================================================
+# Each stage is an async callable with an optional list of dependencies,
+# a deadline and a fallback value. Stages with no pending dependencies start
+# immediately, so the caller waits for the slowest *needed* stage (or its
+# deadline) instead of the sum of all of them.
+
+
+class Stage:
+    """
+    One node of the graph.
+
+    fn is called with the results of its deps as keyword arguments,
+    e.g. Stage("rules", lambda curator: ..., deps=["curator"]).
+    On timeout or exception the stage resolves to `fallback`.
+    """
+
+    def __init__(self, name, fn, deps=None, timeout=None, fallback=None):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps or [])
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+async def run_stages(stages, logger=None, label="STAGES", context=None):
+    """
+    Run a list of Stage objects respecting deps; returns {name: result}.
+
+    Logs one structured record per run:
+    [STAGES] {"total_ms": .., "stages": {"curator": {"status": "ok", "ms": ..}, ...}, ...context}
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [d for d in stage.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {missing}")
+
+    tasks = {}
+    timings = {}
+    t_start = time.perf_counter()
+
+    async def run_one(stage):
+        dep_results = {}
+        for dep in stage.deps:
+            dep_results[dep] = await tasks[dep]
+
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            result = await asyncio.wait_for(stage.fn(**dep_results), timeout=stage.timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            result = stage.fallback
+        except Exception as e:
+            status = f"error: {e}"
+            result = stage.fallback
+
+        timings[stage.name] = {
+            "status": status,
+            "ms": round((time.perf_counter() - started) * 1000),
+            "waited_ms": round((started - t_start) * 1000),
+        }
+        return result
+
+    for stage in _topological_order(stages):
+        tasks[stage.name] = asyncio.ensure_future(run_one(stage))
+
+    try:
+        values = await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+
+    if logger is not None:
+        record = {"total_ms": round((time.perf_counter() - t_start) * 1000), "stages": timings}
+        if context:
+            record.update(context)
+        logger.info(f"[{label}] {json.dumps(record)}")
+
+    return dict(zip(tasks.keys(), values))
+
+
+def _topological_order(stages):
+    """Order stages so every dependency is scheduled before its dependents."""
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Stage graph has a cycle through '{stage.name}'")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+from day_segmenter import SUGGESTION_PATTERN
+
+# ============================================================
+# TYPED STREAM EVENTS - NDJSON / SSE framing of the plan streams
+# ============================================================
+# /mealplan and /workoutplan stream application/octet-stream: formatted day
+# text, REPLACE-DAY patches, error strings and bare "\n" keep-alives (one per
+# fallback token), which the frontend re-parses. A client that sends
+#
+#   Accept: application/x-ndjson     one JSON object per line
+#   Accept: text/event-stream        SSE: "event: <type>\ndata: <json>\n\n"
+#
+# gets typed events instead:
+#
+#   day         {"day": 3, "meals": [{"meal", "kcal", "items": [[name, quantity, unit, kcal], ...]}],
+#                "total_kcal", "elapsed_ms"}; "replace": true when it is a background
+#               repair of a day already sent. Items are positional to keep days
+#               about as small as their text.
+#   suggestion  {"text"}
+#   progress    {"days", "total", "elapsed_ms"} after every day
+#   heartbeat   {"elapsed_ms"} every STREAM_HEARTBEAT_SECONDS without another event
+#   error       {"message"}
+#
+# The events are derived from the legacy byte stream at the edge, per
+# response, so single-flight followers and pregen replays are encoded the
+# same way and the producers stay format-agnostic. Without one of those
+# Accept types the response is the legacy text, byte for byte.
+
+STREAM_FORMAT_TEXT = "text"
+STREAM_FORMAT_NDJSON = "ndjson"
+STREAM_FORMAT_SSE = "sse"
+STREAM_MEDIA_TYPES = {
+    STREAM_FORMAT_TEXT: "application/octet-stream",
+    STREAM_FORMAT_NDJSON: "application/x-ndjson",
+    STREAM_FORMAT_SSE: "text/event-stream",
+}
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "10"))
+PLAN_DAYS = 7
+
+PATCH_PATTERN = re.compile(r'^\s*REPLACE-DAY-(\d+):\n(.*?)\nEND-REPLACE-DAY-\1', re.DOTALL)
+ERROR_PATTERN = re.compile(r'^\s*(?:\[(?:FALLBACK )?ERROR\]|Error\b|Exception during streaming)')
+DAY_HEADER_PATTERN = re.compile(r'^\s*Day (\d+)\b[^\n]*', re.MULTILINE)
+MEAL_PATTERN = re.compile(r'^\s*-\s*(Breakfast|Lunch|Snack|Dinner)\s*\((\d+)\s*kcal', re.IGNORECASE)
+ITEM_PATTERN = re.compile(r'^\s*\d+\.\s*(.+?)\s+[—-]\s+([\d.]+)\s*([^\s—-]*)\s+[—-]\s+(\d+)\s*kcal')
+TOTAL_PATTERN = re.compile(r'^\s*Total(?: Daily Calories)?:\s*(\d+)\s*kcal', re.IGNORECASE)
+
+
+def negotiate_stream_format(request):
+    """STREAM_FORMAT_* from the Accept header; anything else keeps the legacy text stream."""
+    accept = request.headers.get("accept", "").lower()
+    if "text/event-stream" in accept:
+        return STREAM_FORMAT_SSE
+    if "application/x-ndjson" in accept:
+        return STREAM_FORMAT_NDJSON
+    return STREAM_FORMAT_TEXT
+
+
+def parse_day(text):
+    """Processed day text -> {"day", "meals": [...], "total_kcal"}; "text" too if no meal was recognized."""
+    header = DAY_HEADER_PATTERN.search(text)
+    day = {"day": int(header.group(1)) if header else None, "meals": [], "total_kcal": None}
+    meal = None
+    for line in text.splitlines():
+        match = MEAL_PATTERN.match(line)
+        if match:
+            meal = {"meal": match.group(1).capitalize(), "kcal": int(match.group(2)), "items": []}
+            day["meals"].append(meal)
+            continue
+        match = ITEM_PATTERN.match(line)
+        if match and meal is not None:
+            name, quantity, unit, kcal = match.groups()
+            meal["items"].append([name, float(quantity) if "." in quantity else int(quantity), unit, int(kcal)])
+            continue
+        match = TOTAL_PATTERN.match(line)
+        if match:
+            day["total_kcal"] = int(match.group(1))
+    if not day["meals"]:
+        day["text"] = text.strip()
+    return day
+
+
+def parse_workout_day(text):
+    """'Day 1 – Chest & Triceps:\\n1. Bench press — 4 × 8' -> {"day", "title", "text"}."""
+    header = DAY_HEADER_PATTERN.search(text)
+    title = re.sub(r'^\s*Day \d+\s*[–—:-]*\s*', "", header.group(0)).rstrip(":").strip() if header else ""
+    body = text[header.end():] if header else text
+    return {"day": int(header.group(1)) if header else None, "title": title, "text": body.strip()}
+
+
+def suggestion_text(text):
+    return SUGGESTION_PATTERN.sub("", text, count=1).strip()
+
+
+class StreamEventStats:
+    def __init__(self):
+        self.responses = {STREAM_FORMAT_NDJSON: 0, STREAM_FORMAT_SSE: 0}
+        self.events = {}
+        self.legacy_bytes = 0       # What the same responses would have sent as text
+        self.bytes_sent = 0
+        self.keepalives_dropped = 0
+
+    def count(self, event_type):
+        self.events[event_type] = self.events.get(event_type, 0) + 1
+
+    def stats(self):
+        return {
+            "responses": dict(self.responses),
+            "events": dict(self.events),
+            "legacy_bytes": self.legacy_bytes,
+            "bytes_sent": self.bytes_sent,
+            "keepalives_dropped": self.keepalives_dropped,
+        }
+
+
+class PlanEventEncoder:
+    """
+    Turns legacy /mealplan byte chunks into typed events.
+
+    Producers yield whole days, patches and errors as single chunks; the
+    suggestion may arrive token by token, so it is collected until the next
+    non-suggestion chunk or the end of the stream.
+    """
+
+    def __init__(self, total_days=PLAN_DAYS):
+        self.total_days = total_days
+        self.started = time.perf_counter()
+        self.days = 0
+        self.suggestion = None
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000)
+
+    def _flush_suggestion(self):
+        if self.suggestion is None:
+            return []
+        text, self.suggestion = suggestion_text(self.suggestion), None
+        return [("suggestion", {"text": text})] if text else []
+
+    def _day(self, text, replace=False):
+        day = parse_day(text)
+        day["elapsed_ms"] = self.elapsed_ms()
+        if replace:
+            day["replace"] = True
+            return [("day", day)]
+        self.days += 1
+        return [("day", day), ("progress", {"days": self.days, "total": self.total_days, "elapsed_ms": day["elapsed_ms"]})]
+
+    def feed(self, text):
+        """One legacy chunk -> [(event_type, payload), ...]; [] for keep-alives."""
+        if self.suggestion is not None and "\n" not in text:
+            self.suggestion += text  # Suggestion token; days, patches and errors are multi-line
+            return []
+        patch = PATCH_PATTERN.match(text)
+        if patch:
+            return self._flush_suggestion() + self._day(patch.group(2), replace=True)
+        if ERROR_PATTERN.match(text):
+            return self._flush_suggestion() + [("error", {"message": text.strip()})]
+        if DAY_HEADER_PATTERN.match(text):
+            events = self._flush_suggestion()
+            marker = SUGGESTION_PATTERN.search(text)
+            if marker:  # Pregen keeps the suggestion inside the last day
+                events += self._day(text[:marker.start()])
+                self.suggestion = text[marker.start():]
+                return events
+            return events + self._day(text)
+        if self.suggestion is not None:
+            self.suggestion += text
+            return []
+        if not text.strip():
+            return []
+        self.suggestion = text
+        return []
+
+    def close(self):
+        return self._flush_suggestion()
+
+
+class WorkoutEventEncoder:
+    """Typed events for /workoutplan, which streams raw tokens: a day is emitted once the next one starts."""
+
+    def __init__(self, total_days=PLAN_DAYS):
+        self.total_days = total_days
+        self.started = time.perf_counter()
+        self.buffer = ""
+        self.days = 0
+        self.suggestion = None
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000)
+
+    def _day(self, text):
+        if not DAY_HEADER_PATTERN.search(text):
+            return []
+        self.days += 1
+        day = parse_workout_day(text)
+        day["elapsed_ms"] = self.elapsed_ms()
+        return [("day", day), ("progress", {"days": self.days, "total": self.total_days, "elapsed_ms": day["elapsed_ms"]})]
+
+    def feed(self, text):
+        if self.suggestion is not None:
+            self.suggestion += text
+            return []
+        if ERROR_PATTERN.match(text):
+            return [("error", {"message": text.strip()})]
+        self.buffer += text
+        events = []
+        marker = SUGGESTION_PATTERN.search(self.buffer)
+        if marker:
+            self.buffer, self.suggestion = self.buffer[:marker.start()], self.buffer[marker.start():]
+        # Only whole lines can start a day
+        complete = self.buffer if marker else self.buffer[:self.buffer.rfind("\n") + 1]
+        starts = [m.start() for m in DAY_HEADER_PATTERN.finditer(complete)]
+        if len(starts) > 1:
+            for start, end in zip(starts, starts[1:]):
+                events += self._day(self.buffer[start:end])
+            self.buffer = self.buffer[starts[-1]:]
+        if marker:
+            events += self._day(self.buffer)
+            self.buffer = ""
+        return events
+
+    def close(self):
+        events = self._day(self.buffer)
+        self.buffer = ""
+        if self.suggestion is not None:
+            text, self.suggestion = suggestion_text(self.suggestion), None
+            if text:
+                events.append(("suggestion", {"text": text}))
+        return events
+
+
+def frame(event_type, payload, stream_format):
+    if stream_format == STREAM_FORMAT_SSE:
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        return f"event: {event_type}\ndata: {data}\n\n".encode("utf-8")
+    data = json.dumps({"type": event_type, **payload}, ensure_ascii=False, separators=(",", ":"))
+    return f"{data}\n".encode("utf-8")
+
+
+async def encode_stream(chunks, stream_format, encoder, stats=None, heartbeat_seconds=STREAM_HEARTBEAT_SECONDS):
+    """
+    Re-frame an async iterator of legacy byte chunks as typed events
+    (stream_format NDJSON or SSE; text responses don't go through here).
+
+    Heartbeats come from a timer rather than the upstream keep-alives: the
+    next chunk is awaited with a timeout, and the pending read survives the
+    timeout so no chunk is lost.
+    """
+    if stats is not None:
+        stats.responses[stream_format] += 1
+
+    def emit(events):
+        for event_type, payload in events:
+            data = frame(event_type, payload, stream_format)
+            if stats is not None:
+                stats.count(event_type)
+                stats.bytes_sent += len(data)
+            yield data
+
+    loop = asyncio.get_event_loop()
+    last_event = loop.time()
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            # Keep-alive chunks are dropped, so the heartbeat is timed from the last event sent
+            timeout = max(0.0, last_event + heartbeat_seconds - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                for data in emit([("heartbeat", {"elapsed_ms": encoder.elapsed_ms()})]):
+                    yield data
+                last_event = loop.time()
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            text = chunk.decode("utf-8", errors="replace") if isinstance(chunk, bytes) else chunk
+            if stats is not None:
+                stats.legacy_bytes += len(chunk)
+                if not text.strip() and encoder.suggestion is None:
+                    stats.keepalives_dropped += 1
+            for data in emit(encoder.feed(text)):
+                yield data
+                last_event = loop.time()
+        for data in emit(encoder.close()):
+            yield data
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass  # Cancelled read of a stream that is being closed anyway
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
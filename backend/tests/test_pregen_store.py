@@ -0,0 +1,241 @@
+"""
+InMemoryPregenStore and RedisPregenStore (on fakeredis) must behave the same
+for everything app.py relies on. The Redis cases use two store instances on
+one server, like two gunicorn workers.
+
+    cd backend && python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from pregen_store import InMemoryPregenStore, PregenDropped, RedisPregenStore, create_pregen_admission
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def memory_stores(**caps):
+    store = InMemoryPregenStore(**caps)
+    return store, store
+
+
+def redis_stores(**caps):
+    server = fakeredis.FakeServer()
+    producer = RedisPregenStore(fakeredis.FakeAsyncRedis(server=server), **caps)
+    reader = RedisPregenStore(fakeredis.FakeAsyncRedis(server=server), **caps)
+    producer.block_ms = reader.block_ms = 50
+    return producer, reader
+
+
+@pytest.fixture(params=[memory_stores, redis_stores], ids=["memory", "redis"])
+def make_stores(request):
+    """make_stores(**caps) -> (producer's store, reader's store): the same object in memory, two workers' views in Redis."""
+    return request.param
+
+
+@pytest.fixture
+def stores(make_stores):
+    return make_stores()
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=5))
+
+
+async def read_all(store, session_id):
+    return [chunk async for chunk in store.tail(session_id)]
+
+
+def test_create_append_finish_tail(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        assert await producer.append("s1", b"Day 1") is True
+        assert await producer.append("s1", b"Day 2") is True
+        await producer.finish("s1")
+        assert await reader.exists("s1")
+        assert await read_all(reader, "s1") == [b"Day 1", b"Day 2"]
+        assert await reader.status("s1") == {"done": True, "error": None, "chunks": 2}
+
+    run(scenario())
+
+
+def test_unknown_session(stores):
+    producer, reader = stores
+
+    async def scenario():
+        assert not await reader.exists("missing")
+        assert await reader.status("missing") is None
+        assert await read_all(reader, "missing") == []
+        assert await producer.append("missing", b"x") is False
+
+    run(scenario())
+
+
+def test_error_is_reported(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        await producer.append("s1", b"Day 1")
+        await producer.finish("s1", error="upstream failed")
+        assert await read_all(reader, "s1") == [b"Day 1"]
+        status = await reader.status("s1")
+        assert status["done"] and status["error"] == "upstream failed"
+
+    run(scenario())
+
+
+def test_tail_follows_a_running_generation(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        await producer.append("s1", b"Day 1")
+        tail = asyncio.ensure_future(read_all(reader, "s1"))
+        await asyncio.sleep(0.1)
+        assert not tail.done()  # Waits for the producer
+        await producer.append("s1", b"Day 2")
+        await producer.finish("s1")
+        assert await tail == [b"Day 1", b"Day 2"]
+        # A second reader (a browser retry) replays everything
+        assert await read_all(reader, "s1") == [b"Day 1", b"Day 2"]
+
+    run(scenario())
+
+
+def test_delete_stops_producer_and_readers(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        await producer.append("s1", b"Day 1")
+        received = []
+
+        async def follow():
+            async for chunk in reader.tail("s1"):
+                received.append(chunk)
+
+        tail = asyncio.ensure_future(follow())
+        await asyncio.sleep(0.1)
+        await reader.delete("s1")  # E.g. /user superseded the session on the reader's worker
+        with pytest.raises(PregenDropped):
+            await tail
+        assert received == [b"Day 1"]
+        assert not await producer.exists("s1")
+        assert await producer.append("s1", b"Day 2") is False
+        await producer.finish("s1")
+        assert await reader.status("s1") is None
+        assert await read_all(reader, "s1") == []
+
+    run(scenario())
+
+
+def test_delete_cancels_a_local_producer(stores):
+    producer, _ = stores
+
+    async def scenario():
+        await producer.create("s1")
+        task = asyncio.ensure_future(asyncio.sleep(10))
+        producer.attach_task("s1", task)
+        await producer.delete("s1")
+        await asyncio.sleep(0)
+        assert task.cancelled()
+
+    run(scenario())
+
+
+def test_create_replaces_an_entry(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        await producer.append("s1", b"old")
+        await producer.create("s1")
+        await producer.append("s1", b"new")
+        await producer.finish("s1")
+        assert await read_all(reader, "s1") == [b"new"]
+
+    run(scenario())
+
+
+def test_finished_entry_deleted_by_another_reader(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        await producer.append("s1", b"Day 1")
+        await producer.finish("s1")
+        assert await read_all(reader, "s1") == [b"Day 1"]
+        await reader.delete("s1")  # The first reader cleans up; nothing was dropped
+        assert await read_all(reader, "s1") == []
+
+    run(scenario())
+
+
+def test_promotion_is_seen_by_the_producer(stores):
+    producer, reader = stores
+
+    async def scenario():
+        await producer.create("s1")
+        assert not await producer.promoted("s1")
+        await reader.promote("s1")
+        assert await producer.promoted("s1")
+        await reader.delete("s1")
+        assert not await producer.promoted("s1")
+        await reader.promote("s1")  # Gone: promoting must not re-create it
+        assert not await producer.exists("s1")
+        assert not await producer.promoted("s1")
+
+    run(scenario())
+
+
+def test_admission_hit_rate_is_shared(stores):
+    """/user (start) and /mealplan (hit) on different workers: both see the same hit rate."""
+    producer, reader = stores
+    user_worker = create_pregen_admission(producer)
+    mealplan_worker = user_worker if reader is producer else create_pregen_admission(reader)
+
+    async def scenario():
+        for _ in range(4):
+            await user_worker.on_start()
+        await mealplan_worker.on_hit()
+        await mealplan_worker.on_hit()
+        await user_worker.admit()
+        assert user_worker.hit_rate() == 0.5
+
+    run(scenario())
+
+
+def test_max_entries_evicts_the_oldest(make_stores):
+    producer, reader = make_stores(max_entries=2)
+
+    async def scenario():
+        await producer.create("s1")
+        await reader.create("s2")
+        await reader.create("s3")
+        assert not await producer.exists("s1")
+        assert await producer.append("s1", b"Day 1") is False
+        assert await producer.exists("s2") and await producer.exists("s3")
+
+    run(scenario())
+
+
+def test_max_bytes_evicts_but_keeps_the_growing_entry(make_stores):
+    producer, reader = make_stores(max_bytes=10)
+
+    async def scenario():
+        await reader.create("s1")
+        assert await reader.append("s1", b"x" * 8) is True
+        await producer.create("s2")
+        assert await producer.append("s2", b"y" * 8) is True
+        assert not await reader.exists("s1")
+        # The only entry left is never evicted for its own size
+        assert await producer.append("s2", b"y" * 8) is True
+        await producer.delete("s2")
+        await producer.create("s3")
+        assert await producer.append("s3", b"z" * 8) is True
+        assert await producer.exists("s3")
+
+    run(scenario())
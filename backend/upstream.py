@@ -0,0 +1,219 @@
+import inspect
+import os
+import time
+
+from day_segmenter import MARKER_OVERLAP, SUGGESTION_PATTERN
+
+# ============================================================
+# UPSTREAM STREAMS - Stop reading the LLM once nobody needs the rest
+# ============================================================
+# A Groq completion keeps streaming (and billing) until the provider ends it,
+# even when every day and the END-OF-PLAN-SUGGESTION have been sent, when the
+# client is gone (single-flight cancels the orphaned producer after its
+# linger), or when the pre-generation was for a session the browser no longer
+# holds. TrackedStream wraps a completion stream, counts the tokens read and
+# closes the HTTP response on close(reason), so the connection is released
+# right away instead of when the generator is garbage-collected. The other
+# wrappers on the way (ScheduledStream, HedgedStream) share its base,
+# StreamWrapper.
+#
+# What a stopped stream would still have produced is unknowable, so savings
+# are estimated per call site from the streams that ran to their natural end:
+#   tokens_saved  = expected tokens (EWMA of complete streams) - tokens read
+#   seconds_saved = tokens_saved / EWMA tokens per second
+
+UPSTREAM_EXPECTED_TOKENS = int(os.getenv("UPSTREAM_EXPECTED_TOKENS", "2300"))  # Seed: one 7-day text plan
+UPSTREAM_TOKENS_PER_SEC = float(os.getenv("UPSTREAM_TOKENS_PER_SEC", "250"))
+PLAN_SUGGESTION_MAX_LINES = 2  # "2 lines max" in the prompts
+EWMA_ALPHA = 0.2
+
+CLOSE_COMPLETE = "complete"       # Plan finished; the rest would be discarded
+CLOSE_CANCELLED = "cancelled"     # Client gone or generation superseded
+
+
+async def close_upstream(stream):
+    """Release a completion stream: AsyncStream.close() for the SDK, aclose() for async generators."""
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close is None:
+        return
+    result = close()
+    if inspect.isawaitable(result):
+        await result
+
+
+def chunk_content(chunk):
+    """The content text of a chat.completion.chunk, None for role / finish / usage chunks."""
+    try:
+        return chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta else None
+    except Exception:
+        return None
+
+
+class StreamWrapper:
+    """
+    Async-iterable stand-in for a chat.completions stream.
+
+    Subclasses override _iterate() (one pass over self.stream); close() stops
+    that pass and closes the upstream response.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._chunks = None
+
+    def __aiter__(self):
+        if self._chunks is None:
+            self._chunks = self._iterate()
+        return self._chunks
+
+    async def _iterate(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def close(self):
+        if self._chunks is not None:
+            try:
+                await self._chunks.aclose()
+            except RuntimeError:
+                pass  # Still running in a reader that is being cancelled; closing the response ends it
+        await close_upstream(self.stream)
+
+
+class SiteStats:
+    def __init__(self):
+        self.streams = 0
+        self.completed = 0         # Ran until the provider ended them
+        self.closed = {CLOSE_COMPLETE: 0, CLOSE_CANCELLED: 0}
+        self.tokens_read = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+        self.expected_tokens = float(UPSTREAM_EXPECTED_TOKENS)
+        self.tokens_per_sec = UPSTREAM_TOKENS_PER_SEC
+
+    def record_complete(self, tokens, seconds):
+        self.completed += 1
+        self.expected_tokens += EWMA_ALPHA * (tokens - self.expected_tokens)
+        if seconds > 0 and tokens > 1:
+            self.tokens_per_sec += EWMA_ALPHA * (tokens / seconds - self.tokens_per_sec)
+
+    def record_close(self, reason, tokens):
+        self.closed[reason] += 1
+        saved = max(0, round(self.expected_tokens) - tokens)
+        self.tokens_saved += saved
+        self.seconds_saved += saved / self.tokens_per_sec if self.tokens_per_sec else 0.0
+        return saved
+
+    def as_dict(self):
+        return {
+            "streams": self.streams,
+            "completed": self.completed,
+            "closed_complete": self.closed[CLOSE_COMPLETE],
+            "closed_cancelled": self.closed[CLOSE_CANCELLED],
+            "tokens_read": self.tokens_read,
+            "tokens_saved": self.tokens_saved,
+            "seconds_saved": round(self.seconds_saved, 1),
+            "expected_tokens": round(self.expected_tokens),
+        }
+
+
+class UpstreamStats:
+    """Per call site ("mealplan", "mealplan_fallback", "parallel", "pregen", "workoutplan") counters."""
+
+    def __init__(self):
+        self.sites = {}
+        self.pregen_superseded = 0  # Pre-generations cancelled because /user issued a new session
+        self.repairs_cancelled = 0
+
+    def site(self, name):
+        if name not in self.sites:
+            self.sites[name] = SiteStats()
+        return self.sites[name]
+
+    def track(self, stream, site, logger=None):
+        return TrackedStream(stream, self.site(site), site, logger)
+
+    def stats(self):
+        sites = {name: site.as_dict() for name, site in self.sites.items()}
+        return {
+            "sites": sites,
+            "tokens_saved": sum(s["tokens_saved"] for s in sites.values()),
+            "seconds_saved": round(sum(s["seconds_saved"] for s in sites.values()), 1),
+            "pregen_superseded": self.pregen_superseded,
+            "repairs_cancelled": self.repairs_cancelled,
+        }
+
+
+class TrackedStream(StreamWrapper):
+    """
+    Iterating it counts content tokens; close(reason) ends the upstream
+    response early and books the estimated savings. close() after the stream
+    ran to its end (or a second close) does nothing.
+    """
+
+    def __init__(self, stream, site_stats, site, logger=None):
+        super().__init__(stream)
+        self.stats = site_stats
+        self.site = site
+        self.logger = logger
+        self.tokens = 0
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished = False
+        self.closed = False
+        site_stats.streams += 1
+
+    async def _iterate(self):
+        async for chunk in self.stream:
+            if chunk_content(chunk):
+                self.tokens += 1
+                self.stats.tokens_read += 1
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+            yield chunk
+        self.finished = True
+        if not self.closed:
+            decode_s = time.perf_counter() - (self.first_token_at or self.started)
+            self.stats.record_complete(self.tokens, decode_s)
+
+    async def close(self, reason=CLOSE_CANCELLED):
+        if self.finished or self.closed:
+            return
+        self.closed = True
+        saved = self.stats.record_close(reason, self.tokens)
+        if self.logger is not None:
+            self.logger.info(f"[UPSTREAM] {self.site}: closed ({reason}) after {self.tokens} tokens, "
+                             f"~{saved} tokens saved")
+        await super().close()
+
+
+def suggestion_complete(text, max_lines=PLAN_SUGGESTION_MAX_LINES):
+    """True once the text after the suggestion marker has a finished paragraph or max_lines full lines."""
+    marker = SUGGESTION_PATTERN.search(text)
+    if marker is None:
+        return False
+    body = text[marker.end():].lstrip()
+    if not body:
+        return False
+    if "\n\n" in body:
+        return True
+    return body.count("\n") >= max_lines
+
+
+async def until_plan_complete(token_texts, segmenter, on_complete):
+    """
+    Pass token texts through to a pipeline reader, stopping once `segmenter`
+    has every day and the suggestion is finished; on_complete() is awaited
+    then (to close the upstream). The reader feeds each token to the
+    segmenter before it asks for the next, so its state is current here.
+    """
+    text = ""  # Recent text before the marker (it may span tokens), everything after it
+    async for token_text in token_texts:
+        yield token_text
+        if not segmenter.suggestion_mode:
+            text = text[-MARKER_OVERLAP:] + token_text
+            continue
+        text += token_text
+        if segmenter.day_count >= segmenter.max_days and suggestion_complete(text):
+            await on_complete()
+            await token_texts.aclose()
+            return
@@ -1,7 +1,11 @@
 
+import os
 import re
 import time
 from logger_setup import mealplan_logger
+from macro_solver import solve_quantities
+from nutrition_index import get_nutrition_index
+from food_table import get_food_table
 
 # ============================================================
 # PRE-COMPILED REGEX PATTERNS (compiled once at module load)
@@ -204,11 +208,85 @@ def is_serving_based(unit):
     return any(k in unit_lower for k in serving_keywords)
 
 
+# ============================================================
+# MEAL ITEMS
+# ============================================================
+
+class MealItem:
+    """
+    One parsed food item of a day.
+
+    process_single_day creates one per item line and rewrites quantity and
+    macros many times during correction and rounding. __slots__ keeps each
+    item to a fixed set of attributes (no per-instance dict, ~3x smaller
+    than the equivalent dict) with attribute access in the hot loops; the
+    text output is the only place items are turned back into strings.
+    """
+
+    __slots__ = (
+        "name", "quantity", "unit",
+        "calories", "protein", "fat", "carbs", "fiber",
+        "cal_density", "protein_density", "fat_density", "carbs_density", "fiber_density",
+        "gpt_qty_str", "gpt_calories", "gpt_quantity", "inp_item_str",
+        "macros_stated", "indexed",
+    )
+
+    def __init__(self, name, quantity, unit, calories, protein, fat, carbs, gpt_qty_str, inp_item_str,
+                 macros_stated=True):
+        self.name = name
+        self.quantity = quantity
+        self.unit = unit
+        self.calories = float(calories)
+        self.protein = protein
+        self.fat = fat
+        self.carbs = carbs
+        self.fiber = 0
+        # Per-unit values, so quantity changes keep the item's nutrition profile
+        self.cal_density = calories / quantity if quantity > 0 else 1
+        self.protein_density = protein / quantity if quantity > 0 else 0
+        self.fat_density = fat / quantity if quantity > 0 else 0
+        self.carbs_density = carbs / quantity if quantity > 0 else 0
+        self.fiber_density = 0
+        self.gpt_qty_str = gpt_qty_str
+        self.gpt_calories = float(calories)
+        self.gpt_quantity = quantity
+        self.inp_item_str = inp_item_str
+        self.macros_stated = macros_stated  # False when p/f/c were estimated from calories
+        self.indexed = False                # Densities confirmed by the food table or nutrition index
+
+    def set_quantity(self, quantity):
+        """Set a new quantity and recompute calories and macros from the densities."""
+        self.quantity = quantity
+        self.calories = quantity * self.cal_density
+        self.protein = quantity * self.protein_density
+        self.fat = quantity * self.fat_density
+        self.carbs = quantity * self.carbs_density
+        self.fiber = quantity * self.fiber_density
+
+    def set_densities(self, cal_density, protein_density, fat_density, carbs_density):
+        """Replace the per-unit values and recompute calories and macros at the current quantity."""
+        self.cal_density = cal_density
+        self.protein_density = protein_density
+        self.fat_density = fat_density
+        self.carbs_density = carbs_density
+        self.set_quantity(self.quantity)
+
+    def scale_macros(self, factor):
+        """Scale calories and macros without touching the quantity (serving-based items)."""
+        self.calories = self.calories * factor
+        self.protein = self.protein * factor
+        self.fat = self.fat * factor
+        self.carbs = self.carbs * factor
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
 def classify_item_macro_type(item):
     """Classify item as protein/fat/carbs/mixed based on dominant macro."""
-    protein = item.get('protein', 0)
-    fat = item.get('fat', 0)
-    carbs = item.get('carbs', 0)
+    protein = item.protein
+    fat = item.fat
+    carbs = item.carbs
     
     total_macros = protein + fat + carbs
     if total_macros == 0:
@@ -234,30 +312,42 @@ def adjust_item_quantity(item, target_ratio, max_ratio_change=0.5):
     ONLY adjusts items with gram-based or ml-based units.
     Returns: actual ratio applied, or 1.0 if not adjusted
     """
-    if not (is_gram_based(item['unit']) or is_ml_based(item['unit'])):
+    if not (is_gram_based(item.unit) or is_ml_based(item.unit)):
         return 1.0
     
     # Cap the adjustment to prevent extreme changes
     capped_ratio = max(1 - max_ratio_change, min(1 + max_ratio_change, target_ratio))
     
-    new_quantity = item['quantity'] * capped_ratio
+    new_quantity = item.quantity * capped_ratio
     
     # Apply minimum quantity rules (5g/ml minimum)
     new_quantity = max(5, round_to_5(new_quantity))
     
     # Update all values
-    actual_ratio = new_quantity / item['quantity']
-    item['quantity'] = new_quantity
-    item['calories'] = new_quantity * item['cal_density']
-    item['protein'] = new_quantity * item['protein_density']
-    item['fat'] = new_quantity * item['fat_density']
-    item['carbs'] = new_quantity * item['carbs_density']
-    item['fiber'] = new_quantity * item['fiber_density']
+    actual_ratio = new_quantity / item.quantity
+    item.set_quantity(new_quantity)
     
     return actual_ratio
 
 LOG_MODE = "B"  # Batch logs at end, not during streaming
 
+# STEP 2 macro correction: "legacy" (iterative per-macro nudges) or "numpy"
+# (one bounded weighted least-squares solve, see macro_solver.py)
+MACRO_SOLVER = os.getenv("MACRO_SOLVER", "legacy")
+
+# Learned per-food densities (nutrition_index.py): "on" corrects implausible
+# densities before STEP 0 and re-solves locally before reporting an anomaly
+NUTRITION_INDEX_MODE = os.getenv("NUTRITION_INDEX", "off")
+DENSITY_TOLERANCE = 2.5        # Stated kcal/g within [median / 2.5, median * 2.5] is kept
+RESOLVE_QUANTITY_RANGE = (0.5, 2.5)  # Local re-solve reach for confirmed items, x stated quantity
+
+# Bundled reference nutrition (food_table.py), for every item with a known food
+# and unit: "validate" logs stated kcal that disagree with it ([FOOD_CHECK]),
+# "correct" replaces them like the index does. A table passed to
+# process_single_day explicitly is used to correct unless the mode is "validate".
+FOOD_TABLE_MODE = os.getenv("FOOD_TABLE", "off")
+FOOD_TABLE_TOLERANCE = 1.5
+
 def normalize_text_for_parsing(text):
     """
     Normalize Unicode characters that can vary between environments.
@@ -312,7 +402,8 @@ def normalize_text_for_parsing(text):
     
     return text
 
-def process_single_day(day_string, target_calories, macros=None, min_qty=5, expected_day_number=None):
+def process_single_day(day_string, target_calories, macros=None, min_qty=5, expected_day_number=None, timings=None,
+                       solver=None, report=None, nutrition_index=None, food_table=None):
     """
     Parses and adjusts a single day's meal plan output from GPT with macro correction.
     
@@ -321,9 +412,28 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
     
     Args:
         expected_day_number: If provided, used as fallback when day number can't be parsed from text.
+        timings: Optional dict; if given, per-phase milliseconds are added to it
+                 (normalize, parse, correct, round, format, log) - used by benchmarks.
+        solver: STEP 2 macro correction, "legacy" or "numpy" (defaults to MACRO_SOLVER).
+        report: Optional dict; if given, filled with the final day totals
+                (calories, protein, fat, carbs) - used by benchmarks.
+        nutrition_index: NutritionIndex to check densities against (defaults to the
+                         shared index when NUTRITION_INDEX=on, otherwise none).
+        food_table: FoodTable to check densities against (defaults to the bundled
+                    table when FOOD_TABLE is "validate" or "correct", otherwise none).
     """
+    phase_start = time.perf_counter()
+
+    def mark_phase(phase):
+        nonlocal phase_start
+        if timings is not None:
+            now = time.perf_counter()
+            timings[phase] = timings.get(phase, 0.0) + (now - phase_start) * 1000
+            phase_start = now
+
     # FIRST: Normalize the input text to handle encoding differences
     day_string = normalize_text_for_parsing(day_string)
+    mark_phase("normalize")
     
     # DEBUG: Log the raw input to help diagnose parsing issues
     # Count items that look like food items (lines starting with "1.", "2.", etc.)
@@ -572,27 +682,10 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
             fat = (calories * 0.35) / 9
             carbs = (calories * 0.30) / 4
         
-        cal_density = calories / qty_value if qty_value > 0 else 1
-
-        meal_plan[current_meal]["items"].append({
-            "name": food_name,
-                "quantity": float(qty_value),
-            "unit": unit,
-                "calories": float(calories),
-                "protein": protein,
-                "fat": fat,
-                "carbs": carbs,
-            "fiber": 0,
-                "cal_density": cal_density,
-                "protein_density": protein / qty_value if qty_value > 0 else 0,
-                "fat_density": fat / qty_value if qty_value > 0 else 0,
-                "carbs_density": carbs / qty_value if qty_value > 0 else 0,
-            "fiber_density": 0,
-                "gpt_qty_str": gpt_qty_str,
-                "gpt_calories": float(calories),
-                "gpt_quantity": float(qty_value),
-            "inp_item_str": line_stripped,
-            })
+        meal_plan[current_meal]["items"].append(MealItem(
+            food_name, float(qty_value), unit, calories, protein, fat, carbs, gpt_qty_str, line_stripped,
+            macros_stated=macro_match is not None,
+        ))
 
     # =========================================================================
     # FALLBACK: For meals with no parsed items, try to extract from meal header line
@@ -636,25 +729,70 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
                 fat = (calories * 0.35) / 9
                 carbs = (calories * 0.30) / 4
                 
-                meal_data['items'].append({
-                    'name': inline_content[:100],  # Truncate long names
-                    'quantity': 1,
-                    'unit': 'serving',
-                    'calories': float(calories),
-                    'protein': protein,
-                    'fat': fat,
-                    'carbs': carbs,
-                    'fiber': 0,
-                    'cal_density': float(calories),
-                    'protein_density': protein,
-                    'fat_density': fat,
-                    'carbs_density': carbs,
-                    'fiber_density': 0,
-                    'gpt_qty_str': '1 serving',
-                    'gpt_calories': float(calories),
-                    'gpt_quantity': 1,
-                    'inp_item_str': f"1. {inline_content[:100]} - 1 serving - {calories} kcal",
-                })
+                meal_data['items'].append(MealItem(
+                    inline_content[:100],  # Truncate long names
+                    1, 'serving', calories, protein, fat, carbs, '1 serving',
+                    f"1. {inline_content[:100]} - 1 serving - {calories} kcal",
+                ))
+
+    # =========================================================================
+    # DENSITY CHECK - Replace implausible per-unit values with reference ones
+    # =========================================================================
+    # The LLM's kcal for the same food vary a lot between days. A density far
+    # from the bundled food table (any unit with a standard weight) or, for
+    # foods not in it, from the learned index median (g/ml) is replaced before
+    # STEP 0, so every later step adjusts quantities against realistic numbers.
+
+    if nutrition_index is None and NUTRITION_INDEX_MODE == "on":
+        nutrition_index = get_nutrition_index()
+    if food_table is None and FOOD_TABLE_MODE in ("validate", "correct"):
+        food_table = get_food_table()
+    if nutrition_index or food_table:
+        for meal_data in meal_plan.values():
+            for item in meal_data['items']:
+                by_weight = is_gram_based(item.unit) or is_ml_based(item.unit)
+                if nutrition_index and by_weight:
+                    nutrition_index.observe(item, item.macros_stated)
+                reference = food_table.per_unit(item.name, item.unit) if food_table else None
+                if reference is not None:
+                    tolerance, source = FOOD_TABLE_TOLERANCE, "food table"
+                elif nutrition_index and by_weight:
+                    entry = nutrition_index.lookup(item.name, item.unit)
+                    if entry is None:
+                        continue
+                    reference = (entry.cal_density, entry.protein_density, entry.fat_density, entry.carbs_density)
+                    tolerance, source = DENSITY_TOLERANCE, f"median of {entry.count}"
+                else:
+                    continue
+                plausible = reference[0] / tolerance <= item.cal_density <= reference[0] * tolerance
+                if source == "food table":
+                    food_table.checked += 1
+                    food_table.mismatches += not plausible
+                    if FOOD_TABLE_MODE == "validate":
+                        # Report only; the day is processed exactly as without the table
+                        if not plausible:
+                            mealplan_logger.info(
+                                f"[FOOD_CHECK] {item.name}: {item.cal_density:.2f} kcal/{item.unit} stated, "
+                                f"food table says {reference[0]:.2f}"
+                            )
+                        continue
+                item.indexed = True
+                if plausible:
+                    continue
+                if source == "food table":
+                    food_table.corrections += 1
+                else:
+                    nutrition_index.corrections += 1
+                mealplan_logger.info(
+                    f"[DENSITY_FIX] {item.name}: {item.cal_density:.2f} kcal/{item.unit} -> "
+                    f"{reference[0]:.2f} ({source})"
+                )
+                item.set_densities(
+                    reference[0],
+                    reference[1] if reference[1] is not None else item.protein_density,
+                    reference[2] if reference[2] is not None else item.fat_density,
+                    reference[3] if reference[3] is not None else item.carbs_density,
+                )
 
     # =========================================================================
     # STEP 0: PER-MEAL SCALING - Fix when GPT's items don't match stated total
@@ -672,7 +810,7 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         if not items:
             continue
         
-        actual_total = sum(item.get('calories', 0) for item in items)
+        actual_total = sum(item.calories for item in items)
         if actual_total <= 0:
             continue
         
@@ -690,40 +828,31 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
             )
             
             for item in items:
-                if is_gram_based(item.get('unit', '')) or is_ml_based(item.get('unit', '')):
-                    old_qty = item['quantity']
-                    new_qty = old_qty * scale_factor
-                    item['quantity'] = new_qty
-                    item['calories'] = new_qty * item.get('cal_density', 1)
-                    item['protein'] = new_qty * item.get('protein_density', 0)
-                    item['fat'] = new_qty * item.get('fat_density', 0)
-                    item['carbs'] = new_qty * item.get('carbs_density', 0)
-                    item['fiber'] = new_qty * item.get('fiber_density', 0)
+                if is_gram_based(item.unit) or is_ml_based(item.unit):
+                    new_qty = item.quantity * scale_factor
+                    item.set_quantity(new_qty)
                     # CRITICAL: Update gpt_quantity so fine-tuning phase can still adjust
                     # Without this, clamp_quantity uses old baseline and blocks further increases
-                    item['gpt_quantity'] = new_qty
+                    item.gpt_quantity = new_qty
                 else:
                     # For non-gram items (cups, eggs, etc.), just scale the calories
-                    item['calories'] = item['calories'] * scale_factor
-                    item['protein'] = item.get('protein', 0) * scale_factor
-                    item['fat'] = item.get('fat', 0) * scale_factor
-                    item['carbs'] = item.get('carbs', 0) * scale_factor
+                    item.scale_macros(scale_factor)
 
     # --- Helper functions ---
     def calculate_totals():
         totals = {'calories': 0, 'protein': 0, 'fat': 0, 'carbs': 0, 'fiber': 0}
         for meal_data in meal_plan.values():
             for item in meal_data['items']:
-                totals['calories'] += item.get('calories', 0)
-                totals['protein'] += item.get('protein', 0)
-                totals['fat'] += item.get('fat', 0)
-                totals['carbs'] += item.get('carbs', 0)
-                totals['fiber'] += item.get('fiber', 0)
+                totals['calories'] += item.calories
+                totals['protein'] += item.protein
+                totals['fat'] += item.fat
+                totals['carbs'] += item.carbs
+                totals['fiber'] += item.fiber
         return totals
 
     def get_max_quantity(item):
         """Max quantity - Allow reasonable scaling after per-meal adjustment."""
-        original_qty = item.get('gpt_quantity', 100)
+        original_qty = item.gpt_quantity
         
         # Allow up to 2.0x for daily fine-tuning (increased from 1.5x)
         # Combined with per-meal scaling (up to 2.5x), this allows up to 5x total if needed
@@ -731,10 +860,10 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
 
     def is_main_protein_dish(item):
         """Detect main protein dish using nutritional data only. Never goes below 100g."""
-        protein_density = item.get('protein_density', 0)
-        protein = item.get('protein', 0)
-        calories = item.get('gpt_calories', 1)
-        original_qty = item.get('gpt_quantity', 0)
+        protein_density = item.protein_density
+        protein = item.protein
+        calories = item.gpt_calories
+        original_qty = item.gpt_quantity
         
         protein_calorie_ratio = (protein * 4) / calories if calories > 0 else 0
         
@@ -746,7 +875,7 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
 
     def get_min_quantity(item):
         """Min quantity - Allow reasonable reduction after per-meal adjustment."""
-        original_qty = item.get('gpt_quantity', 100)
+        original_qty = item.gpt_quantity
         
         # Allow down to 0.6x for daily fine-tuning
         return original_qty * 0.6
@@ -759,7 +888,7 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
 
     def is_adjustable_for_macros(item):
         """Only adjust primary protein/carb/fat sources"""
-        unit = item.get('unit', '').lower()
+        unit = item.unit.lower()
         
         # Never adjust serving-based items
         if is_serving_based(unit):
@@ -769,8 +898,8 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         if not (is_gram_based(unit) or is_ml_based(unit)):
             return False
         
-        original_qty = item.get('gpt_quantity', item['quantity'])
-        cal_density = item.get('cal_density', 0)
+        original_qty = item.gpt_quantity
+        cal_density = item.cal_density
         
         # Don't adjust tiny portions (toppings/condiments)
         if original_qty < 20 and cal_density > 4:
@@ -780,6 +909,8 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         
         return True
 
+    mark_phase("parse")
+
     # === CHECK PARSING COMPLETENESS ===
     initial_totals = calculate_totals()
     initial_calories = initial_totals['calories']
@@ -809,11 +940,11 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
     # If skipping adjustments, just calculate totals and go to output
     if goto_output:
         for meal_data in meal_plan.values():
-            meal_data["total_cal"] = sum(float(i.get("calories", 0)) for i in meal_data["items"])
-            meal_data["total_protein"] = sum(float(i.get("protein", 0)) for i in meal_data["items"])
-            meal_data["total_fat"] = sum(float(i.get("fat", 0)) for i in meal_data["items"])
-            meal_data["total_carbs"] = sum(float(i.get("carbs", 0)) for i in meal_data["items"])
-            meal_data["total_fiber"] = sum(float(i.get("fiber", 0)) for i in meal_data["items"])
+            meal_data["total_cal"] = sum(float(i.calories) for i in meal_data["items"])
+            meal_data["total_protein"] = sum(float(i.protein) for i in meal_data["items"])
+            meal_data["total_fat"] = sum(float(i.fat) for i in meal_data["items"])
+            meal_data["total_carbs"] = sum(float(i.carbs) for i in meal_data["items"])
+            meal_data["total_fiber"] = sum(float(i.fiber) for i in meal_data["items"])
 
     # === STEP 2: Macro correction (on UNROUNDED gram/ml items) ===
     # If parsing is incomplete, reduce iterations; if critical, skip entirely
@@ -823,6 +954,27 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         MAX_ITERATIONS = 4  # Increased from 2
     else:
         MAX_ITERATIONS = 10  # Increased from 6
+
+    if (solver or MACRO_SOLVER) == "numpy" and MAX_ITERATIONS:
+        # Solve all macros at once instead of iterating; STEP 3 and the FINAL CHECK still run after
+        solver_items = [item for meal_data in meal_plan.values() for item in meal_data['items'] if is_adjustable_for_macros(item)]
+        if solver_items:
+            current = calculate_totals()
+            fixed_totals = [current[key] - sum(getattr(item, key) for item in solver_items) for key in ('calories', 'protein', 'fat', 'carbs')]
+            bounds = []
+            for item in solver_items:
+                lo, hi = get_min_quantity(item), get_max_quantity(item)
+                if parsing_seems_incomplete and item.cal_density > 0:
+                    # Same reach as the legacy loop's 4 conservative iterations (30 kcal each)
+                    reach = 120 / item.cal_density
+                    lo, hi = max(lo, item.quantity - reach), min(hi, item.quantity + reach)
+                bounds.append((lo, max(lo, hi)))
+            new_quantities = solve_quantities(
+                solver_items, (target_calories, target_protein, target_fat, target_carbs), fixed_totals, bounds
+            )
+            for item, new_qty in zip(solver_items, new_quantities):
+                item.set_quantity(float(new_qty))
+        MAX_ITERATIONS = 0
     
     for iteration in range(MAX_ITERATIONS):
         current = calculate_totals()
@@ -868,19 +1020,14 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
                 per_item_cal_change = max(-max_cal_change, min(max_cal_change, per_item_cal_change))
                 
                 for meal_name, idx, item in adjustable_items:
-                    if item['cal_density'] > 0:
-                        qty_change = per_item_cal_change / item['cal_density']
-                        new_qty = item['quantity'] + qty_change
+                    if item.cal_density > 0:
+                        qty_change = per_item_cal_change / item.cal_density
+                        new_qty = item.quantity + qty_change
                         
                         # Use clamping to prevent drastic changes
                         new_qty = clamp_quantity(item, new_qty)
                         
-                        item['quantity'] = new_qty
-                        item['calories'] = new_qty * item['cal_density']
-                        item['protein'] = new_qty * item['protein_density']
-                        item['fat'] = new_qty * item['fat_density']
-                        item['carbs'] = new_qty * item['carbs_density']
-                        item['fiber'] = new_qty * item['fiber_density']
+                        item.set_quantity(new_qty)
         
         # Recalculate and check if we should do macro adjustments
         # CRITICAL: Only do macro adjustments if calories are reasonably close to target
@@ -898,29 +1045,24 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         
         # Fix protein if needed (only small adjustments to avoid breaking calories)
         if not protein_ok and abs(protein_deficit) > 2:
-            protein_items = [x for x in adjustable_items if x[2]['protein_density'] > 0.05]
+            protein_items = [x for x in adjustable_items if x[2].protein_density > 0.05]
             if protein_items:
-                protein_items.sort(key=lambda x: x[2]['protein_density'], reverse=(protein_deficit > 0))
+                protein_items.sort(key=lambda x: x[2].protein_density, reverse=(protein_deficit > 0))
                 # Limit adjustment to avoid breaking calorie budget
                 max_cal_change_per_item = 30  # Max 30 kcal change per item for macro fixes
                 per_item = protein_deficit / len(protein_items)
                 
                 for meal_name, idx, item in protein_items:
-                    qty_change = per_item / item['protein_density']
+                    qty_change = per_item / item.protein_density
                     # Cap the calorie impact
-                    cal_impact = abs(qty_change * item['cal_density'])
+                    cal_impact = abs(qty_change * item.cal_density)
                     if cal_impact > max_cal_change_per_item:
-                        qty_change = (max_cal_change_per_item / item['cal_density']) * (1 if qty_change > 0 else -1)
+                        qty_change = (max_cal_change_per_item / item.cal_density) * (1 if qty_change > 0 else -1)
                     
-                    new_qty = item['quantity'] + qty_change
+                    new_qty = item.quantity + qty_change
                     new_qty = clamp_quantity(item, new_qty)
                     
-                    item['quantity'] = new_qty
-                    item['calories'] = new_qty * item['cal_density']
-                    item['protein'] = new_qty * item['protein_density']
-                    item['fat'] = new_qty * item['fat_density']
-                    item['carbs'] = new_qty * item['carbs_density']
-                    item['fiber'] = new_qty * item['fiber_density']
+                    item.set_quantity(new_qty)
         
         # Check calories again after protein adjustment
         current = calculate_totals()
@@ -931,27 +1073,22 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         fat_ok = abs(fat_deficit) <= max(3, target_fat * 0.05) if target_fat > 0 else True
         
         if not fat_ok and abs(fat_deficit) > 2:
-            fat_items = [x for x in adjustable_items if x[2]['fat_density'] > 0.05]
+            fat_items = [x for x in adjustable_items if x[2].fat_density > 0.05]
             if fat_items:
-                fat_items.sort(key=lambda x: x[2]['fat_density'], reverse=(fat_deficit > 0))
+                fat_items.sort(key=lambda x: x[2].fat_density, reverse=(fat_deficit > 0))
                 max_cal_change_per_item = 25
                 per_item = fat_deficit / len(fat_items)
                 
                 for meal_name, idx, item in fat_items:
-                    qty_change = per_item / item['fat_density']
-                    cal_impact = abs(qty_change * item['cal_density'])
+                    qty_change = per_item / item.fat_density
+                    cal_impact = abs(qty_change * item.cal_density)
                     if cal_impact > max_cal_change_per_item:
-                        qty_change = (max_cal_change_per_item / item['cal_density']) * (1 if qty_change > 0 else -1)
+                        qty_change = (max_cal_change_per_item / item.cal_density) * (1 if qty_change > 0 else -1)
                     
-                    new_qty = item['quantity'] + qty_change
+                    new_qty = item.quantity + qty_change
                     new_qty = clamp_quantity(item, new_qty)
                     
-                    item['quantity'] = new_qty
-                    item['calories'] = new_qty * item['cal_density']
-                    item['protein'] = new_qty * item['protein_density']
-                    item['fat'] = new_qty * item['fat_density']
-                    item['carbs'] = new_qty * item['carbs_density']
-                    item['fiber'] = new_qty * item['fiber_density']
+                    item.set_quantity(new_qty)
         
         # Check calories again after fat adjustment
         current = calculate_totals()
@@ -962,27 +1099,24 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         carbs_ok = abs(carbs_deficit) <= max(5, target_carbs * 0.05) if target_carbs > 0 else True
         
         if not carbs_ok and abs(carbs_deficit) > 2:
-            carb_items = [x for x in adjustable_items if x[2]['carbs_density'] > 0.05]
+            carb_items = [x for x in adjustable_items if x[2].carbs_density > 0.05]
             if carb_items:
-                carb_items.sort(key=lambda x: x[2]['carbs_density'], reverse=(carbs_deficit > 0))
+                carb_items.sort(key=lambda x: x[2].carbs_density, reverse=(carbs_deficit > 0))
                 max_cal_change_per_item = 25
                 per_item = carbs_deficit / len(carb_items)
                 
                 for meal_name, idx, item in carb_items:
-                    qty_change = per_item / item['carbs_density']
-                    cal_impact = abs(qty_change * item['cal_density'])
+                    qty_change = per_item / item.carbs_density
+                    cal_impact = abs(qty_change * item.cal_density)
                     if cal_impact > max_cal_change_per_item:
-                        qty_change = (max_cal_change_per_item / item['cal_density']) * (1 if qty_change > 0 else -1)
+                        qty_change = (max_cal_change_per_item / item.cal_density) * (1 if qty_change > 0 else -1)
                     
-                    new_qty = item['quantity'] + qty_change
+                    new_qty = item.quantity + qty_change
                     new_qty = clamp_quantity(item, new_qty)
                     
-                    item['quantity'] = new_qty
-                    item['calories'] = new_qty * item['cal_density']
-                    item['protein'] = new_qty * item['protein_density']
-                    item['fat'] = new_qty * item['fat_density']
-                    item['carbs'] = new_qty * item['carbs_density']
-                    item['fiber'] = new_qty * item['fiber_density']
+                    item.set_quantity(new_qty)
+
+    mark_phase("correct")
 
     # === STEP 3: SMART ROUNDING (while preserving calorie constraint) ===
     # Skip if we're bypassing all adjustments
@@ -992,19 +1126,14 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
     
     for meal_data in meal_plan.values():
         for item in meal_data["items"]:
-            unit = str(item.get("unit", "")).lower()
+            unit = str(item.unit).lower()
             
             if is_gram_based(unit) or is_ml_based(unit):
-                original_qty = item['quantity']
+                original_qty = item.quantity
                 rounded_qty = round_to_5(original_qty)
                 
                 # Apply rounding
-                item['quantity'] = rounded_qty
-                item['calories'] = rounded_qty * item['cal_density']
-                item['protein'] = rounded_qty * item['protein_density']
-                item['fat'] = rounded_qty * item['fat_density']
-                item['carbs'] = rounded_qty * item['carbs_density']
-                item['fiber'] = rounded_qty * item['fiber_density']
+                item.set_quantity(rounded_qty)
     
     # Check if rounding broke the calorie constraint
     current_after_round = calculate_totals()
@@ -1026,18 +1155,13 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
             per_item_cal = cal_needed / num_items
             
             for meal_name, item in adjustable:
-                if item['cal_density'] > 0:
-                    qty_adjustment = per_item_cal / item['cal_density']
-                    new_qty = item['quantity'] + qty_adjustment
+                if item.cal_density > 0:
+                    qty_adjustment = per_item_cal / item.cal_density
+                    new_qty = item.quantity + qty_adjustment
                     new_qty = clamp_quantity(item, new_qty)
                     new_qty = round_to_5(new_qty)
                     
-                    item['quantity'] = new_qty
-                    item['calories'] = new_qty * item['cal_density']
-                    item['protein'] = new_qty * item['protein_density']
-                    item['fat'] = new_qty * item['fat_density']
-                    item['carbs'] = new_qty * item['carbs_density']
-                    item['fiber'] = new_qty * item['fiber_density']
+                    item.set_quantity(new_qty)
 
     # === FINAL CHECK - Multiple aggressive passes ===
     # Keep adjusting until we hit target or can't improve
@@ -1067,26 +1191,60 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         per_item_target = cal_deficit / len(adjustable)
         
         for item in adjustable:
-            if item['cal_density'] > 0:
-                qty_change = per_item_target / item['cal_density']
-                new_qty = item['quantity'] + qty_change
+            if item.cal_density > 0:
+                qty_change = per_item_target / item.cal_density
+                new_qty = item.quantity + qty_change
                 
                 # Use clamping to prevent drastic changes
                 new_qty = clamp_quantity(item, new_qty)
                 new_qty = round_to_5(new_qty)
                 
-                item['quantity'] = new_qty
-                item['calories'] = new_qty * item['cal_density']
-                item['protein'] = new_qty * item['protein_density']
-                item['fat'] = new_qty * item['fat_density']
-                item['carbs'] = new_qty * item['carbs_density']
-                item['fiber'] = new_qty * item['fiber_density']
+                item.set_quantity(new_qty)
         
         # Check if we made progress
         new_total = calculate_totals()['calories']
         if abs(new_total - old_total) < 10:
             break  # No more progress possible
     
+    # === LOCAL RE-SOLVE - Reference-confirmed items may move further before we give up ===
+    # Their kcal are known to be realistic, so a wider portion range is safer
+    # than sending the day back to the LLM (fix_quantities_with_llm)
+    if (nutrition_index or food_table) and not goto_output:
+
+        def anomaly_count(totals):
+            calories_off = abs(totals['calories'] - target_calories) > 100
+            protein_off = target_protein > 0 and abs(totals['protein'] - target_protein) > target_protein * 0.25
+            return calories_off + protein_off
+
+        check = calculate_totals()
+        if anomaly_count(check):
+            resolve_items = [
+                item
+                for meal_data in meal_plan.values()
+                for item in meal_data['items']
+                if item.indexed and is_adjustable_for_macros(item)
+            ]
+            if resolve_items:
+                previous = [item.quantity for item in resolve_items]
+                fixed_totals = [check[key] - sum(getattr(item, key) for item in resolve_items) for key in ('calories', 'protein', 'fat', 'carbs')]
+                low, high = RESOLVE_QUANTITY_RANGE
+                bounds = [(max(min_qty, item.gpt_quantity * low), max(min_qty, item.gpt_quantity * high)) for item in resolve_items]
+                new_quantities = solve_quantities(
+                    resolve_items, (target_calories, target_protein, target_fat, target_carbs), fixed_totals, bounds
+                )
+                for item, new_qty in zip(resolve_items, new_quantities):
+                    item.set_quantity(float(new_qty))
+                resolved = calculate_totals()
+                if anomaly_count(resolved) < anomaly_count(check):
+                    mealplan_logger.info(
+                        f"[LOCAL_RESOLVE] Re-solved {len(resolve_items)} index-confirmed items: "
+                        f"{check['calories']:.0f} -> {resolved['calories']:.0f} kcal"
+                    )
+                else:
+                    # Only keep a re-solve that removes a reason to call the LLM
+                    for item, quantity in zip(resolve_items, previous):
+                        item.set_quantity(quantity)
+
     # Log final status
     final_check = calculate_totals()
     final_diff = abs(final_check['calories'] - target_calories)
@@ -1100,19 +1258,21 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
 
         # --- Final meal totals (after adjustments) ---
         for meal_data in meal_plan.values():
-            meal_data["total_cal"] = sum(float(i.get("calories", 0)) for i in meal_data["items"])
-            meal_data["total_protein"] = sum(float(i.get("protein", 0)) for i in meal_data["items"])
-            meal_data["total_fat"] = sum(float(i.get("fat", 0)) for i in meal_data["items"])
-            meal_data["total_carbs"] = sum(float(i.get("carbs", 0)) for i in meal_data["items"])
-            meal_data["total_fiber"] = sum(float(i.get("fiber", 0)) for i in meal_data["items"])
+            meal_data["total_cal"] = sum(float(i.calories) for i in meal_data["items"])
+            meal_data["total_protein"] = sum(float(i.protein) for i in meal_data["items"])
+            meal_data["total_fat"] = sum(float(i.fat) for i in meal_data["items"])
+            meal_data["total_carbs"] = sum(float(i.carbs) for i in meal_data["items"])
+            meal_data["total_fiber"] = sum(float(i.fiber) for i in meal_data["items"])
+
+    mark_phase("round")
 
     # --- Final meal totals (always needed for output) ---
     for meal_data in meal_plan.values():
-        meal_data["total_cal"] = sum(float(i.get("calories", 0)) for i in meal_data["items"])
-        meal_data["total_protein"] = sum(float(i.get("protein", 0)) for i in meal_data["items"])
-        meal_data["total_fat"] = sum(float(i.get("fat", 0)) for i in meal_data["items"])
-        meal_data["total_carbs"] = sum(float(i.get("carbs", 0)) for i in meal_data["items"])
-        meal_data["total_fiber"] = sum(float(i.get("fiber", 0)) for i in meal_data["items"])
+        meal_data["total_cal"] = sum(float(i.calories) for i in meal_data["items"])
+        meal_data["total_protein"] = sum(float(i.protein) for i in meal_data["items"])
+        meal_data["total_fat"] = sum(float(i.fat) for i in meal_data["items"])
+        meal_data["total_carbs"] = sum(float(i.carbs) for i in meal_data["items"])
+        meal_data["total_fiber"] = sum(float(i.fiber) for i in meal_data["items"])
 
     # --- Output formatting ---
     output_lines = [f"Day {day_number}:"]
@@ -1126,23 +1286,23 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         output_lines.append(meal_outp_str)
 
         for i, item in enumerate(meal_data["items"], 1):
-            if is_gram_based(item['unit']) or is_ml_based(item['unit']):
+            if is_gram_based(item.unit) or is_ml_based(item.unit):
                 # Only gram/ml items get adjusted, so format as integer
-                qty_str = f"{int(round(item['quantity']))}"
+                qty_str = f"{int(round(item.quantity))}"
             else:
                 # For ALL non-gram units (serving-based, medium, etc.), preserve original quantity
                 # These items should NEVER be adjusted, so use original GPT quantity string
-                gpt_qty_str = item.get('gpt_qty_str', '')
+                gpt_qty_str = item.gpt_qty_str
                 if gpt_qty_str:
                     # Extract just the numeric/fraction part from original string like "1/2 medium"
                     qty_match = QTY_EXTRACT_PATTERN.match(gpt_qty_str)
                     if qty_match:
                         qty_str = qty_match.group(1)
                     else:
-                        qty_str = gpt_qty_str.split()[0] if gpt_qty_str.split() else str(item["quantity"])
+                        qty_str = gpt_qty_str.split()[0] if gpt_qty_str.split() else str(item.quantity)
                 else:
                     # Fallback: format the quantity value with fraction handling
-                    qty_val = item["quantity"]
+                    qty_val = item.quantity
                     if abs(qty_val - 0.25) < 0.01:
                         qty_str = "1/4"
                     elif abs(qty_val - 0.5) < 0.01:
@@ -1158,11 +1318,11 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
                     else:
                         qty_str = f"{qty_val:.2f}".rstrip('0').rstrip('.')
             
-            unit = item["unit"]
-            kcal = round_to_5(item["calories"])
-            item_outp_str = f"  {i}. {item['name']} — {qty_str} {unit} — {kcal} kcal"
+            unit = item.unit
+            kcal = round_to_5(item.calories)
+            item_outp_str = f"  {i}. {item.name} — {qty_str} {unit} — {kcal} kcal"
             
-            item_inp_str = item.get('inp_item_str', f"{item['name']} — ??? — ???")
+            item_inp_str = item.inp_item_str
             log_entry("ITEM", item_inp_str, item_outp_str)
 
             output_lines.append(item_outp_str)
@@ -1188,6 +1348,9 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
             'target_calories': target_calories,
             'actual_calories': 0
         }
+        if report is not None:
+            report.update(calories=0, protein=0, fat=0, carbs=0)
+        mark_phase("format")
         return (fallback_output, anomaly)
     
     output_lines.append(f"Total Daily Calories: {daily_total_kcal} kcal")
@@ -1198,9 +1361,9 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
     anomaly_info = None
     
     # Calculate actual macros from all items
-    actual_protein = sum(item.get('protein', 0) for meal in meal_plan.values() for item in meal.get('items', []))
-    actual_fat = sum(item.get('fat', 0) for meal in meal_plan.values() for item in meal.get('items', []))
-    actual_carbs = sum(item.get('carbs', 0) for meal in meal_plan.values() for item in meal.get('items', []))
+    actual_protein = sum(item.protein for meal in meal_plan.values() for item in meal.get('items', []))
+    actual_fat = sum(item.fat for meal in meal_plan.values() for item in meal.get('items', []))
+    actual_carbs = sum(item.carbs for meal in meal_plan.values() for item in meal.get('items', []))
     
     # Get target macros
     target_protein = macros.get('protein_g', 0) if macros else 0
@@ -1246,6 +1409,11 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
             f"[ANOMALY_DETECTED] Day {day_number}: {'; '.join(problems)} - REGENERATING"
         )
 
+    if report is not None:
+        report.update(calories=daily_total_kcal, protein=actual_protein, fat=actual_fat, carbs=actual_carbs)
+
+    mark_phase("format")
+
     # END TIMING
     t_end = time.perf_counter()
     total_ms = (t_end - t_start) * 1000
@@ -1257,6 +1425,7 @@ def process_single_day(day_string, target_calories, macros=None, min_qty=5, expe
         mealplan_logger.info("===== BATCH TRANSFORMATIONS END =====\n")
 
     mealplan_logger.info(f"[PROCESS_SINGLE_DAY TIME][MODE={LOG_MODE}] {total_ms:.2f} ms")
+    mark_phase("log")
 
     # Return tuple: (output, anomaly_info) - anomaly_info is None if no issues
     return ("\n".join(output_lines), anomaly_info)
@@ -14,6 +14,7 @@ from pdf2image import convert_from_path
 from werkzeug.utils import secure_filename
 from collections import defaultdict
 from datetime import datetime
+from backend.food_table import get_food_table
 
 app = Flask(__name__)
 CORS(app)
@@ -88,6 +89,10 @@ UNIT_CONVERSIONS = {
     "tsp": 5,      # to ml for liquids
 }
 
+# Units that are a fixed amount whatever the food; anything else (piece, slice,
+# cup, tbsp, egg...) is looked up in the food table first
+MEASURE_UNITS = {"kg", "g", "mg", "l", "ml", "cl", "dl", "oz", "lb"}
+
 def normalize_unit(value, unit, item_type="solid"):
     """Normalize units to g or ml with proper conversion"""
     unit = unit.lower().strip()
@@ -96,6 +101,12 @@ def normalize_unit(value, unit, item_type="solid"):
     unit = re.sub(r's$', '', unit)  # remove trailing 's'
     unit = unit.replace('gram', 'g').replace('liter', 'l').replace('milli', 'm')
     
+    # Standard weight of this unit of this food (an egg, a slice of bread, a cup of rice)
+    if unit not in MEASURE_UNITS:
+        weight = get_food_table().serving_weight(item_type, unit)
+        if weight is not None:
+            return value * weight[0], weight[1]
+
     # Handle special cases
     if unit in ['piece', 'pc', 'pcs', 'unit', 'units']:
         if item_type in STANDARD_MEASURES: